@@ -9,9 +9,47 @@ Twisted concurrency primative, like `DeferredLock` or `DeferredSemaphore`.
 
 """
 
-__all__ = ["webapp"]
+__all__ = ["PriorityDeferredSemaphore", "webapp"]
+
+from twisted.internet.defer import Deferred, DeferredSemaphore, maybeDeferred
+
+
+class PriorityDeferredSemaphore(DeferredSemaphore):
+    """A `DeferredSemaphore` with a priority lane.
+
+    Work run with `runWithPriority` is given the next free token before any
+    work waiting in the normal lane.
+    """
+
+    def __init__(self, tokens):
+        super().__init__(tokens)
+        self.priorityWaiting = []
+
+    def acquire(self, priority=False):
+        """Acquire a token, ahead of the normal lane if `priority`."""
+        if not priority or self.tokens:
+            return super().acquire()
+        d = Deferred(canceller=self.priorityWaiting.remove)
+        self.priorityWaiting.append(d)
+        return d
+
+    def release(self):
+        """Release a token, handing it to a priority waiter first."""
+        if self.priorityWaiting:
+            self.priorityWaiting.pop(0).callback(self)
+        else:
+            super().release()
+
+    def runWithPriority(self, f, *args, **kwargs):
+        """Like `run`, but acquiring the token with priority."""
+
+        def execute(_):
+            d = maybeDeferred(f, *args, **kwargs)
+            d.addBoth(self._releaseAndReturn)
+            return d
+
+        return self.acquire(priority=True).addCallback(execute)
 
-from twisted.internet.defer import DeferredSemaphore
 
 #
 # Limit web application and threaded websocket handler requests.
@@ -45,4 +83,7 @@ from twisted.internet.defer import DeferredSemaphore
 # connections for example. It is a stopgap. Ultimately we want to reduce or
 # eliminate all RPC calls made while a database connection is being held.
 #
-webapp = DeferredSemaphore(4)
+# Cheap calls, like the ones made by the web UI to populate its navigation,
+# can use the priority lane so they don't wait behind heavy ones.
+#
+webapp = PriorityDeferredSemaphore(4)
@@ -98,6 +98,14 @@ class RegionConfiguration(Configuration, metaclass=RegionConfigurationMeta):
         Int(if_missing=4, accept_python=False, min=1),
     )
 
+    # Allocation options.
+    address_pool_size = ConfigurationOption(
+        "address_pool_size",
+        "The number of addresses each regiond process reserves in advance "
+        "for allocation from a subnet. 0 disables the address pool.",
+        Int(if_missing=0, accept_python=False, min=0),
+    )
+
     # Debug options.
     debug = ConfigurationOption(
         "debug",
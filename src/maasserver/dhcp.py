@@ -6,9 +6,11 @@
 __all__ = ["configure_dhcp", "validate_dhcp_config"]
 
 from collections import defaultdict, namedtuple
+from copy import deepcopy
 from itertools import groupby
 from operator import itemgetter
 from typing import Iterable, Optional, Union
+from uuid import uuid4
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
@@ -48,6 +50,8 @@ from provisioningserver.rpc.cluster import (
     ConfigureDHCPv4_V2,
     ConfigureDHCPv6,
     ConfigureDHCPv6_V2,
+    UpdateDHCPv4Hosts,
+    UpdateDHCPv6Hosts,
     ValidateDHCPv4Config,
     ValidateDHCPv4Config_V2,
     ValidateDHCPv6Config,
@@ -55,7 +59,10 @@ from provisioningserver.rpc.cluster import (
 )
 from provisioningserver.rpc.clusterservice import DHCP_TIMEOUT
 from provisioningserver.rpc.dhcp import downgrade_shared_networks
-from provisioningserver.rpc.exceptions import NoConnectionsAvailable
+from provisioningserver.rpc.exceptions import (
+    DHCPStateMismatch,
+    NoConnectionsAvailable,
+)
 from provisioningserver.utils import typed
 from provisioningserver.utils.network import get_source_address
 from provisioningserver.utils.text import split_string_list
@@ -63,6 +70,12 @@ from provisioningserver.utils.twisted import asynchronous, synchronous
 
 log = LegacyLogger()
 
+# The DHCP configuration last sent to each rack controller, keyed by system
+# ID and IP version. When only host maps change, just those changes are sent.
+_rack_dhcp_states = {}
+
+RackDHCPState = namedtuple("RackDHCPState", ("version", "config", "hosts"))
+
 
 def get_omapi_key():
     """Return the OMAPI key for all DHCP servers that are ran by MAAS."""
@@ -835,7 +848,9 @@ def configure_dhcp(rack_controller):
     # exception, meaning we can avoid some work if it fails.
     client = yield getClientFor(rack_controller.system_id)
 
-    # Get configuration for both IPv4 and IPv6.
+    # Get configuration for both IPv4 and IPv6. The `sys_dhcp` notifications
+    # carry no payload, so this is always computed in full; when only hosts
+    # changed, `_configure_dhcp_server` sends the rack controller just those.
     config = yield deferToDatabase(get_dhcp_configuration, rack_controller)
 
     # Fix interfaces to go over the wire.
@@ -847,10 +862,10 @@ def configure_dhcp(rack_controller):
     ipv4_status, ipv6_status = SERVICE_STATUS.UNKNOWN, SERVICE_STATUS.UNKNOWN
 
     try:
-        yield _perform_dhcp_config(
+        yield _configure_dhcp_server(
             client,
-            ConfigureDHCPv4_V2,
-            ConfigureDHCPv4,
+            rack_controller,
+            4,
             failover_peers=config.failover_peers_v4,
             interfaces=interfaces_v4,
             shared_networks=config.shared_networks_v4,
@@ -877,10 +892,10 @@ def configure_dhcp(rack_controller):
         )
 
     try:
-        yield _perform_dhcp_config(
+        yield _configure_dhcp_server(
             client,
-            ConfigureDHCPv6_V2,
-            ConfigureDHCPv6,
+            rack_controller,
+            6,
             failover_peers=config.failover_peers_v6,
             interfaces=interfaces_v6,
             shared_networks=config.shared_networks_v6,
@@ -1094,3 +1109,76 @@ def _perform_dhcp_config(
             return failure
 
     return call(v2_command).addErrback(maybeDowngrade)
+
+
+@asynchronous
+@inlineCallbacks
+def _configure_dhcp_server(
+    client, rack_controller, ip_version, *, hosts, **args
+):
+    """Configure the DHCPv4 or DHCPv6 server on `rack_controller`.
+
+    When nothing but the hosts have changed since the configuration last sent
+    to the rack controller, only the hosts that were added, changed, or
+    removed are sent, along with the version of the configuration they apply
+    to. The rack controller refuses them if it has a different configuration,
+    e.g. because it restarted or another region controller configured it; the
+    full configuration is sent in that case, and whenever anything else has
+    changed.
+
+    The changes are found by comparing `hosts` with the hosts last sent, so
+    the configuration must be given in full. This keeps the rack controller
+    from rewriting its configuration and restarting dhcpd for host changes,
+    but the region still queries the database for the whole configuration.
+
+    :param client: An RPC client for `rack_controller`.
+    :param ip_version: 4 or 6.
+    :param hosts: The hosts argument for the configure commands.
+    :param args: Remaining arguments for the configure commands.
+    """
+    if ip_version == 4:
+        v2_command, v1_command = ConfigureDHCPv4_V2, ConfigureDHCPv4
+        update_command = UpdateDHCPv4Hosts
+    else:
+        v2_command, v1_command = ConfigureDHCPv6_V2, ConfigureDHCPv6
+        update_command = UpdateDHCPv6Hosts
+    key = rack_controller.system_id, ip_version
+    # Forget what was sent before; if this fails the state of the rack
+    # controller is unknown and the next change must be sent in full.
+    previous = _rack_dhcp_states.pop(key, None)
+    # Copy the configuration as it may be downgraded in place when sent.
+    config = deepcopy(args)
+    hosts_by_mac = {host["mac"]: host for host in hosts}
+    version = uuid4().hex
+    if previous is not None and previous.config == config:
+        try:
+            yield client(
+                update_command,
+                _timeout=DHCP_TIMEOUT + 5,
+                omapi_key=args["omapi_key"],
+                previous_version=previous.version,
+                version=version,
+                removed_macs=[
+                    mac for mac in previous.hosts if mac not in hosts_by_mac
+                ],
+                hosts=[
+                    host
+                    for mac, host in hosts_by_mac.items()
+                    if previous.hosts.get(mac) != host
+                ],
+            )
+        except (DHCPStateMismatch, amp.UnhandledCommand):
+            log.msg(
+                "DHCPv%d configuration on rack controller '%s (%s)' is out "
+                "of date; sending it in full."
+                % (ip_version, rack_controller.hostname, key[0])
+            )
+        else:
+            _rack_dhcp_states[key] = RackDHCPState(
+                version, config, hosts_by_mac
+            )
+            return
+    yield _perform_dhcp_config(
+        client, v2_command, v1_command, hosts=hosts, version=version, **args
+    )
+    _rack_dhcp_states[key] = RackDHCPState(version, config, hosts_by_mac)
@@ -49,6 +49,10 @@ DEBUG = False
 DEBUG_QUERIES = False
 DEBUG_HTTP = False
 
+# The number of addresses each region process claims in advance for
+# allocation from a subnet; see `maasserver.models.ipaddresscandidate`.
+ADDRESS_POOL_SIZE = 0
+
 # The following specify named URL patterns.
 LOGOUT_URL = "/MAAS/"
 LOGIN_URL = "/MAAS/"
@@ -117,6 +121,7 @@ try:
         DEBUG = config.debug
         DEBUG_QUERIES = config.debug_queries
         DEBUG_HTTP = config.debug_http
+        ADDRESS_POOL_SIZE = config.address_pool_size
         if DEBUG_QUERIES and not DEBUG:
             # For debug queries to work debug most also be on, so Django will
             # track the queries made.
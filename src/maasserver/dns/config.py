@@ -6,9 +6,10 @@
 __all__ = ["dns_force_reload", "dns_update_all_zones"]
 
 from collections import defaultdict
+import re
 
 from django.conf import settings
-from netaddr import IPAddress
+from netaddr import AddrFormatError, IPAddress
 
 from maasserver.dns.zonegenerator import (
     InternalDomain,
@@ -19,20 +20,48 @@ from maasserver.dns.zonegenerator import (
 from maasserver.enum import IPADDRESS_TYPE, RDNS_MODE
 from maasserver.models.config import Config
 from maasserver.models.dnspublication import DNSPublication
+from maasserver.models.dnsresource import DNSResource
 from maasserver.models.domain import Domain
-from maasserver.models.node import RackController
+from maasserver.models.node import Node, RackController
+from maasserver.models.staticipaddress import StaticIPAddress
 from maasserver.models.subnet import Subnet
 from provisioningserver.dns.actions import (
     bind_reload,
     bind_reload_with_retries,
+    bind_reload_zones,
     bind_write_configuration,
     bind_write_options,
     bind_write_zones,
 )
+from provisioningserver.dns.zoneconfig import DNSForwardZoneConfig
 from provisioningserver.logger import get_maas_logger
 
 maaslog = get_maas_logger("dns")
 
+# Reasons, as recorded in `DNSPublication.source` by the DNS triggers, that
+# only affect the records of known zones and so can be published without
+# regenerating every zone. Anything else (zones or subnets being added or
+# removed, configuration changes, renamed nodes, etc.) needs a full update.
+INCREMENTAL_DNS_REASONS = [
+    re.compile(r"^ip (?P<ip>\S+) allocated$"),
+    re.compile(r"^ip (?P<ip>\S+) alloc_type changed to \d+$"),
+    re.compile(r"^ip (?P<ip>\S+) changed to (?P<new_ip>\S+)$"),
+    re.compile(
+        r"^ip (?P<ip>\S+) (connected to|disconnected from) "
+        r"(?P<hostname>\S+) on \S+$"
+    ),
+    re.compile(
+        r"^ip (?P<ip>\S+) (linked to|unlinked from) resource \S+ "
+        r"on zone (?P<zone>\S+)$"
+    ),
+    re.compile(r"^zone (?P<zone>\S+) added resource \S+$"),
+    re.compile(r"^zone (?P<zone>\S+) updated resource (?P<resource>\S+)$"),
+    re.compile(
+        r"^(added \S+ to|updated \S+ in|removed \S+ from) resource \S+ "
+        r"on zone (?P<zone>\S+)$"
+    ),
+]
+
 
 def current_zone_serial():
     return "%0.10d" % DNSPublication.objects.get_most_recent().serial
@@ -48,29 +77,45 @@ def dns_force_reload():
     DNSPublication(source="Force reload").save()
 
 
-def dns_update_all_zones(reload_retry=False, reload_timeout=2):
+def dns_update_all_zones(
+    reload_retry=False, reload_timeout=2, previous_serial=None
+):
     """Update all zone files for all domains.
 
     Serving these zone files means updating BIND's configuration to include
     them, then asking it to load the new configuration.
 
+    When `previous_serial` is given and every publication since then only
+    touched the records of existing zones, only the affected zones are
+    rewritten and reloaded; see `dns_update_changed_zones`.
+
     :param reload_retry: Should the DNS server reload be retried in case
         of failure? Defaults to `False`.
     :type reload_retry: bool
+    :param previous_serial: The serial that was last published to BIND, or
+        `None` to regenerate all zones.
     """
     if not is_dns_enabled():
         return
 
-    domains = Domain.objects.filter(authoritative=True)
-    subnets = Subnet.objects.exclude(rdns_mode=RDNS_MODE.DISABLED)
     default_ttl = Config.objects.get_config("default_dns_ttl")
     serial = current_zone_serial()
+    if previous_serial is not None:
+        result = dns_update_changed_zones(
+            previous_serial, serial, default_ttl
+        )
+        if result is not None:
+            return result
+
+    domains = Domain.objects.filter(authoritative=True)
+    subnets = Subnet.objects.exclude(rdns_mode=RDNS_MODE.DISABLED)
     zones = ZoneGenerator(
         domains,
         subnets,
         default_ttl,
         serial,
         internal_domains=[get_internal_domain()],
+        bulk=True,
     ).as_list()
     bind_write_zones(zones)
 
@@ -103,6 +148,144 @@ def dns_update_all_zones(reload_retry=False, reload_timeout=2):
     return serial, reloaded, [domain.name for domain in domains]
 
 
+def dns_update_changed_zones(previous_serial, serial, default_ttl):
+    """Rewrite and reload only the zones changed since `previous_serial`.
+
+    The BIND configuration and options are left alone, as none of the
+    changes handled here add or remove zones.
+
+    :return: The same as `dns_update_all_zones`, or `None` if the changes
+        since `previous_serial` cannot be applied incrementally.
+    """
+    previous_serial, serial_int = int(previous_serial), int(serial)
+    if serial_int < previous_serial:
+        return None
+    reasons = list(
+        DNSPublication.objects.filter(
+            serial__gt=previous_serial, serial__lte=serial_int
+        ).values_list("source", flat=True)
+    )
+    if len(reasons) != serial_int - previous_serial:
+        # Publications have been collected since, so the reasons for some
+        # of the changes are no longer known.
+        return None
+    affected = get_zones_to_update(reasons)
+    if affected is None:
+        return None
+    domain_names, ips = affected
+
+    domains = Domain.objects.filter(authoritative=True, name__in=domain_names)
+    if len(ips) == 0:
+        subnets = []
+    else:
+        # RFC 2317 subnets are always included as they provide the glue in
+        # the reverse zones of the networks that contain them.
+        subnets = [
+            subnet
+            for subnet in Subnet.objects.exclude(rdns_mode=RDNS_MODE.DISABLED)
+            if subnet.rdns_mode == RDNS_MODE.RFC2317
+            or any(ip in subnet.get_ipnetwork() for ip in ips)
+        ]
+    # The internal domain is always regenerated: the changes to the
+    # addresses of rack controllers are published like any other node's, and
+    # its zone is small.
+    zones = [
+        zone
+        for zone in ZoneGenerator(
+            domains,
+            subnets,
+            default_ttl,
+            serial,
+            internal_domains=[get_internal_domain()],
+            bulk=True,
+        )
+        if isinstance(zone, DNSForwardZoneConfig)
+        or any(
+            zone_info.subnetwork is not None and ip in zone_info.subnetwork
+            for zone_info in zone.zone_info
+            for ip in ips
+        )
+    ]
+    bind_write_zones(zones)
+    reloaded = bind_reload_zones(
+        [zone_info.zone_name for zone in zones for zone_info in zone.zone_info]
+    )
+    return serial, reloaded, [domain.name for domain in domains]
+
+
+def get_zones_to_update(reasons):
+    """Work out which zones need to be regenerated for `reasons`.
+
+    :param reasons: A list of `DNSPublication.source` strings.
+    :return: A tuple of the set of forward zone names and the set of IP
+        addresses whose reverse zones need to be regenerated, or `None` if
+        any of the reasons needs every zone to be regenerated.
+    """
+    domain_names, ips, hostnames, resources = set(), set(), set(), set()
+    for reason in reasons:
+        for pattern in INCREMENTAL_DNS_REASONS:
+            match = pattern.match(reason)
+            if match is not None:
+                break
+        else:
+            return None
+        groups = match.groupdict()
+        for key in ("ip", "new_ip"):
+            if groups.get(key) is not None:
+                ips.add(groups[key])
+        if groups.get("hostname") is not None:
+            hostnames.add(groups["hostname"])
+        if groups.get("zone") is not None:
+            domain_names.add(groups["zone"])
+            if groups.get("resource") is not None:
+                # Renaming a resource or changing its TTL changes the
+                # reverse records of all its addresses.
+                resources.add((groups["zone"], groups["resource"]))
+
+    for zone, name in resources:
+        for dnsresource in DNSResource.objects.filter(
+            domain__name=zone, name=name
+        ):
+            ips.update(
+                ip.ip for ip in dnsresource.ip_addresses.all() if ip.ip
+            )
+
+    # The forward records for an address live in the domain of the node or
+    # DNS resource that it belongs to. A change to one of a node's addresses
+    # can also hide or expose its other addresses (static addresses take
+    # precedence over discovered ones), so regenerate all of them.
+    node_ids = set()
+    owners = StaticIPAddress.objects.filter(ip__in=ips).values_list(
+        "interface__node_id",
+        "interface__node__domain__name",
+        "dnsresource__domain__name",
+    )
+    for node_id, node_domain, resource_domain in owners:
+        if node_id is not None:
+            node_ids.add(node_id)
+            domain_names.add(node_domain)
+        if resource_domain is not None:
+            domain_names.add(resource_domain)
+    for node_id, node_domain in Node.objects.filter(
+        hostname__in=hostnames
+    ).values_list("id", "domain__name"):
+        node_ids.add(node_id)
+        domain_names.add(node_domain)
+    if len(node_ids) > 0:
+        ips.update(
+            ip
+            for ip in StaticIPAddress.objects.filter(
+                interface__node_id__in=node_ids
+            ).values_list("ip", flat=True)
+            if ip
+        )
+
+    try:
+        return domain_names, {IPAddress(ip) for ip in ips}
+    except AddrFormatError:
+        return None
+
+
 def get_upstream_dns():
     """Return the IP addresses of configured upstream DNS servers.
 
@@ -33,6 +33,7 @@ from maasserver.dns.config import (
     get_trusted_acls,
     get_trusted_networks,
     get_upstream_dns,
+    get_zones_to_update,
 )
 from maasserver.dns.zonegenerator import InternalDomainResourseRecord
 from maasserver.enum import IPADDRESS_TYPE, NODE_STATUS
@@ -42,7 +43,7 @@ from maasserver.models.dnspublication import DNSPublication
 from maasserver.testing.config import RegionConfigurationFixture
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
-from maastesting.matchers import MockCalledOnceWith
+from maastesting.matchers import MockCalledOnceWith, MockNotCalled
 from provisioningserver.dns.commands import get_named_conf, setup_dns
 from provisioningserver.dns.config import compose_config_path, DNSConfig
 from provisioningserver.dns.testing import (
@@ -405,6 +406,133 @@ class TestDNSConfigModifications(TestDNSServer):
             ),
         )
 
+    def test_dns_update_all_zones_publishes_changed_zones_only(self):
+        self.patch(settings, "DNS_CONNECT", True)
+        node, static = self.create_node_with_static_ip()
+        other_domain = factory.make_Domain()
+        other_node = factory.make_Node(
+            interface=True, status=NODE_STATUS.READY, domain=other_domain
+        )
+        serial, _, _ = dns_update_all_zones()
+        other_static = factory.make_StaticIPAddress(
+            alloc_type=IPADDRESS_TYPE.AUTO,
+            subnet=static.subnet,
+            interface=other_node.get_boot_interface(),
+        )
+        bind_write_configuration = self.patch_autospec(
+            dns_config_module, "bind_write_configuration"
+        )
+        bind_reload = self.patch_autospec(dns_config_module, "bind_reload")
+        new_serial, reloaded, domains = dns_update_all_zones(
+            previous_serial=serial
+        )
+        self.assertThat(bind_write_configuration, MockNotCalled())
+        self.assertThat(bind_reload, MockNotCalled())
+        self.assertTrue(reloaded)
+        self.assertGreater(int(new_serial), int(serial))
+        self.assertEqual([other_domain.name], domains)
+        self.assertDNSMatches(node.hostname, node.domain.name, static.ip)
+        self.assertDNSMatches(
+            other_node.hostname, other_domain.name, other_static.ip
+        )
+
+    def test_dns_update_all_zones_publishes_changed_internal_domain(self):
+        self.patch(settings, "DNS_CONNECT", True)
+        rack, static = self.create_rack_with_static_ip()
+        factory.make_RegionRackRPCConnection(rack)
+        serial, _, _ = dns_update_all_zones()
+        other_static = factory.make_StaticIPAddress(
+            alloc_type=IPADDRESS_TYPE.AUTO,
+            ip=factory.pick_ip_in_Subnet(static.subnet),
+            subnet=static.subnet,
+            interface=rack.get_boot_interface(),
+        )
+        bind_write_configuration = self.patch_autospec(
+            dns_config_module, "bind_write_configuration"
+        )
+        dns_update_all_zones(previous_serial=serial)
+        self.assertThat(bind_write_configuration, MockNotCalled())
+        self.assertDNSMatches(
+            get_resource_name_for_subnet(static.subnet),
+            Config.objects.get_config("maas_internal_domain"),
+            other_static.ip,
+            reverse=False,
+        )
+
+    def test_dns_update_all_zones_publishes_all_zones_on_new_zone(self):
+        self.patch(settings, "DNS_CONNECT", True)
+        serial, _, _ = dns_update_all_zones()
+        domain = factory.make_Domain()
+        bind_reload_zones = self.patch_autospec(
+            dns_config_module, "bind_reload_zones"
+        )
+        _, reloaded, domains = dns_update_all_zones(previous_serial=serial)
+        self.assertThat(bind_reload_zones, MockNotCalled())
+        self.assertTrue(reloaded)
+        self.assertIn(domain.name, domains)
+
+
+class TestGetZonesToUpdate(MAASServerTestCase):
+    """Tests for `get_zones_to_update`."""
+
+    def test_returns_none_for_structural_changes(self):
+        for reason in (
+            "added zone %s" % factory.make_name("zone"),
+            "added subnet %s" % factory.make_ipv4_network(),
+            "ip %s released" % factory.make_ipv4_address(),
+            "Force reload",
+        ):
+            self.assertIsNone(get_zones_to_update([reason]), reason)
+
+    def test_returns_empty_sets_for_no_reasons(self):
+        self.assertEqual((set(), set()), get_zones_to_update([]))
+
+    def test_returns_zone_for_resource_records(self):
+        domain = factory.make_Domain()
+        reasons = [
+            "zone %s added resource foo" % domain.name,
+            "added TXT to resource foo on zone %s" % domain.name,
+            "removed MX from resource foo on zone %s" % domain.name,
+        ]
+        self.assertEqual(({domain.name}, set()), get_zones_to_update(reasons))
+
+    def test_returns_zone_and_all_ips_of_node(self):
+        domain = factory.make_Domain()
+        node = factory.make_Node(interface=True, domain=domain)
+        nic = node.get_boot_interface()
+        subnet = factory.make_Subnet()
+        static = factory.make_StaticIPAddress(
+            alloc_type=IPADDRESS_TYPE.STICKY, subnet=subnet, interface=nic
+        )
+        other = factory.make_StaticIPAddress(
+            alloc_type=IPADDRESS_TYPE.DISCOVERED, subnet=subnet, interface=nic
+        )
+        reasons = [
+            "ip %s connected to %s on %s"
+            % (static.ip, node.hostname, nic.name)
+        ]
+        self.assertEqual(
+            ({domain.name}, {IPAddress(static.ip), IPAddress(other.ip)}),
+            get_zones_to_update(reasons),
+        )
+
+    def test_returns_zone_and_ips_of_dnsresource(self):
+        domain = factory.make_Domain()
+        static = factory.make_StaticIPAddress(
+            alloc_type=IPADDRESS_TYPE.USER_RESERVED
+        )
+        dnsresource = factory.make_DNSResource(
+            domain=domain, ip_addresses=[static]
+        )
+        reasons = [
+            "zone %s updated resource %s" % (domain.name, dnsresource.name),
+            "ip %s allocated" % static.ip,
+        ]
+        self.assertEqual(
+            ({domain.name}, {IPAddress(static.ip)}),
+            get_zones_to_update(reasons),
+        )
+
 
 class TestDNSDynamicIPAddresses(TestDNSServer):
     """Allocated nodes with IP addresses in the dynamic range get a DNS
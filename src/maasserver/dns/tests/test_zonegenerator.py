@@ -717,6 +717,43 @@ class TestZoneGenerator(MAASServerTestCase):
             MatchesSetwise(*expected_zones),
         )
 
+    def test_bulk_yields_same_forward_zones(self):
+        domains = [Domain.objects.get_default_domain()] + [
+            factory.make_Domain() for _ in range(3)
+        ]
+        subnet = factory.make_Subnet()
+        for domain in domains:
+            factory.make_Node_with_Interface_on_Subnet(
+                subnet=subnet, domain=domain
+            )
+            factory.make_DNSData(domain=domain)
+        serial = random.randint(0, 65535)
+
+        def forward_zones(bulk):
+            return {
+                zone.domain: (zone._mapping, zone._other_mapping)
+                for zone in ZoneGenerator(
+                    domains, [subnet], serial=serial, bulk=bulk
+                )
+                if isinstance(zone, DNSForwardZoneConfig)
+            }
+
+        self.assertEqual(forward_zones(False), forward_zones(True))
+
+    def test_bulk_does_not_query_mappings_per_domain(self):
+        get_hostname_ip_mapping = self.patch(
+            zonegenerator, "get_hostname_ip_mapping"
+        )
+        get_hostname_dnsdata_mapping = self.patch(
+            zonegenerator, "get_hostname_dnsdata_mapping"
+        )
+        domains = [factory.make_Domain() for _ in range(3)]
+        ZoneGenerator(
+            domains, [], serial=random.randint(0, 65535), bulk=True
+        ).as_list()
+        self.assertThat(get_hostname_ip_mapping, MockNotCalled())
+        self.assertThat(get_hostname_dnsdata_mapping, MockNotCalled())
+
     def test_yields_internal_forward_zones(self):
         default_domain = Domain.objects.get_default_domain()
         subnet = factory.make_Subnet(cidr=str(IPNetwork("10/29").cidr))
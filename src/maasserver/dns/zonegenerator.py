@@ -202,9 +202,13 @@ class ZoneGenerator:
         default_ttl=None,
         serial=None,
         internal_domains=None,
+        bulk=False,
     ):
         """
         :param serial: A serial number to reuse when creating zones in bulk.
+        :param bulk: Fetch the mappings for all of the domains up front,
+            with a fixed number of queries, rather than querying each domain
+            in turn.
         """
         self.domains = sequence(domains)
         self.subnets = sequence(subnets)
@@ -217,6 +221,7 @@ class ZoneGenerator:
         self.internal_domains = internal_domains
         if self.internal_domains is None:
             self.internal_domains = []
+        self.bulk = bulk
 
     @staticmethod
     def _get_mappings():
@@ -228,6 +233,22 @@ class ZoneGenerator:
         """Return a lazily evaluated mapping dict."""
         return lazydict(get_hostname_dnsdata_mapping)
 
+    def _prefetch_mappings(self, mappings, rrset_mappings):
+        """Populate `mappings` and `rrset_mappings` for all domains at once.
+
+        The reverse zones share a single mapping that is already fetched in
+        one go; see `_gen_reverse_zones`.
+        """
+        ip_mappings = StaticIPAddress.objects.get_hostname_ip_mappings(
+            self.domains
+        )
+        dnsdata_mappings = DNSData.objects.get_hostname_dnsdata_mappings(
+            self.domains, with_ids=False
+        )
+        for domain in self.domains:
+            mappings[domain] = ip_mappings[domain.id]
+            rrset_mappings[domain] = dnsdata_mappings[domain.id]
+
     @staticmethod
     def _gen_forward_zones(
         domains,
@@ -453,6 +474,8 @@ class ZoneGenerator:
         mappings = self._get_mappings()
         ns_host_name = self.default_domain.name
         rrset_mappings = self._get_rrset_mappings()
+        if self.bulk:
+            self._prefetch_mappings(mappings, rrset_mappings)
         serial = self.serial
         default_ttl = self.default_ttl
         return chain(
@@ -126,12 +126,24 @@ def make_PostgresListenerService():
     return PostgresListenerService()
 
 
+def make_PostgresListenerWorkerService(ipcWorker):
+    from maasserver.listener import PostgresListenerWorkerService
+
+    return PostgresListenerWorkerService(ipcWorker)
+
+
 def make_RackControllerService(ipcWorker, postgresListener):
     from maasserver.rack_controller import RackControllerService
 
     return RackControllerService(ipcWorker, postgresListener)
 
 
+def make_SubnetIndexService(postgresListener):
+    from maasserver.subnet_index import SubnetIndexService
+
+    return SubnetIndexService(postgresListener)
+
+
 def make_StatusWorkerService(dbtasks):
     from metadataserver.api_twisted import StatusWorkerService
 
@@ -194,10 +206,12 @@ def make_WorkersService():
     return WorkersService(reactor)
 
 
-def make_IPCMasterService(workers=None):
+def make_IPCMasterService(postgresListener=None, workers=None):
     from maasserver.ipc import IPCMasterService
 
-    return IPCMasterService(reactor, workers)
+    return IPCMasterService(
+        reactor, workers, postgresListener=postgresListener
+    )
 
 
 def make_IPCWorkerService():
@@ -319,8 +333,8 @@ class RegionEventLoop:
         },
         "postgres-listener-worker": {
             "only_on_master": False,
-            "factory": make_PostgresListenerService,
-            "requires": [],
+            "factory": make_PostgresListenerWorkerService,
+            "requires": ["ipc-worker"],
         },
         "web": {
             "only_on_master": False,
@@ -342,6 +356,11 @@ class RegionEventLoop:
             "factory": make_StatusWorkerService,
             "requires": ["database-tasks"],
         },
+        "subnet-index": {
+            "only_on_master": False,
+            "factory": make_SubnetIndexService,
+            "requires": ["postgres-listener-worker"],
+        },
         "networks-monitor": {
             "only_on_master": True,
             "factory": make_NetworksMonitoringService,
@@ -381,7 +400,7 @@ class RegionEventLoop:
         "ipc-master": {
             "only_on_master": True,
             "factory": make_IPCMasterService,
-            "requires": [],
+            "requires": ["postgres-listener-master"],
             "optional": ["workers"],
         },
         "ipc-worker": {
@@ -16,7 +16,12 @@ from socket import gethostname
 
 from netaddr import IPAddress
 from twisted.application import service
-from twisted.internet.defer import CancelledError, inlineCallbacks
+from twisted.internet.defer import (
+    CancelledError,
+    DeferredList,
+    inlineCallbacks,
+    maybeDeferred,
+)
 from twisted.internet.endpoints import (
     connectProtocol,
     UNIXClientEndpoint,
@@ -28,6 +33,10 @@ from twisted.protocols import amp
 
 from maasserver import eventloop, workers
 from maasserver.enum import SERVICE_STATUS
+from maasserver.listener import (
+    PostgresListenerRegistrationError,
+    PostgresListenerUnregistrationError,
+)
 from maasserver.models.node import RackController, RegionController
 from maasserver.models.regioncontrollerprocess import RegionControllerProcess
 from maasserver.models.regioncontrollerprocessendpoint import (
@@ -99,6 +108,60 @@ class RPCUnregisterConnection(amp.Command):
     errors = []
 
 
+class ListenerRegister(amp.Command):
+    """Register worker wants the notifications from a database channel."""
+
+    arguments = [(b"pid", amp.Integer()), (b"channel", amp.Unicode())]
+    response = []
+    errors = []
+
+
+class ListenerUnregister(amp.Command):
+    """Unregister worker no longer wants the notifications from a channel."""
+
+    arguments = [(b"pid", amp.Integer()), (b"channel", amp.Unicode())]
+    response = []
+    errors = []
+
+
+class ListenerNotify(amp.Command):
+    """Pass the notifications received by master on a channel to a worker.
+
+    `action` is empty for system channels.
+    """
+
+    arguments = [
+        (b"channel", amp.Unicode()),
+        (b"action", amp.Unicode()),
+        (b"payloads", amp.ListOf(amp.Unicode())),
+    ]
+    response = []
+    errors = []
+
+
+class ListenerConnection(amp.Command):
+    """Tell a worker the master's listener connected or disconnected."""
+
+    arguments = [(b"connected", amp.Boolean())]
+    response = []
+    errors = []
+
+
+def chunk_payloads(payloads, limit=amp.MAX_VALUE_LENGTH):
+    """Split `payloads` into lists that each fit in one AMP value."""
+    chunk, size = [], 0
+    for payload in payloads:
+        # Each item of an `amp.ListOf` is prefixed with its 2 bytes length.
+        payload_size = len(payload.encode("utf-8")) + 2
+        if chunk and size + payload_size > limit:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(payload)
+        size += payload_size
+    if chunk:
+        yield chunk
+
+
 class IPCMaster(RPCProtocol):
     """The IPC master side of the protocol."""
 
@@ -131,12 +194,30 @@ class IPCMaster(RPCProtocol):
         self.factory.service.unregisterWorkerRPCConnection(pid, connid)
         return {}
 
+    @ListenerRegister.responder
+    def listener_register(self, pid, channel):
+        """Worker wants the notifications from `channel`."""
+        self.factory.service.registerWorkerListener(pid, channel)
+        return {}
+
+    @ListenerUnregister.responder
+    def listener_unregister(self, pid, channel):
+        """Worker no longer wants the notifications from `channel`."""
+        self.factory.service.unregisterWorkerListener(pid, channel)
+        return {}
+
 
 class IPCMasterService(service.Service, object):
     """
     IPC master service.
 
     Provides the master side of the IPC communication between the workers.
+
+    When given the `postgresListener` of the master process, it is the only
+    one listening for database notifications on this host: workers
+    subscribe to the channels they have handlers for, and the notifications
+    received on those channels are passed to them, as are the connected and
+    disconnected events of the listener.
     """
 
     UPDATE_INTERVAL = 60  # 60 seconds.
@@ -145,10 +226,14 @@ class IPCMasterService(service.Service, object):
 
     connections = None
 
-    def __init__(self, reactor, workers=None, socket_path=None):
+    def __init__(
+        self, reactor, workers=None, socket_path=None, postgresListener=None
+    ):
         super().__init__()
         self.reactor = reactor
         self.workers = workers
+        self.postgresListener = postgresListener
+        self.listenerForwarders = {}
         self.socket_path = socket_path
         if self.socket_path is None:
             self.socket_path = get_ipc_socket_path()
@@ -188,6 +273,14 @@ class IPCMasterService(service.Service, object):
         self.starting.addCallback(start_update_loop)
         self.starting.addErrback(log_failure)
 
+        if self.postgresListener is not None:
+            self.postgresListener.events.connected.registerHandler(
+                self._listenerConnected
+            )
+            self.postgresListener.events.disconnected.registerHandler(
+                self._listenerDisconnected
+            )
+
         # Twisted's service framework does not track start-up progress, i.e.
         # it does not check for Deferreds returned by startService(). Here we
         # return a Deferred anyway so that direct callers (esp. those from
@@ -207,6 +300,15 @@ class IPCMasterService(service.Service, object):
                 yield data["connection"].transport.loseConnection()
             except Exception:
                 log.err(None, "Failure when closing IPC connection.")
+        for channel in list(self.listenerForwarders):
+            self._unregisterListenerForwarder(channel)
+        if self.postgresListener is not None:
+            self.postgresListener.events.disconnected.unregisterHandler(
+                self._listenerDisconnected
+            )
+            self.postgresListener.events.connected.unregisterHandler(
+                self._listenerConnected
+            )
 
         @transactional
         def delete_all_processes():
@@ -246,6 +348,7 @@ class IPCMasterService(service.Service, object):
                 "process_id": process_id,
                 "connection": conn,
                 "rpc": {"port": None, "connections": set()},
+                "channels": set(),
             }
             return process_id
 
@@ -276,6 +379,9 @@ class IPCMasterService(service.Service, object):
         """Unregister the worker with `pid` because of `reason`."""
         pid = self.getPIDFromConnection(conn)
         if pid:
+            # Stop passing notifications to the worker straight away.
+            for channel in list(self.connections[pid]["channels"]):
+                self.unregisterWorkerListener(pid, channel)
 
             @transactional
             def delete_process(pid):
@@ -297,6 +403,105 @@ class IPCMasterService(service.Service, object):
             d.addCallback(log_disconnected)
             return d
 
+    def registerWorkerListener(self, pid, channel):
+        """Register the worker with `pid` wants notifications on `channel`.
+
+        The master listens on `channel` once, for all the workers.
+        """
+        if pid not in self.connections or self.postgresListener is None:
+            return
+        if channel not in self.listenerForwarders:
+            if self.postgresListener.isSystemChannel(channel):
+                forwarder = self._forwardSystemNotify
+                batched = False
+            else:
+                forwarder = partial(self.notifyWorkers, channel)
+                batched = True
+            try:
+                self.postgresListener.register(
+                    channel, forwarder, batched=batched
+                )
+            except PostgresListenerRegistrationError:
+                log.err(
+                    None,
+                    "Worker pid:%d cannot listen on channel %s."
+                    % (pid, channel),
+                )
+                return
+            self.listenerForwarders[channel] = forwarder
+        self.connections[pid]["channels"].add(channel)
+        if not self.postgresListener.connected():
+            # The worker will be told once the listener connects.
+            self._notifyWorkerConnection(pid, False)
+
+    def unregisterWorkerListener(self, pid, channel):
+        """Unregister the worker with `pid` from notifications on `channel`.
+
+        The master stops listening on `channel` when no worker wants it.
+        """
+        if pid in self.connections:
+            self.connections[pid]["channels"].discard(channel)
+        if channel in self.listenerForwarders and not any(
+            channel in data["channels"] for data in self.connections.values()
+        ):
+            self._unregisterListenerForwarder(channel)
+
+    def _unregisterListenerForwarder(self, channel):
+        forwarder = self.listenerForwarders.pop(channel)
+        try:
+            self.postgresListener.unregister(channel, forwarder)
+        except PostgresListenerUnregistrationError:
+            # Already gone, nothing to do.
+            pass
+
+    def _forwardSystemNotify(self, channel, payload):
+        return self.notifyWorkers(channel, "", [payload])
+
+    @asynchronous
+    def notifyWorkers(self, channel, action, payloads):
+        """Pass the notifications on `channel` to the subscribed workers."""
+        defers = []
+        for pid, data in list(self.connections.items()):
+            if channel not in data["channels"]:
+                continue
+            for chunk in chunk_payloads(payloads):
+                d = data["connection"].callRemote(
+                    ListenerNotify,
+                    channel=channel,
+                    action=action,
+                    payloads=chunk,
+                )
+                d.addErrback(
+                    log.err,
+                    "Failed to pass notifications on %s to worker pid:%d."
+                    % (channel, pid),
+                )
+                defers.append(d)
+        return DeferredList(defers)
+
+    def _listenerConnected(self):
+        for pid in list(self.connections):
+            self._notifyWorkerConnection(pid, True)
+
+    def _listenerDisconnected(self, reason):
+        for pid in list(self.connections):
+            self._notifyWorkerConnection(pid, False)
+
+    def _notifyWorkerConnection(self, pid, connected):
+        """Tell the worker with `pid` the listener connected or not.
+
+        Notifications may have been missed, so the worker's handlers get to
+        catch up.
+        """
+        d = self.connections[pid]["connection"].callRemote(
+            ListenerConnection, connected=connected
+        )
+        d.addErrback(
+            log.err,
+            "Failed to pass the listener connection to worker pid:%d." % pid,
+        )
+        return d
+
     def _getListenAddresses(self, port):
         """Return list of tuple (address, port) for the addresses the worker
         is listening on."""
@@ -626,6 +831,31 @@ class IPCWorker(RPCProtocol):
         d.addCallback(set_defers)
         return d
 
+    @ListenerNotify.responder
+    def listener_notify(self, channel, action, payloads):
+        """Master passed the notifications received on `channel`.
+
+        This replies once the receiver has queued them, so that the master
+        doesn't wait for the handlers of every worker.
+        """
+        receiver = self.service.listenerReceivers.get(channel)
+        if receiver is None:
+            # No longer listening on the channel.
+            return {}
+        d = maybeDeferred(receiver, channel, action, payloads)
+        d.addErrback(
+            log.err, "Failed to handle notifications on %s." % channel
+        )
+        return {}
+
+    @ListenerConnection.responder
+    def listener_connection(self, connected):
+        """Master's listener connected or disconnected."""
+        receiver = self.service.listenerConnectionReceiver
+        if receiver is not None:
+            receiver(connected)
+        return {}
+
 
 class IPCWorkerService(service.Service, object):
     """
@@ -644,6 +874,8 @@ class IPCWorkerService(service.Service, object):
         self._protocol = None
         self.protocol = DeferredValue()
         self.processId = DeferredValue()
+        self.listenerReceivers = {}
+        self.listenerConnectionReceiver = None
 
     @asynchronous
     def startService(self):
@@ -720,3 +952,31 @@ class IPCWorkerService(service.Service, object):
             )
         )
         return d
+
+    @asynchronous
+    def listenerRegister(self, channel, receiver):
+        """Receive the notifications on `channel` from the master.
+
+        `receiver` is called with the channel, action and list of payloads
+        of the notifications.
+        """
+        self.listenerReceivers[channel] = receiver
+        d = self.protocol.get()
+        d.addCallback(
+            lambda protocol: protocol.callRemote(
+                ListenerRegister, pid=os.getpid(), channel=channel
+            )
+        )
+        return d
+
+    @asynchronous
+    def listenerUnregister(self, channel):
+        """Stop receiving the notifications on `channel` from the master."""
+        self.listenerReceivers.pop(channel, None)
+        d = self.protocol.get()
+        d.addCallback(
+            lambda protocol: protocol.callRemote(
+                ListenerUnregister, pid=os.getpid(), channel=channel
+            )
+        )
+        return d
@@ -3,11 +3,16 @@
 
 """Listens for NOTIFY events from the postgres database."""
 
-__all__ = ["PostgresListenerNotifyError", "PostgresListenerService"]
+__all__ = [
+    "PostgresListenerNotifyError",
+    "PostgresListenerService",
+    "PostgresListenerWorkerService",
+]
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from contextlib import closing
 from errno import ENOENT
+from time import time
 
 from django.db import connections
 from django.db.utils import load_backend
@@ -16,6 +21,7 @@ from twisted.internet import defer, error, interfaces, reactor, task
 from twisted.internet.defer import (
     CancelledError,
     Deferred,
+    DeferredLock,
     ensureDeferred,
     succeed,
 )
@@ -25,6 +31,7 @@ from twisted.logger import Logger
 from twisted.python.failure import Failure
 from zope.interface import implementer
 
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.utils.enum import map_enum
 from provisioningserver.utils.events import EventGroup
 from provisioningserver.utils.twisted import callOut, suppress, synchronous
@@ -72,17 +79,25 @@ class PostgresListenerService(Service, object):
 
     # Seconds to wait to handle new notifications. When the notifications set
     # is empty it will wait this amount of time to check again for new
-    # notifications.
+    # notifications. This is also the window in which notifications are
+    # grouped for the batched handlers.
     HANDLE_NOTIFY_DELAY = 0.5
     CHANNEL_REGISTRAR_DELAY = 0.5
 
-    def __init__(self, alias="default"):
+    # Maximum number of payloads passed to a batched handler in one call.
+    HANDLE_NOTIFY_BATCH_SIZE = 500
+
+    def __init__(self, alias="default", notify_delay=None):
         self.alias = alias
+        if notify_delay is not None:
+            self.HANDLE_NOTIFY_DELAY = notify_delay
         self.listeners = defaultdict(list)
+        self.batchedListeners = set()
         self.autoReconnect = False
         self.connection = None
         self.connectionFileno = None
         self.notifications = set()
+        self.notificationTimes = {}
         self.notifier = task.LoopingCall(self.handleNotifies)
         self.notifierDone = None
         self.connecting = None
@@ -173,13 +188,15 @@ class PostgresListenerService(Service, object):
                             self.unregisterChannel(notify.channel)
                     else:
                         # Place non-system messages into the queue to be
-                        # processed.
-                        self.notifications.add(
-                            (notify.channel, notify.payload)
-                        )
+                        # processed, remembering when the first of any
+                        # duplicates was received.
+                        notification = (notify.channel, notify.payload)
+                        self.notifications.add(notification)
+                        self.notificationTimes.setdefault(notification, time())
                 # Delete the contents of the connection's notifies list so
                 # that we don't process them a second time.
                 del notifies[:]
+                self.updateQueueDepthMetric()
 
     def fileno(self):
         """Return the fileno of the connection."""
@@ -203,11 +220,16 @@ class PostgresListenerService(Service, object):
         finally:
             self.connectionFileno = None
 
-    def register(self, channel, handler):
+    def register(self, channel, handler, batched=False):
         """Register listening for notifications from a channel.
 
         When a notification is received for that `channel` the `handler` will
         be called with the action and object id.
+
+        :param batched: When True, `handler` is instead called with the action
+            and the list of all the object ids notified for that action in the
+            last `HANDLE_NOTIFY_DELAY` seconds, so it can process them in bulk.
+            Only supported for non-system channels.
         """
         handlers = self.listeners[channel]
         if self.isSystemChannel(channel) and len(handlers) > 0:
@@ -219,8 +241,15 @@ class PostgresListenerService(Service, object):
             raise PostgresListenerRegistrationError(
                 "System channel '%s' has already been registered." % channel
             )
+        elif batched and self.isSystemChannel(channel):
+            raise PostgresListenerRegistrationError(
+                "System channel '%s' cannot be registered as batched."
+                % channel
+            )
         else:
             handlers.append(handler)
+            if batched:
+                self.batchedListeners.add((channel, handler))
         self.runChannelRegistrar()
 
     def unregister(self, channel, handler):
@@ -235,6 +264,8 @@ class PostgresListenerService(Service, object):
         handlers = self.listeners[channel]
         if handler in handlers:
             handlers.remove(handler)
+            if handler not in handlers:
+                self.batchedListeners.discard((channel, handler))
         else:
             raise PostgresListenerUnregistrationError(
                 "Handler is not registered on that channel '%s'." % channel
@@ -459,18 +490,92 @@ class PostgresListenerService(Service, object):
         else:
             return succeed(None)
 
+    def updateQueueDepthMetric(self):
+        """Record the number of notifications waiting to be handled."""
+        PROMETHEUS_METRICS.update(
+            "maas_db_notify_queue_depth", "set", value=len(self.notifications)
+        )
+
     def handleNotifies(self, clock=reactor):
-        """Process all notify message in the notifications set."""
+        """Process all notify message in the notifications set.
 
-        def gen_notifications(notifications):
-            while len(notifications) != 0:
-                yield notifications.pop()
+        The notifications are grouped by channel and action, so batched
+        handlers are called once per group.
+        """
+        groups = OrderedDict()
+        while len(self.notifications) != 0:
+            notification = self.notifications.pop()
+            received = self.notificationTimes.pop(notification, None)
+            channel, payload = notification
+            try:
+                channel, action = self.convertChannel(channel)
+            except PostgresListenerNotifyError:
+                # Log the error and continue processing the remaining
+                # notifications.
+                self.log.failure(
+                    "Failed to convert channel {channel!r}.", channel=channel
+                )
+            else:
+                group = groups.setdefault((channel, action), [])
+                group.append((payload, received))
+        self.updateQueueDepthMetric()
 
         return task.coiterate(
-            self.handleNotify(notification, clock=clock)
-            for notification in gen_notifications(self.notifications)
+            self.handleNotifyGroup(channel, action, group, clock=clock)
+            for (channel, action), group in groups.items()
         )
 
+    def handleNotifyGroup(self, channel, action, group, clock=reactor):
+        """Process notifications on `channel` for `action`.
+
+        Batched handlers are called once per batch of payloads. The other
+        handlers are called for one payload at a time, in turn, just as
+        notifications were handled before batching.
+
+        :param group: List of ``(payload, received)`` tuples, `received`
+            being the time the notification was received or `None`.
+        """
+        payloads = [payload for payload, _ in group]
+        handlers = list(self.listeners[channel])
+        batched = [
+            handler
+            for handler in handlers
+            if (channel, handler) in self.batchedListeners
+        ]
+        unbatched = [
+            handler for handler in handlers if handler not in batched
+        ]
+
+        def gen_calls():
+            size = self.HANDLE_NOTIFY_BATCH_SIZE
+            for handler in batched:
+                for i in range(0, len(payloads), size):
+                    yield self.callHandler(
+                        channel, handler, action, payloads[i : i + size]
+                    )
+            if len(unbatched) != 0:
+                for payload in payloads:
+                    yield defer.DeferredList(
+                        [
+                            self.callHandler(channel, handler, action, payload)
+                            for handler in unbatched
+                        ]
+                    )
+
+        def record_latency(result):
+            now = time()
+            for _, received in group:
+                if received is not None:
+                    PROMETHEUS_METRICS.update(
+                        "maas_db_notify_latency",
+                        "observe",
+                        value=now - received,
+                        labels={"channel": channel},
+                    )
+            return result
+
+        return task.coiterate(gen_calls()).addCallback(record_latency)
+
     def handleNotify(self, notification, clock=reactor):
         """Process a notify message in the notifications set."""
         channel, payload = notification
@@ -483,20 +588,155 @@ class PostgresListenerService(Service, object):
                 "Failed to convert channel {channel!r}.", channel=channel
             )
         else:
-            defers = []
-            handlers = self.listeners[channel]
-            # XXX: There could be an arbitrary number of listeners. Should we
-            # limit concurrency here? Perhaps even do one at a time.
-            for handler in handlers:
-                d = defer.maybeDeferred(handler, action, payload)
-                d.addErrback(
-                    lambda failure: self.log.failure(
-                        "Failure while handling notification to {channel!r}: "
-                        "{payload!r}",
-                        failure,
-                        channel=channel,
-                        payload=payload,
-                    )
-                )
-                defers.append(d)
-            return defer.DeferredList(defers)
+            received = self.notificationTimes.pop(notification, None)
+            return self.handleNotifyGroup(
+                channel, action, [(payload, received)], clock=clock
+            )
+
+    def callHandler(self, channel, handler, action, payload):
+        """Call `handler`, logging any failure."""
+        d = defer.maybeDeferred(handler, action, payload)
+        d.addErrback(
+            lambda failure: self.log.failure(
+                "Failure while handling notification to {channel!r}: "
+                "{payload!r}",
+                failure,
+                channel=channel,
+                payload=payload,
+            )
+        )
+        return d
+
+
+class PostgresListenerWorkerService(PostgresListenerService):
+    """Receives the NOTIFY messages from postgres through the master process.
+
+    Instead of making its own connection to postgres, a worker process asks
+    the master process, over IPC, for the notifications on the channels it
+    has handlers for. The master holds the only listening connection of the
+    host and passes the notifications on, already decoded and grouped by
+    action, so they are handled here just like `PostgresListenerService`
+    does. The connected and disconnected events of the master's listener
+    are passed on as well.
+
+    :ivar ipcWorker: The `IPCWorkerService` connected to the master.
+    :ivar masterConnected: Whether the master's listener is connected, as
+        last told by the master. It's assumed to be until told otherwise.
+    """
+
+    def __init__(self, ipcWorker):
+        super().__init__()
+        self.ipcWorker = ipcWorker
+        self.masterConnected = True
+        # channel -> DeferredLock
+        self.notifyLocks = {}
+
+    def startService(self):
+        """Start receiving the notifications from the master."""
+        Service.startService(self)
+        self.ipcWorker.listenerConnectionReceiver = self.masterConnection
+        self.runChannelRegistrar()
+        if self.masterConnected:
+            self.events.connected.fire()
+        return succeed(None)
+
+    def stopService(self):
+        """Stop receiving the notifications from the master."""
+        Service.stopService(self)
+        self.ipcWorker.listenerConnectionReceiver = None
+        self.registeredChannels.clear()
+        d = self.cancelChannelRegistrar()
+        d.addCallback(
+            callOut,
+            self.events.disconnected.fire,
+            Failure(error.ConnectionDone()),
+        )
+        return d
+
+    def connected(self):
+        """Return True if receiving the notifications from the master."""
+        return self.running and self.masterConnected
+
+    def masterConnection(self, connected):
+        """The master's listener connected or disconnected.
+
+        Notifications may have been missed while disconnected, so the
+        events are fired for the handlers to catch up.
+        """
+        self.masterConnected = connected
+        if not self.running:
+            return
+        elif connected:
+            self.events.connected.fire()
+        else:
+            self.events.disconnected.fire(Failure(error.ConnectionLost()))
+
+    def runChannelRegistrar(self):
+        """Start the loop subscribing to channels with the master.
+
+        It will only start if the service is running.
+        """
+        if self.running and not self.channelRegistrar.running:
+            self.channelRegistrarDone = self.channelRegistrar.start(
+                self.CHANNEL_REGISTRAR_DELAY, now=True
+            )
+
+    async def registerChannels(self):
+        """Subscribe/unsubscribe to channels that were (un)registered.
+
+        This works like `PostgresListenerService.registerChannels` except
+        that the master process is asked to listen on the channels.
+        """
+        to_register = set(self.listeners.keys()).difference(
+            self.registeredChannels
+        )
+        to_unregister = self.registeredChannels.difference(
+            set(self.listeners.keys())
+        )
+        if not to_register and not to_unregister:
+            self.channelRegistrar.stop()
+        else:
+            for channel in to_register:
+                await self.ipcWorker.listenerRegister(channel, self.notify)
+                self.registeredChannels.add(channel)
+            for channel in to_unregister:
+                await self.ipcWorker.listenerUnregister(channel)
+                self.registeredChannels.remove(channel)
+
+    def notify(self, channel, action, payloads):
+        """Queue the notifications on `channel` passed by the master.
+
+        They are handled once the notifications passed before on `channel`
+        have been, so the master doesn't wait for the handlers. `action` is
+        empty for system channels.
+        """
+        lock = self.notifyLocks.get(channel)
+        if lock is None:
+            lock = self.notifyLocks[channel] = DeferredLock()
+        d = lock.run(self._handleWorkerNotify, channel, action, payloads)
+        d.addErrback(
+            lambda failure: self.log.failure(
+                "Failure while handling notifications to {channel!r}.",
+                failure,
+                channel=channel,
+            )
+        )
+        d.addBoth(callOut, self._forgetNotifyLock, channel, lock)
+
+    def _forgetNotifyLock(self, channel, lock):
+        if not lock.locked and self.notifyLocks.get(channel) is lock:
+            del self.notifyLocks[channel]
+
+    def _handleWorkerNotify(self, channel, action, payloads):
+        """Handle the notifications on `channel` passed by the master."""
+        handlers = self.listeners.get(channel)
+        if not handlers:
+            # No longer registered, the master will be told shortly.
+            return None
+        elif self.isSystemChannel(channel):
+            for payload in payloads:
+                handlers[0](channel, payload)
+        else:
+            return self.handleNotifyGroup(
+                channel, action, [(payload, None) for payload in payloads]
+            )
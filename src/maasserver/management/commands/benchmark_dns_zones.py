@@ -0,0 +1,52 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Django command: benchmark DNS zone generation."""
+
+__all__ = ["Command"]
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Populate the database with a large number of machines, then report "
+        "the time, peak memory, and queries needed to generate DNS zones."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--nodes", type=int, default=50000, help="Number of machines."
+        )
+        parser.add_argument(
+            "--subnets", type=int, default=500, help="Number of /24 subnets."
+        )
+        parser.add_argument(
+            "--domains", type=int, default=10, help="Number of domains."
+        )
+        parser.add_argument(
+            "--skip-populate",
+            action="store_true",
+            help="Benchmark the data already in the database.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            from maasserver.testing import dnsbenchmark
+        except ImportError:
+            print(
+                "DNS benchmarks are available only in development "
+                "and test environments.",
+                file=self.stderr,
+            )
+            raise SystemExit(1)
+        else:
+            dnsbenchmark.benchmark(
+                self.stdout,
+                nodes=options["nodes"],
+                subnets=options["subnets"],
+                domains=options["domains"],
+                skip_populate=options["skip_populate"],
+            )
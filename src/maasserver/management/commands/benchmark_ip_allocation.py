@@ -0,0 +1,55 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Django command: benchmark choosing IP addresses to allocate."""
+
+__all__ = ["Command"]
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Populate a /16 IPv4 and a /64 IPv6 subnet with many addresses, then "
+        "report the time needed to choose the next address to allocate, and "
+        "to allocate it."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--addresses",
+            type=int,
+            default=30000,
+            help="Number of addresses in use in each subnet.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of times to choose an address.",
+        )
+        parser.add_argument(
+            "--skip-populate",
+            action="store_true",
+            help="Benchmark the data already in the database.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            from maasserver.testing import ipbenchmark
+        except ImportError:
+            print(
+                "IP allocation benchmarks are available only in development "
+                "and test environments.",
+                file=self.stderr,
+            )
+            raise SystemExit(1)
+        else:
+            ipbenchmark.benchmark(
+                self.stdout,
+                addresses=options["addresses"],
+                repeat=options["repeat"],
+                skip_populate=options["skip_populate"],
+            )
@@ -0,0 +1,28 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Test the `benchmark_dns_zones` management command."""
+
+__all__ = []
+
+from unittest.mock import ANY
+
+from django.core.management import call_command
+
+from maasserver.testing import dnsbenchmark
+from maastesting.matchers import MockCalledOnceWith
+from maastesting.testcase import MAASTestCase
+
+
+class TestBenchmarkDNSZones(MAASTestCase):
+    def test_calls_benchmark_with_options(self):
+        self.patch(dnsbenchmark, "benchmark")
+        call_command(
+            "benchmark_dns_zones", "--nodes=10", "--subnets=2", "--domains=3"
+        )
+        self.assertThat(
+            dnsbenchmark.benchmark,
+            MockCalledOnceWith(
+                ANY, nodes=10, subnets=2, domains=3, skip_populate=False
+            ),
+        )
@@ -0,0 +1,26 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Test the `benchmark_ip_allocation` management command."""
+
+__all__ = []
+
+from unittest.mock import ANY
+
+from django.core.management import call_command
+
+from maasserver.testing import ipbenchmark
+from maastesting.matchers import MockCalledOnceWith
+from maastesting.testcase import MAASTestCase
+
+
+class TestBenchmarkIPAllocation(MAASTestCase):
+    def test_calls_benchmark_with_options(self):
+        self.patch(ipbenchmark, "benchmark")
+        call_command("benchmark_ip_allocation", "--addresses=10", "--repeat=2")
+        self.assertThat(
+            ipbenchmark.benchmark,
+            MockCalledOnceWith(
+                ANY, addresses=10, repeat=2, skip_populate=False
+            ),
+        )
@@ -120,6 +120,7 @@ class TestConfigurationSet(MAASTestCase):
         if self.option == "database_port":
             value = factory.pick_port()
         elif self.option in (
+            "address_pool_size",
             "database_conn_max_age",
             "database_keepalive_count",
             "database_keepalive_interval",
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("maasserver", "0211_jsonfield_default_callable")]
+
+    operations = [
+        migrations.CreateModel(
+            name="IPAddressCandidate",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "ip",
+                    models.GenericIPAddressField(
+                        editable=False, unique=True, verbose_name="IP"
+                    ),
+                ),
+                ("owner", models.CharField(editable=False, max_length=255)),
+                ("expires", models.DateTimeField(editable=False)),
+                (
+                    "subnet",
+                    models.ForeignKey(
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="maasserver.Subnet",
+                    ),
+                ),
+            ],
+        )
+    ]
@@ -36,6 +36,7 @@ __all__ = [
     "FilesystemGroup",
     "GlobalDefault",
     "Interface",
+    "IPAddressCandidate",
     "IPRange",
     "ISCSIBlockDevice",
     "KeySource",
@@ -144,6 +145,7 @@ from maasserver.models.interface import (
     UnknownInterface,
     VLANInterface,
 )
+from maasserver.models.ipaddresscandidate import IPAddressCandidate
 from maasserver.models.iprange import IPRange
 from maasserver.models.iscsiblockdevice import ISCSIBlockDevice
 from maasserver.models.keysource import KeySource
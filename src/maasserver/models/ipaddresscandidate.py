@@ -0,0 +1,247 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Addresses claimed by region processes in advance of allocation.
+
+When `ADDRESS_POOL_SIZE` is set, each region process claims a few free
+addresses per subnet at a time, in a short transaction of its own, and
+then hands them out to its threads. Concurrent allocations from the same
+subnet therefore never pick the same address, so they no longer collide
+on `StaticIPAddress` and retry while holding the `address_allocation`
+lock.
+"""
+
+__all__ = ["address_pool", "IPAddressCandidate"]
+
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import timedelta
+import os
+from socket import gethostname
+import threading
+import time
+
+from django.db import connection
+from django.db.models import (
+    CASCADE,
+    CharField,
+    DateTimeField,
+    ForeignKey,
+    GenericIPAddressField,
+    Manager,
+    Model,
+)
+from django.db.models.functions import Now
+from netaddr import IPAddress
+
+from maasserver import DefaultMeta
+from maasserver.utils.orm import transactional
+from provisioningserver.logger import get_maas_logger
+
+maaslog = get_maas_logger("ipaddresscandidate")
+
+
+class IPAddressCandidateManager(Manager):
+    """Manager for `IPAddressCandidate` records."""
+
+    def get_claimed_ips(self, subnet):
+        """Return the addresses in `subnet` whose claim has not expired."""
+        return self.filter(subnet=subnet, expires__gt=Now()).values_list(
+            "ip", flat=True
+        )
+
+
+class IPAddressCandidate(Model):
+    """A free address claimed by a region process for allocation.
+
+    :ivar subnet: The subnet the address belongs to.
+    :ivar ip: The address.
+    :ivar owner: The region process that claimed the address.
+    :ivar expires: When the claim expires. Expired candidates are free
+        again, and are deleted when the subnet is next claimed from.
+    """
+
+    class Meta(DefaultMeta):
+        """Needed for South to recognize this model."""
+
+    objects = IPAddressCandidateManager()
+
+    subnet = ForeignKey(
+        "Subnet", editable=False, null=False, on_delete=CASCADE
+    )
+
+    ip = GenericIPAddressField(
+        editable=False, null=False, unique=True, verbose_name="IP"
+    )
+
+    owner = CharField(editable=False, max_length=255, null=False)
+
+    expires = DateTimeField(editable=False, null=False)
+
+    def __str__(self):
+        return "%s (claimed by %s)" % (self.ip, self.owner)
+
+
+@transactional
+def claim_addresses(subnet_id, owner, count, lifetime, allocated=()):
+    """Claim up to `count` free addresses in a subnet for `owner`.
+
+    This must run in a transaction of its own, so that the claims are
+    visible to other processes as soon as it returns. Claims on the same
+    subnet are serialised by locking its row; the transaction is READ
+    COMMITTED so that each sees the candidates claimed by the one before.
+
+    The claims `owner` has on the `allocated` addresses are dropped first,
+    provided their allocation has been committed. The others are left to
+    expire.
+
+    :return: A tuple of the claimed addresses and when the claim expires.
+    """
+    # Circular imports.
+    from maasserver.models.subnet import Subnet
+
+    with closing(connection.cursor()) as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        # Don't wait forever if the thread that asked for these addresses
+        # has itself locked the subnet.
+        cursor.execute("SET LOCAL lock_timeout = '5s'")
+        cursor.execute(
+            "SELECT now() FROM maasserver_subnet WHERE id = %s "
+            "FOR NO KEY UPDATE",
+            [subnet_id],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        # The subnet is gone, or not yet committed.
+        return [], None
+    [claimed] = row
+    IPAddressCandidate.objects.filter(
+        subnet_id=subnet_id, expires__lte=claimed
+    ).delete()
+    if len(allocated) > 0:
+        # Circular imports.
+        from maasserver.models.staticipaddress import StaticIPAddress
+
+        IPAddressCandidate.objects.filter(
+            subnet_id=subnet_id,
+            owner=owner,
+            ip__in=StaticIPAddress.objects.filter(
+                subnet_id=subnet_id, ip__in=allocated
+            ).values("ip"),
+        ).delete()
+    subnet = Subnet.objects.get(id=subnet_id)
+    ips = subnet.get_next_ips_for_allocation(count)
+    expires = claimed + lifetime
+    IPAddressCandidate.objects.bulk_create(
+        IPAddressCandidate(subnet=subnet, ip=ip, owner=owner, expires=expires)
+        for ip in ips
+    )
+    return ips, expires
+
+
+class AddressPool:
+    """The addresses this region process has claimed, by subnet.
+
+    Addresses are handed out well before their claim expires; the rest of
+    the lifetime leaves room for the transaction that allocates them. That
+    transaction does not touch the claim: it may not see it at all, having
+    started before the claim was made. Instead, `allocated` records the
+    address, and its claim is dropped when the subnet is next claimed from.
+    """
+
+    def __init__(self, lifetime=timedelta(minutes=2)):
+        self.lifetime = lifetime
+        self._lock = threading.Lock()
+        self._pools = defaultdict(deque)
+        self._allocated = defaultdict(set)
+        self._executor = None
+
+    @property
+    def owner(self):
+        return "%s:pid=%d" % (gethostname(), os.getpid())
+
+    def take(self, subnet, size, exclude_addresses=None):
+        """Yield claimed addresses in `subnet` until the caller stops.
+
+        When none are left, up to `size` more are claimed, once.
+        """
+        if exclude_addresses is None:
+            exclude = frozenset()
+        else:
+            exclude = frozenset(
+                str(IPAddress(address)) for address in exclude_addresses
+            )
+        claimed = False
+        while True:
+            ip = self._pop(subnet.id, exclude)
+            if ip is not None:
+                yield ip
+            elif claimed:
+                return
+            else:
+                self._claim(subnet.id, size)
+                claimed = True
+
+    def allocated(self, subnet, ip):
+        """Record that `ip`, taken from `subnet`, has been allocated."""
+        with self._lock:
+            self._allocated[subnet.id].add(ip)
+
+    def _pop(self, subnet_id, exclude):
+        now = time.monotonic()
+        with self._lock:
+            pool = self._pools[subnet_id]
+            skipped = []
+            try:
+                while len(pool) > 0:
+                    ip, deadline = pool.popleft()
+                    if deadline <= now:
+                        # Too close to expiry; drop it.
+                        continue
+                    elif ip in exclude:
+                        skipped.append((ip, deadline))
+                    else:
+                        return ip
+                return None
+            finally:
+                pool.extendleft(reversed(skipped))
+
+    def _claim(self, subnet_id, size):
+        deadline = time.monotonic() + self.lifetime.total_seconds() / 2
+        # Claim from another thread, so that it gets its own connection and
+        # transaction; the calling thread is already in a transaction.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=2, thread_name_prefix="address-pool"
+                )
+            executor = self._executor
+            allocated = self._allocated.pop(subnet_id, ())
+        future = executor.submit(
+            claim_addresses,
+            subnet_id,
+            self.owner,
+            size,
+            self.lifetime,
+            allocated=list(allocated),
+        )
+        try:
+            ips, _ = future.result()
+        except Exception as error:
+            maaslog.warning(
+                "Unable to claim addresses for allocation from subnet %d: %s"
+                % (subnet_id, error)
+            )
+            return
+        with self._lock:
+            self._pools[subnet_id].extend((ip, deadline) for ip in ips)
+
+    def clear(self):
+        """Forget all claimed addresses; their claims will expire."""
+        with self._lock:
+            self._pools.clear()
+            self._allocated.clear()
+
+
+address_pool = AddressPool()
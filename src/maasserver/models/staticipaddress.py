@@ -14,6 +14,7 @@ __all__ = ["StaticIPAddress"]
 
 from collections import defaultdict, namedtuple
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import connection, IntegrityError, transaction
@@ -43,6 +44,7 @@ from maasserver.exceptions import (
 from maasserver.models.cleansave import CleanSave
 from maasserver.models.config import Config
 from maasserver.models.domain import Domain
+from maasserver.models.ipaddresscandidate import address_pool
 from maasserver.models.subnet import Subnet
 from maasserver.models.timestampedmodel import TimestampedModel
 from maasserver.utils import orm
@@ -58,15 +60,28 @@ _mapping_base_fields = (
     "ip",
 )
 
-_special_mapping_result = _mapping_base_fields + ("dnsresource_id",)
+_special_mapping_result = _mapping_base_fields + (
+    "dnsresource_id",
+    "dnsresource_domain2_id",
+    "node_domain2_id",
+    "dnsresource_domain_id",
+    "node_domain_id",
+)
 
 _mapping_query_result = _mapping_base_fields + (
     "is_boot",
     "preference",
     "family",
+    "domain_id",
+    "domain2_id",
 )
 
-_interface_mapping_result = _mapping_base_fields + ("iface_name", "assigned")
+_interface_mapping_result = _mapping_base_fields + (
+    "iface_name",
+    "assigned",
+    "domain_id",
+    "domain2_id",
+)
 
 SpecialMappingQueryResult = namedtuple(
     "SpecialMappingQueryResult", _special_mapping_result
@@ -249,6 +264,43 @@ class StaticIPAddressManager(Manager):
             ipaddress.save()
             return ipaddress
 
+    def _attempt_allocation_from_pool(
+        self, subnet, alloc_type, user=None, exclude_addresses=None
+    ):
+        """Attempt to allocate an address this process has claimed.
+
+        Claimed addresses are not handed out to any other process, so this
+        does not need to retry on a `UNIQUE_VIOLATION`. Should an address
+        have been taken anyway, for example by a request for that specific
+        address, the next one is tried instead.
+
+        The claim itself is left alone: this transaction's snapshot may
+        predate it. The pool drops it once the allocation is committed.
+
+        :return: `StaticIPAddress` if successful, or `None` if no claimed
+            address could be allocated.
+        """
+        for ip in address_pool.take(
+            subnet, settings.ADDRESS_POOL_SIZE, exclude_addresses
+        ):
+            ipaddress = StaticIPAddress(alloc_type=alloc_type, subnet=subnet)
+            try:
+                with orm.savepoint():
+                    ipaddress.set_ip_address(ip)
+                    ipaddress.save()
+            except IntegrityError as error:
+                if orm.is_unique_violation(error):
+                    continue
+                else:
+                    raise
+            else:
+                # See `_attempt_allocation` for why this is saved separately.
+                ipaddress.user = user
+                ipaddress.save()
+                address_pool.allocated(subnet, ip)
+                return ipaddress
+        return None
+
     def allocate_new(
         self,
         subnet=None,
@@ -288,6 +340,15 @@ class StaticIPAddressManager(Manager):
                 )
 
         if requested_address is None:
+            if settings.ADDRESS_POOL_SIZE > 0:
+                ipaddress = self._attempt_allocation_from_pool(
+                    subnet,
+                    alloc_type,
+                    user=user,
+                    exclude_addresses=exclude_addresses,
+                )
+                if ipaddress is not None:
+                    return ipaddress
             requested_address = subnet.get_next_ip_for_allocation(
                 exclude_addresses=exclude_addresses
             )
@@ -317,6 +378,25 @@ class StaticIPAddressManager(Manager):
     def _get_special_mappings(self, domain, raw_ttl=False):
         """Get the special mappings, possibly limited to a single Domain.
 
+        See `_get_special_mappings_by_domain` for details.
+
+        :param domain: limit return to just the given Domain.  If anything
+            other than a Domain is passed in (e.g., a Subnet or None), we
+            return all of the reverse mappings.
+        :param raw_ttl: Boolean, if True then just return the address_ttl,
+            otherwise, coalesce the address_ttl to be the correct answer for
+            zone generation.
+        :return: a (default) dict of hostname: HostnameIPMapping entries.
+        """
+        if isinstance(domain, Domain):
+            mappings = self._get_special_mappings_by_domain([domain], raw_ttl)
+            return mappings[domain.id]
+        else:
+            return self._get_special_mappings_by_domain(None, raw_ttl)[None]
+
+    def _get_special_mappings_by_domain(self, domains, raw_ttl=False):
+        """Get the special mappings for each of the given Domains.
+
         This function is responsible for creating these mappings:
         - any USER_RESERVED IP that has no name (dnsrr or node),
         - any IP not associated with a Node,
@@ -334,13 +414,13 @@ class StaticIPAddressManager(Manager):
         to fetch ALL of the entries for subnets, but forward mappings are
         domain-specific.
 
-        :param domain: limit return to just the given Domain.  If anything
-            other than a Domain is passed in (e.g., a Subnet or None), we
-            return all of the reverse mappings.
+        :param domains: a list of Domains to return the mappings for, or
+            None to return all of the reverse mappings.
         :param raw_ttl: Boolean, if True then just return the address_ttl,
             otherwise, coalesce the address_ttl to be the correct answer for
             zone generation.
-        :return: a (default) dict of hostname: HostnameIPMapping entries.
+        :return: a dict of domain id (None for the reverse mappings) to a
+            (default) dict of hostname: HostnameIPMapping entries.
         """
         default_ttl = "%d" % Config.objects.get_config("default_dns_ttl")
         # raw_ttl says that we don't coalesce, but we need to pick one, so we
@@ -373,7 +453,11 @@ class StaticIPAddressManager(Manager):
             + ttl_clause
             + """ AS ttl,
                 staticip.ip,
-                dnsrr.id AS dnsresource_id
+                dnsrr.id AS dnsresource_id,
+                dnsrr.dom2_id,
+                node.dom2_id,
+                dnsrr.domain_id,
+                node.domain_id
             FROM
                 maasserver_staticipaddress AS staticip
             LEFT JOIN (
@@ -434,49 +518,44 @@ class StaticIPAddressManager(Manager):
                 """
         )
 
+        default_domain = Domain.objects.get_default_domain()
         query_parms = []
-        if isinstance(domain, Domain):
-            if domain.is_default():
+        if domains is not None:
+            domain_ids = [domain.id for domain in domains]
+            # For domains, we only need answers for the domains we were
+            # given.  These can can possibly come from either the child or
+            # the parent for glue.  Anything with a node associated will be
+            # found inside of get_hostname_ip_mapping() - we need any
+            # entries that are:
+            # - in these domains and have a dnsrr associated.
+            sql_query += """ (
+                dnsrr.fqdn IS NOT NULL AND
+                (
+                    dnsrr.dom2_id = ANY(%s) OR
+                    node.dom2_id = ANY(%s) OR
+                    dnsrr.domain_id = ANY(%s) OR
+                    node.domain_id = ANY(%s))"""
+            query_parms += [domain_ids, domain_ids, domain_ids, domain_ids]
+            if default_domain.id in domain_ids:
                 # The default domain is extra special, since it needs to have
                 # A/AAAA RRs for any USER_RESERVED addresses that have no name
                 # otherwise attached to them.
-                # We need to get all of the entries that are:
-                # - in this domain and have a dnsrr associated, OR
-                # - are USER_RESERVED and have NO fqdn associated at all.
-                sql_query += """ ((
-                        staticip.alloc_type = %s AND
-                        dnsrr.fqdn IS NULL AND
-                        node.fqdn IS NULL
-                    ) OR (
-                        dnsrr.fqdn IS NOT NULL AND
-                        (
-                            dnsrr.dom2_id = %s OR
-                            node.dom2_id = %s OR
-                            dnsrr.domain_id = %s OR
-                            node.domain_id = %s)))"""
+                sql_query += """ OR (
+                    staticip.alloc_type = %s AND
+                    dnsrr.fqdn IS NULL AND
+                    node.fqdn IS NULL)"""
                 query_parms += [IPADDRESS_TYPE.USER_RESERVED]
-            else:
-                # For domains, we only need answers for the domain we were
-                # given.  These can can possibly come from either the child or
-                # the parent for glue.  Anything with a node associated will be
-                # found inside of get_hostname_ip_mapping() - we need any
-                # entries that are:
-                # - in this domain and have a dnsrr associated.
-                sql_query += """ (
-                    dnsrr.fqdn IS NOT NULL AND
-                    (
-                        dnsrr.dom2_id = %s OR
-                        node.dom2_id = %s OR
-                        dnsrr.domain_id = %s OR
-                        node.domain_id = %s))"""
-            query_parms += [domain.id, domain.id, domain.id, domain.id]
+            sql_query += """)"""
+            mappings = {
+                domain_id: defaultdict(HostnameIPMapping)
+                for domain_id in domain_ids
+            }
         else:
             # In the subnet map, addresses attached to nodes only map back to
             # the node, since some things don't like multiple PTR RRs in
             # answers from the DNS.
             # Since that is handled in get_hostname_ip_mapping, we exclude
             # anything where the node also has a link to the address.
-            domain = None
             sql_query += """ ((
                     node.fqdn IS NULL AND dnsrr.fqdn IS NOT NULL
                 ) OR (
@@ -484,13 +563,24 @@ class StaticIPAddressManager(Manager):
                     dnsrr.fqdn IS NULL AND
                     node.fqdn IS NULL))"""
             query_parms += [IPADDRESS_TYPE.USER_RESERVED]
+            mappings = {None: defaultdict(HostnameIPMapping)}
 
-        default_domain = Domain.objects.get_default_domain()
-        mapping = defaultdict(HostnameIPMapping)
         cursor = connection.cursor()
         cursor.execute(sql_query, query_parms)
         for result in cursor.fetchall():
             result = SpecialMappingQueryResult(*result)
+            if domains is None:
+                domain_ids = [None]
+            elif result.dnsresource_id is None:
+                # An unnamed USER_RESERVED address.
+                domain_ids = [default_domain.id]
+            else:
+                domain_ids = {
+                    result.dnsresource_domain2_id,
+                    result.node_domain2_id,
+                    result.dnsresource_domain_id,
+                    result.node_domain_id,
+                }.intersection(mappings)
             if result.fqdn is None or result.fqdn == "":
                 fqdn = "%s.%s" % (
                     get_ip_based_hostname(result.ip),
@@ -503,17 +593,18 @@ class StaticIPAddressManager(Manager):
             # TTL.  It is left as an exercise for the admin to make sure that
             # the any non-default TTL applied to the Node and DNSResource are
             # equal.
-            entry = mapping[fqdn]
-            if result.system_id is not None:
-                entry.node_type = result.node_type
-                entry.system_id = result.system_id
-            if result.ttl is not None:
-                entry.ttl = result.ttl
-            if result.user_id is not None:
-                entry.user_id = result.user_id
-            entry.ips.add(result.ip)
-            entry.dnsresource_id = result.dnsresource_id
-        return mapping
+            for domain_id in domain_ids:
+                entry = mappings[domain_id][fqdn]
+                if result.system_id is not None:
+                    entry.node_type = result.node_type
+                    entry.system_id = result.system_id
+                if result.ttl is not None:
+                    entry.ttl = result.ttl
+                if result.user_id is not None:
+                    entry.user_id = result.user_id
+                entry.ips.add(result.ip)
+                entry.dnsresource_id = result.dnsresource_id
+        return mappings
 
     def get_hostname_ip_mapping(self, domain_or_subnet, raw_ttl=False):
         """Return hostname mappings for `StaticIPAddress` entries.
@@ -527,12 +618,43 @@ class StaticIPAddressManager(Manager):
 
         The returned name is an FQDN (no trailing dot.)
         """
+        if isinstance(domain_or_subnet, Domain):
+            mappings = self._get_hostname_ip_mappings(
+                [domain_or_subnet], raw_ttl
+            )
+            return mappings[domain_or_subnet.id]
+        else:
+            return self._get_hostname_ip_mappings(None, raw_ttl)[None]
+
+    def get_hostname_ip_mappings(self, domains, raw_ttl=False):
+        """Return hostname mappings for each of `domains`.
+
+        This is the same as calling `get_hostname_ip_mapping` for each domain,
+        but uses the same number of queries however many domains there are.
+
+        :return: a dict of domain id to the mapping for that domain.
+        """
+        domains = list(domains)
+        if len(domains) == 0:
+            return {}
+        return self._get_hostname_ip_mappings(domains, raw_ttl)
+
+    def _get_hostname_ip_mappings(self, domains, raw_ttl=False):
+        """Return hostname mappings for `domains`, keyed by domain id.
+
+        If `domains` is None, return the mapping for all subnets under the
+        key None.
+        """
         cursor = connection.cursor()
 
         # DISTINCT ON returns the first matching row for any given
         # hostname, using the query's ordering.  Here, we're trying to
         # return the IPs for the oldest Interface address.
         default_ttl = "%d" % Config.objects.get_config("default_dns_ttl")
+        if domains is None:
+            domain2_column = """NULL"""
+        else:
+            domain2_column = """domain2.id"""
         if raw_ttl:
             ttl_clause = """node.address_ttl"""
         else:
@@ -580,7 +702,11 @@ class StaticIPAddressManager(Manager):
                     WHEN interface.type = 'unknown' THEN 9
                     ELSE 10
                 END AS preference,
-                family(staticip.ip) AS family
+                family(staticip.ip) AS family,
+                node.domain_id,
+                """
+            + domain2_column
+            + """
             FROM
                 maasserver_interface AS interface
             LEFT OUTER JOIN maasserver_interfacerelationship AS rel ON
@@ -601,7 +727,7 @@ class StaticIPAddressManager(Manager):
                 staticip.id = link.staticipaddress_id
             """
         )
-        if isinstance(domain_or_subnet, Domain):
+        if domains is not None:
             # The model has nodes in the parent domain, but they actually live
             # in the child domain.  And the parent needs the glue.  So we
             # return such nodes addresses in _BOTH_ the parent and the child
@@ -613,9 +739,10 @@ class StaticIPAddressManager(Manager):
                  * nodes a the top of a domain.
                  */ domain2.name = CONCAT(node.hostname, '.', domain.name)
             WHERE
-                (domain2.id = %s OR node.domain_id = %s) AND
+                (domain2.id = ANY(%s) OR node.domain_id = ANY(%s)) AND
             """
-            query_parms = [domain_or_subnet.id, domain_or_subnet.id]
+            domain_ids = [domain.id for domain in domains]
+            query_parms = [domain_ids, domain_ids]
         else:
             # For subnets, we need ALL the names, so that we can correctly
             # identify which ones should have the FQDN.  dns/zonegenerator.py
@@ -666,7 +793,11 @@ class StaticIPAddressManager(Manager):
             + """ AS ttl,
                 staticip.ip,
                 interface.name,
-                alloc_type != 6 /* DISCOVERED */ AS assigned
+                alloc_type != 6 /* DISCOVERED */ AS assigned,
+                node.domain_id,
+                """
+            + domain2_column
+            + """
             FROM
                 maasserver_interface AS interface
             JOIN maasserver_node AS node ON
@@ -679,7 +810,7 @@ class StaticIPAddressManager(Manager):
                 staticip.id = link.staticipaddress_id
             """
         )
-        if isinstance(domain_or_subnet, Domain):
+        if domains is not None:
             # This logic is similar to the logic in sql_query above.
             iface_sql_query += """
             LEFT JOIN maasserver_domain AS domain2 ON
@@ -689,7 +820,7 @@ class StaticIPAddressManager(Manager):
                 domain2.name = CONCAT(
                     interface.name, '.', node.hostname, '.', domain.name)
             WHERE
-                (domain2.id = %s OR node.domain_id = %s) AND
+                (domain2.id = ANY(%s) OR node.domain_id = ANY(%s)) AND
             """
         else:
             # For subnets, we need ALL the names, so that we can correctly
@@ -710,13 +841,29 @@ class StaticIPAddressManager(Manager):
             """
         # We get user reserved et al mappings first, so that we can overwrite
         # TTL as we process the return from the SQL horror above.
-        mapping = self._get_special_mappings(domain_or_subnet, raw_ttl)
+        mappings = self._get_special_mappings_by_domain(domains, raw_ttl)
         # All of the mappings that we got mean that we will only want to add
         # addresses for the boot interface (is_boot == True).
-        iface_is_boot = defaultdict(
-            bool, {hostname: True for hostname in mapping.keys()}
-        )
-        assigned_ips = defaultdict(bool)
+        iface_is_boot = {
+            domain_id: defaultdict(
+                bool, {hostname: True for hostname in mapping.keys()}
+            )
+            for domain_id, mapping in mappings.items()
+        }
+        assigned_ips = {
+            domain_id: defaultdict(bool) for domain_id in mappings.keys()
+        }
+
+        def get_domain_ids(result):
+            # Each row is processed once for every domain it was selected
+            # for, exactly as if the domains had been queried one by one.
+            if domains is None:
+                return [None]
+            else:
+                return {result.domain_id, result.domain2_id}.intersection(
+                    mappings
+                )
+
         cursor.execute(sql_query, query_parms)
         # The records from the query provide, for each hostname (after
         # stripping domain), the boot and non-boot interface ip address in ipv4
@@ -726,37 +873,45 @@ class StaticIPAddressManager(Manager):
         # interface IPs.  See Bug#1584850
         for result in cursor.fetchall():
             result = MappingQueryResult(*result)
-            entry = mapping[result.fqdn]
-            entry.node_type = result.node_type
-            entry.system_id = result.system_id
-            if result.user_id is not None:
-                entry.user_id = result.user_id
-            entry.ttl = result.ttl
-            if result.is_boot:
-                iface_is_boot[result.fqdn] = True
-            # If we have an IP on the right interface type, save it.
-            if result.is_boot == iface_is_boot[result.fqdn]:
-                entry.ips.add(result.ip)
+            for domain_id in get_domain_ids(result):
+                mapping = mappings[domain_id]
+                entry = mapping[result.fqdn]
+                entry.node_type = result.node_type
+                entry.system_id = result.system_id
+                if result.user_id is not None:
+                    entry.user_id = result.user_id
+                entry.ttl = result.ttl
+                is_boot = iface_is_boot[domain_id]
+                if result.is_boot:
+                    is_boot[result.fqdn] = True
+                # If we have an IP on the right interface type, save it.
+                if result.is_boot == is_boot[result.fqdn]:
+                    entry.ips.add(result.ip)
         # Next, get all the addresses, on all the interfaces, and add the ones
         # that are not already present on the FQDN as $IFACE.$FQDN.  Exclude
         # any discovered addresses once there are any non-discovered addresses.
         cursor.execute(iface_sql_query, query_parms)
         for result in cursor.fetchall():
             result = InterfaceMappingResult(*result)
-            if result.assigned:
-                assigned_ips[result.fqdn] = True
-            # If this is an assigned IP, or there are NO assigned IPs on the
-            # node, then consider adding the IP.
-            if result.assigned or not assigned_ips[result.fqdn]:
-                if result.ip not in mapping[result.fqdn].ips:
-                    entry = mapping["%s.%s" % (result.iface_name, result.fqdn)]
-                    entry.node_type = result.node_type
-                    entry.system_id = result.system_id
-                    if result.user_id is not None:
-                        entry.user_id = result.user_id
-                    entry.ttl = result.ttl
-                    entry.ips.add(result.ip)
-        return mapping
+            for domain_id in get_domain_ids(result):
+                mapping = mappings[domain_id]
+                assigned = assigned_ips[domain_id]
+                if result.assigned:
+                    assigned[result.fqdn] = True
+                # If this is an assigned IP, or there are NO assigned IPs on
+                # the node, then consider adding the IP.
+                if result.assigned or not assigned[result.fqdn]:
+                    if result.ip not in mapping[result.fqdn].ips:
+                        entry = mapping[
+                            "%s.%s" % (result.iface_name, result.fqdn)
+                        ]
+                        entry.node_type = result.node_type
+                        entry.system_id = result.system_id
+                        if result.user_id is not None:
+                            entry.user_id = result.user_id
+                        entry.ttl = result.ttl
+                        entry.ips.add(result.ip)
+        return mappings
 
     def filter_by_ip_family(self, family):
         possible_families = map_enum_reverse(IPADDRESS_FAMILY)
@@ -5,7 +5,7 @@
 
 __all__ = ["create_cidr", "get_allocated_ips", "Subnet"]
 
-from operator import attrgetter
+from ipaddress import ip_address
 from typing import Iterable, Optional
 
 from django.contrib.postgres.fields import ArrayField
@@ -41,6 +41,7 @@ from maasserver.fields import CIDRField
 from maasserver.models.cleansave import CleanSave
 from maasserver.models.staticroute import StaticRoute
 from maasserver.models.timestampedmodel import TimestampedModel
+from maasserver.utils.freeranges import FreeIPRanges
 from maasserver.utils.orm import MAASQueriesMixin
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.utils.network import (
@@ -151,6 +152,44 @@ class SubnetQueriesMixin(MAASQueriesMixin):
         else:
             return None
 
+    find_best_subnets_for_ips_query = """
+        SELECT DISTINCT ON (lease.ip)
+            subnet.*,
+            host(lease.ip) "for_ip"
+        FROM unnest(%s::inet[]) AS lease(ip)
+        INNER JOIN maasserver_subnet AS subnet
+            ON lease.ip << subnet.cidr
+        INNER JOIN maasserver_vlan AS vlan
+            ON subnet.vlan_id = vlan.id
+        ORDER BY
+            lease.ip,
+            /* As in find_best_subnet_for_ip_query. */
+            vlan.dhcp_on DESC,
+            masklen(subnet.cidr) DESC
+        """
+
+    def get_best_subnets_for_ips(self, ips):
+        """Find the most-specific managed Subnet for each of `ips`.
+
+        This is `get_best_subnet_for_ip` for many addresses in one query.
+
+        :return: A dict mapping each address in `ips` that belongs to a
+            subnet, as an `IPAddress`, to that subnet. IPv4-mapped addresses
+            are given as IPv4 addresses.
+        """
+        addresses = set()
+        for ip in ips:
+            ip = IPAddress(ip)
+            if ip.is_ipv4_mapped():
+                ip = ip.ipv4()
+            addresses.add(str(ip))
+        if len(addresses) == 0:
+            return {}
+        subnets = self.raw(
+            self.find_best_subnets_for_ips_query, params=[sorted(addresses)]
+        )
+        return {IPAddress(subnet.for_ip): subnet for subnet in subnets}
+
     def validate_filter_specifiers(self, specifiers):
         """Validate the given filter string."""
         try:
@@ -490,20 +529,40 @@ class Subnet(CleanSave, TimestampedModel):
         """Returns a set of MAASIPRange objects created from the set of allocated
         StaticIPAddress objects.
         """
-        ranges = set()
+        return {
+            make_iprange(
+                IPAddress(value, ipnetwork.version), purpose="assigned-ip"
+            )
+            for value in self._get_allocated_ip_values(
+                ipnetwork, ignore_discovered_ips
+            )
+        }
+
+    def _get_allocated_ip_values(
+        self, ipnetwork: IPNetwork, ignore_discovered_ips: bool
+    ) -> list:
+        """Returns the allocated StaticIPAddress addresses in `ipnetwork`, as
+        integers.
+        """
+        values = []
         # We work with tuple rather than real model objects, since a
         # subnet may many IPs and creating a model object for each IP is
-        # slow.
+        # slow. For the same reason the addresses are parsed with the
+        # standard library rather than netaddr.
         ips = self.get_allocated_ips()
         for ip, alloc_type in ips:
             if ip and not (
                 ignore_discovered_ips
                 and (alloc_type == IPADDRESS_TYPE.DISCOVERED)
             ):
-                ip = IPAddress(ip)
-                if ip in ipnetwork:
-                    ranges.add(make_iprange(ip, purpose="assigned-ip"))
-        return ranges
+                ip = ip_address(ip)
+                value = int(ip)
+                if (
+                    ip.version == ipnetwork.version
+                    and ipnetwork.first <= value <= ipnetwork.last
+                ):
+                    values.append(value)
+        return values
 
     def get_ipranges_in_use(
         self,
@@ -514,6 +573,7 @@ class Subnet(CleanSave, TimestampedModel):
         ignore_discovered_ips: bool = False,
         exclude_ip_ranges: list = None,
         cached_staticroutes: list = None,
+        with_allocated_ips: bool = True,
     ) -> MAASIPSet:
         """Returns a `MAASIPSet` of `MAASIPRange` objects which are currently
         in use on this `Subnet`.
@@ -524,6 +584,8 @@ class Subnet(CleanSave, TimestampedModel):
             DNS servers, and `exclude_addresses`.
         :param with_neighbours: If True, includes addresses learned from
             neighbour observation.
+        :param with_allocated_ips: If False, leaves out allocated addresses,
+            for callers that deal with them separately.
         """
         if exclude_addresses is None:
             exclude_addresses = []
@@ -577,9 +639,10 @@ class Subnet(CleanSave, TimestampedModel):
                 ranges |= {
                     make_iprange(static_route.gateway_ip, purpose="gateway-ip")
                 }
-            ranges |= self._get_ranges_for_allocated_ips(
-                network, ignore_discovered_ips
-            )
+            if with_allocated_ips:
+                ranges |= self._get_ranges_for_allocated_ips(
+                    network, ignore_discovered_ips
+                )
             ranges |= set(
                 make_iprange(address, purpose="excluded")
                 for address in exclude_addresses
@@ -755,6 +818,60 @@ class Subnet(CleanSave, TimestampedModel):
             reserved_ranges |= self.get_maasipset_for_neighbours()
         return reserved_ranges.get_full_range(self.get_ipnetwork())
 
+    def get_free_ip_ranges(
+        self,
+        exclude_addresses: IPAddressExcludeList = None,
+        ignore_discovered_ips: bool = False,
+    ) -> FreeIPRanges:
+        """Returns a `FreeIPRanges` index of the addresses which are currently
+        free on this `Subnet`.
+
+        These are the same addresses as `get_ipranges_not_in_use` returns,
+        but allocated addresses are never turned into `MAASIPRange` objects,
+        which is what makes that slow on subnets with many of them.
+
+        :param exclude_addresses: An iterable of addresses not to use.
+        :param ignore_discovered_ips: DISCOVERED addresses are not "in use".
+        """
+        network = self.get_ipnetwork()
+        # Reserved ranges are in use on managed subnets; on unmanaged subnets
+        # they are the only addresses that can be used.
+        in_use = self.get_ipranges_in_use(
+            exclude_addresses=exclude_addresses,
+            include_reserved=self.managed,
+            ignore_discovered_ips=ignore_discovered_ips,
+            with_allocated_ips=False,
+        )
+        used = [(iprange.first, iprange.last) for iprange in in_use.ranges]
+        used.extend(
+            (value, value)
+            for value in self._get_allocated_ip_values(
+                network, ignore_discovered_ips
+            )
+        )
+        # Addresses claimed by region processes are in use until allocated
+        # or until the claim expires.
+        from maasserver.models.ipaddresscandidate import IPAddressCandidate
+
+        for ip in IPAddressCandidate.objects.get_claimed_ips(self):
+            value = int(ip_address(ip))
+            used.append((value, value))
+        # Leave out the network and broadcast addresses, as
+        # `MAASIPSet.get_unused_ranges` does.
+        first, last = network.first, network.last
+        if network.prefixlen < (31 if network.version == 4 else 127):
+            first += 1
+            if network.version == 4:
+                last -= 1
+        if self.managed:
+            allowed = [(first, last)]
+        else:
+            allowed = [
+                (max(iprange.first, first), min(iprange.last, last))
+                for iprange in self.get_reserved_maasipset().ranges
+            ]
+        return FreeIPRanges(allowed, used)
+
     def get_next_ip_for_allocation(
         self,
         exclude_addresses: Optional[Iterable] = None,
@@ -765,30 +882,32 @@ class Subnet(CleanSave, TimestampedModel):
         :param exclude_addresses: Optional list of addresses to exclude.
         :param avoid_observed_neighbours: Optional parameter to specify if
             known observed neighbours should be avoided. This parameter is not
-            intended to be specified by a caller in production code; it is used
-            internally to recursively call this method if the first allocation
-            attempt fails.
+            intended to be specified by a caller in production code; it is
+            only used to skip straight to considering neighbours as free.
         """
-        if exclude_addresses is None:
-            exclude_addresses = []
-        free_ranges = self.get_ipranges_not_in_use(
-            exclude_addresses=exclude_addresses,
-            with_neighbours=avoid_observed_neighbours,
+        free_ranges = self.get_free_ip_ranges(
+            exclude_addresses=exclude_addresses
         )
-        if len(free_ranges) == 0 and avoid_observed_neighbours is True:
-            # Try again recursively, but this time consider neighbours to be
-            # "free" IP addresses. (We'll pick the least recently seen IP.)
-            return self.get_next_ip_for_allocation(
-                exclude_addresses, avoid_observed_neighbours=False
-            )
-        elif len(free_ranges) == 0:
+        if avoid_observed_neighbours:
+            neighbours = []
+            for neighbour in self.get_maasipset_for_neighbours().ranges:
+                neighbours.extend(
+                    free_ranges.remove(neighbour.first, neighbour.last)
+                )
+            if len(free_ranges) == 0:
+                # Try again, but this time consider neighbours to be "free"
+                # IP addresses. (We'll pick the least recently seen IP.)
+                for first, last in neighbours:
+                    free_ranges.add(first, last)
+                avoid_observed_neighbours = False
+        if len(free_ranges) == 0:
             raise StaticIPAddressExhaustion(
                 "No more IPs available in subnet: %s." % self.cidr
             )
-        # The first time through this function, we aren't trying to avoid
-        # observed neighbours. In fact, `free_ranges` only contains completely
-        # unused ranges. So we don't need to check for the least recently seen
-        # neighbour on the first pass.
+        # The first time through, we aren't trying to avoid observed
+        # neighbours. In fact, `free_ranges` only contains completely unused
+        # ranges. So we don't need to check for the least recently seen
+        # neighbour in that case.
         if avoid_observed_neighbours is False:
             # We tried considering neighbours as "in-use" addresses, but the
             # subnet is still full. So make an educated guess about which IP
@@ -811,8 +930,29 @@ class Subnet(CleanSave, TimestampedModel):
         # from the *smallest* free contiguous range. This way, larger ranges
         # can be preserved in case they need to be used for applications
         # requiring them.
-        free_range = min(free_ranges, key=attrgetter("num_addresses"))
-        return str(IPAddress(free_range.first))
+        first, _ = free_ranges.smallest()
+        return str(IPAddress(first, self.get_ip_version()))
+
+    def get_next_ips_for_allocation(self, count):
+        """Return up to `count` addresses from this subnet to use next, best
+        first, as `get_next_ip_for_allocation` would pick them one by one.
+
+        Observed neighbours are never returned, so fewer than `count`
+        addresses are returned when there are not enough other free ones.
+        """
+        free_ranges = self.get_free_ip_ranges()
+        for neighbour in self.get_maasipset_for_neighbours().ranges:
+            free_ranges.remove(neighbour.first, neighbour.last)
+        version = self.get_ip_version()
+        ips = []
+        while len(ips) < count:
+            smallest = free_ranges.smallest()
+            if smallest is None:
+                break
+            first, _ = smallest
+            free_ranges.remove(first)
+            ips.append(str(IPAddress(first, version)))
+        return ips
 
     def render_json_for_related_ips(
         self, with_username=True, with_summary=True
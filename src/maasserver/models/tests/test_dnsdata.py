@@ -382,3 +382,25 @@ class TestDNSDataMapping(MAASServerTestCase):
                 dom, raw_ttl=True
             )
             self.assertEqual(expected_mapping, actual)
+
+    def test_get_hostname_dnsdata_mappings_matches_mapping_per_domain(self):
+        parent = Domain.objects.get_default_domain()
+        name = factory.make_name("node")
+        domain = factory.make_Domain(name="%s.%s" % (name, parent.name))
+        dnsrr = factory.make_DNSResource(
+            name="@", domain=domain, no_ip_addresses=True
+        )
+        factory.make_DNSData(dnsresource=dnsrr, ip_addresses=True)
+        factory.make_Node_with_Interface_on_Subnet(
+            hostname=name, domain=parent
+        )
+        factory.make_DNSData(domain=parent)
+        factory.make_DNSData(domain=domain)
+        domains = [parent, domain]
+        self.assertEqual(
+            {
+                dom.id: DNSData.objects.get_hostname_dnsdata_mapping(dom)
+                for dom in domains
+            },
+            DNSData.objects.get_hostname_dnsdata_mappings(domains),
+        )
@@ -0,0 +1,194 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `IPAddressCandidate` and the address pool."""
+
+__all__ = []
+
+from datetime import timedelta
+import random
+from unittest.mock import Mock, sentinel
+
+from fixtures import FakeLogger
+
+from maasserver.models import ipaddresscandidate as ipaddresscandidate_module
+from maasserver.models.ipaddresscandidate import (
+    AddressPool,
+    claim_addresses,
+    IPAddressCandidate,
+)
+from maasserver.models.timestampedmodel import now
+from maasserver.testing.factory import factory
+from maasserver.testing.testcase import (
+    MAASServerTestCase,
+    MAASTransactionServerTestCase,
+)
+from maastesting.matchers import DocTestMatches
+from maastesting.testcase import MAASTestCase
+
+
+class TestIPAddressCandidateManager(MAASServerTestCase):
+    def make_candidate(self, subnet, ip, owner=None, lifetime=None):
+        if owner is None:
+            owner = factory.make_name("owner")
+        if lifetime is None:
+            lifetime = timedelta(minutes=1)
+        return IPAddressCandidate.objects.create(
+            subnet=subnet, ip=ip, owner=owner, expires=now() + lifetime
+        )
+
+    def test_get_claimed_ips_leaves_out_expired_claims(self):
+        subnet = factory.make_Subnet(cidr="10.0.0.0/24")
+        self.make_candidate(subnet, "10.0.0.1")
+        self.make_candidate(subnet, "10.0.0.2", lifetime=timedelta(minutes=-1))
+        self.make_candidate(factory.make_Subnet(), factory.make_ip_address())
+        self.assertEqual(
+            ["10.0.0.1"],
+            list(IPAddressCandidate.objects.get_claimed_ips(subnet)),
+        )
+
+
+class TestClaimAddresses(MAASTransactionServerTestCase):
+    def make_Subnet(self):
+        # Note: 10.0.0.0/29 --> 10.0.0.1 through 10.0.0.0.6 are usable.
+        return factory.make_Subnet(
+            cidr="10.0.0.0/29", gateway_ip=None, dns_servers=[]
+        )
+
+    def test_claims_free_addresses(self):
+        subnet = self.make_Subnet()
+        lifetime = timedelta(minutes=1)
+        ips, expires = claim_addresses(subnet.id, "one", 3, lifetime)
+        self.assertEqual(["10.0.0.1", "10.0.0.2", "10.0.0.3"], ips)
+        self.assertEqual(
+            {(ip, "one", expires) for ip in ips},
+            set(
+                IPAddressCandidate.objects.values_list(
+                    "ip", "owner", "expires"
+                )
+            ),
+        )
+
+    def test_does_not_claim_addresses_claimed_by_others(self):
+        subnet = self.make_Subnet()
+        lifetime = timedelta(minutes=1)
+        claim_addresses(subnet.id, "one", 3, lifetime)
+        ips, _ = claim_addresses(subnet.id, "two", 6, lifetime)
+        self.assertEqual(["10.0.0.4", "10.0.0.5", "10.0.0.6"], ips)
+        ips, _ = claim_addresses(subnet.id, "three", 6, lifetime)
+        self.assertEqual([], ips)
+
+    def test_claims_addresses_whose_claim_has_expired(self):
+        subnet = self.make_Subnet()
+        claim_addresses(subnet.id, "one", 6, timedelta(minutes=-1))
+        ips, _ = claim_addresses(subnet.id, "two", 6, timedelta(minutes=1))
+        self.assertEqual(6, len(ips))
+        self.assertEqual(
+            {"two"},
+            set(IPAddressCandidate.objects.values_list("owner", flat=True)),
+        )
+
+    def test_drops_claims_on_committed_allocations(self):
+        subnet = self.make_Subnet()
+        lifetime = timedelta(minutes=1)
+        claim_addresses(subnet.id, "one", 3, lifetime)
+        claim_addresses(subnet.id, "two", 1, lifetime)
+        factory.make_StaticIPAddress(ip="10.0.0.1", subnet=subnet)
+        factory.make_StaticIPAddress(ip="10.0.0.4", subnet=subnet)
+        # 10.0.0.2 is not allocated (yet), and 10.0.0.4 is claimed by "two".
+        ips, _ = claim_addresses(
+            subnet.id,
+            "one",
+            0,
+            lifetime,
+            allocated=["10.0.0.1", "10.0.0.2", "10.0.0.4"],
+        )
+        self.assertEqual([], ips)
+        self.assertEqual(
+            {("10.0.0.2", "one"), ("10.0.0.3", "one"), ("10.0.0.4", "two")},
+            set(IPAddressCandidate.objects.values_list("ip", "owner")),
+        )
+
+    def test_claims_nothing_from_unknown_subnet(self):
+        self.assertEqual(
+            ([], None),
+            claim_addresses(
+                random.randint(1000, 2000), "one", 6, timedelta(minutes=1)
+            ),
+        )
+
+
+class TestAddressPool(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.claim_addresses = self.patch(
+            ipaddresscandidate_module, "claim_addresses"
+        )
+        self.claim_addresses.side_effect = [
+            (["10.0.0.1", "10.0.0.2"], sentinel.expires),
+            ([], None),
+        ]
+        self.subnet = Mock(id=random.randint(1, 100))
+
+    def test_take_claims_addresses(self):
+        pool = AddressPool()
+        self.assertEqual(
+            ["10.0.0.1", "10.0.0.2"], list(pool.take(self.subnet, 2))
+        )
+        self.claim_addresses.assert_called_once_with(
+            self.subnet.id, pool.owner, 2, pool.lifetime, allocated=[]
+        )
+
+    def test_take_drops_claims_on_allocated_addresses(self):
+        self.claim_addresses.side_effect = [
+            (["10.0.0.1"], sentinel.expires),
+            (["10.0.0.2"], sentinel.expires),
+        ]
+        pool = AddressPool()
+        ip = next(pool.take(self.subnet, 1))
+        pool.allocated(self.subnet, ip)
+        self.assertEqual(["10.0.0.2"], list(pool.take(self.subnet, 1)))
+        self.assertEqual(
+            {"10.0.0.1"},
+            set(self.claim_addresses.call_args[1]["allocated"]),
+        )
+        # Each allocated address is passed on only once.
+        self.assertEqual({}, pool._allocated)
+
+    def test_take_hands_out_each_address_once(self):
+        pool = AddressPool()
+        self.assertEqual("10.0.0.1", next(pool.take(self.subnet, 2)))
+        self.assertEqual("10.0.0.2", next(pool.take(self.subnet, 2)))
+        self.assertEqual(1, self.claim_addresses.call_count)
+        self.assertEqual([], list(pool.take(self.subnet, 2)))
+
+    def test_take_keeps_excluded_addresses(self):
+        pool = AddressPool()
+        self.assertEqual(
+            ["10.0.0.2"], list(pool.take(self.subnet, 2, ["10.0.0.1"]))
+        )
+        self.assertEqual(["10.0.0.1"], list(pool.take(self.subnet, 2)))
+
+    def test_take_drops_addresses_close_to_expiry(self):
+        pool = AddressPool(lifetime=timedelta(0))
+        self.assertEqual([], list(pool.take(self.subnet, 2)))
+        self.assertEqual(1, self.claim_addresses.call_count)
+
+    def test_clear_forgets_addresses(self):
+        pool = AddressPool()
+        next(pool.take(self.subnet, 2))
+        pool.clear()
+        self.assertEqual([], list(pool.take(self.subnet, 2)))
+
+    def test_take_logs_failure_to_claim(self):
+        self.claim_addresses.side_effect = factory.make_exception("boom")
+        logger = self.useFixture(FakeLogger("maas"))
+        pool = AddressPool()
+        self.assertEqual([], list(pool.take(self.subnet, 2)))
+        self.assertThat(
+            logger.output,
+            DocTestMatches(
+                "Unable to claim addresses for allocation from subnet ...: "
+                "boom\n"
+            ),
+        )
@@ -5,11 +5,12 @@
 
 __all__ = []
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from random import randint, shuffle
 import threading
-from unittest.mock import sentinel
+from unittest.mock import Mock, sentinel
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 from netaddr import IPAddress
@@ -43,6 +44,10 @@ from maasserver.exceptions import (
 )
 from maasserver.models.config import Config
 from maasserver.models.domain import Domain
+from maasserver.models.ipaddresscandidate import (
+    address_pool,
+    IPAddressCandidate,
+)
 from maasserver.models.staticipaddress import (
     HostnameIPMapping,
     StaticIPAddress,
@@ -57,6 +62,7 @@ from maasserver.utils import orm
 from maasserver.utils.dns import get_ip_based_hostname
 from maasserver.utils.orm import reload_object, transactional
 from maasserver.websockets.base import dehydrate_datetime
+from maastesting.djangotestcase import count_queries
 
 
 class TestStaticIPAddressManager(MAASServerTestCase):
@@ -319,6 +325,54 @@ class TestStaticIPAddressManager(MAASServerTestCase):
             "No more IPs available in subnet: %s." % subnet.cidr, str(e)
         )
 
+    def test_allocate_new_uses_address_pool(self):
+        self.patch(settings, "ADDRESS_POOL_SIZE", 4)
+        subnet = factory.make_Subnet(
+            cidr="10.0.0.0/24", gateway_ip=None, dns_servers=[]
+        )
+        taken = factory.make_StaticIPAddress(
+            ip="10.0.0.10", subnet=subnet, alloc_type=IPADDRESS_TYPE.STICKY
+        )
+        for ip in ["10.0.0.10", "10.0.0.20", "10.0.0.30"]:
+            IPAddressCandidate.objects.create(
+                subnet=subnet,
+                ip=ip,
+                owner=address_pool.owner,
+                expires=datetime.now() + timedelta(minutes=1),
+            )
+        # 10.0.0.10 is already allocated, so it is skipped.
+        take = self.patch(address_pool, "take")
+        take.return_value = iter(["10.0.0.10", "10.0.0.20", "10.0.0.30"])
+        exclude_addresses = [factory.make_ip_address()]
+        ipaddress = StaticIPAddress.objects.allocate_new(
+            subnet, exclude_addresses=exclude_addresses
+        )
+        self.assertEqual("10.0.0.20", ipaddress.ip)
+        self.assertEqual(subnet, ipaddress.subnet)
+        take.assert_called_once_with(subnet, 4, exclude_addresses)
+        # The claims are left for the pool to drop.
+        self.assertEqual(
+            {taken.ip, "10.0.0.20", "10.0.0.30"},
+            set(IPAddressCandidate.objects.values_list("ip", flat=True)),
+        )
+
+    def test_allocate_new_records_address_allocated_from_pool(self):
+        self.patch(settings, "ADDRESS_POOL_SIZE", 4)
+        subnet = factory.make_Subnet(
+            cidr="10.0.0.0/24", gateway_ip=None, dns_servers=[]
+        )
+        self.patch(address_pool, "take").return_value = iter(["10.0.0.20"])
+        allocated = self.patch(address_pool, "allocated")
+        ipaddress = StaticIPAddress.objects.allocate_new(subnet)
+        self.assertEqual("10.0.0.20", ipaddress.ip)
+        allocated.assert_called_once_with(subnet, "10.0.0.20")
+
+    def test_allocate_new_without_address_pool_does_not_use_it(self):
+        self.patch(settings, "ADDRESS_POOL_SIZE", 0)
+        take = self.patch(address_pool, "take")
+        StaticIPAddress.objects.allocate_new(factory.make_managed_Subnet())
+        take.assert_not_called()
+
     def test_allocate_new_requests_retry_when_free_address_taken(self):
         set_ip_address = self.patch(StaticIPAddress, "set_ip_address")
         set_ip_address.side_effect = orm.make_unique_violation()
@@ -394,6 +448,83 @@ class TestStaticIPAddressManagerTransactional(MAASTransactionServerTestCase):
             AllMatch(AfterPreprocessing(subnet.is_valid_static_ip, Is(True))),
         )
 
+    def test_allocate_new_from_address_pool_after_querying(self):
+        # Transactions are REPEATABLE READ, so this one's snapshot is taken
+        # before the pool claims the addresses and it cannot see the claims.
+        # They are used regardless.
+        self.patch(settings, "ADDRESS_POOL_SIZE", 4)
+        self.addCleanup(address_pool.clear)
+        subnet = factory.make_managed_Subnet(ipv6=self.ip_version == 6)
+        free_address = self.patch(
+            StaticIPAddress.objects, "_attempt_allocation_of_free_address"
+        )
+
+        @transactional
+        def allocate():
+            self.assertTrue(Subnet.objects.filter(id=subnet.id).exists())
+            return StaticIPAddress.objects.allocate_new(subnet)
+
+        ipaddress = allocate()
+        self.assertIsNotNone(ipaddress)
+        free_address.assert_not_called()
+        ips = IPAddressCandidate.objects.values_list("ip", flat=True)
+        self.assertIn(ipaddress.ip, ips)
+        # Claiming again drops the claim on the committed allocation.
+        self.assertNotIn(ipaddress.ip, address_pool.take(subnet, 4))
+        self.assertNotIn(
+            ipaddress.ip,
+            IPAddressCandidate.objects.values_list("ip", flat=True),
+        )
+
+    def test_allocate_new_from_address_pool_does_not_collide(self):
+        # Allocate as many addresses as deploying this many machines at once
+        # onto the same subnet would.
+        self.patch(settings, "ADDRESS_POOL_SIZE", 16)
+        self.addCleanup(address_pool.clear)
+        request_transaction_retry = self.patch(
+            orm,
+            "request_transaction_retry",
+            Mock(side_effect=orm.request_transaction_retry),
+        )
+        ipv6 = self.ip_version == 6
+        subnet = factory.make_managed_Subnet(ipv6=ipv6)
+        count = 500
+        concurrency = threading.Semaphore(16)
+        mutex = threading.Lock()
+        results = []
+
+        @transactional
+        def allocate():
+            return StaticIPAddress.objects.allocate_new(subnet)
+
+        def allocate_one():
+            try:
+                with concurrency:
+                    sip = allocate()
+            except Exception:
+                failure = Failure()
+                with mutex:
+                    results.append(failure)
+            else:
+                with mutex:
+                    results.append(sip)
+
+        threads = [threading.Thread(target=allocate_one) for _ in range(count)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertThat(results, AllMatch(IsInstance(StaticIPAddress)))
+        ips = {sip.ip for sip in results}
+        self.assertThat(ips, HasLength(count))
+        self.assertThat(
+            ips,
+            AllMatch(AfterPreprocessing(subnet.is_valid_static_ip, Is(True))),
+        )
+        request_transaction_retry.assert_not_called()
+
 
 class TestStaticIPAddressManagerMapping(MAASServerTestCase):
     """Tests for get_hostname_ip_mapping()."""
@@ -1354,6 +1485,58 @@ class TestStaticIPAddressManagerMapping(MAASServerTestCase):
             full_dnsrrname: HostnameIPMapping(None, 30, {sip3.ip}, None),
         }
 
+    def test_get_hostname_ip_mappings_matches_mapping_per_domain(self):
+        default_domain = Domain.objects.get_default_domain()
+        parent = factory.make_Domain()
+        name = factory.make_name()
+        child = factory.make_Domain(name="%s.%s" % (name, parent.name))
+        other = factory.make_Domain()
+        subnet = factory.make_Subnet()
+        node = factory.make_Node_with_Interface_on_Subnet(
+            subnet=subnet, domain=parent, hostname=name
+        )
+        node.interface_set.first().ip_addresses.add(
+            factory.make_StaticIPAddress(subnet=subnet)
+        )
+        factory.make_Node_with_Interface_on_Subnet(
+            subnet=subnet, domain=other
+        )
+        factory.make_DNSResource(
+            domain=other,
+            ip_addresses=[factory.make_StaticIPAddress(subnet=subnet)],
+        )
+        factory.make_StaticIPAddress(
+            alloc_type=IPADDRESS_TYPE.USER_RESERVED, subnet=subnet
+        )
+        domains = [default_domain, parent, child, other]
+        mappings = StaticIPAddress.objects.get_hostname_ip_mappings(domains)
+        self.assertEqual(
+            {
+                domain.id: StaticIPAddress.objects.get_hostname_ip_mapping(
+                    domain
+                )
+                for domain in domains
+            },
+            mappings,
+        )
+
+    def test_get_hostname_ip_mappings_uses_fixed_number_of_queries(self):
+        domains = [factory.make_Domain() for _ in range(3)]
+        for domain in domains:
+            factory.make_Node_with_Interface_on_Subnet(domain=domain)
+        count_one, _ = count_queries(
+            StaticIPAddress.objects.get_hostname_ip_mappings, domains[:1]
+        )
+        count_all, _ = count_queries(
+            StaticIPAddress.objects.get_hostname_ip_mappings, domains
+        )
+        self.assertEqual(count_one, count_all)
+
+    def test_get_hostname_ip_mappings_returns_nothing_for_no_domains(self):
+        self.assertEqual(
+            {}, StaticIPAddress.objects.get_hostname_ip_mappings([])
+        )
+
 
 class TestStaticIPAddress(MAASServerTestCase):
     def test_repr_with_valid_type(self):
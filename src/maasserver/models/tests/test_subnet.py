@@ -32,7 +32,13 @@ from maasserver.enum import (
     RDNS_MODE_CHOICES,
 )
 from maasserver.exceptions import StaticIPAddressExhaustion
-from maasserver.models import Config, Notification, Space
+from maasserver.models import (
+    Config,
+    IPAddressCandidate,
+    Notification,
+    Space,
+)
+from maasserver.models import subnet as subnet_module
 from maasserver.models.subnet import create_cidr, get_allocated_ips, Subnet
 from maasserver.models.timestampedmodel import now
 from maasserver.permissions import NodePermission
@@ -825,6 +831,56 @@ class TestGetBestSubnetForIP(MAASServerTestCase):
         self.expectThat(subnet, Is(None))
 
 
+class TestGetBestSubnetsForIPs(MAASServerTestCase):
+    def test_returns_most_specific_subnets(self):
+        factory.make_Subnet(cidr="10.0.0.0/8")
+        subnet_v4 = factory.make_Subnet(cidr="10.1.1.0/24")
+        factory.make_Subnet(cidr="10.1.0.0/16")
+        factory.make_Subnet(cidr="2001::/16")
+        subnet_v6 = factory.make_Subnet(cidr="2001:db8:1:2::/64")
+        subnets = Subnet.objects.get_best_subnets_for_ips(
+            ["10.1.1.1", "10.1.1.2", "2001:db8:1:2::1"]
+        )
+        self.assertEqual(
+            {
+                IPAddress("10.1.1.1"): subnet_v4,
+                IPAddress("10.1.1.2"): subnet_v4,
+                IPAddress("2001:db8:1:2::1"): subnet_v6,
+            },
+            subnets,
+        )
+
+    def test_prefers_subnets_on_managed_vlans(self):
+        managed = factory.make_Subnet(
+            cidr="10.0.0.0/8", vlan=factory.make_VLAN(dhcp_on=True)
+        )
+        factory.make_Subnet(
+            cidr="10.1.1.0/24", vlan=factory.make_VLAN(dhcp_on=False)
+        )
+        self.assertEqual(
+            {IPAddress("10.1.1.1"): managed},
+            Subnet.objects.get_best_subnets_for_ips(["10.1.1.1"]),
+        )
+
+    def test_returns_ipv4_subnet_for_ipv4_mapped_ipv6_addr(self):
+        subnet = factory.make_Subnet(cidr="10.1.1.0/24")
+        self.assertEqual(
+            {IPAddress("10.1.1.1"): subnet},
+            Subnet.objects.get_best_subnets_for_ips(["::ffff:10.1.1.1"]),
+        )
+
+    def test_omits_addresses_without_subnet(self):
+        factory.make_Subnet(cidr="10.0.0.0/8")
+        self.assertEqual({}, Subnet.objects.get_best_subnets_for_ips(["::"]))
+
+    def test_uses_one_query(self):
+        network = IPNetwork("10.0.0.0/8")
+        factory.make_Subnet(cidr=network)
+        ips = [factory.pick_ip_in_network(network) for _ in range(5)]
+        count, _ = count_queries(Subnet.objects.get_best_subnets_for_ips, ips)
+        self.assertEqual(1, count)
+
+
 class SubnetLabelTest(MAASServerTestCase):
     def test_returns_cidr_for_null_name(self):
         network = factory.make_ip4_or_6_network()
@@ -1326,6 +1382,104 @@ class TestSubnetGetLeastRecentlySeenUnknownNeighbour(MAASServerTestCase):
         self.assertThat(ip, Is(None))
 
 
+class TestSubnetGetFreeIPRanges(MAASServerTestCase):
+    def assertMatchesIPRangesNotInUse(self, subnet, **kwargs):
+        expected = subnet.get_ipranges_not_in_use(**kwargs)
+        self.assertEqual(
+            [(iprange.first, iprange.last) for iprange in expected.ranges],
+            list(subnet.get_free_ip_ranges(**kwargs)),
+        )
+
+    def test_matches_ipranges_not_in_use_on_managed_subnet(self):
+        subnet = factory.make_Subnet(
+            cidr="10.0.0.0/24",
+            gateway_ip="10.0.0.1",
+            dns_servers=["10.0.0.2"],
+        )
+        factory.make_IPRange(subnet, "10.0.0.100", "10.0.0.149")
+        factory.make_IPRange(
+            subnet,
+            "10.0.0.200",
+            "10.0.0.209",
+            alloc_type=IPRANGE_TYPE.RESERVED,
+        )
+        factory.make_StaticIPAddress(ip="10.0.0.50", subnet=subnet)
+        factory.make_StaticIPAddress(
+            ip="10.0.0.60", subnet=subnet, alloc_type=IPADDRESS_TYPE.DISCOVERED
+        )
+        self.assertMatchesIPRangesNotInUse(subnet)
+        self.assertMatchesIPRangesNotInUse(subnet, ignore_discovered_ips=True)
+        self.assertMatchesIPRangesNotInUse(
+            subnet, exclude_addresses=["10.0.0.70", "10.0.0.71"]
+        )
+
+    def test_matches_ipranges_not_in_use_on_unmanaged_subnet(self):
+        subnet = factory.make_Subnet(
+            cidr="10.0.0.0/24", gateway_ip=None, dns_servers=[], managed=False
+        )
+        factory.make_IPRange(
+            subnet, "10.0.0.1", "10.0.0.9", alloc_type=IPRANGE_TYPE.RESERVED
+        )
+        factory.make_IPRange(
+            subnet,
+            "10.0.0.200",
+            "10.0.0.254",
+            alloc_type=IPRANGE_TYPE.RESERVED,
+        )
+        factory.make_StaticIPAddress(ip="10.0.0.5", subnet=subnet)
+        subnet = reload_object(subnet)
+        self.assertMatchesIPRangesNotInUse(subnet)
+
+    def test_matches_ipranges_not_in_use_on_ipv6_subnet(self):
+        subnet = factory.make_Subnet(
+            cidr="2001:db8::/64", gateway_ip="2001:db8::1", dns_servers=[]
+        )
+        factory.make_StaticIPAddress(ip="2001:db8::1:0:1", subnet=subnet)
+        self.assertMatchesIPRangesNotInUse(subnet)
+
+    def test_matches_ipranges_not_in_use_on_small_subnets(self):
+        for cidr in ["10.0.0.0/31", "10.0.0.0/32", "2001:db8::/127"]:
+            subnet = factory.make_Subnet(
+                cidr=cidr, gateway_ip=None, dns_servers=[]
+            )
+            self.assertMatchesIPRangesNotInUse(subnet)
+
+    def test_does_not_create_a_range_for_each_allocated_address(self):
+        subnet = factory.make_Subnet(
+            cidr="10.0.0.0/24", gateway_ip=None, dns_servers=[]
+        )
+        for ip in ["10.0.0.10", "10.0.0.11", "10.0.0.12"]:
+            factory.make_StaticIPAddress(ip=ip, subnet=subnet)
+        make_iprange = self.patch(subnet_module, "make_iprange")
+        free_ranges = subnet.get_free_ip_ranges()
+        self.assertNotIn(int(IPAddress("10.0.0.11")), free_ranges)
+        self.assertEqual(0, make_iprange.call_count)
+
+    def test_leaves_out_addresses_claimed_for_allocation(self):
+        subnet = factory.make_Subnet(
+            cidr="10.0.0.0/29", gateway_ip=None, dns_servers=[]
+        )
+        IPAddressCandidate.objects.create(
+            subnet=subnet,
+            ip="10.0.0.2",
+            owner=factory.make_name("owner"),
+            expires=now() + timedelta(minutes=1),
+        )
+        IPAddressCandidate.objects.create(
+            subnet=subnet,
+            ip="10.0.0.5",
+            owner=factory.make_name("owner"),
+            expires=now() - timedelta(minutes=1),
+        )
+        self.assertEqual(
+            [
+                (int(IPAddress("10.0.0.1")), int(IPAddress("10.0.0.1"))),
+                (int(IPAddress("10.0.0.3")), int(IPAddress("10.0.0.6"))),
+            ],
+            list(subnet.get_free_ip_ranges()),
+        )
+
+
 class TestSubnetGetNextIPForAllocation(MAASServerTestCase):
 
     scenarios = (
@@ -1440,6 +1594,45 @@ class TestSubnetGetNextIPForAllocation(MAASServerTestCase):
         ip = subnet.get_next_ip_for_allocation()
         self.assertThat(ip, Equals("10.0.0.5"))
 
+    def test_uses_lowest_of_equally_small_free_ranges(self):
+        # Note: 10.0.0.0/29 --> 10.0.0.1 through 10.0.0.0.6 are usable.
+        subnet = self.make_Subnet(
+            cidr="10.0.0.0/29", gateway_ip=None, dns_servers=None
+        )
+        # With .3 and .4 in use, the free ranges are {1, 2}, {5, 6}.
+        factory.make_StaticIPAddress(ip="10.0.0.3", cidr="10.0.0.0/29")
+        factory.make_StaticIPAddress(ip="10.0.0.4", cidr="10.0.0.0/29")
+        ip = subnet.get_next_ip_for_allocation()
+        self.assertThat(ip, Equals("10.0.0.1"))
+
+    def test_allocates_ipv6_address(self):
+        subnet = factory.make_Subnet(
+            cidr="2001:db8::/64", gateway_ip=None, dns_servers=None
+        )
+        ip = subnet.get_next_ip_for_allocation()
+        self.assertThat(ip, Equals("2001:db8::1:0:0"))
+
+
+class TestSubnetGetNextIPsForAllocation(MAASServerTestCase):
+    def test_returns_addresses_in_order_of_allocation(self):
+        subnet = factory.make_Subnet(
+            cidr="10.0.0.0/29", gateway_ip=None, dns_servers=None
+        )
+        factory.make_StaticIPAddress(ip="10.0.0.4", cidr="10.0.0.0/29")
+        self.assertEqual(
+            ["10.0.0.5", "10.0.0.6", "10.0.0.1"],
+            subnet.get_next_ips_for_allocation(3),
+        )
+
+    def test_does_not_return_observed_neighbours(self):
+        # Note: 10.0.0.0/30 --> 10.0.0.1 and 10.0.0.0.2 are usable.
+        subnet = factory.make_Subnet(
+            cidr="10.0.0.0/30", gateway_ip=None, dns_servers=None
+        )
+        rackif = factory.make_Interface(vlan=subnet.vlan)
+        factory.make_Discovery(ip="10.0.0.1", interface=rackif)
+        self.assertEqual(["10.0.0.2"], subnet.get_next_ips_for_allocation(3))
+
 
 class TestUnmanagedSubnets(MAASServerTestCase):
     def test_allocation_uses_reserved_range(self):
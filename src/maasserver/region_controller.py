@@ -178,7 +178,10 @@ class RegionControllerService(Service):
         defers = []
         if self.needsDNSUpdate:
             self.needsDNSUpdate = False
-            d = deferToDatabase(transactional(dns_update_all_zones))
+            d = deferToDatabase(
+                transactional(dns_update_all_zones),
+                previous_serial=self.previousSerial,
+            )
             d.addCallback(self._checkSerial)
             d.addCallback(self._logDNSReload)
             # Order here matters, first needsDNSUpdate is set then pass the
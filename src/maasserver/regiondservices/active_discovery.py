@@ -49,7 +49,11 @@ class ActiveDiscoveryService(TimerService):
     def startService(self):
         super().startService()
         if self.listener is not None:
-            self.listener.register("config", self.refreshDiscoveryConfig)
+            # Any number of changes to the configuration needs only one
+            # refresh, so take them in batches.
+            self.listener.register(
+                "config", self.refreshDiscoveryConfig, batched=True
+            )
 
     def stopService(self):
         if self.listener is not None:
@@ -57,11 +61,11 @@ class ActiveDiscoveryService(TimerService):
         return super().stopService()
 
     @inlineCallbacks
-    def refreshDiscoveryConfig(self, action=None, obj_id=None):
+    def refreshDiscoveryConfig(self, action=None, obj_ids=None):
         """Reconfigures the discovery interval based on the global setting.
 
-        Called when the postgresListener indicates that a configuration value
-        has changed, and the first time the timer fires (immediately after
+        Called when the postgresListener indicates that configuration values
+        have changed, and the first time the timer fires (immediately after
         the service starts).
 
         Prints log messages for significant configuration changes.
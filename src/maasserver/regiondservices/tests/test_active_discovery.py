@@ -52,7 +52,9 @@ class TestActiveDiscoveryService(MAASTransactionServerTestCase):
         )
         self.assertThat(
             register,
-            MockCalledOnceWith("config", service.refreshDiscoveryConfig),
+            MockCalledOnceWith(
+                "config", service.refreshDiscoveryConfig, batched=True
+            ),
         )
         self.assertThat(unregister, MockNotCalled())
         service.stopService()
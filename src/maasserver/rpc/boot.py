@@ -20,7 +20,6 @@ from maasserver.models import (
     Event,
     Node,
     RackController,
-    Subnet,
     VLAN,
 )
 from maasserver.node_status import NODE_STATUS
@@ -28,6 +27,7 @@ from maasserver.preseed import (
     compose_enlistment_preseed_url,
     compose_preseed_url,
 )
+from maasserver.subnet_index import subnet_index
 from maasserver.third_party_drivers import get_third_party_driver
 from maasserver.utils.orm import transactional
 from maasserver.utils.osystems import validate_hwe_kernel
@@ -284,7 +284,7 @@ def get_boot_config_for_machine(machine, configs, purpose):
 
 def get_base_url_for_local_ip(local_ip, internal_domain):
     """Get the base URL for the preseed using the `local_ip`."""
-    subnet = Subnet.objects.get_best_subnet_for_ip(local_ip)
+    subnet = subnet_index.get_best_subnet_for_ip(local_ip)
     if subnet is not None and not subnet.dns_servers and subnet.vlan.dhcp_on:
         # Use the MAAS internal domain to resolve the IP address of
         # the rack controllers on the subnet.
@@ -396,7 +396,7 @@ def get_config(
         except ObjectDoesNotExist:
             # MAC is unknown or wasn't sent. Determine the boot_interface using
             # the boot_cluster_ip.
-            subnet = Subnet.objects.get_best_subnet_for_ip(local_ip)
+            subnet = subnet_index.get_best_subnet_for_ip(local_ip)
             boot_vlan = getattr(machine.boot_interface, "vlan", None)
             if subnet and subnet.vlan != boot_vlan:
                 # This might choose the wrong interface, but we don't
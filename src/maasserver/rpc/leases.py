@@ -3,21 +3,24 @@
 
 """RPC helpers relating to DHCP leases."""
 
-__all__ = ["update_lease"]
+__all__ = ["update_lease", "update_leases"]
 
+from collections import defaultdict
 from datetime import datetime
 
 from netaddr import IPAddress
 
-from maasserver.enum import IPADDRESS_FAMILY, IPADDRESS_TYPE
+from maasserver.enum import IPADDRESS_FAMILY, IPADDRESS_TYPE, IPRANGE_TYPE
 from maasserver.models import (
     DNSResource,
     Interface,
+    IPRange,
     Node,
     StaticIPAddress,
     Subnet,
     UnknownInterface,
 )
+from maasserver.subnet_index import subnet_index
 from maasserver.utils.orm import transactional
 from provisioningserver.logger import LegacyLogger
 from provisioningserver.utils.network import coerce_to_valid_hostname
@@ -74,13 +77,175 @@ def update_lease(
     :raises NoSuchCluster: If the cluster identified by `cluster_uuid` does not
         exist.
     """
+    (
+        subnet,
+        dynamic_ranges,
+    ) = subnet_index.get_best_subnet_and_dynamic_ranges_for_ip(ip)
+    return _update_lease(
+        action,
+        mac,
+        ip_family,
+        ip,
+        timestamp,
+        lease_time,
+        hostname,
+        subnet=subnet,
+        dynamic_ranges=dynamic_ranges,
+        interfaces=list(Interface.objects.filter(mac_address=mac)),
+    )
+
+
+@synchronous
+@transactional
+def update_leases(updates):
+    """Update a batch of DHCP leases from a cluster in one transaction.
+
+    :param updates: A list of dicts of the arguments to `update_lease`, in
+        the order in which the actions were taken on the cluster.
+
+    Each update replaces the DISCOVERED addresses of its family on the
+    interfaces with its MAC address, so the updates in the batch made before
+    the last one that takes effect for the same MAC address and family are
+    skipped; see `_collapse_lease_updates`. The subnets, dynamic ranges and
+    interfaces for the whole batch are each found with a single query.
+
+    An update that cannot be applied is logged and skipped; it does not
+    prevent the rest of the batch from being applied.
+    """
+    subnets = Subnet.objects.get_best_subnets_for_ips(
+        update["ip"] for update in updates
+    )
+    dynamic_ranges = defaultdict(list)
+    for iprange in IPRange.objects.filter(
+        subnet__in=subnets.values(), type=IPRANGE_TYPE.DYNAMIC
+    ):
+        dynamic_ranges[iprange.subnet_id].append(iprange.netaddr_iprange)
+    interfaces = defaultdict(list)
+    for interface in Interface.objects.filter(
+        mac_address__in={update["mac"] for update in updates}
+    ):
+        interfaces[str(interface.mac_address).lower()].append(interface)
+
+    def get_subnet(update):
+        ip = IPAddress(update["ip"])
+        return subnets.get(ip.ipv4() if ip.is_ipv4_mapped() else ip)
+
+    def takes_effect(update):
+        subnet = get_subnet(update)
+        return subnet is not None and _lease_update_takes_effect(
+            update, subnet, dynamic_ranges[subnet.id]
+        )
+
+    updates = _collapse_lease_updates(
+        updates, takes_effect, known_macs=set(interfaces)
+    )
+    for update in updates:
+        ip = IPAddress(update["ip"])
+        subnet = get_subnet(update)
+        subnet_id = None if subnet is None else subnet.id
+        try:
+            _update_lease(
+                subnet=subnet,
+                dynamic_ranges=dynamic_ranges[subnet_id],
+                interfaces=interfaces[str(update["mac"]).lower()],
+                **update
+            )
+        except LeaseUpdateError as error:
+            log.msg("Ignoring lease update for %s: %s" % (ip, error))
+    return {}
+
+
+def _collapse_lease_updates(updates, takes_effect, known_macs):
+    """Return the `updates` that need to be applied, in the given order.
+
+    For each MAC address and IP family, the updates before the last one
+    that takes effect are dropped, as it replaces whatever they did. An
+    update that doesn't take effect, e.g. the expiry of an address outside
+    the dynamic ranges, doesn't supersede anything.
+
+    :param takes_effect: A function telling whether an update changes
+        anything when applied; see `_lease_update_takes_effect`.
+    :param known_macs: The MAC addresses, in lower case, that have
+        interfaces. An expiry or release for another MAC address only takes
+        effect once a commit created an interface for it, so the last commit
+        that takes effect before it is kept as well.
+    """
+    indexes_by_key = defaultdict(list)
+    for index, update in enumerate(updates):
+        key = str(update["mac"]).lower(), update["ip_family"]
+        indexes_by_key[key].append(index)
+    dropped = set()
+    for (mac, _), indexes in indexes_by_key.items():
+        effective = [
+            index for index in indexes if takes_effect(updates[index])
+        ]
+        if len(effective) == 0:
+            continue
+        last = effective[-1]
+        dropped.update(index for index in indexes if index < last)
+        if updates[last]["action"] != "commit" and mac not in known_macs:
+            commits = [
+                index
+                for index in effective[:-1]
+                if updates[index]["action"] == "commit"
+            ]
+            if len(commits) > 0:
+                dropped.discard(commits[-1])
+    return [
+        update
+        for index, update in enumerate(updates)
+        if index not in dropped
+    ]
+
+
+def _lease_update_takes_effect(update, subnet, dynamic_ranges):
+    """Return whether `_update_lease` would change anything for `update`.
+
+    This doesn't check that there are interfaces for its MAC address.
+
+    :param subnet: The best subnet for the IP address of `update`.
+    :param dynamic_ranges: The dynamic ranges of `subnet`, as
+        `netaddr.IPRange`s.
+    """
+    if update["action"] not in ["commit", "expiry", "release"]:
+        return False
+    ip_family = update["ip_family"]
+    subnet_family = subnet.get_ipnetwork().version
+    if ip_family == "ipv4" and subnet_family != IPADDRESS_FAMILY.IPv4:
+        return False
+    elif ip_family == "ipv6" and subnet_family != IPADDRESS_FAMILY.IPv6:
+        return False
+    address = IPAddress(update["ip"])
+    return any(address in iprange for iprange in dynamic_ranges)
+
+
+def _update_lease(
+    action,
+    mac,
+    ip_family,
+    ip,
+    timestamp,
+    lease_time=None,
+    hostname=None,
+    *,
+    subnet,
+    dynamic_ranges,
+    interfaces
+):
+    """Update one DHCP lease, as `update_lease` does.
+
+    :param subnet: The best subnet for `ip`, or `None` if there is none.
+    :param dynamic_ranges: The dynamic ranges of `subnet`, as
+        `netaddr.IPRange`s.
+    :param interfaces: A list of the interfaces with MAC address `mac`. If
+        an interface is created for the lease it is appended to this.
+    """
     # Check for a valid action.
     if action not in ["commit", "expiry", "release"]:
         raise LeaseUpdateError("Unknown lease action: %s" % action)
 
-    # Get the subnet for this IP address. If no subnet exists then something
-    # is wrong as we should not be recieving message about unknown subnets.
-    subnet = Subnet.objects.get_best_subnet_for_ip(ip)
+    # If no subnet exists for this IP address then something is wrong as we
+    # should not be recieving message about unknown subnets.
     if subnet is None:
         raise LeaseUpdateError("No subnet exists for: %s" % ip)
 
@@ -114,12 +279,11 @@ def update_lease(
 
     # We will recieve actions on all addresses in the subnet. We only want
     # to update the addresses in the dynamic range.
-    dynamic_range = subnet.get_dynamic_range_for_ip(IPAddress(ip))
-    if dynamic_range is None:
+    address = IPAddress(ip)
+    if not any(address in iprange for iprange in dynamic_ranges):
         # Do nothing.
         return {}
 
-    interfaces = list(Interface.objects.filter(mac_address=mac))
     if len(interfaces) == 0 and action == "commit":
         # A MAC address that is unknown to MAAS was given an IP address. Create
         # an unknown interface for this lease.
@@ -127,7 +291,7 @@ def update_lease(
             name="eth0", mac_address=mac, vlan_id=subnet.vlan_id
         )
         unknown_interface.save()
-        interfaces = [unknown_interface]
+        interfaces.append(unknown_interface)
     elif len(interfaces) == 0:
         # No interfaces and not commit action so nothing needs to be done.
         return {}
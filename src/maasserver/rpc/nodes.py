@@ -6,10 +6,12 @@
 __all__ = [
     "mark_node_failed",
     "update_node_power_state",
+    "update_node_power_states",
     "commission_node",
     "create_node",
 ]
 
+from collections import defaultdict
 from datetime import timedelta
 import json
 
@@ -19,7 +21,7 @@ from django.db.models import F, Q
 
 from maasserver import exceptions, ntp
 from maasserver.api.utils import get_overridden_query_dict
-from maasserver.enum import NODE_STATUS
+from maasserver.enum import NODE_STATUS, NODE_TYPE, POWER_STATE
 from maasserver.forms import AdminMachineWithMACAddressesForm
 from maasserver.models import Node, PhysicalInterface, RackController
 from maasserver.models.timestampedmodel import now
@@ -166,6 +168,53 @@ def update_node_power_state(system_id, power_state):
     node.update_power_state(power_state)
 
 
+@synchronous
+@transactional
+def update_node_power_states(power_states):
+    """Update the power states of many nodes.
+
+    for :py:class:`~provisioningserver.rpc.region.UpdateNodePowerStates`.
+
+    Nodes whose power state has not changed are not written to. Nodes whose
+    change may have side-effects, like finishing a release once a machine
+    powers off, are updated one by one with `Node.update_power_state`; the
+    rest are updated with one query per power state.
+
+    :param power_states: A list of dicts with "system_id" and "power_state"
+        keys. When a node appears more than once, the last state wins.
+    :return: The system IDs of the nodes that could not be found.
+    """
+    new_states = {
+        update["system_id"]: update["power_state"] for update in power_states
+    }
+    unknown = set(new_states)
+    individually = []
+    together = defaultdict(list)
+    current = Node.objects.filter(system_id__in=new_states).values_list(
+        "system_id", "power_state", "status", "node_type"
+    )
+    for system_id, power_state, status, node_type in current:
+        unknown.discard(system_id)
+        new_state = new_states[system_id]
+        if status in (NODE_STATUS.RELEASING, NODE_STATUS.EXITING_RESCUE_MODE):
+            individually.append(system_id)
+        elif new_state == power_state:
+            continue
+        elif new_state == POWER_STATE.OFF and node_type == NODE_TYPE.MACHINE:
+            # Machines release their auto-assigned IPs when they power off.
+            individually.append(system_id)
+        else:
+            together[new_state].append(system_id)
+    updated = now()
+    for new_state, system_ids in together.items():
+        Node.objects.filter(system_id__in=system_ids).update(
+            power_state=new_state, power_state_updated=updated
+        )
+    for node in Node.objects.filter(system_id__in=individually):
+        node.update_power_state(new_states[node.system_id])
+    return sorted(unknown)
+
+
 @synchronous
 @transactional
 def create_node(
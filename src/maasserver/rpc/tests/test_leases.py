@@ -17,10 +17,12 @@ from maasserver.enum import INTERFACE_TYPE, IPADDRESS_FAMILY, IPADDRESS_TYPE
 from maasserver.models import DNSResource
 from maasserver.models.interface import UnknownInterface
 from maasserver.models.staticipaddress import StaticIPAddress
-from maasserver.rpc.leases import LeaseUpdateError, update_lease
+from maasserver.rpc import leases as leases_module
+from maasserver.rpc.leases import LeaseUpdateError, update_lease, update_leases
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
 from maasserver.utils.orm import get_one, reload_object
+from maastesting.djangotestcase import count_queries
 
 
 class TestUpdateLease(MAASServerTestCase):
@@ -508,3 +510,158 @@ class TestUpdateLease(MAASServerTestCase):
         self.assertEqual(1, ip_address2.interface_set.count())
         self.assertEqual(1, boot_interface1.ip_addresses.count())
         self.assertEqual(1, boot_interface2.ip_addresses.count())
+
+
+class TestUpdateLeases(MAASServerTestCase):
+
+    make_kwargs = TestUpdateLease.make_kwargs
+
+    def make_node_on_managed_subnet(self):
+        subnet = factory.make_ipv4_Subnet_with_IPRanges(
+            with_static_range=False, dhcp_on=True
+        )
+        node = factory.make_Node_with_Interface_on_Subnet(subnet=subnet)
+        return node.get_boot_interface(), subnet.get_dynamic_ranges()[0]
+
+    def get_discovered_ips(self, interface):
+        return [
+            sip.ip
+            for sip in interface.ip_addresses.filter(
+                alloc_type=IPADDRESS_TYPE.DISCOVERED
+            )
+        ]
+
+    def test_creates_leases_for_each_interface(self):
+        interfaces, updates = [], []
+        for _ in range(3):
+            interface, dynamic_range = self.make_node_on_managed_subnet()
+            interfaces.append(interface)
+            updates.append(
+                self.make_kwargs(
+                    action="commit",
+                    mac=str(interface.mac_address),
+                    ip=factory.pick_ip_in_IPRange(dynamic_range),
+                )
+            )
+        update_leases(updates)
+        self.assertEqual(
+            [[update["ip"]] for update in updates],
+            [self.get_discovered_ips(interface) for interface in interfaces],
+        )
+
+    def test_applies_only_last_update_for_each_mac(self):
+        interface, dynamic_range = self.make_node_on_managed_subnet()
+        first_ip = factory.pick_ip_in_IPRange(dynamic_range)
+        last_ip = factory.pick_ip_in_IPRange(dynamic_range, but_not=[first_ip])
+        mac = str(interface.mac_address)
+        mock_update_lease = self.patch(leases_module, "_update_lease")
+        update_leases(
+            [
+                self.make_kwargs(action="commit", mac=mac, ip=first_ip),
+                self.make_kwargs(action="commit", mac=mac, ip=last_ip),
+            ]
+        )
+        self.assertEqual(1, mock_update_lease.call_count)
+        self.assertEqual(last_ip, mock_update_lease.call_args[1]["ip"])
+
+    def test_applies_commit_when_later_update_has_no_effect(self):
+        interface, dynamic_range = self.make_node_on_managed_subnet()
+        ip = factory.pick_ip_in_IPRange(dynamic_range)
+        # Addresses in the dynamic range are in use, so not picked.
+        outside_ip = factory.pick_ip_in_Subnet(dynamic_range.subnet)
+        mac = str(interface.mac_address)
+        update_leases(
+            [
+                self.make_kwargs(action="commit", mac=mac, ip=ip),
+                # Outside of the dynamic range, so ignored.
+                self.make_kwargs(action="expiry", mac=mac, ip=outside_ip),
+                # No subnet, so ignored.
+                self.make_kwargs(
+                    action="release", mac=mac, ip=factory.make_ipv4_address()
+                ),
+            ]
+        )
+        self.assertEqual([ip], self.get_discovered_ips(interface))
+
+    def test_applies_commit_creating_interface_before_release(self):
+        interface, dynamic_range = self.make_node_on_managed_subnet()
+        ip = factory.pick_ip_in_IPRange(dynamic_range)
+        mac = factory.make_mac_address()
+        update_leases(
+            [
+                self.make_kwargs(action="commit", mac=mac, ip=ip),
+                self.make_kwargs(action="release", mac=mac, ip=ip),
+            ]
+        )
+        [unknown_interface] = UnknownInterface.objects.filter(mac_address=mac)
+        self.assertEqual([], self.get_discovered_ips(unknown_interface))
+
+    def test_replaces_lease_with_last_update(self):
+        interface, dynamic_range = self.make_node_on_managed_subnet()
+        first_ip = factory.pick_ip_in_IPRange(dynamic_range)
+        last_ip = factory.pick_ip_in_IPRange(dynamic_range, but_not=[first_ip])
+        mac = str(interface.mac_address)
+        update_lease(**self.make_kwargs(action="commit", mac=mac, ip=first_ip))
+        update_leases([self.make_kwargs(action="commit", mac=mac, ip=last_ip)])
+        self.assertEqual([last_ip], self.get_discovered_ips(interface))
+
+    def test_skips_updates_that_cannot_be_applied(self):
+        interface, dynamic_range = self.make_node_on_managed_subnet()
+        ip = factory.pick_ip_in_IPRange(dynamic_range)
+        update_leases(
+            [
+                self.make_kwargs(action="unknown"),
+                self.make_kwargs(
+                    action="commit", mac=str(interface.mac_address), ip=ip
+                ),
+            ]
+        )
+        self.assertEqual([ip], self.get_discovered_ips(interface))
+
+    def test_creates_unknown_interface_once(self):
+        subnet_v4 = factory.make_ipv4_Subnet_with_IPRanges(
+            with_static_range=False, dhcp_on=True
+        )
+        subnet_v6 = factory.make_Subnet(
+            cidr="fd38:c341:27da:c831::/64", vlan=subnet_v4.vlan
+        )
+        dynamic_range_v6 = factory.make_IPRange(
+            subnet_v6,
+            "fd38:c341:27da:c831:0:1::",
+            "fd38:c341:27da:c831:0:1:ffff:0",
+        )
+        mac = factory.make_mac_address()
+        update_leases(
+            [
+                self.make_kwargs(
+                    action="commit",
+                    mac=mac,
+                    ip=factory.pick_ip_in_IPRange(
+                        subnet_v4.get_dynamic_ranges()[0]
+                    ),
+                ),
+                self.make_kwargs(
+                    action="commit",
+                    mac=mac,
+                    ip=factory.pick_ip_in_IPRange(dynamic_range_v6),
+                ),
+            ]
+        )
+        [unknown_interface] = UnknownInterface.objects.filter(mac_address=mac)
+        self.assertEqual(2, len(self.get_discovered_ips(unknown_interface)))
+
+    def test_looks_up_batch_in_constant_queries(self):
+        subnet = factory.make_Subnet(cidr="10.0.0.0/24")
+        factory.make_IPRange(subnet, "10.0.0.100", "10.0.0.199")
+        updates = [
+            self.make_kwargs(
+                action="commit",
+                mac=factory.make_mac_address(),
+                ip="10.0.0.%d" % index,
+            )
+            for index in range(10, 15)
+        ]
+        # None of the addresses are in the dynamic range so nothing is
+        # written; only the lookups for the whole batch are made.
+        count, _ = count_queries(update_leases, updates)
+        self.assertEqual(3, count)
@@ -36,6 +36,7 @@ from maasserver.rpc.nodes import (
     mark_node_failed,
     request_node_info_by_mac_address,
     update_node_power_state,
+    update_node_power_states,
 )
 from maasserver.rpc.testing.fixtures import MockLiveRegionToClusterRPCFixture
 from maasserver.testing.architecture import make_usable_architecture
@@ -49,6 +50,8 @@ from maasserver.testing.testcase import (
     MAASTransactionServerTestCase,
 )
 from maasserver.utils.orm import post_commit_hooks, reload_object
+from maastesting.djangotestcase import count_queries
+from maastesting.matchers import MockCalledOnceWith
 from maastesting.twisted import always_succeed_with
 from provisioningserver.drivers.power.registry import PowerDriverRegistry
 from provisioningserver.rpc.cluster import DescribePowerTypes
@@ -550,6 +553,94 @@ class TestUpdateNodePowerState(MAASServerTestCase):
         self.assertEqual(reload_object(node).power_state, POWER_STATE.ON)
 
 
+class TestUpdateNodePowerStates(MAASServerTestCase):
+    def make_update(self, node, power_state):
+        return {"system_id": node.system_id, "power_state": power_state}
+
+    def test_updates_node_power_states(self):
+        nodes = [
+            factory.make_Node(power_state=POWER_STATE.OFF) for _ in range(3)
+        ]
+        unknown = update_node_power_states(
+            [self.make_update(node, POWER_STATE.ON) for node in nodes]
+        )
+        self.assertEqual([], unknown)
+        self.assertEqual(
+            [POWER_STATE.ON] * 3,
+            [reload_object(node).power_state for node in nodes],
+        )
+
+    def test_returns_unknown_system_ids(self):
+        node = factory.make_Node(power_state=POWER_STATE.OFF)
+        system_id = factory.make_name("system_id")
+        unknown = update_node_power_states(
+            [
+                self.make_update(node, POWER_STATE.ON),
+                {"system_id": system_id, "power_state": POWER_STATE.ON},
+            ]
+        )
+        self.assertEqual([system_id], unknown)
+        self.assertEqual(POWER_STATE.ON, reload_object(node).power_state)
+
+    def test_last_state_wins(self):
+        node = factory.make_Node(power_state=POWER_STATE.OFF)
+        update_node_power_states(
+            [
+                self.make_update(node, POWER_STATE.ON),
+                self.make_update(node, POWER_STATE.ERROR),
+            ]
+        )
+        self.assertEqual(POWER_STATE.ERROR, reload_object(node).power_state)
+
+    def test_leaves_unchanged_nodes_alone(self):
+        node = factory.make_Node(power_state=POWER_STATE.ON)
+        updated = node.power_state_updated
+        update_node_power_states([self.make_update(node, POWER_STATE.ON)])
+        self.assertEqual(updated, reload_object(node).power_state_updated)
+
+    def test_sets_power_state_updated_of_changed_nodes(self):
+        node = factory.make_Node(power_state=POWER_STATE.OFF)
+        update_node_power_states([self.make_update(node, POWER_STATE.ON)])
+        self.assertIsNotNone(reload_object(node).power_state_updated)
+
+    def test_query_count_does_not_depend_on_number_of_nodes(self):
+        nodes = [
+            factory.make_Node(power_state=POWER_STATE.OFF) for _ in range(10)
+        ]
+        unchanged = [
+            factory.make_Node(power_state=POWER_STATE.ON) for _ in range(10)
+        ]
+        count_one, _ = count_queries(
+            update_node_power_states,
+            [
+                self.make_update(nodes[0], POWER_STATE.ON),
+                self.make_update(unchanged[0], POWER_STATE.ON),
+            ],
+        )
+        count_all, _ = count_queries(
+            update_node_power_states,
+            [self.make_update(node, POWER_STATE.ON) for node in nodes[1:]]
+            + [self.make_update(node, POWER_STATE.ON) for node in unchanged],
+        )
+        self.assertEqual(count_one, count_all)
+
+    def test_finalizes_release_of_machine_powered_off(self):
+        machine = factory.make_Node(
+            status=NODE_STATUS.RELEASING, power_state=POWER_STATE.OFF
+        )
+        self.patch(Node, "_finalize_release")
+        update_node_power_states([self.make_update(machine, POWER_STATE.OFF)])
+        self.assertThat(Node._finalize_release, MockCalledOnceWith())
+
+    def test_updates_machines_powered_off_one_by_one(self):
+        machine = factory.make_Machine(power_state=POWER_STATE.ON)
+        update_power_state = self.patch(Node, "update_power_state")
+        update_node_power_states([self.make_update(machine, POWER_STATE.OFF)])
+        self.assertThat(
+            update_power_state, MockCalledOnceWith(POWER_STATE.OFF)
+        )
+
+
 class TestGetControllerType(MAASServerTestCase):
     """Tests for `get_controller_type`."""
 
@@ -81,7 +81,9 @@ from provisioningserver.rpc.region import (
     SendEventMACAddress,
     UpdateInterfaces,
     UpdateLease,
+    UpdateLeases,
     UpdateNodePowerState,
+    UpdateNodePowerStates,
     UpdateServices,
 )
 from provisioningserver.rpc.testing import (
@@ -278,6 +280,69 @@ class TestRegionProtocol_UpdateLease(MAASTransactionServerTestCase):
         # works as expected.
 
 
+class TestRegionProtocol_UpdateLeases(MAASTransactionServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.useFixture(RegionEventLoopFixture("database-tasks"))
+
+    def test_update_leases_is_registered(self):
+        protocol = Region()
+        responder = protocol.locateResponder(UpdateLeases.commandName)
+        self.assertIsNotNone(responder)
+
+    def make_update(self):
+        return {
+            "action": "expiry",
+            "mac": factory.make_mac_address(),
+            "ip_family": "ipv4",
+            "ip": factory.make_ipv4_address(),
+            "timestamp": int(time.time()),
+        }
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_passes_updates_to_update_leases(self):
+        update_leases = self.patch(leases_module, "update_leases")
+        update_leases.return_value = {}
+        updates = [self.make_update() for _ in range(3)]
+
+        yield eventloop.start()
+        try:
+            yield call_responder(
+                Region(),
+                UpdateLeases,
+                {"cluster_uuid": factory.make_name("uuid"), "updates": updates},
+            )
+        finally:
+            yield eventloop.reset()
+
+        self.assertThat(update_leases, MockCalledOnceWith(updates))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_doesnt_raises_other_errors(self):
+        # Cause a random exception
+        self.patch(
+            leases_module, "update_leases"
+        ).side_effect = factory.make_exception()
+
+        yield eventloop.start()
+        try:
+            yield call_responder(
+                Region(),
+                UpdateLeases,
+                {
+                    "cluster_uuid": factory.make_name("uuid"),
+                    "updates": [self.make_update()],
+                },
+            )
+        finally:
+            yield eventloop.reset()
+
+        # Test is that no exceptions are raised. If this test passes then all
+        # works as expected.
+
+
 class TestRegionProtocol_GetBootConfig(MAASTransactionServerTestCase):
     def test_get_boot_config_is_registered(self):
         protocol = Region()
@@ -656,6 +721,50 @@ class TestRegionProtocol_UpdateNodePowerState(MAASTransactionServerTestCase):
         return d.addErrback(check)
 
 
+class TestRegionProtocol_UpdateNodePowerStates(MAASTransactionServerTestCase):
+    @transactional
+    def create_node(self, power_state):
+        node = factory.make_Node(power_state=power_state)
+        return node
+
+    @transactional
+    def get_node_power_state(self, system_id):
+        node = Node.objects.get(system_id=system_id)
+        return node.power_state
+
+    def test_is_registered(self):
+        protocol = Region()
+        responder = protocol.locateResponder(
+            UpdateNodePowerStates.commandName
+        )
+        self.assertIsNotNone(responder)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_changes_power_states(self):
+        power_state = factory.pick_enum(POWER_STATE)
+        node = yield deferToDatabase(self.create_node, power_state)
+        system_id = factory.make_name("unknown-system-id")
+
+        new_state = factory.pick_enum(POWER_STATE, but_not=power_state)
+        response = yield call_responder(
+            Region(),
+            UpdateNodePowerStates,
+            {
+                "power_states": [
+                    {"system_id": node.system_id, "power_state": new_state},
+                    {"system_id": system_id, "power_state": new_state},
+                ]
+            },
+        )
+
+        self.assertEqual({"unknown": [system_id]}, response)
+        db_state = yield deferToDatabase(
+            self.get_node_power_state, node.system_id
+        )
+        self.assertEqual(new_state, db_state)
+
+
 class TestRegionProtocol_RegisterEventType(MAASTransactionServerTestCase):
     def test_register_event_type_is_registered(self):
         protocol = Region()
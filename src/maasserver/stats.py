@@ -14,7 +14,7 @@ from collections import Counter, defaultdict
 from datetime import timedelta
 import json
 
-from django.db.models import Count, Sum, Value
+from django.db.models import Sum, Value
 from django.db.models.functions import Coalesce
 import requests
 from twisted.application.internet import TimerService
@@ -34,15 +34,16 @@ from maasserver.models import (
     Node,
     Pod,
     Space,
-    StaticIPAddress,
+    StaticRoute,
     Subnet,
     VLAN,
 )
+from maasserver.models.subnet import get_allocated_ips
 from maasserver.utils import get_maas_user_agent
 from maasserver.utils.orm import transactional
 from maasserver.utils.threads import deferToDatabase
 from provisioningserver.logger import LegacyLogger
-from provisioningserver.utils.network import IPRangeStatistics
+from provisioningserver.utils.network import IPRANGE_TYPE as MAASIPRANGE_TYPE
 
 log = LegacyLogger()
 
@@ -146,19 +147,33 @@ def get_subnets_stats():
 
 
 def get_subnets_utilisation_stats():
-    """Return a dict mapping subnet CIDRs to their utilisation details."""
-    ips_count = _get_subnets_ipaddress_count()
+    """Return a dict mapping subnet CIDRs to their utilisation details.
+
+    The subnets, their IP ranges, allocated addresses and static routes are
+    each fetched with a single query, however many subnets there are.
+    """
+    subnets = list(Subnet.objects.prefetch_related("iprange_set"))
+    for subnet, allocated_ips in get_allocated_ips(subnets):
+        subnet.cache_allocated_ips(allocated_ips)
+    staticroutes = defaultdict(list)
+    for staticroute in StaticRoute.objects.select_related("source"):
+        staticroutes[staticroute.source_id].append(staticroute)
 
     stats = {}
-    for subnet in Subnet.objects.all():
-        full_range = subnet.get_iprange_usage()
-        range_stats = IPRangeStatistics(subnet.get_iprange_usage())
+    for subnet in subnets:
+        full_range = subnet.get_iprange_usage(
+            cached_staticroutes=staticroutes[subnet.id]
+        )
+        available = 0
+        unavailable = 0
         static = 0
         reserved_available = 0
-        reserved_used = 0
         dynamic_available = 0
-        dynamic_used = 0
         for rng in full_range.ranges:
+            if MAASIPRANGE_TYPE.UNUSED in rng.purpose:
+                available += rng.num_addresses
+            else:
+                unavailable += rng.num_addresses
             if IPRANGE_TYPE.DYNAMIC in rng.purpose:
                 dynamic_available += rng.num_addresses
             elif IPRANGE_TYPE.RESERVED in rng.purpose:
@@ -166,18 +181,20 @@ def get_subnets_utilisation_stats():
             elif "assigned-ip" in rng.purpose:
                 static += rng.num_addresses
         # allocated IPs
-        subnet_ips = ips_count[subnet.id]
-        reserved_used += subnet_ips[IPADDRESS_TYPE.USER_RESERVED]
+        subnet_ips = Counter(
+            alloc_type for _, alloc_type in subnet.get_allocated_ips()
+        )
+        reserved_used = subnet_ips[IPADDRESS_TYPE.USER_RESERVED]
         reserved_available -= reserved_used
-        dynamic_used += (
+        dynamic_used = (
             subnet_ips[IPADDRESS_TYPE.AUTO]
             + subnet_ips[IPADDRESS_TYPE.DHCP]
             + subnet_ips[IPADDRESS_TYPE.DISCOVERED]
         )
         dynamic_available -= dynamic_used
         stats[subnet.cidr] = {
-            "available": range_stats.num_available,
-            "unavailable": range_stats.num_unavailable,
+            "available": available,
+            "unavailable": unavailable,
             "dynamic_available": dynamic_available,
             "dynamic_used": dynamic_used,
             "static": static,
@@ -187,18 +204,6 @@ def get_subnets_utilisation_stats():
     return stats
 
 
-def _get_subnets_ipaddress_count():
-    counts = defaultdict(lambda: defaultdict(int))
-    rows = (
-        StaticIPAddress.objects.values("subnet_id", "alloc_type")
-        .filter(ip__isnull=False)
-        .annotate(count=Count("ip"))
-    )
-    for row in rows:
-        counts[row["subnet_id"]][row["alloc_type"]] = row["count"]
-    return counts
-
-
 def get_maas_stats():
     # TODO
     # - architectures
@@ -0,0 +1,290 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""In-memory index of subnets, for finding the subnet of an IP address.
+
+`Subnet.objects.get_best_subnet_for_ip` asks the database every time. The
+`subnet_index` in each regiond process answers the same question from
+memory, for the callers on hot paths: lease updates, boot configuration,
+and finding the rack controller for a request.
+
+The index is built in the background by `SubnetIndexService`, and thrown
+away whenever a subnet, VLAN or IP range changes; until it has been built
+again, lookups fall back to the database. Changes made in the current
+transaction are not seen by the index, so only use it when they don't
+matter.
+"""
+
+__all__ = ["SubnetIndexService", "subnet_index"]
+
+from collections import defaultdict, namedtuple
+from copy import deepcopy
+import threading
+
+from netaddr import IPAddress, IPRange as NetaddrIPRange
+from twisted.application.service import Service
+from twisted.internet.defer import inlineCallbacks
+
+from maasserver.enum import IPRANGE_TYPE
+from maasserver.models import IPRange, Subnet
+from maasserver.utils.orm import transactional
+from maasserver.utils.threads import deferToDatabase
+from provisioningserver.logger import LegacyLogger
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
+
+log = LegacyLogger()
+
+# The number of bits in IPv4 and IPv6 addresses.
+_WIDTHS = {4: 32, 6: 128}
+
+
+def _clone(instance):
+    """Return a copy of the model `instance` that can be changed freely."""
+    fields = type(instance)._meta.concrete_fields
+    return type(instance).from_db(
+        instance._state.db,
+        [field.attname for field in fields],
+        [deepcopy(getattr(instance, field.attname)) for field in fields],
+    )
+
+
+class _IndexedSubnet(namedtuple("_IndexedSubnet", ("subnet", "ranges"))):
+    """A subnet, with its VLAN, and its dynamic ranges as `netaddr.IPRange`s.
+
+    The subnet is only a template: use `get_subnet` to get a copy.
+    """
+
+    def get_subnet(self):
+        subnet = _clone(self.subnet)
+        subnet.vlan = _clone(self.subnet.vlan)
+        return subnet
+
+
+class _SubnetTable:
+    """Longest-prefix match over all subnets.
+
+    For each IP version there is a hash table of subnets for each prefix
+    length in use, keyed by the network part of their CIDR; they are checked
+    from the longest prefix length down. There are rarely more than a
+    handful of distinct prefix lengths, so this takes a few dict lookups.
+    """
+
+    def __init__(self, subnets, dynamic_ranges):
+        tables = {4: defaultdict(dict), 6: defaultdict(dict)}
+        for subnet in subnets:
+            network = subnet.get_ipnetwork()
+            key = int(network.network) >> (
+                _WIDTHS[network.version] - network.prefixlen
+            )
+            tables[network.version][network.prefixlen][key] = _IndexedSubnet(
+                subnet, dynamic_ranges.get(subnet.id, [])
+            )
+        self.tables = {
+            version: sorted(by_prefixlen.items(), reverse=True)
+            for version, by_prefixlen in tables.items()
+        }
+
+    @classmethod
+    def load(cls):
+        """Load every subnet, its VLAN and its dynamic ranges."""
+        dynamic_ranges = defaultdict(list)
+        for subnet_id, start_ip, end_ip in IPRange.objects.filter(
+            type=IPRANGE_TYPE.DYNAMIC
+        ).values_list("subnet_id", "start_ip", "end_ip"):
+            dynamic_ranges[subnet_id].append(NetaddrIPRange(start_ip, end_ip))
+        return cls(Subnet.objects.select_related("vlan"), dynamic_ranges)
+
+    def lookup(self, ip):
+        """Return the `_IndexedSubnet` that best matches `ip`, or `None`.
+
+        The subnets are chosen as `Subnet.objects.get_best_subnet_for_ip`
+        chooses them: those on VLANs with DHCP enabled first, then the most
+        specific. As with PostgreSQL's ``<<`` operator, an address is not
+        within a subnet with a prefix as long as the address itself.
+        """
+        ip = IPAddress(ip)
+        if ip.is_ipv4_mapped():
+            ip = ip.ipv4()
+        value, width = int(ip), _WIDTHS[ip.version]
+        best = None
+        for prefixlen, table in self.tables[ip.version]:
+            if prefixlen == width:
+                continue
+            found = table.get(value >> (width - prefixlen))
+            if found is not None:
+                if found.subnet.vlan.dhcp_on:
+                    return found
+                elif best is None:
+                    best = found
+        return best
+
+
+class SubnetIndex:
+    """Find the subnet for an IP address from memory.
+
+    Until `rebuild` has been called, and whenever `invalidate` has been
+    called since, lookups fall back to the database.
+
+    :ivar hits: The number of lookups answered from the index.
+    :ivar misses: The number of lookups that fell back to the database.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._table = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def stale(self):
+        return self._table is None
+
+    def invalidate(self):
+        """Stop using the index until it has been rebuilt."""
+        with self._lock:
+            self._generation += 1
+            self._table = None
+
+    @transactional
+    def rebuild(self):
+        """Build the index from the database.
+
+        :return: Whether the index was built. It is not if `invalidate` was
+            called while it was being built, since it may then be stale.
+        """
+        with self._lock:
+            generation = self._generation
+        table = _SubnetTable.load()
+        with self._lock:
+            if generation == self._generation:
+                self._table = table
+                return True
+            else:
+                return False
+
+    def _lookup(self, ip):
+        """Look up `ip` in the index, if it can be used.
+
+        :return: A tuple of the `_IndexedSubnet` found, or `None`, and
+            whether the index was used.
+        """
+        table = self._table
+        if table is None:
+            self.misses += 1
+            result = "miss"
+            found = None
+        else:
+            self.hits += 1
+            result = "hit"
+            found = table.lookup(ip)
+        PROMETHEUS_METRICS.update(
+            "maas_subnet_index_lookups", "inc", labels={"result": result}
+        )
+        return found, table is not None
+
+    def get_best_subnet_for_ip(self, ip):
+        """Return the subnet for `ip`, as `Subnet.objects` would.
+
+        The subnet's VLAN is returned with it.
+        """
+        found, indexed = self._lookup(ip)
+        if not indexed:
+            return Subnet.objects.get_best_subnet_for_ip(ip)
+        elif found is None:
+            return None
+        else:
+            return found.get_subnet()
+
+    def get_best_subnet_and_dynamic_ranges_for_ip(self, ip):
+        """Return the subnet for `ip` and its dynamic ranges.
+
+        :return: A tuple of the `Subnet`, or `None`, and a list of its
+            dynamic ranges as `netaddr.IPRange`s.
+        """
+        found, indexed = self._lookup(ip)
+        if not indexed:
+            subnet = Subnet.objects.get_best_subnet_for_ip(ip)
+            if subnet is None:
+                return None, []
+            else:
+                return subnet, [
+                    iprange.netaddr_iprange
+                    for iprange in subnet.get_dynamic_ranges()
+                ]
+        elif found is None:
+            return None, []
+        else:
+            return found.get_subnet(), list(found.ranges)
+
+
+subnet_index = SubnetIndex()
+
+
+class SubnetIndexService(Service):
+    """Keep a `SubnetIndex` up to date in this regiond process.
+
+    The index is invalidated and rebuilt whenever a subnet, VLAN or IP range
+    changes, and whenever the listener connects, since notifications may
+    have been missed while it was not. It is not used while the listener is
+    disconnected.
+    """
+
+    channels = ("subnet", "vlan", "iprange")
+
+    def __init__(self, postgresListener, index=subnet_index):
+        super().__init__()
+        self.postgresListener = postgresListener
+        self.index = index
+        self.needsRebuild = False
+        self.rebuilding = None
+
+    def startService(self):
+        super().startService()
+        for channel in self.channels:
+            self.postgresListener.register(channel, self.markForRebuild)
+        self.postgresListener.events.connected.registerHandler(
+            self.markForRebuild
+        )
+        self.postgresListener.events.disconnected.registerHandler(
+            self.invalidate
+        )
+        if self.postgresListener.connected():
+            self.markForRebuild()
+
+    def stopService(self):
+        self.postgresListener.events.disconnected.unregisterHandler(
+            self.invalidate
+        )
+        self.postgresListener.events.connected.unregisterHandler(
+            self.markForRebuild
+        )
+        for channel in self.channels:
+            self.postgresListener.unregister(channel, self.markForRebuild)
+        self.index.invalidate()
+        super().stopService()
+        return self.rebuilding
+
+    def invalidate(self, *args):
+        """Called when the listener disconnects."""
+        self.index.invalidate()
+
+    def markForRebuild(self, *args):
+        """Called when a subnet, VLAN or IP range changes."""
+        self.index.invalidate()
+        self.needsRebuild = True
+        if self.rebuilding is None:
+            self.rebuilding = self.rebuild()
+
+    @inlineCallbacks
+    def rebuild(self):
+        """Rebuild the index until it is up to date."""
+        try:
+            while self.needsRebuild and self.running:
+                self.needsRebuild = False
+                try:
+                    yield deferToDatabase(self.index.rebuild)
+                except Exception:
+                    log.err(None, "Failed to build the subnet index.")
+        finally:
+            self.rebuilding = None
@@ -0,0 +1,172 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Benchmark DNS zone generation against a large, synthetic, deployment."""
+
+__all__ = ["benchmark", "populate"]
+
+from itertools import cycle, islice
+import time
+import tracemalloc
+
+from django.db import connection
+from netaddr import IPNetwork
+
+from maasserver.dns.zonegenerator import ZoneGenerator
+from maasserver.enum import (
+    INTERFACE_TYPE,
+    IPADDRESS_TYPE,
+    NODE_STATUS,
+    NODE_TYPE,
+    RDNS_MODE,
+)
+from maasserver.models import (
+    Config,
+    Domain,
+    Fabric,
+    Interface,
+    Node,
+    StaticIPAddress,
+    Subnet,
+    Zone,
+)
+from maasserver.testing.factory import factory
+from maasserver.utils.orm import transactional
+
+
+@transactional
+def populate(nodes=50000, subnets=500, domains=10, batch_size=1000):
+    """Populate the database with `nodes` deployed machines.
+
+    The machines are spread across `subnets` /24 subnets and `domains`
+    authoritative domains, each with one physical interface and one sticky
+    address. Rows are inserted in bulk; the usual model validation is skipped.
+
+    This expects to be run against a database that has no other sample data.
+    """
+    vlan = Fabric.objects.get_default_fabric().get_default_vlan()
+    zone = Zone.objects.get_default_zone()
+    all_domains = [Domain.objects.get_default_domain()] + [
+        factory.make_Domain("bench%d" % index) for index in range(1, domains)
+    ]
+    all_subnets = [
+        factory.make_Subnet(
+            cidr="10.%d.%d.0/24" % divmod(index, 256),
+            gateway_ip="10.%d.%d.1" % divmod(index, 256),
+            vlan=vlan,
+            rdns_mode=RDNS_MODE.DEFAULT,
+            dns_servers=[],
+        )
+        for index in range(subnets)
+    ]
+    # Hand out addresses from each subnet in turn, skipping the network and
+    # gateway addresses.
+    addresses = {
+        subnet.id: iter(IPNetwork(subnet.cidr)[2:-1]) for subnet in all_subnets
+    }
+    placements = islice(zip(cycle(all_subnets), cycle(all_domains)), nodes)
+    for start in range(0, nodes, batch_size):
+        batch = list(islice(placements, batch_size))
+        machines = Node.objects.bulk_create(
+            Node(
+                hostname="bench-%06d" % (start + index),
+                system_id="bench%06d" % (start + index),
+                node_type=NODE_TYPE.MACHINE,
+                status=NODE_STATUS.DEPLOYED,
+                domain=domain,
+                zone=zone,
+            )
+            for index, (_, domain) in enumerate(batch)
+        )
+        interfaces = Interface.objects.bulk_create(
+            Interface(
+                node=machine,
+                name="eth0",
+                type=INTERFACE_TYPE.PHYSICAL,
+                mac_address=factory.make_mac_address(),
+                vlan=vlan,
+            )
+            for machine in machines
+        )
+        ips = StaticIPAddress.objects.bulk_create(
+            StaticIPAddress(
+                alloc_type=IPADDRESS_TYPE.STICKY,
+                ip=str(next(addresses[subnet.id])),
+                subnet=subnet,
+            )
+            for subnet, _ in batch
+        )
+        Interface.ip_addresses.through.objects.bulk_create(
+            Interface.ip_addresses.through(
+                interface_id=interface.id, staticipaddress_id=ip.id
+            )
+            for interface, ip in zip(interfaces, ips)
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE maasserver_node AS node
+            SET boot_interface_id = interface.id
+            FROM maasserver_interface AS interface
+            WHERE interface.node_id = node.id
+              AND node.system_id LIKE %s
+            """,
+            ["bench%"],
+        )
+
+
+@transactional
+def generate_zones(bulk):
+    """Generate every zone, as `dns_update_all_zones` would.
+
+    :return: A tuple of the number of zones generated, the wall-clock time
+        taken in seconds, the peak memory traced in bytes, and the number of
+        queries issued.
+    """
+    domains = Domain.objects.filter(authoritative=True)
+    subnets = Subnet.objects.exclude(rdns_mode=RDNS_MODE.DISABLED)
+    default_ttl = Config.objects.get_config("default_dns_ttl")
+    queries_before = len(connection.queries)
+    tracemalloc.start()
+    try:
+        started = time.monotonic()
+        zones = ZoneGenerator(
+            domains, subnets, default_ttl, serial=1, bulk=bulk
+        ).as_list()
+        elapsed = time.monotonic() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return len(zones), elapsed, peak, len(connection.queries) - queries_before
+
+
+def benchmark(
+    stdout, nodes=50000, subnets=500, domains=10, skip_populate=False
+):
+    """Benchmark zone generation with and without bulk mappings.
+
+    The results are written to `stdout`.
+    """
+    if not skip_populate:
+        started = time.monotonic()
+        populate(nodes=nodes, subnets=subnets, domains=domains)
+        stdout.write(
+            "Populated %d nodes, %d subnets, %d domains in %.1fs\n"
+            % (nodes, subnets, domains, time.monotonic() - started)
+        )
+    connection.force_debug_cursor = True
+    try:
+        for bulk in (False, True):
+            count, elapsed, peak, queries = generate_zones(bulk)
+            stdout.write(
+                "%-8s %d zones in %.2fs, peak memory %.1f MiB, %d queries\n"
+                % (
+                    "bulk" if bulk else "default",
+                    count,
+                    elapsed,
+                    peak / 2 ** 20,
+                    queries,
+                )
+            )
+    finally:
+        connection.force_debug_cursor = False
@@ -0,0 +1,34 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.testing.dnsbenchmark`."""
+
+__all__ = []
+
+from io import StringIO
+
+from maasserver.models import Node, StaticIPAddress
+from maasserver.testing import dnsbenchmark
+from maasserver.testing.testcase import MAASServerTestCase
+
+
+class TestDNSBenchmark(MAASServerTestCase):
+    def test_populate_creates_nodes_with_addresses(self):
+        dnsbenchmark.populate(nodes=20, subnets=3, domains=2, batch_size=7)
+        nodes = Node.objects.filter(system_id__startswith="bench")
+        self.assertEqual(20, nodes.count())
+        self.assertEqual(
+            20, nodes.filter(boot_interface__isnull=False).count()
+        )
+        self.assertEqual(
+            20,
+            StaticIPAddress.objects.filter(interface__node__in=nodes).count(),
+        )
+
+    def test_benchmark_reports_both_modes(self):
+        stdout = StringIO()
+        dnsbenchmark.benchmark(stdout, nodes=10, subnets=2, domains=2)
+        output = stdout.getvalue()
+        self.assertIn("Populated 10 nodes", output)
+        self.assertIn("default ", output)
+        self.assertIn("bulk ", output)
@@ -0,0 +1,55 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.testing.ipbenchmark`."""
+
+__all__ = []
+
+from io import StringIO
+
+from netaddr import IPAddress, IPNetwork
+
+from maasserver.models import StaticIPAddress
+from maasserver.testing import ipbenchmark
+from maasserver.testing.testcase import MAASServerTestCase
+
+
+class TestIPBenchmark(MAASServerTestCase):
+    def test_populate_creates_subnets_with_addresses(self):
+        ipbenchmark.populate(addresses=20, batch_size=7)
+        for cidr, _ in ipbenchmark.SUBNETS:
+            self.assertEqual(
+                20, StaticIPAddress.objects.filter(subnet__cidr=cidr).count()
+            )
+
+    def test_choose_next_ip_agrees_with_maasipset(self):
+        ipbenchmark.populate(addresses=20)
+        for cidr, _ in ipbenchmark.SUBNETS:
+            (old_ip, _), (new_ip, _) = ipbenchmark.choose_next_ip(
+                cidr, repeat=1
+            )
+            self.assertEqual(old_ip, new_ip)
+
+    def test_allocate_new_times_each_step(self):
+        ipbenchmark.populate(addresses=20)
+        for cidr, _ in ipbenchmark.SUBNETS:
+            results = ipbenchmark.allocate_new(cidr, repeat=2)
+            self.assertEqual(
+                ["allocated", "next_ip", "allocate_new"],
+                [name for name, _, _ in results],
+            )
+            self.assertEqual(20, results[0][1])
+            self.assertIn(IPAddress(results[2][1]), IPNetwork(cidr))
+            # The allocated addresses are gone again.
+            self.assertEqual(
+                20, StaticIPAddress.objects.filter(subnet__cidr=cidr).count()
+            )
+
+    def test_benchmark_reports_both_methods(self):
+        stdout = StringIO()
+        ipbenchmark.benchmark(stdout, addresses=10, repeat=1)
+        output = stdout.getvalue()
+        self.assertIn("Populated 10 addresses", output)
+        self.assertIn("10.64.0.0/16       maasipset", output)
+        self.assertIn("2001:db8:64::/64   index", output)
+        self.assertIn("10.64.0.0/16       allocate_new", output)
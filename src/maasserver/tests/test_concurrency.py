@@ -0,0 +1,54 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.concurrency`."""
+
+__all__ = []
+
+from twisted.internet.defer import CancelledError, Deferred
+
+from maasserver.concurrency import PriorityDeferredSemaphore
+from maastesting.testcase import MAASTestCase
+
+
+class TestPriorityDeferredSemaphore(MAASTestCase):
+    def test_run_acquires_token(self):
+        semaphore = PriorityDeferredSemaphore(1)
+        d = Deferred()
+        semaphore.run(lambda: d)
+        self.assertEqual(0, semaphore.tokens)
+        d.callback(None)
+        self.assertEqual(1, semaphore.tokens)
+
+    def test_runWithPriority_acquires_token(self):
+        semaphore = PriorityDeferredSemaphore(1)
+        d = Deferred()
+        semaphore.runWithPriority(lambda: d)
+        self.assertEqual(0, semaphore.tokens)
+        d.callback(None)
+        self.assertEqual(1, semaphore.tokens)
+
+    def test_runWithPriority_runs_before_waiting_work(self):
+        semaphore = PriorityDeferredSemaphore(1)
+        blocker = Deferred()
+        semaphore.run(lambda: blocker)
+        calls = []
+        semaphore.run(calls.append, "normal")
+        semaphore.runWithPriority(calls.append, "priority")
+        self.assertEqual([], calls)
+        blocker.callback(None)
+        self.assertEqual(["priority", "normal"], calls)
+        self.assertEqual(1, semaphore.tokens)
+
+    def test_runWithPriority_can_be_cancelled_while_waiting(self):
+        semaphore = PriorityDeferredSemaphore(1)
+        blocker = Deferred()
+        semaphore.run(lambda: blocker)
+        calls = []
+        d = semaphore.runWithPriority(calls.append, "priority")
+        d.addErrback(lambda failure: failure.trap(CancelledError))
+        d.cancel()
+        blocker.callback(None)
+        self.assertEqual([], calls)
+        self.assertEqual([], semaphore.priorityWaiting)
+        self.assertEqual(1, semaphore.tokens)
@@ -130,6 +130,22 @@ class TestRegionConfigurationWorkerOptions(MAASTestCase):
         self.assertEqual({"num_workers": workers}, config.store)
 
 
+class TestRegionConfigurationAllocationOptions(MAASTestCase):
+    """Tests for the allocation options in `RegionConfiguration`."""
+
+    def test_default(self):
+        config = RegionConfiguration({})
+        self.assertEqual(0, config.address_pool_size)
+
+    def test_set_and_get(self):
+        config = RegionConfiguration({})
+        size = random.randint(8, 32)
+        config.address_pool_size = size
+        self.assertEqual(size, config.address_pool_size)
+        # It's also stored in the configuration database.
+        self.assertEqual({"address_pool_size": size}, config.store)
+
+
 class TestRegionConfigurationDebugOptions(MAASTestCase):
     """Tests for the debug options in `RegionConfiguration`."""
 
@@ -60,13 +60,18 @@ from provisioningserver.rpc.cluster import (
     ConfigureDHCPv4_V2,
     ConfigureDHCPv6,
     ConfigureDHCPv6_V2,
+    UpdateDHCPv4Hosts,
+    UpdateDHCPv6Hosts,
     ValidateDHCPv4Config,
     ValidateDHCPv4Config_V2,
     ValidateDHCPv6Config,
     ValidateDHCPv6Config_V2,
 )
 from provisioningserver.rpc.dhcp import downgrade_shared_networks
-from provisioningserver.rpc.exceptions import CannotConfigureDHCP
+from provisioningserver.rpc.exceptions import (
+    CannotConfigureDHCP,
+    DHCPStateMismatch,
+)
 from provisioningserver.utils.twisted import synchronous
 
 wait_for_reactor = wait_for(30)  # 30 seconds.
@@ -2427,6 +2432,7 @@ class TestConfigureDHCP(MAASTransactionServerTestCase):
                 command_v4=ConfigureDHCPv4,
                 command_v6=ConfigureDHCPv6,
                 process_expected_shared_networks=downgrade_shared_networks,
+                expected_version_args={},
             ),
         ),
         (
@@ -2436,10 +2442,15 @@ class TestConfigureDHCP(MAASTransactionServerTestCase):
                 command_v4=ConfigureDHCPv4_V2,
                 command_v6=ConfigureDHCPv6_V2,
                 process_expected_shared_networks=None,
+                expected_version_args={"version": ANY},
             ),
         ),
     )
 
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(dhcp._rack_dhcp_states.clear)
+
     @synchronous
     def prepare_rpc(self, rack_controller):
         """"Set up test case for speaking RPC to `rack_controller`."""
@@ -2554,6 +2565,7 @@ class TestConfigureDHCP(MAASTransactionServerTestCase):
                 hosts=config.hosts_v4,
                 interfaces=interfaces_v4,
                 global_dhcp_snippets=config.global_dhcp_snippets,
+                **self.expected_version_args
             ),
         )
         self.assertThat(
@@ -2566,6 +2578,7 @@ class TestConfigureDHCP(MAASTransactionServerTestCase):
                 hosts=config.hosts_v6,
                 interfaces=interfaces_v6,
                 global_dhcp_snippets=config.global_dhcp_snippets,
+                **self.expected_version_args
             ),
         )
 
@@ -2750,6 +2763,167 @@ class TestConfigureDHCP(MAASTransactionServerTestCase):
         yield deferToDatabase(service_status_updated)
 
 
+class TestConfigureDHCPServer(MAASTransactionServerTestCase):
+    """Tests for `_configure_dhcp_server`."""
+
+    scenarios = (
+        (
+            "v4",
+            dict(
+                ip_version=4,
+                configure_command=ConfigureDHCPv4_V2,
+                update_command=UpdateDHCPv4Hosts,
+            ),
+        ),
+        (
+            "v6",
+            dict(
+                ip_version=6,
+                configure_command=ConfigureDHCPv6_V2,
+                update_command=UpdateDHCPv6Hosts,
+            ),
+        ),
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(dhcp._rack_dhcp_states.clear)
+
+    @synchronous
+    def prepare_rpc(self):
+        """Set up a rack controller that can configure and update DHCP."""
+        rack_controller = transactional(factory.make_RackController)()
+        self.useFixture(RegionEventLoopFixture("rpc"))
+        self.useFixture(RunningEventLoopFixture())
+        fixture = self.useFixture(MockLiveRegionToClusterRPCFixture())
+        cluster = fixture.makeCluster(
+            rack_controller, self.configure_command, self.update_command
+        )
+        configure = getattr(
+            cluster, self.configure_command.commandName.decode("ascii")
+        )
+        configure.side_effect = always_succeed_with({})
+        update = getattr(
+            cluster, self.update_command.commandName.decode("ascii")
+        )
+        update.side_effect = always_succeed_with({})
+        return rack_controller, configure, update
+
+    def make_host(self, mac=None):
+        if mac is None:
+            mac = factory.make_mac_address()
+        return {
+            "host": factory.make_name("host"),
+            "mac": mac,
+            "ip": factory.make_ip_address(),
+            "dhcp_snippets": [],
+        }
+
+    def make_args(self, hosts):
+        return dict(
+            omapi_key=factory.make_name("omapi_key"),
+            failover_peers=[],
+            shared_networks=[],
+            interfaces=[{"name": factory.make_name("eth")}],
+            global_dhcp_snippets=[],
+            hosts=hosts,
+        )
+
+    @inlineCallbacks
+    def configure(self, rack_controller, args):
+        client = yield dhcp.getClientFor(rack_controller.system_id)
+        yield dhcp._configure_dhcp_server(
+            client, rack_controller, self.ip_version, **args
+        )
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_sends_full_configuration_first(self):
+        rack_controller, configure, update = yield deferToThread(
+            self.prepare_rpc
+        )
+        args = self.make_args([self.make_host()])
+        yield self.configure(rack_controller, args)
+        self.assertThat(
+            configure, MockCalledOnceWith(ANY, version=ANY, **args)
+        )
+        self.assertThat(update, MockNotCalled())
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_sends_only_changed_hosts(self):
+        rack_controller, configure, update = yield deferToThread(
+            self.prepare_rpc
+        )
+        kept, changed, removed = [self.make_host() for _ in range(3)]
+        args = self.make_args([kept, changed, removed])
+        yield self.configure(rack_controller, args)
+        [_, first_args] = configure.call_args
+        changed = self.make_host(mac=changed["mac"])
+        added = self.make_host()
+        yield self.configure(
+            rack_controller, dict(args, hosts=[kept, changed, added])
+        )
+        self.assertThat(
+            configure, MockCalledOnceWith(ANY, version=ANY, **args)
+        )
+        self.assertThat(
+            update,
+            MockCalledOnceWith(
+                ANY,
+                omapi_key=args["omapi_key"],
+                previous_version=first_args["version"],
+                version=ANY,
+                removed_macs=[removed["mac"]],
+                hosts=[changed, added],
+            ),
+        )
+        [_, update_args] = update.call_args
+        self.assertNotEqual(first_args["version"], update_args["version"])
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_sends_full_configuration_when_more_than_hosts_change(self):
+        rack_controller, configure, update = yield deferToThread(
+            self.prepare_rpc
+        )
+        hosts = [self.make_host()]
+        yield self.configure(rack_controller, self.make_args(hosts))
+        yield self.configure(rack_controller, self.make_args(hosts))
+        self.assertEqual(2, configure.call_count)
+        self.assertThat(update, MockNotCalled())
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_sends_full_configuration_when_rack_state_differs(self):
+        rack_controller, configure, update = yield deferToThread(
+            self.prepare_rpc
+        )
+        update.side_effect = always_fail_with(DHCPStateMismatch())
+        args = self.make_args([self.make_host()])
+        yield self.configure(rack_controller, args)
+        args["hosts"] = [self.make_host()]
+        yield self.configure(rack_controller, args)
+        self.assertEqual(1, update.call_count)
+        self.assertEqual(2, configure.call_count)
+        configure.assert_called_with(ANY, version=ANY, **args)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_sends_full_configuration_after_failure(self):
+        rack_controller, configure, update = yield deferToThread(
+            self.prepare_rpc
+        )
+        configure.side_effect = always_fail_with(CannotConfigureDHCP())
+        args = self.make_args([self.make_host()])
+        with ExpectedException(CannotConfigureDHCP):
+            yield self.configure(rack_controller, args)
+        configure.side_effect = always_succeed_with({})
+        yield self.configure(rack_controller, args)
+        self.assertEqual(2, configure.call_count)
+        self.assertThat(update, MockNotCalled())
+
+
 class TestValidateDHCPConfig(MAASTransactionServerTestCase):
     """Tests for `validate_dhcp_config`."""
 
@@ -24,10 +24,12 @@ from maasserver import (
     region_controller,
     stats,
     status_monitor,
+    subnet_index,
     webapp,
     workers,
 )
 from maasserver.eventloop import DEFAULT_PORT, MAASServices
+from maasserver.listener import PostgresListenerWorkerService
 from maasserver.prometheus.stats import PrometheusService
 from maasserver.regiondservices import ntp, service_monitor_service, syslog
 from maasserver.rpc import regionservice
@@ -520,6 +522,25 @@ class TestFactories(MAASServerTestCase):
             eventloop.loop.factories["status-worker"]["only_on_master"]
         )
 
+    def test_make_SubnetIndexService(self):
+        service = eventloop.make_SubnetIndexService(
+            FakePostgresListenerService()
+        )
+        self.assertThat(service, IsInstance(subnet_index.SubnetIndexService))
+        # It is registered as a factory in RegionEventLoop.
+        self.assertIs(
+            eventloop.make_SubnetIndexService,
+            eventloop.loop.factories["subnet-index"]["factory"],
+        )
+        # Has a dependency of postgres-listener-worker.
+        self.assertEquals(
+            ["postgres-listener-worker"],
+            eventloop.loop.factories["subnet-index"]["requires"],
+        )
+        self.assertFalse(
+            eventloop.loop.factories["subnet-index"]["only_on_master"]
+        )
+
     def test_make_NetworkTimeProtocolService(self):
         service = eventloop.make_NetworkTimeProtocolService()
         self.assertThat(
@@ -559,6 +580,28 @@ class TestFactories(MAASServerTestCase):
         self.assertTrue(eventloop.loop.factories["workers"]["only_on_master"])
         self.assertTrue(eventloop.loop.factories["workers"]["not_all_in_one"])
 
+    def test_make_PostgresListenerWorkerService(self):
+        service = eventloop.make_PostgresListenerWorkerService(
+            sentinel.ipcWorker
+        )
+        self.assertThat(service, IsInstance(PostgresListenerWorkerService))
+        self.assertIs(sentinel.ipcWorker, service.ipcWorker)
+        # It is registered as a factory in RegionEventLoop.
+        self.assertIs(
+            eventloop.make_PostgresListenerWorkerService,
+            eventloop.loop.factories["postgres-listener-worker"]["factory"],
+        )
+        # Has a dependency of ipc-worker.
+        self.assertEquals(
+            ["ipc-worker"],
+            eventloop.loop.factories["postgres-listener-worker"]["requires"],
+        )
+        self.assertFalse(
+            eventloop.loop.factories["postgres-listener-worker"][
+                "only_on_master"
+            ]
+        )
+
     def test_make_IPCMasterService(self):
         service = eventloop.make_IPCMasterService()
         self.assertThat(service, IsInstance(ipc.IPCMasterService))
@@ -567,9 +610,10 @@ class TestFactories(MAASServerTestCase):
             eventloop.make_IPCMasterService,
             eventloop.loop.factories["ipc-master"]["factory"],
         )
-        # Has a no dependencies.
+        # Has a dependency of postgres-listener-master.
         self.assertEquals(
-            [], eventloop.loop.factories["ipc-master"]["requires"]
+            ["postgres-listener-master"],
+            eventloop.loop.factories["ipc-master"]["requires"],
         )
         # Has an optional dependency on workers.
         self.assertEquals(
@@ -14,16 +14,22 @@ import uuid
 from crochet import wait_for
 from fixtures import EnvironmentVariableFixture
 from testtools.matchers import MatchesStructure
-from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet import error, reactor
+from twisted.internet.defer import DeferredQueue, inlineCallbacks, succeed
+from twisted.python.failure import Failure
 
 from maasserver import workers
 from maasserver.enum import SERVICE_STATUS
 from maasserver.ipc import (
+    chunk_payloads,
     get_ipc_socket_path,
     IPCMasterService,
     IPCWorkerService,
 )
+from maasserver.listener import (
+    PostgresListenerService,
+    PostgresListenerWorkerService,
+)
 from maasserver.models import timestampedmodel
 from maasserver.models.node import RegionController
 from maasserver.models.regioncontrollerprocess import RegionControllerProcess
@@ -70,6 +76,18 @@ class TestGetIPCSocketPath(MAASTestCase):
         )
 
 
+class TestChunkPayloads(MAASTestCase):
+    def test_returns_nothing_without_payloads(self):
+        self.assertEqual([], list(chunk_payloads([])))
+
+    def test_splits_payloads_to_fit_limit(self):
+        payloads = ["%04d" % i for i in range(5)]
+        self.assertEqual(
+            [payloads[:2], payloads[2:4], payloads[4:]],
+            list(chunk_payloads(payloads, limit=12)),
+        )
+
+
 class TestIPCCommunication(MAASTransactionServerTestCase):
 
     run_tests_with = MAASCrochetRunTest
@@ -80,9 +98,14 @@ class TestIPCCommunication(MAASTransactionServerTestCase):
             self.useFixture(TempDirectory()).path, "maas-regiond.sock"
         )
 
-    def make_IPCMasterService(self, workers=None, run_loop=False):
+    def make_IPCMasterService(
+        self, workers=None, run_loop=False, postgresListener=None
+    ):
         master = IPCMasterService(
-            reactor, workers=workers, socket_path=self.ipc_path
+            reactor,
+            workers=workers,
+            socket_path=self.ipc_path,
+            postgresListener=postgresListener,
         )
 
         if not run_loop:
@@ -107,8 +130,14 @@ class TestIPCCommunication(MAASTransactionServerTestCase):
         new_method.side_effect = mock_method
         return dv
 
-    def make_IPCMasterService_with_wrap(self, workers=None, run_loop=False):
-        master = self.make_IPCMasterService(workers=workers, run_loop=run_loop)
+    def make_IPCMasterService_with_wrap(
+        self, workers=None, run_loop=False, postgresListener=None
+    ):
+        master = self.make_IPCMasterService(
+            workers=workers,
+            run_loop=run_loop,
+            postgresListener=postgresListener,
+        )
 
         dv_connected = self.wrap_async_method(master, "registerWorker")
         dv_disconnected = self.wrap_async_method(master, "unregisterWorker")
@@ -176,6 +205,110 @@ class TestIPCCommunication(MAASTransactionServerTestCase):
 
         self.assertThat(workers.killWorker, MockCalledOnceWith(pid))
 
+    @inlineCallbacks
+    def start_worker_listener(self, postgresListener):
+        (
+            master,
+            connected,
+            disconnected,
+        ) = self.make_IPCMasterService_with_wrap(
+            postgresListener=postgresListener
+        )
+        yield master.startService()
+        worker = IPCWorkerService(reactor, socket_path=self.ipc_path)
+        listener = PostgresListenerWorkerService(worker)
+        yield worker.startService()
+        yield listener.startService()
+        yield connected.get(timeout=2)
+        return master, worker, listener, disconnected
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_worker_receives_notifications_through_master(self):
+        pid = random.randint(1, 512)
+        self.patch(os, "getpid").return_value = pid
+        postgresListener = PostgresListenerService()
+        master, worker, listener, disconnected = yield (
+            self.start_worker_listener(postgresListener)
+        )
+
+        handled = DeferredQueue()
+
+        def handler(action, payload):
+            handled.put((action, payload))
+
+        registered = self.wrap_async_method(worker, "listenerRegister")
+        listener.register("machine", handler)
+        yield registered.get(timeout=2)
+        self.assertEqual(["machine"], list(postgresListener.listeners))
+        self.assertEqual({"machine"}, master.connections[pid]["channels"])
+
+        yield postgresListener.handleNotifyGroup(
+            "machine", "update", [("1", None), ("2", None)]
+        )
+        self.assertEqual(("update", "1"), (yield handled.get()))
+        self.assertEqual(("update", "2"), (yield handled.get()))
+
+        unregistered = self.wrap_async_method(worker, "listenerUnregister")
+        listener.unregister("machine", handler)
+        yield unregistered.get(timeout=2)
+        self.assertEqual([], list(postgresListener.listeners))
+
+        yield listener.stopService()
+        yield worker.stopService()
+        yield disconnected.get(timeout=2)
+        yield master.stopService()
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_worker_told_when_master_listener_connects(self):
+        postgresListener = PostgresListenerService()
+        master, worker, listener, disconnected = yield (
+            self.start_worker_listener(postgresListener)
+        )
+        events = DeferredQueue()
+        listener.events.connected.registerHandler(
+            lambda: events.put("connected")
+        )
+        listener.events.disconnected.registerHandler(
+            lambda reason: events.put("disconnected")
+        )
+
+        postgresListener.events.disconnected.fire(
+            Failure(error.ConnectionLost())
+        )
+        self.assertEqual("disconnected", (yield events.get()))
+        self.assertFalse(listener.connected())
+        postgresListener.events.connected.fire()
+        self.assertEqual("connected", (yield events.get()))
+        self.assertTrue(listener.connected())
+
+        yield listener.stopService()
+        yield worker.stopService()
+        yield disconnected.get(timeout=2)
+        yield master.stopService()
+        self.assertEqual(set(), postgresListener.events.connected.handlers)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_master_stops_listening_when_worker_disconnects(self):
+        postgresListener = PostgresListenerService()
+        master, worker, listener, disconnected = yield (
+            self.start_worker_listener(postgresListener)
+        )
+
+        registered = self.wrap_async_method(worker, "listenerRegister")
+        listener.register("machine", MagicMock())
+        yield registered.get(timeout=2)
+        self.assertEqual(["machine"], list(postgresListener.listeners))
+
+        yield listener.stopService()
+        yield worker.stopService()
+        yield disconnected.get(timeout=2)
+        self.assertEqual([], list(postgresListener.listeners))
+        self.assertEqual({}, master.listenerForwarders)
+        yield master.stopService()
+
     @wait_for_reactor
     @inlineCallbacks
     def test_worker_registers_rpc_endpoints(self):
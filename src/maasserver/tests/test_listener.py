@@ -27,6 +27,7 @@ from twisted.internet.defer import (
     Deferred,
     DeferredQueue,
     inlineCallbacks,
+    succeed,
 )
 from twisted.logger import LogLevel
 from twisted.python.failure import Failure
@@ -37,6 +38,7 @@ from maasserver.listener import (
     PostgresListenerRegistrationError,
     PostgresListenerService,
     PostgresListenerUnregistrationError,
+    PostgresListenerWorkerService,
 )
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
@@ -510,6 +512,107 @@ class TestPostgresListenerService(MAASServerTestCase):
         listener.doRead()
         self.assertItemsEqual(listener.notifications, set(notifications))
 
+    def test_doRead_records_notification_receive_time(self):
+        listener = PostgresListenerService()
+        notification = FakeNotify(
+            channel=factory.make_name("channel_action"),
+            payload=factory.make_name("payload"),
+        )
+        connection = self.patch(listener, "connection")
+        connection.connection.poll.return_value = None
+        connection.connection.notifies = [notification]
+        listener.doRead()
+        self.assertIn(notification, listener.notificationTimes)
+
+    def test_register_raises_error_if_system_channel_batched(self):
+        listener = PostgresListenerService()
+        channel = factory.make_name("sys_", sep="")
+        with ExpectedException(PostgresListenerRegistrationError):
+            listener.register(channel, lambda *args: None, batched=True)
+
+    def test_unregister_removes_batched_handler(self):
+        listener = PostgresListenerService()
+        listener.register("machine", sentinel.handler, batched=True)
+        listener.unregister("machine", sentinel.handler)
+        self.assertEqual(set(), listener.batchedListeners)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_handleNotifies_calls_batched_handler_once_per_action(self):
+        listener = PostgresListenerService()
+        calls = []
+        listener.register(
+            "machine", lambda *args: calls.append(args), batched=True
+        )
+        listener.notifications.update(
+            {
+                ("machine_update", "1"),
+                ("machine_update", "2"),
+                ("machine_delete", "3"),
+            }
+        )
+        yield listener.handleNotifies()
+        self.assertItemsEqual(
+            [("update", ["1", "2"]), ("delete", ["3"])],
+            [(action, sorted(pks)) for action, pks in calls],
+        )
+        self.assertEqual(set(), listener.notifications)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_handleNotifies_splits_batches(self):
+        listener = PostgresListenerService()
+        listener.HANDLE_NOTIFY_BATCH_SIZE = 2
+        calls = []
+        listener.register(
+            "machine", lambda *args: calls.append(args), batched=True
+        )
+        listener.notifications.update(
+            {("machine_update", str(i)) for i in range(5)}
+        )
+        yield listener.handleNotifies()
+        self.assertEqual([2, 2, 1], [len(pks) for _, pks in calls])
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_handleNotifies_calls_unbatched_handler_per_payload(self):
+        listener = PostgresListenerService()
+        calls = []
+        listener.register("machine", lambda *args: calls.append(args))
+        listener.notifications.update(
+            {("machine_update", "1"), ("machine_update", "2")}
+        )
+        yield listener.handleNotifies()
+        self.assertItemsEqual([("update", "1"), ("update", "2")], calls)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_handleNotifies_calls_unbatched_handler_one_payload_at_a_time(
+        self,
+    ):
+        listener = PostgresListenerService()
+        started = []
+        calls = DeferredQueue()
+
+        def handler(action, payload):
+            d = Deferred()
+            started.append(payload)
+            calls.put(d)
+            return d
+
+        listener.register("machine", handler)
+        listener.notifications.update(
+            {("machine_update", str(i)) for i in range(3)}
+        )
+        done = listener.handleNotifies()
+        for count in range(1, 4):
+            pending = yield calls.get()
+            # The next payload is handled only once this one is done.
+            self.assertEqual(count, len(started))
+            pending.callback(None)
+        yield done
+        self.assertItemsEqual(["0", "1", "2"], started)
+
     @wait_for_reactor
     @inlineCallbacks
     def test_listener_ignores_ENOENT_when_removing_itself_from_reactor(self):
@@ -652,3 +755,122 @@ class TestPostgresListenerService(MAASServerTestCase):
                 call("UNLISTEN %s_update;" % channel),
             ),
         )
+
+
+class TestPostgresListenerWorkerService(MAASServerTestCase):
+    def make_listener(self):
+        ipcWorker = MagicMock()
+        ipcWorker.listenerRegister.return_value = succeed(None)
+        ipcWorker.listenerUnregister.return_value = succeed(None)
+        return PostgresListenerWorkerService(ipcWorker)
+
+    def test_register_not_starts_registrar_not_running(self):
+        listener = self.make_listener()
+        listener.register("machine", lambda *args: None)
+        self.assertFalse(listener.channelRegistrar.running)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_registerChannels_subscribes_with_master(self):
+        listener = self.make_listener()
+        listener.register("machine", lambda *args: None)
+        yield listener.startService()
+        yield listener.channelRegistrarDone
+        self.assertThat(
+            listener.ipcWorker.listenerRegister,
+            MockCalledOnceWith("machine", listener.notify),
+        )
+        self.assertEqual({"machine"}, listener.registeredChannels)
+        yield listener.stopService()
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_registerChannels_unsubscribes_with_master(self):
+        listener = self.make_listener()
+
+        def handler(*args):
+            pass
+
+        listener.register("machine", handler)
+        yield listener.startService()
+        yield listener.channelRegistrarDone
+        listener.unregister("machine", handler)
+        yield listener.channelRegistrarDone
+        self.assertThat(
+            listener.ipcWorker.listenerUnregister,
+            MockCalledOnceWith("machine"),
+        )
+        self.assertEqual(set(), listener.registeredChannels)
+        yield listener.stopService()
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_handleWorkerNotify_calls_handlers(self):
+        listener = self.make_listener()
+        calls, batched_calls = [], []
+        listener.register("machine", lambda *args: calls.append(args))
+        listener.register(
+            "machine", lambda *args: batched_calls.append(args), batched=True
+        )
+        yield listener._handleWorkerNotify("machine", "update", ["1", "2"])
+        self.assertEqual([("update", "1"), ("update", "2")], calls)
+        self.assertEqual([("update", ["1", "2"])], batched_calls)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_notify_queues_notifications(self):
+        listener = self.make_listener()
+        handled = DeferredQueue()
+        pending = Deferred()
+
+        def handler(action, payload):
+            handled.put(payload)
+            if payload == "1":
+                return pending
+
+        listener.register("machine", handler)
+        self.assertIsNone(listener.notify("machine", "update", ["1"]))
+        self.assertIsNone(listener.notify("machine", "update", ["2"]))
+        self.assertEqual("1", (yield handled.get()))
+        # The second notification waits for the first to be handled.
+        self.assertEqual([], handled.pending)
+        pending.callback(None)
+        self.assertEqual("2", (yield handled.get()))
+
+    def test_notify_calls_system_handler(self):
+        listener = self.make_listener()
+        channel = factory.make_name("sys_", sep="")
+        calls = []
+        listener.register(channel, lambda *args: calls.append(args))
+        listener.notify(channel, "", ["payload"])
+        self.assertEqual([(channel, "payload")], calls)
+        # The lock queueing the notifications is gone once they're handled.
+        self.assertEqual({}, listener.notifyLocks)
+
+    def test_handleWorkerNotify_ignores_unregistered_channel(self):
+        listener = self.make_listener()
+        self.assertIsNone(
+            listener._handleWorkerNotify("machine", "update", ["1"])
+        )
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_masterConnection_fires_events(self):
+        listener = self.make_listener()
+        connected, disconnected = Mock(), Mock()
+        listener.events.connected.registerHandler(connected)
+        listener.events.disconnected.registerHandler(disconnected)
+        yield listener.startService()
+        self.assertIs(
+            listener.masterConnection,
+            listener.ipcWorker.listenerConnectionReceiver,
+        )
+        self.assertThat(connected, MockCalledOnceWith())
+        listener.masterConnection(False)
+        self.assertFalse(listener.connected())
+        self.assertThat(disconnected, MockCalledOnceWith(ANY))
+        listener.masterConnection(True)
+        self.assertTrue(listener.connected())
+        self.assertThat(connected, MockCallsMatch(call(), call()))
+        yield listener.stopService()
+        self.assertIsNone(listener.ipcWorker.listenerConnectionReceiver)
@@ -124,6 +124,7 @@ class TestRegionWorkerServiceMaker(TestServiceMaker):
             "rack-controller",
             "rpc",
             "status-worker",
+            "subnet-index",
             "web",
             "ipc-worker",
         ]
@@ -161,6 +162,7 @@ class TestRegionWorkerServiceMaker(TestServiceMaker):
             "rack-controller",
             "rpc",
             "status-worker",
+            "subnet-index",
             "web",
             "ipc-worker",
             "import-resources",
@@ -363,6 +365,7 @@ class TestRegionAllInOneServiceMaker(TestServiceMaker):
             "rpc",
             "service-monitor",
             "status-worker",
+            "subnet-index",
             "web",
             "ipc-worker",
             # Master services.
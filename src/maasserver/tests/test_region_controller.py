@@ -209,13 +209,33 @@ class TestRegionControllerService(MAASServerTestCase):
         mock_msg = self.patch(region_controller.log, "msg")
         service.startProcessing()
         yield service.processingDefer
-        self.assertThat(mock_dns_update_all_zones, MockCalledOnceWith())
+        self.assertThat(
+            mock_dns_update_all_zones,
+            MockCalledOnceWith(previous_serial=None),
+        )
         self.assertThat(mock_check_serial, MockCalledOnceWith(dns_result))
         self.assertThat(
             mock_msg,
             MockCalledOnceWith("Reloaded DNS configuration; regiond started."),
         )
 
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_process_updates_zones_since_previous_serial(self):
+        service = self.make_service(sentinel.listener)
+        service.needsDNSUpdate = True
+        service.previousSerial = random.randint(1, 1000)
+        mock_dns_update_all_zones = self.patch(
+            region_controller, "dns_update_all_zones"
+        )
+        mock_dns_update_all_zones.return_value = None
+        service.startProcessing()
+        yield service.processingDefer
+        self.assertThat(
+            mock_dns_update_all_zones,
+            MockCalledOnceWith(previous_serial=service.previousSerial),
+        )
+
     @wait_for_reactor
     @inlineCallbacks
     def test_process_zones_kills_bind_on_failed_reload(self):
@@ -251,7 +271,10 @@ class TestRegionControllerService(MAASServerTestCase):
         service.startProcessing()
         yield service.processingDefer
         self.assertThat(
-            mock_dns_update_all_zones, MockCallsMatch(call(), call())
+            mock_dns_update_all_zones,
+            MockCallsMatch(
+                call(previous_serial=None), call(previous_serial=None)
+            ),
         )
         self.assertThat(
             mock_check_serial,
@@ -306,7 +329,10 @@ class TestRegionControllerService(MAASServerTestCase):
         mock_err = self.patch(region_controller.log, "err")
         service.startProcessing()
         yield service.processingDefer
-        self.assertThat(mock_dns_update_all_zones, MockCalledOnceWith())
+        self.assertThat(
+            mock_dns_update_all_zones,
+            MockCalledOnceWith(previous_serial=None),
+        )
         self.assertThat(
             mock_err, MockCalledOnceWith(ANY, "Failed configuring DNS.")
         )
@@ -393,7 +419,10 @@ class TestRegionControllerService(MAASServerTestCase):
         mock_rbacSync.return_value = None
         service.startProcessing()
         yield service.processingDefer
-        self.assertThat(mock_dns_update_all_zones, MockCalledOnceWith())
+        self.assertThat(
+            mock_dns_update_all_zones,
+            MockCalledOnceWith(previous_serial=None),
+        )
         self.assertThat(mock_check_serial, MockCalledOnceWith(dns_result))
         self.assertThat(
             mock_proxy_update_config, MockCalledOnceWith(reload_proxy=True)
@@ -611,7 +640,10 @@ class TestRegionControllerServiceTransactional(MAASTransactionServerTestCase):
         mock_msg = self.patch(region_controller.log, "msg")
         service.startProcessing()
         yield service.processingDefer
-        self.assertThat(mock_dns_update_all_zones, MockCalledOnceWith())
+        self.assertThat(
+            mock_dns_update_all_zones,
+            MockCalledOnceWith(previous_serial=None),
+        )
         self.assertThat(mock_check_serial, MockCalledOnceWith(dns_result))
         self.assertThat(
             mock_msg,
@@ -655,7 +687,10 @@ class TestRegionControllerServiceTransactional(MAASTransactionServerTestCase):
             " * %s" % publication.source
             for publication in reversed(publications[1:])
         )
-        self.assertThat(mock_dns_update_all_zones, MockCalledOnceWith())
+        self.assertThat(
+            mock_dns_update_all_zones,
+            MockCalledOnceWith(previous_serial=None),
+        )
         self.assertThat(mock_check_serial, MockCalledOnceWith(dns_result))
         self.assertThat(mock_msg, MockCalledOnceWith(expected_msg))
 
@@ -29,6 +29,7 @@ from maasserver.testing.testcase import (
     MAASServerTestCase,
     MAASTransactionServerTestCase,
 )
+from maastesting.djangotestcase import count_queries
 from maastesting.matchers import MockCalledOnce, MockNotCalled
 from maastesting.testcase import MAASTestCase
 from maastesting.twisted import extract_result
@@ -398,6 +399,25 @@ class TestGetSubnetsUtilisationStats(MAASServerTestCase):
             },
         )
 
+    def test_query_count_does_not_depend_on_number_of_subnets(self):
+        def make_subnet():
+            subnet = factory.make_Subnet(version=4)
+            factory.make_IPRange(subnet=subnet)
+            factory.make_StaticIPAddress(
+                alloc_type=IPADDRESS_TYPE.STICKY, subnet=subnet
+            )
+            factory.make_StaticRoute(source=subnet)
+
+        make_subnet()
+        count_one, _ = count_queries(stats.get_subnets_utilisation_stats)
+        for _ in range(3):
+            make_subnet()
+        count_many, result = count_queries(
+            stats.get_subnets_utilisation_stats
+        )
+        self.assertEqual(4, len(result))
+        self.assertEqual(count_one, count_many)
+
 
 class TestStatsService(MAASTestCase):
     """Tests for `ImportStatsService`."""
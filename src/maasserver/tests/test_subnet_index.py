@@ -0,0 +1,260 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.subnet_index`."""
+
+__all__ = []
+
+from unittest.mock import call, MagicMock
+
+from netaddr import IPAddress
+from twisted.internet.defer import Deferred, fail, maybeDeferred
+
+from maasserver import subnet_index as subnet_index_module
+from maasserver.models import Subnet
+from maasserver.subnet_index import SubnetIndex, SubnetIndexService
+from maasserver.testing.factory import factory
+from maasserver.testing.testcase import MAASServerTestCase
+from maastesting.djangotestcase import count_queries
+from maastesting.matchers import (
+    DocTestMatches,
+    MockCalledOnceWith,
+    MockCallsMatch,
+    MockNotCalled,
+)
+from maastesting.testcase import MAASTestCase
+from maastesting.twisted import TwistedLoggerFixture
+
+
+class TestSubnetIndex(MAASServerTestCase):
+    def make_index(self):
+        index = SubnetIndex()
+        self.assertTrue(index.rebuild())
+        return index
+
+    def test_falls_back_to_database_until_built(self):
+        subnet = factory.make_Subnet(cidr="10.0.0.0/24")
+        index = SubnetIndex()
+        self.assertTrue(index.stale)
+        self.assertEqual(subnet, index.get_best_subnet_for_ip("10.0.0.1"))
+        self.assertEqual((0, 1), (index.hits, index.misses))
+
+    def test_finds_same_subnets_as_database(self):
+        factory.make_Subnet(cidr="10.0.0.0/8")
+        factory.make_Subnet(cidr="10.1.0.0/16")
+        factory.make_Subnet(cidr="10.1.1.0/24")
+        factory.make_Subnet(cidr="10.2.2.2/32")
+        factory.make_Subnet(
+            cidr="10.3.0.0/16", vlan=factory.make_VLAN(dhcp_on=True)
+        )
+        factory.make_Subnet(
+            cidr="10.3.3.0/24", vlan=factory.make_VLAN(dhcp_on=False)
+        )
+        factory.make_Subnet(cidr="2001::/16")
+        factory.make_Subnet(cidr="2001:db8:1:2::/64")
+        index = self.make_index()
+        for ip in [
+            "10.1.1.1",
+            "10.1.2.1",
+            "10.2.2.2",
+            "10.3.3.3",
+            "10.200.0.1",
+            "192.168.0.1",
+            "::ffff:10.1.1.1",
+            "2001:db8:1:2::1",
+            "2001:db8:1:3::1",
+            "fd00::1",
+        ]:
+            self.assertEqual(
+                Subnet.objects.get_best_subnet_for_ip(ip),
+                index.get_best_subnet_for_ip(ip),
+                ip,
+            )
+
+    def test_lookups_do_not_query_the_database(self):
+        factory.make_Subnet(cidr="10.0.0.0/24")
+        index = self.make_index()
+        count, _ = count_queries(
+            lambda: index.get_best_subnet_for_ip("10.0.0.1").vlan.dhcp_on
+        )
+        self.assertEqual(0, count)
+        self.assertEqual((1, 0), (index.hits, index.misses))
+
+    def test_returns_copies_of_subnets(self):
+        subnet = factory.make_Subnet(cidr="10.0.0.0/24")
+        index = self.make_index()
+        found = index.get_best_subnet_for_ip("10.0.0.1")
+        found.name = factory.make_name("subnet")
+        found.vlan.name = factory.make_name("vlan")
+        found = index.get_best_subnet_for_ip("10.0.0.1")
+        self.assertEqual(subnet.name, found.name)
+        self.assertEqual(subnet.vlan.name, found.vlan.name)
+
+    def test_returns_dynamic_ranges(self):
+        subnet = factory.make_ipv4_Subnet_with_IPRanges()
+        ip = factory.pick_ip_in_IPRange(subnet.get_dynamic_ranges()[0])
+        ranges = subnet.get_dynamic_ranges()
+        expected = subnet, [iprange.netaddr_iprange for iprange in ranges]
+        index = SubnetIndex()
+        self.assertEqual(
+            expected, index.get_best_subnet_and_dynamic_ranges_for_ip(ip)
+        )
+        index.rebuild()
+        self.assertEqual(
+            expected, index.get_best_subnet_and_dynamic_ranges_for_ip(ip)
+        )
+
+    def test_returns_no_subnet_or_dynamic_ranges(self):
+        index = self.make_index()
+        self.assertEqual(
+            (None, []),
+            index.get_best_subnet_and_dynamic_ranges_for_ip(
+                factory.make_ipv4_address()
+            ),
+        )
+
+    def test_invalidate_makes_index_stale(self):
+        subnet = factory.make_Subnet(cidr="10.0.0.0/24")
+        index = self.make_index()
+        index.invalidate()
+        self.assertTrue(index.stale)
+        self.assertEqual(subnet, index.get_best_subnet_for_ip("10.0.0.1"))
+        self.assertEqual(1, index.misses)
+
+    def test_rebuild_is_discarded_if_invalidated_meanwhile(self):
+        index = SubnetIndex()
+        load = subnet_index_module._SubnetTable.load
+
+        def load_and_invalidate():
+            index.invalidate()
+            return load()
+
+        self.patch(
+            subnet_index_module._SubnetTable, "load", load_and_invalidate
+        )
+        self.assertFalse(index.rebuild())
+        self.assertTrue(index.stale)
+
+    def test_counts_lookups(self):
+        update = self.patch(subnet_index_module.PROMETHEUS_METRICS, "update")
+        index = SubnetIndex()
+        index.get_best_subnet_for_ip(IPAddress("10.0.0.1"))
+        index.rebuild()
+        index.get_best_subnet_for_ip(IPAddress("10.0.0.1"))
+        self.assertThat(
+            update,
+            MockCallsMatch(
+                call(
+                    "maas_subnet_index_lookups",
+                    "inc",
+                    labels={"result": "miss"},
+                ),
+                call(
+                    "maas_subnet_index_lookups",
+                    "inc",
+                    labels={"result": "hit"},
+                ),
+            ),
+        )
+
+
+class TestSubnetIndexService(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.deferToDatabase = self.patch(
+            subnet_index_module, "deferToDatabase"
+        )
+        self.deferToDatabase.side_effect = maybeDeferred
+
+    def make_service(self, connected=False):
+        listener = MagicMock()
+        listener.connected.return_value = connected
+        index = MagicMock()
+        service = SubnetIndexService(listener, index)
+        return service, listener, index
+
+    def test_registers_with_listener(self):
+        service, listener, _ = self.make_service()
+        service.startService()
+        self.assertThat(
+            listener.register,
+            MockCallsMatch(
+                *(
+                    call(channel, service.markForRebuild)
+                    for channel in ["subnet", "vlan", "iprange"]
+                )
+            ),
+        )
+        self.assertThat(
+            listener.events.connected.registerHandler,
+            MockCalledOnceWith(service.markForRebuild),
+        )
+        self.assertThat(
+            listener.events.disconnected.registerHandler,
+            MockCalledOnceWith(service.invalidate),
+        )
+
+    def test_builds_index_when_started_if_listener_is_connected(self):
+        service, _, index = self.make_service(connected=True)
+        service.startService()
+        self.assertThat(index.rebuild, MockCalledOnceWith())
+
+    def test_waits_for_listener_to_connect(self):
+        service, _, index = self.make_service()
+        service.startService()
+        self.assertThat(index.rebuild, MockNotCalled())
+
+    def test_unregisters_and_invalidates_when_stopped(self):
+        service, listener, index = self.make_service()
+        service.startService()
+        service.stopService()
+        self.assertThat(
+            listener.unregister,
+            MockCallsMatch(
+                *(
+                    call(channel, service.markForRebuild)
+                    for channel in ["subnet", "vlan", "iprange"]
+                )
+            ),
+        )
+        self.assertThat(index.invalidate, MockCalledOnceWith())
+
+    def test_invalidates_and_rebuilds_on_change(self):
+        service, _, index = self.make_service()
+        service.startService()
+        service.markForRebuild("update", "1")
+        self.assertThat(index.invalidate, MockCalledOnceWith())
+        self.assertThat(index.rebuild, MockCalledOnceWith())
+        self.assertIsNone(service.rebuilding)
+
+    def test_coalesces_changes_during_rebuild(self):
+        service, _, index = self.make_service()
+        service.startService()
+        rebuilt = Deferred()
+        self.deferToDatabase.side_effect = [rebuilt, None]
+        for _ in range(3):
+            service.markForRebuild("update", "1")
+        self.assertEqual(1, self.deferToDatabase.call_count)
+        rebuilt.callback(True)
+        self.assertEqual(2, self.deferToDatabase.call_count)
+        self.assertEqual(3, index.invalidate.call_count)
+
+    def test_invalidates_when_listener_disconnects(self):
+        service, _, index = self.make_service()
+        service.startService()
+        service.invalidate(None)
+        self.assertThat(index.invalidate, MockCalledOnceWith())
+
+    def test_logs_failure_to_rebuild(self):
+        service, _, index = self.make_service()
+        service.startService()
+        self.deferToDatabase.side_effect = lambda func: fail(
+            factory.make_exception()
+        )
+        with TwistedLoggerFixture() as logger:
+            service.markForRebuild("update", "1")
+        self.assertThat(
+            logger.output,
+            DocTestMatches("Failed to build the subnet index.\n..."),
+        )
+        self.assertIsNone(service.rebuilding)
@@ -167,10 +167,10 @@ def find_rack_controller(request):
     rack controller for that subnet.
     """
     # Circular imports.
-    from maasserver.models.subnet import Subnet
+    from maasserver.subnet_index import subnet_index
 
     ip_address = get_remote_ip(request)
-    subnet = Subnet.objects.get_best_subnet_for_ip(ip_address)
+    subnet = subnet_index.get_best_subnet_for_ip(ip_address)
     if subnet is None:
         return None
     if subnet.vlan.dhcp_on is False:
@@ -0,0 +1,162 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Index of free IP address ranges, for allocating addresses."""
+
+__all__ = ["FreeIPRanges"]
+
+from bisect import bisect_right, insort
+import heapq
+
+
+class FreeIPRanges:
+    """The ranges of free IP addresses in a subnet, as integers.
+
+    Ranges are kept as a sorted list of their first addresses, a dict of
+    their last addresses, and a heap ordered by their size. Finding the
+    range containing an address, or the smallest range, takes O(log n);
+    removing or adding addresses also moves the tail of the sorted list.
+
+    Unlike `MAASIPSet` no object is created for each address, so this can
+    be built cheaply for subnets with tens of thousands of addresses in use.
+    """
+
+    def __init__(self, allowed, used=()):
+        """Index the addresses in `allowed` that are not in `used`.
+
+        :param allowed: An iterable of ``(first, last)`` tuples of the
+            ranges of addresses that may be free, inclusive.
+        :param used: An iterable of ``(first, last)`` tuples of the ranges
+            of addresses in use, inclusive. They may overlap.
+        """
+        self._starts = []
+        self._ends = {}
+        used = sorted(used)
+        index = 0
+        for first, last in _merge(allowed):
+            # Skip the used ranges that end before this allowed range.
+            while index < len(used) and used[index][1] < first:
+                index += 1
+            start = first
+            scan = index
+            while scan < len(used) and used[scan][0] <= last:
+                used_first, used_last = used[scan]
+                if used_first > start:
+                    self._append(start, used_first - 1)
+                start = max(start, used_last + 1)
+                scan += 1
+            if start <= last:
+                self._append(start, last)
+        self._reheap()
+
+    def _reheap(self):
+        self._by_size = [
+            (last - first + 1, first) for first, last in self._ends.items()
+        ]
+        heapq.heapify(self._by_size)
+
+    def _append(self, first, last):
+        self._starts.append(first)
+        self._ends[first] = last
+
+    def _insert(self, first, last):
+        insort(self._starts, first)
+        self._ends[first] = last
+        if len(self._by_size) > 2 * len(self._starts) + 64:
+            # Drop the entries for ranges that no longer exist.
+            self._reheap()
+        else:
+            heapq.heappush(self._by_size, (last - first + 1, first))
+
+    def _delete(self, index):
+        # Entries in the heap are discarded lazily, by `smallest`.
+        del self._ends[self._starts.pop(index)]
+
+    def _find(self, value):
+        """Return the index of the last range starting at or before `value`.
+
+        Returns -1 if there is none.
+        """
+        return bisect_right(self._starts, value) - 1
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        for first in self._starts:
+            yield first, self._ends[first]
+
+    def __contains__(self, value):
+        index = self._find(value)
+        return index >= 0 and value <= self._ends[self._starts[index]]
+
+    def remove(self, first, last=None):
+        """Mark the addresses from `first` to `last` as in use.
+
+        :return: A list of ``(first, last)`` tuples of the ranges that were
+            free until now; adding them back undoes this.
+        """
+        if last is None:
+            last = first
+        index = max(self._find(first), 0)
+        removed = []
+        while index < len(self._starts) and self._starts[index] <= last:
+            start = self._starts[index]
+            end = self._ends[start]
+            if end < first:
+                index += 1
+                continue
+            self._delete(index)
+            removed.append((max(start, first), min(end, last)))
+            if start < first:
+                self._insert(start, first - 1)
+                index += 1
+            if end > last:
+                self._insert(last + 1, end)
+                break
+        return removed
+
+    def add(self, first, last=None):
+        """Mark the addresses from `first` to `last` as free.
+
+        The range is merged with any free ranges it overlaps or adjoins.
+        """
+        if last is None:
+            last = first
+        index = self._find(first)
+        if index >= 0 and self._ends[self._starts[index]] >= first - 1:
+            first = self._starts[index]
+            last = max(last, self._ends[first])
+            self._delete(index)
+        else:
+            index += 1
+        while index < len(self._starts) and self._starts[index] <= last + 1:
+            last = max(last, self._ends[self._starts[index]])
+            self._delete(index)
+        self._insert(first, last)
+
+    def smallest(self):
+        """Return the smallest free range, as a ``(first, last)`` tuple.
+
+        Ties go to the range with the lowest addresses. Returns `None` if no
+        addresses are free.
+        """
+        heap = self._by_size
+        while heap:
+            size, first = heap[0]
+            if self._ends.get(first) == first + size - 1:
+                return first, first + size - 1
+            heapq.heappop(heap)
+        return None
+
+
+def _merge(ranges):
+    """Sort `ranges` and merge those that overlap or adjoin."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1][1] = last
+        else:
+            merged.append([first, last])
+    return merged
@@ -0,0 +1,108 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.utils.freeranges`."""
+
+__all__ = []
+
+import random
+
+from maasserver.utils.freeranges import FreeIPRanges
+from maastesting.testcase import MAASTestCase
+
+
+class TestFreeIPRanges(MAASTestCase):
+    def assertFree(self, expected, free_ranges):
+        self.assertEqual(expected, list(free_ranges))
+        self.assertEqual(len(expected), len(free_ranges))
+
+    def test_leaves_out_used_addresses(self):
+        free_ranges = FreeIPRanges([(1, 100)], [(10, 19), (15, 29), (50, 50)])
+        self.assertFree([(1, 9), (30, 49), (51, 100)], free_ranges)
+
+    def test_merges_allowed_ranges(self):
+        free_ranges = FreeIPRanges([(20, 29), (1, 10), (11, 15), (5, 8)])
+        self.assertFree([(1, 15), (20, 29)], free_ranges)
+
+    def test_ignores_used_addresses_outside_allowed_ranges(self):
+        free_ranges = FreeIPRanges([(10, 19), (30, 39)], [(1, 12), (25, 31)])
+        self.assertFree([(13, 19), (32, 39)], free_ranges)
+
+    def test_contains(self):
+        free_ranges = FreeIPRanges([(1, 10)], [(5, 5)])
+        self.assertEqual(
+            [1, 2, 3, 4, 6, 7, 8, 9, 10],
+            [value for value in range(12) if value in free_ranges],
+        )
+
+    def test_remove_splits_ranges(self):
+        free_ranges = FreeIPRanges([(1, 100)])
+        self.assertEqual([(10, 19)], free_ranges.remove(10, 19))
+        self.assertEqual([(50, 50)], free_ranges.remove(50))
+        self.assertFree([(1, 9), (20, 49), (51, 100)], free_ranges)
+
+    def test_remove_returns_only_addresses_that_were_free(self):
+        free_ranges = FreeIPRanges([(1, 100)], [(20, 29), (40, 49)])
+        self.assertEqual(
+            [(15, 19), (30, 39), (50, 55)], free_ranges.remove(15, 55)
+        )
+        self.assertEqual([], free_ranges.remove(20))
+        self.assertFree([(1, 14), (56, 100)], free_ranges)
+
+    def test_add_merges_adjoining_ranges(self):
+        free_ranges = FreeIPRanges([(1, 100)], [(10, 19), (30, 39)])
+        free_ranges.add(10, 19)
+        self.assertFree([(1, 29), (40, 100)], free_ranges)
+        free_ranges.add(5, 45)
+        self.assertFree([(1, 100)], free_ranges)
+        free_ranges.add(102)
+        self.assertFree([(1, 100), (102, 102)], free_ranges)
+
+    def test_add_undoes_remove(self):
+        free_ranges = FreeIPRanges([(1, 100)], [(20, 29), (40, 49)])
+        before = list(free_ranges)
+        for first, last in free_ranges.remove(10, 60):
+            free_ranges.add(first, last)
+        self.assertFree(before, free_ranges)
+
+    def test_smallest_returns_smallest_then_lowest_range(self):
+        free_ranges = FreeIPRanges([(1, 100)], [(4, 4), (7, 7), (90, 97)])
+        self.assertEqual((5, 6), free_ranges.smallest())
+        free_ranges.remove(5)
+        self.assertEqual((6, 6), free_ranges.smallest())
+        free_ranges.remove(6)
+        self.assertEqual((1, 3), free_ranges.smallest())
+        free_ranges.add(4, 7)
+        self.assertEqual((98, 100), free_ranges.smallest())
+
+    def test_smallest_returns_none_when_nothing_is_free(self):
+        free_ranges = FreeIPRanges([(1, 10)], [(1, 10)])
+        self.assertIsNone(free_ranges.smallest())
+        self.assertFree([], free_ranges)
+
+    def test_matches_set_of_addresses(self):
+        free_ranges = FreeIPRanges([(0, 199)])
+        free = set(range(200))
+        for _ in range(500):
+            first = random.randint(0, 199)
+            last = min(first + random.randint(0, 9), 199)
+            if random.choice([True, False]):
+                free_ranges.remove(first, last)
+                free.difference_update(range(first, last + 1))
+            else:
+                free_ranges.add(first, last)
+                free.update(range(first, last + 1))
+            self.assertEqual(
+                free,
+                {
+                    value
+                    for first, last in free_ranges
+                    for value in range(first, last + 1)
+                },
+            )
+            smallest = free_ranges.smallest()
+            if smallest is not None:
+                self.assertEqual(
+                    min(free_ranges, key=lambda r: (r[1] - r[0], r[0])),
+                    smallest,
+                )
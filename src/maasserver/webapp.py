@@ -29,6 +29,7 @@ from maasserver.utils.views import WebApplicationHandler
 from maasserver.websockets.protocol import WebSocketFactory
 from maasserver.websockets.websockets import (
     lookupProtocolForFactory,
+    PerMessageDeflateFactory,
     WebSocketsResource,
 )
 from metadataserver.api_twisted import StatusHandlerResource
@@ -41,6 +42,11 @@ from provisioningserver.utils.twisted import (
 
 log = LegacyLogger()
 
+# Settings for the permessage-deflate compression of websocket messages.
+# Messages smaller than the minimum size are not worth compressing.
+WEBSOCKET_COMPRESSION_LEVEL = 6
+WEBSOCKET_COMPRESSION_MIN_SIZE = 1024
+
 
 class CleanPathRequest(Request, object):
     """A request that supports '/+' in the path.
@@ -229,7 +235,14 @@ class WebApplicationService(StreamServerEndpointService):
         maas = Resource()
         maas.putChild(b"metadata", metadata)
         maas.putChild(
-            b"ws", WebSocketsResource(lookupProtocolForFactory(self.websocket))
+            b"ws",
+            WebSocketsResource(
+                lookupProtocolForFactory(self.websocket),
+                deflateFactory=PerMessageDeflateFactory(
+                    level=WEBSOCKET_COMPRESSION_LEVEL,
+                    minSize=WEBSOCKET_COMPRESSION_MIN_SIZE,
+                ),
+            ),
         )
 
         # /MAAS/r/{path} and /MAAS/l/{path} are all resolved by the new MAAS UI
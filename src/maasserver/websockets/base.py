@@ -8,14 +8,19 @@ __all__ = [
     "HandlerPKError",
     "HandlerValidationError",
     "Handler",
+    "NotifyDehydrationCache",
 ]
 
-from functools import wraps
+from functools import partial, wraps
+from hashlib import blake2b
+import json
 from operator import attrgetter
+import threading
+from time import time
 
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
-from django.db.models import Model
+from django.db.models import Model, prefetch_related_objects
 from django.utils.encoding import is_protected_type
 
 from maasserver import concurrency
@@ -26,7 +31,11 @@ from maasserver.utils.forms import get_QueryDict
 from maasserver.utils.orm import transactional
 from maasserver.utils.threads import deferToDatabase
 from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
-from provisioningserver.utils.twisted import asynchronous, IAsynchronous
+from provisioningserver.utils.twisted import (
+    asynchronous,
+    callOut,
+    IAsynchronous,
+)
 
 DATETIME_FORMAT = "%a, %d %b. %Y %H:%M:%S"
 
@@ -39,6 +48,48 @@ def dehydrate_datetime(datetime):
         return datetime.strftime(DATETIME_FORMAT)
 
 
+def fingerprint_dehydrated(data):
+    """Return a compact fingerprint of the dehydrated `data`.
+
+    The fingerprint maps each key of `data` to a short digest of its value,
+    which is enough to tell which keys changed between two versions.
+    """
+    return {
+        key: blake2b(
+            json.dumps(value, sort_keys=True, default=str).encode("utf-8"),
+            digest_size=8,
+        ).digest()
+        for key, value in data.items()
+    }
+
+
+def make_dehydrated_patch(previous, current, data):
+    """Return the JSON-patch operations turning `previous` into `data`.
+
+    :param previous: Fingerprint of the data previously sent to the client.
+    :param current: Fingerprint of `data`.
+    :param data: The dehydrated data to send.
+    :return: A list of RFC 6902 operations on the top-level keys, or `None`
+        when most of the keys changed and a full update is cheaper.
+    """
+    patch = []
+    for key, digest in current.items():
+        if key not in previous:
+            patch.append({"op": "add", "path": "/%s" % key, "value": data[key]})
+        elif previous[key] != digest:
+            patch.append(
+                {"op": "replace", "path": "/%s" % key, "value": data[key]}
+            )
+    patch.extend(
+        {"op": "remove", "path": "/%s" % key}
+        for key in previous
+        if key not in current
+    )
+    if len(patch) * 2 > len(current):
+        return None
+    return patch
+
+
 class HandlerError(Exception):
     """Generic exception a handler can raise."""
 
@@ -66,6 +117,95 @@ class HandlerPermissionError(HandlerError):
         super().__init__("Permission denied")
 
 
+class NotifyDehydrationCache:
+    """Objects shared between the clients receiving the same notification.
+
+    A notification is fanned out to every connected client. Clients of the
+    same user share the loaded object, and clients whose handlers return the
+    same `Handler.get_notify_share_key` share the dehydrated data, so each of
+    them is only computed once per notification.
+
+    Loaded objects are only shared within a single database thread, as they
+    are keyed by user and all the clients of a user are processed together.
+    Dehydrated data is plain JSON-able data and is safe to share between the
+    threads processing different users.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _get_entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _NotifyCacheEntry()
+                return entry, False
+            else:
+                return entry, True
+
+    def _get_or_compute(self, key, compute):
+        entry, hit = self._get_entry(key)
+        with entry.lock:
+            if not entry.computed:
+                try:
+                    entry.value = compute()
+                except Exception as error:
+                    entry.error = error
+                entry.computed = True
+        if entry.error is not None:
+            raise entry.error
+        return entry.value, hit
+
+    def get_object(self, handler, channel, action, pk):
+        """Return the object for `pk`, as loaded by `handler.listen`."""
+        key = (
+            "object",
+            handler._meta.handler_name,
+            channel,
+            action,
+            pk,
+            handler.user.id,
+        )
+        obj, _ = self._get_or_compute(
+            key, partial(handler.listen, channel, action, pk)
+        )
+        return obj
+
+    def get_dehydrated(self, handler, pk, obj, for_list):
+        """Return the dehydrated data for `obj`, as seen from `handler`."""
+        handler_name = handler._meta.handler_name
+        key = (
+            "data",
+            handler_name,
+            pk,
+            for_list,
+            handler.get_notify_share_key(obj),
+        )
+        data, hit = self._get_or_compute(
+            key, partial(handler.full_dehydrate, obj, for_list=for_list)
+        )
+        PROMETHEUS_METRICS.update(
+            "maas_websocket_notify_dehydrate_cache",
+            "inc",
+            labels={
+                "handler": handler_name,
+                "result": "hit" if hit else "miss",
+            },
+        )
+        return data
+
+
+class _NotifyCacheEntry:
+    """A value computed once, shared through `NotifyDehydrationCache`."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.computed = False
+        self.value = None
+        self.error = None
+
+
 class HandlerOptions:
     """Configuraton class for `Handler`.
 
@@ -97,6 +237,8 @@ class HandlerOptions:
     form_requires_request = True
     listen_channels = []
     batch_key = "id"
+    list_field_prefetch = None
+    priority = False
     create_permission = None
     view_permission = None
     edit_permission = None
@@ -172,6 +314,14 @@ class Handler(metaclass=HandlerMetaclass):
         # correct notifications based on what items the client has.
         if "loaded_pks" not in self.cache:
             self.cache["loaded_pks"] = set()
+        # Fingerprints of the data last sent in a notification for each pk,
+        # keyed by pk. Only used when the client accepts patches, see
+        # `on_listen_for_active_pk`.
+        if "sent_fingerprints" not in self.cache:
+            self.cache["sent_fingerprints"] = {}
+        # Set by the protocol when processing a notification, so the loaded
+        # and dehydrated object is shared with the other clients.
+        self.notify_cache = None
 
     def full_dehydrate(self, obj, for_list=False):
         """Convert the given object into a dictionary.
@@ -197,20 +347,7 @@ class Handler(metaclass=HandlerMetaclass):
             if exclude_fields is not None and field_name in exclude_fields:
                 continue
 
-            # Get the value from the field and set it in data. The value
-            # will pass through the dehydrate method if present.
-            field_obj = getattr(obj, field_name)
-            dehydrate_method = getattr(self, "dehydrate_%s" % field_name, None)
-            if dehydrate_method is not None:
-                data[field_name] = dehydrate_method(field_obj)
-            else:
-                value = field.value_from_object(obj)
-                if is_protected_type(value) or isinstance(value, dict):
-                    data[field_name] = value
-                elif isinstance(field, ArrayField):
-                    data[field_name] = field.to_python(value)
-                else:
-                    data[field_name] = field.value_to_string(obj)
+            data[field_name] = self._dehydrate_field(obj, field)
 
         # Add permissions that can be performed on this object.
         data = self._add_permissions(obj, data)
@@ -218,6 +355,98 @@ class Handler(metaclass=HandlerMetaclass):
         # Return the data after the final dehydrate.
         return self.dehydrate(obj, data, for_list=for_list)
 
+    def _dehydrate_field(self, obj, field):
+        """Return the value of the model `field` of `obj` for the client.
+
+        The value will pass through the dehydrate method if present.
+        """
+        field_name = str(field.name)
+        field_obj = getattr(obj, field_name)
+        dehydrate_method = getattr(self, "dehydrate_%s" % field_name, None)
+        if dehydrate_method is not None:
+            return dehydrate_method(field_obj)
+        value = field.value_from_object(obj)
+        if is_protected_type(value) or isinstance(value, dict):
+            return value
+        elif isinstance(field, ArrayField):
+            return field.to_python(value)
+        else:
+            return field.value_to_string(obj)
+
+    def _get_model_fields(self):
+        """Return the model fields of `object_class` by name."""
+        return {
+            str(field.name): field
+            for field in self._meta.object_class._meta.fields
+        }
+
+    def validate_selected_fields(self, fields):
+        """Check that all the `fields` selected by the client are known.
+
+        A field is known when the handler has a ``list_field_<name>`` method
+        computing it, or when it's a model field allowed in the list.
+        """
+        model_fields = self._get_model_fields()
+        allowed_fields = self._meta.list_fields
+        exclude_fields = self._meta.list_exclude
+        unknown = []
+        for name in fields:
+            if hasattr(self, "list_field_%s" % name):
+                continue
+            if (
+                name not in model_fields
+                or (allowed_fields is not None and name not in allowed_fields)
+                or (exclude_fields is not None and name in exclude_fields)
+            ):
+                unknown.append(name)
+        if unknown:
+            raise HandlerValidationError(
+                {"fields": ["Unknown fields: %s." % ", ".join(unknown)]}
+            )
+
+    def prefetch_selected_fields(self, objs, fields):
+        """Prefetch the relations needed to dehydrate `fields` for `objs`.
+
+        The relations needed by each field are taken from
+        `Meta.list_field_prefetch`. Model foreign keys are prefetched by
+        default.
+        """
+        field_prefetch = self._meta.list_field_prefetch or {}
+        model_fields = self._get_model_fields()
+        lookups = []
+        for name in fields:
+            if name in field_prefetch:
+                field_lookups = field_prefetch[name]
+            elif name in model_fields and model_fields[name].many_to_one:
+                field_lookups = [name]
+            else:
+                field_lookups = []
+            for lookup in field_lookups:
+                if lookup not in lookups:
+                    lookups.append(lookup)
+        if lookups:
+            prefetch_related_objects(objs, *lookups)
+
+    def dehydrate_selected_fields(self, obj, fields):
+        """Convert `obj` into a dictionary holding only `fields`.
+
+        Unlike `full_dehydrate`, only the work needed for the selected fields
+        is done. The primary key is always included.
+        """
+        model_fields = self._get_model_fields()
+        data = {self._meta.pk: getattr(obj, self._meta.pk)}
+        for name in fields:
+            list_field_method = getattr(self, "list_field_%s" % name, None)
+            if list_field_method is not None:
+                data[name] = list_field_method(obj)
+            else:
+                data[name] = self._dehydrate_field(obj, model_fields[name])
+        return data
+
+    def list_field_permissions(self, obj):
+        """Return the permissions the user has on `obj`."""
+        return self._add_permissions(obj, {}).get("permissions", [])
+
     def dehydrate(self, obj, data, for_list=False):
         """Add any extra info to the `data` before finalizing the final object.
 
@@ -350,7 +579,9 @@ class Handler(metaclass=HandlerMetaclass):
         """
         return get_QueryDict(params)
 
-    def _get_call_latency_metrics_label(self, method_name, params):
+    def _get_call_latency_metrics_label(
+        self, method_name, params, queued=None
+    ):
         call_name = "{handler_name}.{method_name}".format(
             handler_name=self._meta.handler_name, method_name=method_name
         )
@@ -361,12 +592,21 @@ class Handler(metaclass=HandlerMetaclass):
         get_labels=_get_call_latency_metrics_label,
     )
     @asynchronous
-    def execute(self, method_name, params):
+    def execute(self, method_name, params, queued=None):
         """Execute the given method on the handler.
 
         Checks to make sure the method is valid and allowed perform executing
         the method.
+
+        :param queued: The time the call was queued, defaults to now. The time
+            waited before the method is run is recorded.
         """
+        if queued is None:
+            queued = time()
+        if self._meta.priority:
+            run = concurrency.webapp.runWithPriority
+        else:
+            run = concurrency.webapp.run
         if method_name in self._meta.allowed_methods:
             try:
                 method = getattr(self, method_name)
@@ -381,10 +621,13 @@ class Handler(metaclass=HandlerMetaclass):
                     rbac.clear()
 
                     # Reload the user from the database.
-                    d = concurrency.webapp.run(
+                    d = run(
                         deferToDatabase,
                         transactional(self.user.refresh_from_db),
                     )
+                    d.addCallback(
+                        callOut, self._record_queue_wait, method_name, queued
+                    )
                     d.addCallback(lambda _: method(params))
                     return d
                 else:
@@ -395,6 +638,7 @@ class Handler(metaclass=HandlerMetaclass):
                         # Clear RBAC and reload the user to ensure that
                         # its up to date. `rbac.clear` must be done inside
                         # the thread because it uses thread locals internally.
+                        self._record_queue_wait(method_name, queued)
                         rbac.clear()
                         self.user.refresh_from_db()
 
@@ -412,12 +656,19 @@ class Handler(metaclass=HandlerMetaclass):
 
                     # This is going to block and hold a database connection so
                     # we limit its concurrency.
-                    return concurrency.webapp.run(
-                        deferToDatabase, prep_user_execute, params
-                    )
+                    return run(deferToDatabase, prep_user_execute, params)
         else:
             raise HandlerNoSuchMethodError(method_name)
 
+    def _record_queue_wait(self, method_name, queued):
+        """Record the time the call waited before running."""
+        PROMETHEUS_METRICS.update(
+            "maas_websocket_call_queue_wait",
+            "observe",
+            value=time() - queued,
+            labels=self._get_call_latency_metrics_label(method_name, []),
+        )
+
     def _call_method_track_queries(self, method_name, method, params):
         """Call the specified method tracking query-related metrics."""
         latencies = []
@@ -442,10 +693,26 @@ class Handler(metaclass=HandlerMetaclass):
 
         return result
 
-    def _cache_pks(self, objs):
-        """Cache all loaded object pks."""
+    def _cache_pks(self, objs, fields=None):
+        """Cache all loaded object pks.
+
+        `fields` are the fields selected by the client when only those are
+        listed. Overrides caching more than the pks can skip what those
+        fields don't need.
+        """
         getpk = attrgetter(self._meta.pk)
-        self.cache["loaded_pks"].update(getpk(obj) for obj in objs)
+        pks = {getpk(obj) for obj in objs}
+        self.cache["loaded_pks"].update(pks)
+        self._forget_sent_fingerprints(pks)
+
+    def _forget_sent_fingerprints(self, pks):
+        """Forget the data sent for `pks`, as the client got it afresh.
+
+        The next update for those objects is sent in full.
+        """
+        sent_fingerprints = self.cache["sent_fingerprints"]
+        for pk in pks:
+            sent_fingerprints.pop(pk, None)
 
     def list(self, params):
         """List objects.
@@ -455,8 +722,16 @@ class Handler(metaclass=HandlerMetaclass):
             also understands this distinction.
         :param offset: Offset into the queryset to return.
         :param limit: Maximum number of objects to return.
+        :param fields: Optional list of the fields to return for each object.
+            Only the data needed for those fields is loaded, page by page,
+            instead of everything the list view may need.
         """
-        queryset = self.get_queryset(for_list=True)
+        fields = params.get("fields")
+        if fields is None:
+            queryset = self.get_queryset(for_list=True)
+        else:
+            self.validate_selected_fields(fields)
+            queryset = self.get_selected_fields_queryset(fields)
         queryset = queryset.order_by(self._meta.batch_key)
         if "start" in params:
             queryset = queryset.filter(
@@ -465,8 +740,24 @@ class Handler(metaclass=HandlerMetaclass):
         if "limit" in params:
             queryset = queryset[: params["limit"]]
         objs = list(queryset)
-        self._cache_pks(objs)
-        return [self.full_dehydrate(obj, for_list=True) for obj in objs]
+        self._cache_pks(objs, fields=fields)
+        if fields is None:
+            return [self.full_dehydrate(obj, for_list=True) for obj in objs]
+        self.prefetch_selected_fields(objs, fields)
+        return [self.dehydrate_selected_fields(obj, fields) for obj in objs]
+
+    def get_selected_fields_queryset(self, fields):
+        """Return the `QuerySet` used to list objects with selected `fields`.
+
+        The relations needed by the fields are prefetched once the page has
+        been loaded, so this is the list queryset without its own
+        prefetching. Override if the list queryset does other expensive work.
+        """
+        return (
+            self.get_queryset(for_list=True)
+            .select_related(None)
+            .prefetch_related(None)
+        )
 
     def get(self, params):
         """Get object.
@@ -590,6 +881,7 @@ class Handler(metaclass=HandlerMetaclass):
         """
         pk = self._meta.pk_type(pk)
         if action == "delete":
+            self.cache["sent_fingerprints"].pop(pk, None)
             if pk in self.cache["loaded_pks"]:
                 self.cache["loaded_pks"].remove(pk)
                 return (self._meta.handler_name, action, pk)
@@ -598,7 +890,10 @@ class Handler(metaclass=HandlerMetaclass):
 
         self.user.refresh_from_db()
         try:
-            obj = self.listen(channel, action, pk)
+            if self.notify_cache is None:
+                obj = self.listen(channel, action, pk)
+            else:
+                obj = self.notify_cache.get_object(self, channel, action, pk)
         except HandlerDoesNotExistError:
             obj = None
         if action == "create" and obj is not None:
@@ -615,6 +910,7 @@ class Handler(metaclass=HandlerMetaclass):
                     # The user no longer has access to this object. To the
                     # client this is a delete action.
                     self.cache["loaded_pks"].remove(pk)
+                    self.cache["sent_fingerprints"].pop(pk, None)
                     return (self._meta.handler_name, "delete", pk)
                 else:
                     # Just a normal update to the client.
@@ -635,22 +931,66 @@ class Handler(metaclass=HandlerMetaclass):
 
     def on_listen_for_active_pk(self, action, pk, obj):
         """Return the correct data for `obj` depending on if its the
-        active primary key."""
+        active primary key.
+
+        When the client accepts patches, an update to an object the client
+        already got in a notification is sent as a "patch" action, with
+        only the keys that changed since then as RFC 6902 operations::
+
+            {"pk": pk, "patch": [{"op": "replace", "path": "/x", ...}]}
+
+        The update is sent in full the first time, when the active object
+        changes, or when most of the keys changed.
+        """
         if "active_pk" in self.cache and pk == self.cache["active_pk"]:
             # Active so send all the data for the object.
-            return (
-                self._meta.handler_name,
-                action,
-                self.full_dehydrate(obj, for_list=False),
-            )
+            for_list = False
         else:
             # Not active so only send the data like it was comming from
             # the list call.
-            return (
-                self._meta.handler_name,
-                action,
-                self.full_dehydrate(obj, for_list=True),
-            )
+            for_list = True
+        data = self._notify_dehydrate(pk, obj, for_list=for_list)
+        if not self.cache.get("notify_patches"):
+            return (self._meta.handler_name, action, data)
+
+        fingerprint = fingerprint_dehydrated(data)
+        sent_fingerprints = self.cache["sent_fingerprints"]
+        previous = sent_fingerprints.get(pk)
+        sent_fingerprints[pk] = (for_list, fingerprint)
+        if action == "update" and previous is not None:
+            previous_for_list, previous_fingerprint = previous
+            if previous_for_list == for_list:
+                patch = make_dehydrated_patch(
+                    previous_fingerprint, fingerprint, data
+                )
+                if patch is not None:
+                    if len(patch) == 0:
+                        # Nothing the client can see has changed.
+                        return None
+                    return (
+                        self._meta.handler_name,
+                        "patch",
+                        {"pk": pk, "patch": patch},
+                    )
+        return (self._meta.handler_name, action, data)
+
+    def _notify_dehydrate(self, pk, obj, for_list=False):
+        """Dehydrate `obj` for a notification, sharing it when possible."""
+        if self.notify_cache is None:
+            return self.full_dehydrate(obj, for_list=for_list)
+        else:
+            return self.notify_cache.get_dehydrated(self, pk, obj, for_list)
+
+    def get_notify_share_key(self, obj):
+        """Return the key identifying clients that see `obj` the same way.
+
+        Clients whose handlers return the same key receive the same
+        dehydrated data for `obj` when a notification is processed. The
+        default is the user, as dehydration can depend on who is asking.
+        Override if the dehydrated data only depends on something coarser,
+        such as the user's permissions.
+        """
+        return self.user.id
 
     def listen(self, channel, action, pk):
         """Called when the handler listens for events on channels with
@@ -16,7 +16,10 @@ from maasserver.models.event import Event
 from maasserver.models.node import Controller, RackController
 from maasserver.permissions import NodePermission
 from maasserver.websockets.base import HandlerError, HandlerPermissionError
-from maasserver.websockets.handlers.machine import MachineHandler
+from maasserver.websockets.handlers.machine import (
+    MachineHandler,
+    status_event_annotations,
+)
 from maasserver.websockets.handlers.node import node_prefetch
 from provisioningserver.utils.version import get_version_tuple
 
@@ -107,6 +110,11 @@ class ControllerHandler(MachineHandler):
             "cpu_count",
             "cpu_speed",
         ]
+        list_field_prefetch = {
+            **MachineHandler.Meta.list_field_prefetch,
+            "version": ["controllerinfo"],
+            "service_ids": ["service_set"],
+        }
         listen_channels = ["controller"]
 
     def get_form_class(self, action):
@@ -126,6 +134,25 @@ class ControllerHandler(MachineHandler):
             self.user, NodePermission.view, from_nodes=qs
         )
 
+    def get_selected_fields_queryset(self, fields):
+        """Return `QuerySet` for controllers viewable by `user` with `fields`.
+
+        The expensive annotations of the list queryset are only added when
+        the fields need them.
+        """
+        queryset = Controller.controllers.all()
+        if "status_message" in fields:
+            queryset = queryset.annotate(**status_event_annotations())
+        return Controller.controllers.get_nodes(
+            self.user, NodePermission.view, from_nodes=queryset
+        )
+
+    def list_field_version(self, obj):
+        return obj.as_self().version
+
+    def list_field_service_ids(self, obj):
+        return [service.id for service in obj.service_set.all()]
+
     def dehydrate(self, obj, data, for_list=False):
         obj = obj.as_self()
         data = super().dehydrate(obj, data, for_list=for_list)
@@ -134,16 +134,30 @@ class DeviceHandler(NodeHandler):
             "parent",
             "pxe_mac",
         ]
+        list_field_prefetch = {
+            **NodeHandler.Meta.list_field_prefetch,
+            "primary_mac": ["boot_interface", "interface_set"],
+            "ip_assignment": [
+                "boot_interface__ip_addresses__subnet",
+                "interface_set__ip_addresses__subnet",
+            ],
+            "ip_address": [
+                "boot_interface__ip_addresses",
+                "interface_set__ip_addresses",
+            ],
+        }
         listen_channels = ["device"]
         view_permission = NodePermission.view
         edit_permission = NodePermission.edit
         delete_permission = NodePermission.edit
 
-    def _cache_pks(self, objs):
+    def _cache_pks(self, objs, fields=None):
         """Cache all loaded object pks."""
         # Copy from base.py as devices don't have ScriptResults
         getpk = attrgetter(self._meta.pk)
-        self.cache["loaded_pks"].update(getpk(obj) for obj in objs)
+        pks = {getpk(obj) for obj in objs}
+        self.cache["loaded_pks"].update(pks)
+        self._forget_sent_fingerprints(pks)
 
     def get_queryset(self, for_list=False):
         """Return `QuerySet` for devices only viewable by `user`."""
@@ -190,6 +204,18 @@ class DeviceHandler(NodeHandler):
 
         return data
 
+    def list_field_primary_mac(self, obj):
+        boot_interface = obj.get_boot_interface()
+        if boot_interface is None:
+            return ""
+        return "%s" % boot_interface.mac_address
+
+    def list_field_ip_assignment(self, obj):
+        return self.dehydrate_ip_assignment(obj, obj.get_boot_interface())
+
+    def list_field_ip_address(self, obj):
+        return self.dehydrate_ip_address(obj, obj.get_boot_interface())
+
     def dehydrate_interface(self, interface, obj):
         """Add extra fields to interface data."""
         # NodeHandler.dehydrate_interface gives us subnet linkage, and such.
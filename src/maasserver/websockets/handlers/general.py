@@ -38,6 +38,9 @@ class GeneralHandler(Handler):
     """Provides general methods that can be called from the client."""
 
     class Meta:
+        # These calls are cheap and needed to render the UI, run them ahead
+        # of the other handlers' calls.
+        priority = True
         allowed_methods = [
             "architectures",
             "known_architectures",
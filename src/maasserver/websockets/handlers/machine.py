@@ -84,6 +84,21 @@ from provisioningserver.utils.twisted import asynchronous
 log = LegacyLogger()
 
 
+def status_event_annotations():
+    """Return the annotations loading the latest status event of machines."""
+    latest_events = Event.objects.filter(
+        node=OuterRef("pk"), type__level__gte=logging.INFO
+    ).order_by("-created", "-id")
+    return {
+        "status_event_type_description": Subquery(
+            latest_events.values("type__description")[:1]
+        ),
+        "status_event_description": Subquery(
+            latest_events.values("description")[:1]
+        ),
+    }
+
+
 class MachineHandler(NodeHandler):
     class Meta(NodeHandler.Meta):
         abstract = False
@@ -131,20 +146,7 @@ class MachineHandler(NodeHandler):
             .prefetch_related("tags")
             .prefetch_related("pool")
             .annotate(
-                status_event_type_description=Subquery(
-                    Event.objects.filter(
-                        node=OuterRef("pk"), type__level__gte=logging.INFO
-                    )
-                    .order_by("-created", "-id")
-                    .values("type__description")[:1]
-                ),
-                status_event_description=Subquery(
-                    Event.objects.filter(
-                        node=OuterRef("pk"), type__level__gte=logging.INFO
-                    )
-                    .order_by("-created", "-id")
-                    .values("description")[:1]
-                ),
+                **status_event_annotations(),
                 numa_nodes_count=Count("numanode"),
                 sriov_support=Exists(
                     Interface.objects.filter(
@@ -153,6 +155,19 @@ class MachineHandler(NodeHandler):
                 ),
             )
         )
+        list_field_prefetch = {
+            **NodeHandler.Meta.list_field_prefetch,
+            "power_type": ["bmc"],
+            "pxe_mac": ["boot_interface", "interface_set"],
+            "vlan": [
+                "boot_interface__vlan__fabric",
+                "interface_set__vlan__fabric",
+            ],
+            "ip_addresses": [
+                "boot_interface",
+                "interface_set__ip_addresses__subnet",
+            ],
+        }
         allowed_methods = [
             "list",
             "get",
@@ -255,25 +270,26 @@ class MachineHandler(NodeHandler):
             from_nodes=super().get_queryset(for_list=for_list),
         )
 
+    def get_selected_fields_queryset(self, fields):
+        """Return `QuerySet` for machines viewable by `user` with `fields`.
+
+        The expensive annotations of the list queryset are only added when
+        the fields need them.
+        """
+        queryset = Machine.objects.all()
+        if "status_message" in fields:
+            queryset = queryset.annotate(**status_event_annotations())
+        return Machine.objects.get_nodes(
+            self.user, NodePermission.view, from_nodes=queryset
+        )
+
     def dehydrate(self, obj, data, for_list=False):
         """Add extra fields to `data`."""
         data = super().dehydrate(obj, data, for_list=for_list)
         data.update(
             {"locked": obj.locked, "pool": self.dehydrate_pool(obj.pool)}
         )
-        # Try to use the annotated event description so its loaded in the same
-        # query as loading the machines. Otherwise fallback to the method on
-        # the machine.
-        if hasattr(obj, "status_event_description"):
-            if obj.status_event_description:
-                data["status_message"] = "%s - %s" % (
-                    obj.status_event_type_description,
-                    obj.status_event_description,
-                )
-            else:
-                data["status_message"] = obj.status_event_type_description
-        else:
-            data["status_message"] = obj.status_message()
+        data["status_message"] = self.list_field_status_message(obj)
 
         if obj.is_machine or not for_list:
             boot_interface = obj.get_boot_interface()
@@ -366,6 +382,36 @@ class MachineHandler(NodeHandler):
 
         return data
 
+    def list_field_status_message(self, obj):
+        # Try to use the annotated event description so its loaded in the same
+        # query as loading the machines. Otherwise fallback to the method on
+        # the machine.
+        if hasattr(obj, "status_event_description"):
+            if obj.status_event_description:
+                return "%s - %s" % (
+                    obj.status_event_type_description,
+                    obj.status_event_description,
+                )
+            else:
+                return obj.status_event_type_description
+        else:
+            return obj.status_message()
+
+    def list_field_pxe_mac(self, obj):
+        boot_interface = obj.get_boot_interface()
+        if boot_interface is None:
+            return ""
+        return "%s" % boot_interface.mac_address
+
+    def list_field_power_type(self, obj):
+        return obj.power_type
+
+    def list_field_vlan(self, obj):
+        return self.dehydrate_vlan(obj, obj.get_boot_interface())
+
+    def list_field_ip_addresses(self, obj):
+        return self.dehydrate_all_ip_addresses(obj)
+
     def dehydrate_show_os_info(self, obj):
         """Return True if OS information should show in the UI."""
         return (
@@ -31,6 +31,7 @@ from maasserver.models.tag import Tag
 from maasserver.models.virtualblockdevice import VirtualBlockDevice
 from maasserver.node_action import compile_node_actions
 from maasserver.permissions import NodePermission
+from maasserver.rbac import rbac
 from maasserver.storage_layouts import get_applied_storage_layout_for_node
 from maasserver.third_party_drivers import get_third_party_driver
 from maasserver.utils.converters import human_readable_bytes, XMLToYAML
@@ -94,6 +95,13 @@ class NodeHandler(TimestampedModelHandler):
         abstract = True
         pk = "system_id"
         pk_type = str
+        # Relations to prefetch for the list fields that all nodes share.
+        list_field_prefetch = {
+            "fqdn": ["domain"],
+            "tags": ["tags"],
+            "physical_disk_count": ["blockdevice_set__physicalblockdevice"],
+            "storage": ["blockdevice_set__physicalblockdevice"],
+        }
 
     def __init__(self, user, cache, request):
         super().__init__(user, cache, request)
@@ -475,14 +483,72 @@ class NodeHandler(TimestampedModelHandler):
                     script_result
                 )
 
-    def _cache_pks(self, nodes):
-        super()._cache_pks(nodes)
-        self._cache_script_results(nodes)
+    def _cache_pks(self, nodes, fields=None):
+        super()._cache_pks(nodes, fields=fields)
+        # None of the fields that can be selected are computed from the
+        # script results, they're only needed to dehydrate the whole node.
+        if fields is None:
+            self._cache_script_results(nodes)
 
     def on_listen_for_active_pk(self, action, pk, obj):
         self._cache_script_results([obj])
         return super().on_listen_for_active_pk(action, pk, obj)
 
+    def get_notify_share_key(self, obj):
+        """Administrators share the dehydrated node when RBAC is disabled.
+
+        The actions available to them only depend on whether they own the
+        node, see `compile_node_actions`.
+        """
+        if self.user.is_superuser and not rbac.is_enabled():
+            return ("admin", obj.owner_id == self.user.id)
+        return super().get_notify_share_key(obj)
+
+    def list_field_fqdn(self, obj):
+        return obj.fqdn
+
+    def list_field_actions(self, obj):
+        return list(compile_node_actions(obj, self.user).keys())
+
+    def list_field_node_type_display(self, obj):
+        return obj.get_node_type_display()
+
+    def list_field_link_type(self, obj):
+        return NODE_TYPE_TO_LINK_TYPE[obj.node_type]
+
+    def list_field_tags(self, obj):
+        return [tag.name for tag in obj.tags.all()]
+
+    def list_field_memory(self, obj):
+        return obj.display_memory()
+
+    def list_field_status(self, obj):
+        return obj.display_status()
+
+    def list_field_status_code(self, obj):
+        return obj.status
+
+    def list_field_physical_disk_count(self, obj):
+        return len(self._get_physical_blockdevices(obj))
+
+    def list_field_storage(self, obj):
+        return round(
+            sum(
+                blockdevice.size
+                for blockdevice in self._get_physical_blockdevices(obj)
+            )
+            / (1000 ** 3),
+            1,
+        )
+
+    def _get_physical_blockdevices(self, obj):
+        """Return the `PhysicalBlockDevice`s using the prefetched query."""
+        return [
+            blockdevice
+            for blockdevice in self.get_blockdevices_for(obj)
+            if isinstance(blockdevice, PhysicalBlockDevice)
+        ]
+
     def dehydrate_blockdevice(self, blockdevice, obj):
         """Return `BlockDevice` formatted for JSON encoding."""
         # model and serial are currently only avalible on physical block
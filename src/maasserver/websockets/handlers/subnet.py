@@ -73,8 +73,11 @@ class SubnetHandler(TimestampedModelHandler):
             del parameters["space"]
         return super().update(parameters)
 
-    def _cache_pks(self, objs):
-        super()._cache_pks(objs)
+    def _cache_pks(self, objs, fields=None):
+        super()._cache_pks(objs, fields=fields)
+        if fields is not None:
+            # The usage statistics are only computed by `dehydrate`.
+            return
         self.cache["staticroutes"] = StaticRoute.objects.filter(
             source__in=objs
         )
@@ -119,6 +119,38 @@ class TestControllerHandler(MAASServerTestCase):
             "Number of queries has changed; make sure this is expected.",
         )
 
+    def test_list_selected_fields(self):
+        owner = factory.make_admin()
+        handler = ControllerHandler(owner, {}, None)
+        factory.make_Machine(owner=owner)
+        node = factory.make_RegionRackController(owner=owner)
+        ControllerInfo.objects.set_version(node, "2.3.0")
+        fields = ["hostname", "node_type", "version", "service_ids"]
+        data = handler.list({})[0]
+        expected = {field: data[field] for field in fields}
+        expected["system_id"] = node.system_id
+        self.assertEqual([expected], handler.list({"fields": fields}))
+
+    def test_list_selected_fields_num_queries_is_independent_of_num_nodes(
+        self,
+    ):
+        self.useFixture(RBACForceOffFixture())
+
+        owner = factory.make_admin()
+        handler = ControllerHandler(owner, {}, None)
+        fields = ["hostname", "fqdn", "tags", "version", "ip_addresses"]
+        for _ in range(2):
+            factory.make_RegionRackController(owner=owner)
+        query_2_count, _ = count_queries(handler.list, {"fields": fields})
+        for _ in range(8):
+            factory.make_RegionRackController(owner=owner)
+        query_10_count, _ = count_queries(handler.list, {"fields": fields})
+        self.assertEqual(
+            query_2_count,
+            query_10_count,
+            "Number of queries is not independent to the number of nodes.",
+        )
+
     @skip("XXX: ltrager 2919-11-29 bug=1854546")
     def test_get_num_queries_is_the_expected_number(self):
         owner = factory.make_admin()
@@ -378,6 +378,46 @@ class TestDeviceHandler(MAASTransactionServerTestCase):
             "Number of queries is not independent to the number of nodes.",
         )
 
+    @transactional
+    def test_list_selected_fields(self):
+        owner = factory.make_User()
+        handler = DeviceHandler(owner, {}, None)
+        device = self.make_device_with_ip_address(
+            owner=owner, ip_assignment=DEVICE_IP_ASSIGNMENT_TYPE.STATIC
+        )
+        fields = [
+            "hostname",
+            "fqdn",
+            "primary_mac",
+            "ip_assignment",
+            "ip_address",
+        ]
+        data = self.dehydrate_device(device, owner, for_list=True)
+        expected = {field: data[field] for field in fields}
+        expected["system_id"] = device.system_id
+        self.assertEqual([expected], handler.list({"fields": fields}))
+
+    @transactional
+    def test_list_selected_fields_num_queries_is_independent_of_num_devices(
+        self,
+    ):
+        # Prevent RBAC from making a query.
+        self.useFixture(RBACForceOffFixture())
+
+        owner = factory.make_User()
+        handler = DeviceHandler(owner, {}, None)
+        fields = ["hostname", "fqdn", "tags", "ip_assignment", "ip_address"]
+        ip_assignment = factory.pick_enum(DEVICE_IP_ASSIGNMENT_TYPE)
+        self.make_devices(10, owner=owner, ip_assignment=ip_assignment)
+        query_10_count, _ = count_queries(handler.list, {"fields": fields})
+        self.make_devices(10, owner=owner, ip_assignment=ip_assignment)
+        query_20_count, _ = count_queries(handler.list, {"fields": fields})
+        self.assertEqual(
+            query_10_count,
+            query_20_count,
+            "Number of queries is not independent to the number of nodes.",
+        )
+
     @transactional
     def test_list_returns_devices_only_viewable_by_user(self):
         user = factory.make_User()
@@ -2099,6 +2099,56 @@ class TestMachineHandler(MAASServerTestCase):
             handler._script_results,
         )
 
+    def test_list_selected_fields(self):
+        user = factory.make_User()
+        node = factory.make_Machine(owner=user)
+        factory.make_PhysicalBlockDevice(node)
+        handler = MachineHandler(user, {}, None)
+        fields = ["hostname", "fqdn", "status", "storage", "pxe_mac"]
+        data = self.dehydrate_node(node, handler, for_list=True)
+        expected = {field: data[field] for field in fields}
+        expected["system_id"] = node.system_id
+        self.assertEqual([expected], handler.list({"fields": fields}))
+
+    def test_list_selected_fields_only_annotates_when_needed(self):
+        user = factory.make_User()
+        factory.make_Machine(owner=user)
+        handler = MachineHandler(user, {}, None)
+        [result] = handler.list({"fields": ["hostname"]})
+        self.assertNotIn("numa_nodes_count", result)
+        self.assertNotIn(
+            "status_event_description",
+            handler.get_selected_fields_queryset(
+                ["hostname"]
+            ).query.annotations,
+        )
+        self.assertIn(
+            "status_event_description",
+            handler.get_selected_fields_queryset(
+                ["status_message"]
+            ).query.annotations,
+        )
+
+    def test_list_selected_fields_num_queries_is_constant(self):
+        user = factory.make_User()
+        handler = MachineHandler(user, {}, None)
+        fields = ["hostname", "fqdn", "tags", "storage", "ip_addresses"]
+        self.make_nodes(2)
+        query_10_count, _ = count_queries(handler.list, {"fields": fields})
+        self.make_nodes(8)
+        query_20_count, _ = count_queries(handler.list, {"fields": fields})
+        self.assertEqual(query_10_count, query_20_count)
+
+    def test_list_selected_fields_skips_script_results(self):
+        user = factory.make_User()
+        factory.make_Machine(owner=user)
+        handler = MachineHandler(user, {}, None)
+        cache_script_results = self.patch(handler, "_cache_script_results")
+        handler.list({"fields": ["hostname", "status"]})
+        self.assertThat(cache_script_results, MockNotCalled())
+        handler.list({})
+        self.assertThat(cache_script_results, MockCalledOnceWith(ANY))
+
     def test_list_includes_numa_node_info(self):
         user = factory.make_User()
         machine = factory.make_Machine(owner=user)
@@ -5,10 +5,11 @@
 
 __all__ = ["WebSocketProtocol"]
 
-from collections import deque
+from collections import deque, OrderedDict
 from functools import partial
 from http.cookies import SimpleCookie
 import json
+from time import time
 from typing import Optional
 from urllib.parse import parse_qs, urlparse
 
@@ -18,7 +19,13 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.http import HttpRequest
 from twisted.internet import defer
-from twisted.internet.defer import fail, inlineCallbacks
+from twisted.internet.defer import (
+    CancelledError,
+    Deferred,
+    DeferredList,
+    fail,
+    maybeDeferred,
+)
 from twisted.internet.protocol import Factory, Protocol
 from twisted.python.modules import getModule
 from twisted.web.server import NOT_DONE_YET
@@ -27,10 +34,11 @@ from maasserver.eventloop import services
 from maasserver.utils.orm import transactional
 from maasserver.utils.threads import deferToDatabase
 from maasserver.websockets import handlers
+from maasserver.websockets.base import NotifyDehydrationCache
 from maasserver.websockets.websockets import STATUSES
 from provisioningserver.logger import LegacyLogger
 from provisioningserver.utils import typed
-from provisioningserver.utils.twisted import deferred, synchronous
+from provisioningserver.utils.twisted import callOut, deferred, synchronous
 from provisioningserver.utils.url import splithost
 
 log = LegacyLogger()
@@ -77,12 +85,24 @@ class WebSocketProtocol(Protocol):
     :ivar factory: Set by the factory that spawned this protocol.
     """
 
+    # Maximum number of requests from one connection executing at the same
+    # time. Further requests are queued until one completes, so a single
+    # client cannot hold all the database threads. Requests to priority
+    # handlers are not limited.
+    MAX_REQUESTS_IN_FLIGHT = 2
+
     def __init__(self):
         self.messages = deque()
+        self.requestsInFlight = set()
+        self.queuedRequests = deque()
+        self.disconnected = False
         self.user = None
         self.request = None
         self.cache = {}
         self.sequence_number = 0
+        # Whether the client accepts "patch" notifications, as requested
+        # with the `patches` query argument when connecting.
+        self.notify_patches = False
 
     def connectionMade(self):
         """Connection has been made to client."""
@@ -148,6 +168,10 @@ class WebSocketProtocol(Protocol):
         # 'client' will not have been added to the list.
         if self in self.factory.clients:
             self.factory.clients.remove(self)
+        # Nobody is waiting for the result of the queued requests anymore.
+        self.disconnected = True
+        while len(self.queuedRequests) > 0:
+            self.queuedRequests.popleft().cancel()
 
     def loseConnection(self, status, reason):
         """Close connection with status and reason."""
@@ -206,7 +230,8 @@ class WebSocketProtocol(Protocol):
         the connection is being dropped, and that processing should cease.
         """
         # Check the CSRF token.
-        tokens = parse_qs(urlparse(self.transport.uri).query).get(b"csrftoken")
+        query = parse_qs(urlparse(self.transport.uri).query)
+        tokens = query.get(b"csrftoken")
         # Convert tokens from bytes to str as the transport sends it
         # as ascii bytes and the cookie is decoded as unicode.
         if tokens is not None:
@@ -215,6 +240,10 @@ class WebSocketProtocol(Protocol):
             # No csrftoken in the request or the token does not match.
             self.loseConnection(STATUSES.PROTOCOL_ERROR, "Invalid CSRF token.")
             return None
+        self.notify_patches = query.get(b"patches", [b""])[0] in (
+            b"1",
+            b"true",
+        )
 
         # Authenticate user.
         def got_user(user):
@@ -321,13 +350,43 @@ class WebSocketProtocol(Protocol):
             return None
 
         handler = self.buildHandler(handler_class)
-        d = handler.execute(method, message.get("params", {}))
+        params = message.get("params", {})
+        if handler._meta.priority:
+            d = handler.execute(method, params)
+        else:
+            d = self.scheduleRequest(handler, method, params)
         d.addCallbacks(
             partial(self.sendResult, request_id),
             partial(self.sendError, request_id, handler, method),
         )
         return d
 
+    def scheduleRequest(self, handler, method, params):
+        """Execute `method` on `handler` once fewer requests are in flight.
+
+        Requests are executed in the order they were received.
+        """
+        queued = time()
+        start = Deferred()
+        if len(self.requestsInFlight) < self.MAX_REQUESTS_IN_FLIGHT:
+            start.callback(None)
+        else:
+            self.queuedRequests.append(start)
+        start.addCallback(
+            lambda _: self._executeRequest(handler, method, params, queued)
+        )
+        return start
+
+    def _executeRequest(self, handler, method, params, queued):
+        d = maybeDeferred(handler.execute, method, params, queued=queued)
+        self.requestsInFlight.add(d)
+        return d.addBoth(callOut, self._requestDone, d)
+
+    def _requestDone(self, d):
+        self.requestsInFlight.discard(d)
+        if len(self.queuedRequests) > 0:
+            self.queuedRequests.popleft().callback(None)
+
     def _json_encode(self, obj):
         """Allow byte strings embedded in the 'result' object passed to
         `sendResult` to be seamlessly decoded.
@@ -352,6 +411,9 @@ class WebSocketProtocol(Protocol):
 
     def sendError(self, request_id, handler, method, failure):
         """Log and send error to client."""
+        if self.disconnected and failure.check(CancelledError):
+            # The request was dropped with the connection.
+            return None
         if isinstance(failure.value, ValidationError):
             try:
                 # When the error is a validation issue, send the error as a
@@ -397,6 +459,7 @@ class WebSocketProtocol(Protocol):
         """Return an initialised instance of `handler_class`."""
         handler_name = handler_class._meta.handler_name
         handler_cache = self.cache.setdefault(handler_name, {})
+        handler_cache["notify_patches"] = self.notify_patches
         return handler_class(self.user, handler_cache, self.request)
 
 
@@ -461,21 +524,51 @@ class WebSocketFactory(Factory):
                     channel, partial(self.onNotify, handler, channel)
                 )
 
-    @inlineCallbacks
     def onNotify(self, handler_class, channel, action, obj_id):
+        """Send the notification to all the connected clients.
+
+        The clients of each user are processed together in one transaction,
+        and the users are processed concurrently. All of them share a
+        `NotifyDehydrationCache` so the object is only dehydrated once for
+        clients that would receive the same data.
+        """
+        clients_by_user = OrderedDict()
         for client in self.clients:
-            handler = client.buildHandler(handler_class)
-            data = yield deferToDatabase(
-                self.processNotify, handler, channel, action, obj_id
+            clients_by_user.setdefault(client.user.id, []).append(client)
+
+        notify_cache = NotifyDehydrationCache()
+        ds = []
+        for clients in clients_by_user.values():
+            client_handlers = []
+            for client in clients:
+                handler = client.buildHandler(handler_class)
+                handler.notify_cache = notify_cache
+                client_handlers.append(handler)
+            d = deferToDatabase(
+                self.processNotifies, client_handlers, channel, action, obj_id
+            )
+            d.addCallback(self.sendNotifies, clients)
+            d.addErrback(
+                log.err,
+                "Failed to process %s notification for %s(%s)."
+                % (action, channel, obj_id),
             )
+            ds.append(d)
+        return DeferredList(ds)
+
+    @transactional
+    def processNotifies(self, handlers, channel, action, obj_id):
+        return [
+            handler.on_listen(channel, action, obj_id) for handler in handlers
+        ]
+
+    def sendNotifies(self, results, clients):
+        """Send the `results` of `processNotifies` to `clients`."""
+        for client, data in zip(clients, results):
             if data is not None:
                 (name, client_action, data) = data
                 client.sendNotify(name, client_action, data)
 
-    @transactional
-    def processNotify(self, handler, channel, action, obj_id):
-        return handler.on_listen(channel, action, obj_id)
-
     def registerRPCEvents(self):
         """Register for connected and disconnected events from the RPC
         service."""
@@ -6,13 +6,16 @@
 __all__ = []
 
 import random
+import time
 from unittest.mock import ANY, MagicMock, sentinel
 
 from django.db.models.query import QuerySet
 from django.http import HttpRequest
 from testtools.matchers import Equals, Is, IsInstance, MatchesStructure
 from testtools.testcase import ExpectedException
+from twisted.internet.defer import succeed
 
+from maasserver import concurrency
 from maasserver.forms import AdminMachineForm, AdminMachineWithMACAddressesForm
 from maasserver.models.node import Device, Node
 from maasserver.models.vlan import VLAN
@@ -27,11 +30,14 @@ from maasserver.testing.testcase import (
 from maasserver.utils.orm import reload_object
 from maasserver.websockets import base
 from maasserver.websockets.base import (
+    fingerprint_dehydrated,
     Handler,
     HandlerDoesNotExistError,
     HandlerNoSuchMethodError,
     HandlerPermissionError,
     HandlerValidationError,
+    make_dehydrated_patch,
+    NotifyDehydrationCache,
 )
 from maastesting.matchers import MockCalledOnceWith, MockNotCalled
 from maastesting.testcase import MAASTestCase
@@ -452,6 +458,29 @@ class TestHandler(MAASServerTestCase, FakeNodesHandlerMixin):
             value=ANY,
         )
 
+    def test_execute_uses_priority_lane_for_priority_handlers(self):
+        handler = self.make_nodes_handler(priority=True)
+        params = {"system_id": factory.make_name("system_id")}
+        mock_run = self.patch(concurrency.webapp, "runWithPriority")
+        mock_run.return_value = succeed(sentinel.thing)
+        result = handler.execute("get", params).wait(30)
+        self.assertIs(result, sentinel.thing)
+        self.assertThat(
+            mock_run, MockCalledOnceWith(base.deferToDatabase, ANY, params)
+        )
+
+    def test_record_queue_wait(self):
+        mock_metrics = self.patch(PROMETHEUS_METRICS, "update")
+        handler = self.make_nodes_handler()
+        handler._record_queue_wait("get", time.time() - 10)
+        mock_metrics.assert_called_once_with(
+            "maas_websocket_call_queue_wait",
+            "observe",
+            labels={"call": "testnodes.get"},
+            value=ANY,
+        )
+        self.assertGreaterEqual(mock_metrics.call_args[1]["value"], 10)
+
     def test_list(self):
         output = [{"hostname": factory.make_Node().hostname} for _ in range(3)]
         handler = self.make_nodes_handler(fields=["hostname"])
@@ -496,6 +525,49 @@ class TestHandler(MAASServerTestCase, FakeNodesHandlerMixin):
         handler.list({"start": nodes[0].id})
         self.assertItemsEqual(pks, handler.cache["loaded_pks"])
 
+    def test_list_selected_fields(self):
+        node = factory.make_Node()
+        handler = self.make_nodes_handler(fields=["hostname", "cpu_count"])
+        self.assertEqual(
+            [{"system_id": node.system_id, "cpu_count": node.cpu_count}],
+            handler.list({"fields": ["cpu_count"]}),
+        )
+
+    def test_list_selected_fields_uses_list_field_methods(self):
+        node = factory.make_Node()
+        handler = self.make_nodes_handler(fields=["hostname"])
+        handler.list_field_name = lambda obj: obj.hostname.upper()
+        self.assertEqual(
+            [{"system_id": node.system_id, "name": node.hostname.upper()}],
+            handler.list({"fields": ["name"]}),
+        )
+
+    def test_list_selected_fields_start_and_limit(self):
+        nodes = [factory.make_Node() for _ in range(9)]
+        output = [
+            {"system_id": node.system_id, "hostname": node.hostname}
+            for node in nodes[3:6]
+        ]
+        handler = self.make_nodes_handler(fields=["hostname"])
+        self.assertEqual(
+            output,
+            handler.list(
+                {"start": nodes[2].id, "limit": 3, "fields": ["hostname"]}
+            ),
+        )
+
+    def test_list_selected_fields_rejects_unknown_fields(self):
+        handler = self.make_nodes_handler(fields=["hostname"])
+        error = self.assertRaises(
+            HandlerValidationError,
+            handler.list,
+            {"fields": ["hostname", "cpu_count", "unknown"]},
+        )
+        self.assertEqual(
+            {"fields": ["Unknown fields: cpu_count, unknown."]},
+            error.message_dict,
+        )
+
     def test_get(self):
         node = factory.make_Node()
         handler = self.make_nodes_handler(fields=["hostname"])
@@ -854,6 +926,140 @@ class TestHandler(MAASServerTestCase, FakeNodesHandlerMixin):
             mock_dehydrate, MockCalledOnceWith(node, for_list=False)
         )
 
+    def test_on_listen_shares_object_and_data_through_notify_cache(self):
+        node = factory.make_Node()
+        handler = self.make_nodes_handler(fields=["hostname"])
+        other_handler = self.make_nodes_handler(fields=["hostname"])
+        other_handler.user = handler.user
+        notify_cache = NotifyDehydrationCache()
+        handler.notify_cache = other_handler.notify_cache = notify_cache
+        mock_listen = self.patch(handler, "listen")
+        mock_listen.return_value = node
+        mock_other_listen = self.patch(other_handler, "listen")
+        expected = (
+            handler._meta.handler_name,
+            "create",
+            {"hostname": node.hostname},
+        )
+        self.assertEqual(
+            expected,
+            handler.on_listen(sentinel.channel, "update", node.system_id),
+        )
+        self.assertEqual(
+            expected,
+            other_handler.on_listen(
+                sentinel.channel, "update", node.system_id
+            ),
+        )
+        self.assertThat(mock_listen, MockCalledOnceWith(ANY, ANY, ANY))
+        self.assertThat(mock_other_listen, MockNotCalled())
+
+    def test_get_notify_share_key_defaults_to_user(self):
+        handler = self.make_nodes_handler()
+        self.assertEqual(
+            handler.user.id, handler.get_notify_share_key(sentinel.obj)
+        )
+
+    def make_patches_handler(self, node):
+        handler = self.make_nodes_handler(
+            fields=["hostname", "cpu_count", "memory", "power_state"]
+        )
+        handler.cache["notify_patches"] = True
+        handler.cache["loaded_pks"].add(node.system_id)
+        return handler
+
+    def test_on_listen_update_sends_full_data_first(self):
+        node = factory.make_Node()
+        handler = self.make_patches_handler(node)
+        name, action, data = handler.on_listen(
+            sentinel.channel, "update", node.system_id
+        )
+        self.assertEqual("update", action)
+        self.assertEqual(node.hostname, data["hostname"])
+
+    def test_on_listen_update_sends_patch_with_changed_keys(self):
+        node = factory.make_Node()
+        handler = self.make_patches_handler(node)
+        handler.on_listen(sentinel.channel, "update", node.system_id)
+        node.hostname = factory.make_name("hostname")
+        node.save()
+        self.assertEqual(
+            (
+                handler._meta.handler_name,
+                "patch",
+                {
+                    "pk": node.system_id,
+                    "patch": [
+                        {
+                            "op": "replace",
+                            "path": "/hostname",
+                            "value": node.hostname,
+                        }
+                    ],
+                },
+            ),
+            handler.on_listen(sentinel.channel, "update", node.system_id),
+        )
+
+    def test_on_listen_update_sends_nothing_if_unchanged(self):
+        node = factory.make_Node()
+        handler = self.make_patches_handler(node)
+        handler.on_listen(sentinel.channel, "update", node.system_id)
+        self.assertIsNone(
+            handler.on_listen(sentinel.channel, "update", node.system_id)
+        )
+
+    def test_on_listen_update_sends_full_data_after_reload(self):
+        node = factory.make_Node()
+        handler = self.make_patches_handler(node)
+        handler.on_listen(sentinel.channel, "update", node.system_id)
+        handler.get({"system_id": node.system_id})
+        node.hostname = factory.make_name("hostname")
+        node.save()
+        name, action, data = handler.on_listen(
+            sentinel.channel, "update", node.system_id
+        )
+        self.assertEqual("update", action)
+
+    def test_on_listen_update_sends_full_data_when_active_changes(self):
+        node = factory.make_Node()
+        handler = self.make_patches_handler(node)
+        handler.on_listen(sentinel.channel, "update", node.system_id)
+        handler.cache["active_pk"] = node.system_id
+        name, action, data = handler.on_listen(
+            sentinel.channel, "update", node.system_id
+        )
+        self.assertEqual("update", action)
+
+    def test_make_dehydrated_patch(self):
+        unchanged = {str(i): i for i in range(5)}
+        previous_data = dict(unchanged, a=1, b=[1, 2], c="c")
+        data = dict(unchanged, a=1, b=[1, 2, 3], d="d", g=3)
+        self.assertEqual(
+            [
+                {"op": "replace", "path": "/b", "value": [1, 2, 3]},
+                {"op": "add", "path": "/d", "value": "d"},
+                {"op": "add", "path": "/g", "value": 3},
+                {"op": "remove", "path": "/c"},
+            ],
+            make_dehydrated_patch(
+                fingerprint_dehydrated(previous_data),
+                fingerprint_dehydrated(data),
+                data,
+            ),
+        )
+
+    def test_make_dehydrated_patch_returns_None_if_most_keys_changed(self):
+        previous_data = {"a": 1, "b": 2}
+        data = {"a": 2, "b": 3}
+        self.assertIsNone(
+            make_dehydrated_patch(
+                fingerprint_dehydrated(previous_data),
+                fingerprint_dehydrated(data),
+                data,
+            )
+        )
+
     def test_listen_calls_get_object_with_pk_on_other_actions(self):
         handler = self.make_nodes_handler()
         mock_get_object = self.patch(handler, "get_object")
@@ -868,6 +1074,77 @@ class TestHandler(MAASServerTestCase, FakeNodesHandlerMixin):
         )
 
 
+class TestNotifyDehydrationCache(MAASServerTestCase, FakeNodesHandlerMixin):
+    def test_get_dehydrated_dehydrates_once_per_share_key(self):
+        node = factory.make_Node()
+        handler = self.make_nodes_handler(fields=["hostname"])
+        other_handler = self.make_nodes_handler(fields=["hostname"])
+        self.patch(handler, "get_notify_share_key").return_value = "key"
+        self.patch(other_handler, "get_notify_share_key").return_value = "key"
+        mock_dehydrate = self.patch(handler, "full_dehydrate")
+        mock_dehydrate.return_value = sentinel.data
+        mock_other_dehydrate = self.patch(other_handler, "full_dehydrate")
+        notify_cache = NotifyDehydrationCache()
+        self.assertIs(
+            sentinel.data,
+            notify_cache.get_dehydrated(
+                handler, node.system_id, node, for_list=True
+            ),
+        )
+        self.assertIs(
+            sentinel.data,
+            notify_cache.get_dehydrated(
+                other_handler, node.system_id, node, for_list=True
+            ),
+        )
+        self.assertThat(mock_other_dehydrate, MockNotCalled())
+
+    def test_get_dehydrated_separates_share_keys_and_for_list(self):
+        node = factory.make_Node()
+        handler = self.make_nodes_handler(fields=["hostname"])
+        other_handler = self.make_nodes_handler(fields=["hostname"])
+        mock_dehydrate = self.patch(other_handler, "full_dehydrate")
+        mock_dehydrate.return_value = sentinel.data
+        notify_cache = NotifyDehydrationCache()
+        notify_cache.get_dehydrated(handler, node.system_id, node, True)
+        notify_cache.get_dehydrated(other_handler, node.system_id, node, True)
+        notify_cache.get_dehydrated(handler, node.system_id, node, False)
+        self.assertThat(
+            mock_dehydrate, MockCalledOnceWith(node, for_list=True)
+        )
+
+    def test_get_dehydrated_records_cache_metrics(self):
+        node = factory.make_Node()
+        handler = self.make_nodes_handler(fields=["hostname"])
+        mock_update = self.patch(PROMETHEUS_METRICS, "update")
+        notify_cache = NotifyDehydrationCache()
+        notify_cache.get_dehydrated(handler, node.system_id, node, True)
+        notify_cache.get_dehydrated(handler, node.system_id, node, True)
+        labels = [
+            call[1]["labels"]["result"] for call in mock_update.call_args_list
+        ]
+        self.assertEqual(["miss", "hit"], labels)
+
+    def test_get_object_reraises_listen_error_for_every_client(self):
+        handler = self.make_nodes_handler()
+        mock_listen = self.patch(handler, "listen")
+        mock_listen.side_effect = HandlerDoesNotExistError()
+        notify_cache = NotifyDehydrationCache()
+        for _ in range(2):
+            self.assertRaises(
+                HandlerDoesNotExistError,
+                notify_cache.get_object,
+                handler,
+                sentinel.channel,
+                "update",
+                sentinel.pk,
+            )
+        self.assertThat(
+            mock_listen,
+            MockCalledOnceWith(sentinel.channel, "update", sentinel.pk),
+        )
+
+
 class TestHandlerTransaction(
     MAASTransactionServerTestCase, FakeNodesHandlerMixin
 ):
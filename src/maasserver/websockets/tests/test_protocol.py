@@ -14,7 +14,7 @@ from django.core.exceptions import ValidationError
 from django.http import HttpRequest
 from testtools.matchers import Equals, Is
 from twisted.internet import defer
-from twisted.internet.defer import fail, inlineCallbacks, succeed
+from twisted.internet.defer import Deferred, fail, inlineCallbacks, succeed
 from twisted.web.server import NOT_DONE_YET
 
 from apiclient.utils import ascii_url
@@ -25,7 +25,7 @@ from maasserver.testing.testcase import MAASTransactionServerTestCase
 from maasserver.utils.orm import transactional
 from maasserver.utils.threads import deferToDatabase
 from maasserver.websockets import protocol as protocol_module
-from maasserver.websockets.base import Handler
+from maasserver.websockets.base import Handler, NotifyDehydrationCache
 from maasserver.websockets.handlers import DeviceHandler, MachineHandler
 from maasserver.websockets.protocol import (
     MSG_TYPE,
@@ -39,6 +39,7 @@ from maastesting.matchers import (
     IsFiredDeferred,
     MockCalledOnceWith,
     MockCalledWith,
+    MockNotCalled,
 )
 from maastesting.testcase import MAASTestCase
 from maastesting.twisted import TwistedLoggerFixture
@@ -337,6 +338,32 @@ class TestWebSocketProtocol(MAASTransactionServerTestCase):
             MockCalledOnceWith(STATUSES.PROTOCOL_ERROR, "Invalid CSRF token."),
         )
 
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_authenticate_enables_notify_patches(self):
+        user, session_id = yield deferToDatabase(self.get_user_and_session_id)
+        csrftoken = maas_factory.make_name("csrftoken")
+        uri = self.make_ws_uri(csrftoken) + b"&patches=1"
+        protocol, factory = self.make_protocol(
+            patch_authenticate=False, transport_uri=uri
+        )
+        yield protocol.authenticate(session_id, csrftoken)
+        self.assertTrue(protocol.notify_patches)
+        handler = protocol.buildHandler(MachineHandler)
+        self.assertTrue(handler.cache["notify_patches"])
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_authenticate_leaves_notify_patches_disabled(self):
+        user, session_id = yield deferToDatabase(self.get_user_and_session_id)
+        csrftoken = maas_factory.make_name("csrftoken")
+        uri = self.make_ws_uri(csrftoken)
+        protocol, factory = self.make_protocol(
+            patch_authenticate=False, transport_uri=uri
+        )
+        yield protocol.authenticate(session_id, csrftoken)
+        self.assertFalse(protocol.notify_patches)
+
     @wait_for_reactor
     @inlineCallbacks
     def test_authenticate_calls_loseConnection_if_csrftoken_is_missing(self):
@@ -602,6 +629,62 @@ class TestWebSocketProtocol(MAASTransactionServerTestCase):
             protocol.cache[handler_name], handler_class.call_args[0][1]
         )
 
+    def make_request_handler(self, factory, priority=False):
+        handler_class = MagicMock()
+        handler_name = maas_factory.make_name("handler")
+        handler_class._meta.handler_name = handler_name
+        handler = handler_class.return_value
+        handler._meta.priority = priority
+        handler.execute.side_effect = lambda *args, **kwargs: Deferred()
+        factory.handlers[handler_name] = handler_class
+        return handler_name, handler
+
+    def make_request(self, handler_name):
+        return {
+            "type": MSG_TYPE.REQUEST,
+            "request_id": random.randint(1, 999999),
+            "method": "%s.get" % handler_name,
+        }
+
+    def test_handleRequest_limits_requests_in_flight(self):
+        protocol, factory = self.make_protocol()
+        protocol.user = sentinel.user
+        handler_name, handler = self.make_request_handler(factory)
+        limit = protocol.MAX_REQUESTS_IN_FLIGHT
+        for _ in range(limit + 1):
+            protocol.handleRequest(self.make_request(handler_name))
+        self.assertEqual(limit, handler.execute.call_count)
+        self.assertEqual(1, len(protocol.queuedRequests))
+        # Completing a request executes the next one.
+        [first_request, *_] = protocol.requestsInFlight
+        first_request.callback(None)
+        self.assertEqual(limit + 1, handler.execute.call_count)
+        self.assertEqual(0, len(protocol.queuedRequests))
+
+    def test_handleRequest_does_not_limit_priority_handlers(self):
+        protocol, factory = self.make_protocol()
+        protocol.user = sentinel.user
+        handler_name, handler = self.make_request_handler(
+            factory, priority=True
+        )
+        limit = protocol.MAX_REQUESTS_IN_FLIGHT
+        for _ in range(limit + 1):
+            protocol.handleRequest(self.make_request(handler_name))
+        self.assertEqual(limit + 1, handler.execute.call_count)
+        self.assertEqual(0, len(protocol.queuedRequests))
+
+    def test_connectionLost_cancels_queued_requests(self):
+        protocol, factory = self.make_protocol()
+        protocol.user = sentinel.user
+        handler_name, handler = self.make_request_handler(factory)
+        limit = protocol.MAX_REQUESTS_IN_FLIGHT
+        for _ in range(limit + 1):
+            protocol.handleRequest(self.make_request(handler_name))
+        protocol.connectionLost("")
+        self.assertEqual(0, len(protocol.queuedRequests))
+        self.assertEqual(limit, handler.execute.call_count)
+        self.assertThat(protocol.transport.write, MockNotCalled())
+
     @wait_for_reactor
     @inlineCallbacks
     def test_handleRequest_sends_response(self):
@@ -979,6 +1062,74 @@ class TestWebSocketFactoryTransactional(
         )
         self.assertThat(mock_sendNotify, MockCalledWith(name, action, data))
 
+    def add_protocol(self, factory, user):
+        protocol = factory.buildProtocol(None)
+        protocol.transport = MagicMock()
+        protocol.transport.cookies = b""
+        mock_authenticate = self.patch(protocol, "authenticate")
+        mock_authenticate.return_value = defer.succeed(user)
+        protocol.connectionMade()
+        self.addCleanup(lambda: protocol.connectionLost(""))
+        return protocol
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotify_processes_clients_of_same_user_together(self):
+        user = yield deferToDatabase(self.make_user)
+        protocol, factory = self.make_protocol_with_factory(user=user)
+        other_protocol = self.add_protocol(factory, user)
+        name = maas_factory.make_name("name")
+        mock_class = MagicMock()
+        mock_process = self.patch(factory, "processNotifies")
+        mock_process.return_value = [
+            (name, "update", sentinel.data),
+            (name, "update", sentinel.data),
+        ]
+        mock_sendNotify = self.patch(protocol, "sendNotify")
+        mock_other_sendNotify = self.patch(other_protocol, "sendNotify")
+        yield factory.onNotify(
+            mock_class, sentinel.channel, "update", sentinel.obj_id
+        )
+        self.assertThat(
+            mock_process,
+            MockCalledOnceWith(
+                [mock_class.return_value, mock_class.return_value],
+                sentinel.channel,
+                "update",
+                sentinel.obj_id,
+            ),
+        )
+        self.assertThat(
+            mock_sendNotify, MockCalledOnceWith(name, "update", sentinel.data)
+        )
+        self.assertThat(
+            mock_other_sendNotify,
+            MockCalledOnceWith(name, "update", sentinel.data),
+        )
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotify_shares_notify_cache_between_users(self):
+        user = yield deferToDatabase(self.make_user)
+        other_user = yield deferToDatabase(self.make_user)
+        protocol, factory = self.make_protocol_with_factory(user=user)
+        self.add_protocol(factory, other_user)
+        handlers = []
+
+        def process(client_handlers, channel, action, obj_id):
+            handlers.extend(client_handlers)
+            return [None] * len(client_handlers)
+
+        self.patch(factory, "processNotifies").side_effect = process
+        handler_class = MagicMock()
+        handler_class.side_effect = lambda *args: MagicMock()
+        yield factory.onNotify(
+            handler_class, sentinel.channel, "update", sentinel.obj_id
+        )
+        self.assertEqual(2, len(handlers))
+        self.assertIsInstance(handlers[0].notify_cache, NotifyDehydrationCache)
+        self.assertIs(handlers[0].notify_cache, handlers[1].notify_cache)
+
     @wait_for_reactor
     @inlineCallbacks
     def test_updateRackController_calls_onNotify_for_controller_update(self):
@@ -14,6 +14,8 @@ HyBi-07 (http://tools.ietf.org/html/draft-ietf-hybi-thewebsocketprotocol-07),
 which are drafts of RFC 6455.
 """
 
+import zlib
+
 from testtools.matchers import StartsWith
 from twisted.internet.address import IPv6Address
 from twisted.internet.protocol import Factory, Protocol
@@ -36,9 +38,12 @@ from maasserver.websockets.websockets import (
     _mask,
     _parseFrames,
     _WSException,
+    _WSMessageTooBig,
     CONTROLS,
     IWebSocketsFrameReceiver,
     lookupProtocolForFactory,
+    PerMessageDeflate,
+    PerMessageDeflateFactory,
     STATUSES,
     WebSocketsProtocol,
     WebSocketsProtocolWrapper,
@@ -335,6 +340,171 @@ class TestFrameHelpers(MAASTestCase):
         self.assertEqual(frame, buf)
 
 
+def compress_like_client(data):
+    """Compress `data` as a permessage-deflate client does."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data[:-4]
+
+
+def decompress_like_client(data, decompressor=None):
+    """Decompress `data` as a permessage-deflate client does."""
+    if decompressor is None:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    return decompressor.decompress(data + b"\x00\x00\xff\xff")
+
+
+class PerMessageDeflateTest(MAASTestCase):
+    """
+    Tests for L{PerMessageDeflate} and L{PerMessageDeflateFactory}.
+    """
+
+    def test_acceptPlainOffer(self):
+        deflate = PerMessageDeflateFactory().accept([b"permessage-deflate"])
+        self.assertIsInstance(deflate, PerMessageDeflate)
+        self.assertEqual(b"permessage-deflate", deflate.responseHeader())
+
+    def test_acceptIgnoresOtherExtensions(self):
+        self.assertIsNone(
+            PerMessageDeflateFactory().accept([b"x-webkit-deflate-frame"])
+        )
+
+    def test_acceptFirstValidOffer(self):
+        deflate = PerMessageDeflateFactory().accept(
+            [
+                b"permessage-deflate; unknown, "
+                b"permessage-deflate; client_max_window_bits; "
+                b'server_max_window_bits="10"'
+            ]
+        )
+        self.assertEqual(10, deflate.serverMaxWindowBits)
+        self.assertEqual(
+            b"permessage-deflate; server_max_window_bits=10",
+            deflate.responseHeader(),
+        )
+
+    def test_acceptRejectsTooSmallWindow(self):
+        self.assertIsNone(
+            PerMessageDeflateFactory().accept(
+                [b"permessage-deflate; server_max_window_bits=8"]
+            )
+        )
+
+    def test_acceptHonoursContextTakeover(self):
+        deflate = PerMessageDeflateFactory(
+            clientNoContextTakeover=True
+        ).accept([b"permessage-deflate; server_no_context_takeover"])
+        self.assertEqual(
+            b"permessage-deflate; server_no_context_takeover; "
+            b"client_no_context_takeover",
+            deflate.responseHeader(),
+        )
+
+    def test_compressMessageKeepsContext(self):
+        deflate = PerMessageDeflate()
+        message = b"Hello " * 100
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        first, compressed = deflate.compressMessage(message)
+        self.assertTrue(compressed)
+        second, _ = deflate.compressMessage(message)
+        self.assertLess(len(second), len(first))
+        self.assertEqual(
+            message, decompress_like_client(first, decompressor)
+        )
+        self.assertEqual(
+            message, decompress_like_client(second, decompressor)
+        )
+
+    def test_compressMessageWithoutContextTakeover(self):
+        deflate = PerMessageDeflate(serverNoContextTakeover=True)
+        message = b"Hello " * 100
+        first, _ = deflate.compressMessage(message)
+        second, _ = deflate.compressMessage(message)
+        self.assertEqual(first, second)
+        self.assertEqual(message, decompress_like_client(second))
+
+    def test_compressMessageSkipsSmallMessages(self):
+        deflate = PerMessageDeflate(minSize=100)
+        self.assertEqual(
+            (b"Hello", False), deflate.compressMessage(b"Hello")
+        )
+
+    def test_parseCompressedFragments(self):
+        message = b"Hello " * 100
+        data = compress_like_client(message)
+        frames = [
+            _makeFrame(data[:10], CONTROLS.TEXT, False, rsv1=True)
+            + _makeFrame(data[10:], CONTROLS.CONTINUE, True)
+        ]
+        parsed = list(
+            _parseFrames(frames, needMask=False, deflate=PerMessageDeflate())
+        )
+        self.assertEqual(
+            message, b"".join(data for _, data, _ in parsed)
+        )
+
+    def test_parseUncompressedWithDeflate(self):
+        frames = [_makeFrame(b"Hello", CONTROLS.TEXT, True)]
+        parsed = list(
+            _parseFrames(frames, needMask=False, deflate=PerMessageDeflate())
+        )
+        self.assertEqual([(CONTROLS.TEXT, b"Hello", True)], parsed)
+
+    def test_parseCompressedControlFrame(self):
+        frames = [_makeFrame(b"", CONTROLS.PING, True, rsv1=True)]
+        self.assertRaises(
+            _WSException,
+            list,
+            _parseFrames(
+                frames, needMask=False, deflate=PerMessageDeflate()
+            ),
+        )
+
+    def test_decompressFrameCapsInflatedSize(self):
+        deflate = PerMessageDeflate(maxMessageSize=1000)
+        data = compress_like_client(b"\x00" * 1000)
+        self.assertEqual(
+            b"\x00" * 1000, deflate.decompressFrame(data, True, False, True)
+        )
+        data = compress_like_client(b"\x00" * 10 ** 7)
+        self.assertRaises(
+            _WSMessageTooBig,
+            deflate.decompressFrame,
+            data[:100],
+            True,
+            False,
+            False,
+        )
+        # No more than the limit was inflated from the small first frame.
+        self.assertEqual(1001, deflate._inflated)
+
+    def test_decompressFrameCapsWholeMessage(self):
+        deflate = PerMessageDeflate(maxMessageSize=1000)
+        data = compress_like_client(b"Hello " * 200)
+        deflate.decompressFrame(data[:10], True, False, False)
+        self.assertRaises(
+            _WSMessageTooBig,
+            deflate.decompressFrame,
+            data[10:],
+            False,
+            True,
+            True,
+        )
+
+    def test_sendFrameCompresses(self):
+        transport = StringTransportWithDisconnection()
+        transport.protocol = Protocol()
+        webSocketsTransport = WebSocketsTransport(
+            transport, PerMessageDeflate()
+        )
+        message = b"Hello " * 100
+        webSocketsTransport.sendFrame(CONTROLS.TEXT, message, True)
+        [(opcode, data, fin)] = _parseFrames(
+            [transport.value()], needMask=False, deflate=PerMessageDeflate()
+        )
+        self.assertEqual(message, data)
+
+
 @implementer(IWebSocketsFrameReceiver)
 class SavingEchoReceiver:
     """
@@ -405,6 +575,29 @@ class WebSocketsProtocolTest(MAASTestCase):
             ["Closing connection: <STATUSES=NONE>"], logger.messages
         )
 
+    def test_messageTooBig(self):
+        """
+        If a compressed message inflates to more than allowed,
+        L{WebSocketsProtocol} closes the connection with C{MESSAGE_TOO_BIG}.
+        """
+        self.protocol = WebSocketsProtocol(
+            self.receiver, PerMessageDeflate(maxMessageSize=1000)
+        )
+        self.transport = StringTransportWithDisconnection()
+        self.protocol.makeConnection(self.transport)
+        self.transport.protocol = self.protocol
+        data = compress_like_client(b"\x00" * 10 ** 6)
+        self.protocol.dataReceived(
+            _makeFrame(data, CONTROLS.TEXT, True, mask=b"abcd", rsv1=True)
+        )
+        self.assertFalse(self.transport.connected)
+        [(opcode, (code, _), _)] = _parseFrames(
+            [self.transport.value()], needMask=False
+        )
+        self.assertEqual(CONTROLS.CLOSE, opcode)
+        self.assertEqual(STATUSES.MESSAGE_TOO_BIG, code)
+        self.assertEqual([], self.receiver.received)
+
     def test_invalidFrame(self):
         """
         If an invalid frame is received, L{WebSocketsProtocol} closes the
@@ -646,6 +839,47 @@ class WebSocketsResourceTest(MAASTestCase):
         self.assertEqual(request.getHeader(b"cookie"), transport.cookies)
         self.assertEqual(request.uri, transport.uri)
 
+    def test_renderDeflate(self):
+        """
+        If the client offers the permessage-deflate extension and the
+        resource has a deflate factory, the extension is negotiated.
+        """
+        self.resource = WebSocketsResource(
+            self.resource._lookupProtocol,
+            deflateFactory=PerMessageDeflateFactory(),
+        )
+        request = DummyRequest(b"/")
+        request.requestHeaders = Headers(
+            {
+                b"sec-websocket-extensions": [
+                    b"permessage-deflate; client_max_window_bits"
+                ],
+                b"user-agent": [b"user-agent"],
+                b"host": [b"host"],
+            }
+        )
+        transport = StringTransportWithDisconnection()
+        transport.protocol = Protocol()
+        request.transport = transport
+        self.update_headers(
+            request,
+            headers={
+                b"upgrade": b"Websocket",
+                b"connection": b"Upgrade",
+                b"sec-websocket-key": b"secure",
+                b"sec-websocket-version": b"13",
+            },
+        )
+        result = self.resource.render(request)
+        self.assertEqual(NOT_DONE_YET, result)
+        self.assertEqual(
+            [b"permessage-deflate"],
+            request.responseHeaders.getRawHeaders(b"Sec-WebSocket-Extensions"),
+        )
+        self.assertIsInstance(
+            transport.protocol._deflate, PerMessageDeflate
+        )
+
     def test_renderProtocol(self):
         """
         If protocols are specified via the C{Sec-WebSocket-Protocol} header,
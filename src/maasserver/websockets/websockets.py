@@ -18,6 +18,8 @@ __all__ = [
     "lookupProtocolForFactory",
     "WebSocketsProtocol",
     "WebSocketsProtocolWrapper",
+    "PerMessageDeflate",
+    "PerMessageDeflateFactory",
     "CONTROLS",
     "STATUSES",
 ]
@@ -28,6 +30,7 @@ from hashlib import sha1
 from itertools import cycle
 from struct import pack, unpack
 from typing import List, Sequence
+import zlib
 
 from twisted.internet.protocol import Protocol
 from twisted.protocols.tls import TLSMemoryBIOProtocol
@@ -37,6 +40,7 @@ from twisted.web.server import NOT_DONE_YET
 from zope.interface import directlyProvides, implementer, Interface, providedBy
 
 from provisioningserver.logger import LegacyLogger
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.utils import typed
 
 log = LegacyLogger()
@@ -48,6 +52,13 @@ class _WSException(Exception):
     """
 
 
+class _WSMessageTooBig(_WSException):
+    """
+    Internal exception raised when a compressed message inflates to more
+    than the size allowed.
+    """
+
+
 class CONTROLS(Values):
     """
     Control frame specifiers.
@@ -87,6 +98,9 @@ class STATUSES(Values):
 # The GUID for WebSockets, from RFC 6455.
 _WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
 
+# The largest size a compressed incoming message may inflate to.
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
 
 @typed
 def _makeAccept(key: bytes) -> bytes:
@@ -121,7 +135,9 @@ def _mask(buf: bytes, key: bytes) -> bytes:
 
 
 @typed
-def _makeFrame(buf: bytes, opcode, fin: bool, mask: bytes = None) -> bytes:
+def _makeFrame(
+    buf: bytes, opcode, fin: bool, mask: bytes = None, rsv1: bool = False
+) -> bytes:
     """
     Make a frame.
 
@@ -140,6 +156,10 @@ def _makeFrame(buf: bytes, opcode, fin: bool, mask: bytes = None) -> bytes:
     @type mask: C{bytes} or C{NoneType}
     @param mask: If specified, the masking key to apply on the created frame.
 
+    @type rsv1: C{bool}
+    @param rsv1: Whether to set the RSV1 bit, marking a compressed message
+        when permessage-deflate is in use.
+
     @rtype: C{bytes}
     @return: A packed frame.
     """
@@ -166,6 +186,8 @@ def _makeFrame(buf: bytes, opcode, fin: bool, mask: bytes = None) -> bytes:
         header = 0x80
     else:
         header = 0x01
+    if rsv1:
+        header |= 0x40
 
     header = bytes([header | opcode.value])
     if mask is not None:
@@ -175,7 +197,9 @@ def _makeFrame(buf: bytes, opcode, fin: bool, mask: bytes = None) -> bytes:
 
 
 @typed
-def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
+def _parseFrames(
+    frameBuffer: List[bytes], needMask: bool = True, deflate=None
+):
     """
     Parse frames in a highly compliant manner. It modifies C{frameBuffer}
     removing the parsed content from it.
@@ -185,6 +209,10 @@ def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
 
     @param needMask: If C{True}, refuse any frame which is not masked.
     @type needMask: C{bool}
+
+    @param deflate: The negotiated permessage-deflate extension, used to
+        decompress the data frames of compressed messages.
+    @type deflate: L{PerMessageDeflate} or C{NoneType}
     """
     start = 0
     payload = b"".join(frameBuffer)
@@ -196,9 +224,15 @@ def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
 
         # Grab the header. This single byte holds some flags and an opcode
         header = payload[start]
-        if header & 0x70:
+        if deflate is None:
+            reserved = 0x70
+        else:
+            # RSV1 marks compressed messages when permessage-deflate is used.
+            reserved = 0x30
+        if header & reserved:
             # At least one of the reserved flags is set. Pork chop sandwiches!
             raise _WSException("Reserved flag in frame (%d)" % (header,))
+        compressed = bool(header & 0x40)
 
         fin = header & 0x80
 
@@ -209,6 +243,9 @@ def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
             opcode = CONTROLS.lookupByValue(opcode)
         except ValueError:
             raise _WSException("Unknown opcode %d in frame" % opcode)
+        if compressed and opcode not in (CONTROLS.TEXT, CONTROLS.BINARY):
+            # Only the first frame of a data message can be marked.
+            raise _WSException("Compressed flag on %s frame" % opcode.name)
 
         # Get the payload length and determine whether we need to look for an
         # extra length.
@@ -260,6 +297,18 @@ def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
         if masked:
             data = _mask(data, key)
 
+        if deflate is not None and opcode in (
+            CONTROLS.TEXT,
+            CONTROLS.BINARY,
+            CONTROLS.CONTINUE,
+        ):
+            try:
+                data = deflate.decompressFrame(
+                    data, compressed, opcode == CONTROLS.CONTINUE, bool(fin)
+                )
+            except zlib.error as error:
+                raise _WSException("Invalid compressed data: %s" % error)
+
         if opcode == CONTROLS.CLOSE:
             if len(data) >= 2:
                 # Gotta unpack the opcode and return usable data here.
@@ -278,6 +327,229 @@ def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
         frameBuffer[:] = []
 
 
+def _parseExtensions(headers: Sequence):
+    """
+    Parse C{Sec-WebSocket-Extensions} header values.
+
+    @param headers: The raw header values.
+    @type headers: C{list} of C{bytes}
+
+    @return: A list of (name, params) offers, in order of preference, where
+        params is a C{dict} mapping parameter names to their value, or to
+        C{None} for parameters without a value.
+    """
+    offers = []
+    for header in headers:
+        for offer in header.split(b","):
+            parts = [part.strip() for part in offer.split(b";")]
+            if not parts[0]:
+                continue
+            params = {}
+            for param in parts[1:]:
+                if not param:
+                    continue
+                name, sep, value = param.partition(b"=")
+                value = value.strip().strip(b'"') if sep else None
+                params[name.strip().lower()] = value
+            offers.append((parts[0].lower(), params))
+    return offers
+
+
+class PerMessageDeflate:
+    """
+    The permessage-deflate extension (RFC 7692) negotiated on a connection.
+
+    Outgoing messages at least C{minSize} bytes long are compressed, smaller
+    ones are sent as is. Incoming messages are decompressed when their first
+    frame has the RSV1 bit set, up to C{maxMessageSize} bytes per message.
+    """
+
+    name = b"permessage-deflate"
+
+    # Trailer removed from each compressed message, see RFC 7692 7.2.1.
+    _TAIL = b"\x00\x00\xff\xff"
+
+    def __init__(
+        self,
+        level=zlib.Z_DEFAULT_COMPRESSION,
+        minSize=0,
+        serverNoContextTakeover=False,
+        clientNoContextTakeover=False,
+        serverMaxWindowBits=zlib.MAX_WBITS,
+        maxMessageSize=MAX_MESSAGE_SIZE,
+    ):
+        self.level = level
+        self.minSize = minSize
+        self.serverNoContextTakeover = serverNoContextTakeover
+        self.clientNoContextTakeover = clientNoContextTakeover
+        self.serverMaxWindowBits = serverMaxWindowBits
+        self.maxMessageSize = maxMessageSize
+        self._compressor = None
+        # The client may use up to the maximum window size, as this server
+        # never asks for a smaller one.
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._inflating = False
+        self._inflated = 0
+
+    def responseHeader(self):
+        """
+        Return the C{Sec-WebSocket-Extensions} value accepting the extension.
+        """
+        params = [self.name]
+        if self.serverNoContextTakeover:
+            params.append(b"server_no_context_takeover")
+        if self.clientNoContextTakeover:
+            params.append(b"client_no_context_takeover")
+        if self.serverMaxWindowBits != zlib.MAX_WBITS:
+            params.append(
+                b"server_max_window_bits=%d" % self.serverMaxWindowBits
+            )
+        return b"; ".join(params)
+
+    def compressMessage(self, data: bytes):
+        """
+        Compress an outgoing message.
+
+        @return: A tuple of the payload to send, and whether it is compressed.
+        """
+        if len(data) < self.minSize:
+            payload, compressed = data, False
+        else:
+            if self._compressor is None or self.serverNoContextTakeover:
+                self._compressor = zlib.compressobj(
+                    self.level, zlib.DEFLATED, -self.serverMaxWindowBits
+                )
+            payload = self._compressor.compress(data)
+            payload += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            if payload.endswith(self._TAIL):
+                payload = payload[: -len(self._TAIL)]
+            compressed = True
+        PROMETHEUS_METRICS.update(
+            "maas_websocket_sent_bytes", "inc", value=len(data)
+        )
+        PROMETHEUS_METRICS.update(
+            "maas_websocket_sent_wire_bytes", "inc", value=len(payload)
+        )
+        return payload, compressed
+
+    def decompressFrame(
+        self, data: bytes, compressed: bool, continuation: bool, fin: bool
+    ):
+        """
+        Decompress an incoming data frame if its message is compressed.
+
+        @param compressed: Whether the RSV1 bit is set on the frame.
+        @param continuation: Whether the frame continues a message.
+        @param fin: Whether the frame is the last one of its message.
+
+        @raise _WSMessageTooBig: If the message inflates to more than
+            C{maxMessageSize} bytes.
+        """
+        if not continuation:
+            self._inflating = compressed
+            self._inflated = 0
+        if not self._inflating:
+            return data
+        data = self._inflate(data)
+        if fin:
+            data += self._inflate(self._TAIL)
+            self._inflating = False
+        return data
+
+    def _inflate(self, data):
+        # Inflate no more than one byte past the limit, so that a small
+        # frame can't make it allocate much more memory than allowed.
+        allowed = self.maxMessageSize - self._inflated
+        data = self._decompressor.decompress(data, allowed + 1)
+        self._inflated += len(data)
+        if self._inflated > self.maxMessageSize:
+            raise _WSMessageTooBig(
+                "Message is larger than %d bytes" % self.maxMessageSize
+            )
+        return data
+
+
+class PerMessageDeflateFactory:
+    """
+    Negotiate L{PerMessageDeflate} with the offers made by clients.
+
+    @ivar level: The zlib compression level, from 0 to 9.
+    @ivar minSize: Outgoing messages smaller than this are not compressed.
+    @ivar serverNoContextTakeover: Whether to reset the compression context
+        for each message, trading compression ratio for memory.
+    @ivar clientNoContextTakeover: Whether to ask clients to reset their
+        compression context for each message.
+    @ivar serverMaxWindowBits: The compression window size, from 9 to 15.
+    @ivar maxMessageSize: The largest size a compressed incoming message may
+        inflate to.
+    """
+
+    def __init__(
+        self,
+        level=zlib.Z_DEFAULT_COMPRESSION,
+        minSize=1024,
+        serverNoContextTakeover=False,
+        clientNoContextTakeover=False,
+        serverMaxWindowBits=zlib.MAX_WBITS,
+        maxMessageSize=MAX_MESSAGE_SIZE,
+    ):
+        self.level = level
+        self.minSize = minSize
+        self.serverNoContextTakeover = serverNoContextTakeover
+        self.clientNoContextTakeover = clientNoContextTakeover
+        self.serverMaxWindowBits = serverMaxWindowBits
+        self.maxMessageSize = maxMessageSize
+
+    def accept(self, headers: Sequence):
+        """
+        Return a L{PerMessageDeflate} for the first acceptable offer in the
+        C{Sec-WebSocket-Extensions} C{headers}, or C{None}.
+        """
+        for name, params in _parseExtensions(headers):
+            if name != PerMessageDeflate.name:
+                continue
+            deflate = self._acceptOffer(params)
+            if deflate is not None:
+                return deflate
+        return None
+
+    def _acceptOffer(self, params):
+        serverNoContextTakeover = self.serverNoContextTakeover
+        serverMaxWindowBits = self.serverMaxWindowBits
+        for name, value in params.items():
+            if name == b"server_no_context_takeover":
+                if value is not None:
+                    return None
+                serverNoContextTakeover = True
+            elif name == b"client_no_context_takeover":
+                if value is not None:
+                    return None
+            elif name == b"server_max_window_bits":
+                try:
+                    bits = int(value)
+                except (TypeError, ValueError):
+                    return None
+                # zlib cannot produce raw deflate data with 8 bits windows.
+                if not 9 <= bits <= 15:
+                    return None
+                serverMaxWindowBits = min(serverMaxWindowBits, bits)
+            elif name == b"client_max_window_bits":
+                # The server can always decompress with the largest window,
+                # so there is no need to limit the client.
+                if value is not None and not value.isdigit():
+                    return None
+            else:
+                return None
+        return PerMessageDeflate(
+            level=self.level,
+            minSize=self.minSize,
+            serverNoContextTakeover=serverNoContextTakeover,
+            clientNoContextTakeover=self.clientNoContextTakeover,
+            serverMaxWindowBits=serverMaxWindowBits,
+            maxMessageSize=self.maxMessageSize,
+        )
+
+
 class IWebSocketsFrameReceiver(Interface):
     """
     An interface for receiving WebSockets frames.
@@ -320,14 +592,18 @@ class WebSocketsTransport:
 
     _disconnecting = False
 
-    def __init__(self, transport):
+    def __init__(self, transport, deflate=None):
         self._transport = transport
+        self._deflate = deflate
 
     @typed
     def sendFrame(self, opcode, data: bytes, fin: bool):
         """
         Build a frame packet and send it over the wire.
 
+        Complete data messages are compressed if permessage-deflate has been
+        negotiated.
+
         @type opcode: C{CONTROLS}
         @param opcode: The type of frame to send.
 
@@ -337,7 +613,14 @@ class WebSocketsTransport:
         @type fin: C{bool}
         @param fin: Whether or not we're sending a final frame.
         """
-        packet = _makeFrame(data, opcode, fin)
+        compressed = False
+        if (
+            self._deflate is not None
+            and fin
+            and opcode in (CONTROLS.TEXT, CONTROLS.BINARY)
+        ):
+            data, compressed = self._deflate.compressMessage(data)
+        packet = _makeFrame(data, opcode, fin, rsv1=compressed)
         self._transport.write(packet)
 
     @typed
@@ -381,13 +664,17 @@ class WebSocketsProtocol(Protocol):
     @ivar _buffer: The pending list of frames not processed yet.
     @type _buffer: C{list}
 
+    @ivar _deflate: The negotiated permessage-deflate extension, if any.
+    @type _deflate: L{PerMessageDeflate} or C{NoneType}
+
     @since: 13.2
     """
 
     _buffer = None
 
-    def __init__(self, receiver):
+    def __init__(self, receiver, deflate=None):
         self._receiver = receiver
+        self._deflate = deflate
 
     def connectionMade(self):
         """
@@ -396,13 +683,17 @@ class WebSocketsProtocol(Protocol):
         peer = self.transport.getPeer()
         log.debug("Opening connection with {peer}", peer=peer)
         self._buffer = []
-        self._receiver.makeConnection(WebSocketsTransport(self.transport))
+        self._receiver.makeConnection(
+            WebSocketsTransport(self.transport, self._deflate)
+        )
 
     def _parseFrames(self):
         """
         Find frames in incoming data and pass them to the underlying protocol.
         """
-        for opcode, data, fin in _parseFrames(self._buffer):
+        for opcode, data, fin in _parseFrames(
+            self._buffer, deflate=self._deflate
+        ):
             self._receiver.frameReceived(opcode, data, fin)
             if opcode == CONTROLS.CLOSE:
                 # The other side wants us to close.
@@ -432,6 +723,12 @@ class WebSocketsProtocol(Protocol):
         self._buffer.append(data)
         try:
             self._parseFrames()
+        except _WSMessageTooBig as error:
+            log.debug("Closing connection: {error}", error=error)
+            reason = pack(">H", STATUSES.MESSAGE_TOO_BIG.value)
+            reason += str(error).encode("utf-8")
+            self.transport.write(_makeFrame(reason, CONTROLS.CLOSE, True))
+            self.transport.loseConnection()
         except _WSException:
             # Couldn't parse all the frames, something went wrong, let's bail.
             log.err()
@@ -504,11 +801,13 @@ class WebSocketsProtocolWrapper(WebSocketsProtocol):
     @since: 13.2
     """
 
-    def __init__(self, wrappedProtocol, defaultOpcode=CONTROLS.TEXT):
+    def __init__(
+        self, wrappedProtocol, defaultOpcode=CONTROLS.TEXT, deflate=None
+    ):
         self.wrappedProtocol = wrappedProtocol
         self.defaultOpcode = defaultOpcode
         WebSocketsProtocol.__init__(
-            self, _WebSocketsProtocolWrapperReceiver(wrappedProtocol)
+            self, _WebSocketsProtocolWrapperReceiver(wrappedProtocol), deflate
         )
 
     def makeConnection(self, transport):
@@ -590,13 +889,18 @@ class WebSocketsResource:
         L{lookupProtocolForFactory}.
     @type lookupProtocol: C{callable}.
 
+    @param deflateFactory: If specified, used to negotiate permessage-deflate
+        compression with the clients offering it.
+    @type deflateFactory: L{PerMessageDeflateFactory} or C{NoneType}
+
     @since: 13.2
     """
 
     isLeaf = True
 
-    def __init__(self, lookupProtocol):
+    def __init__(self, lookupProtocol, deflateFactory=None):
         self._lookupProtocol = lookupProtocol
+        self._deflateFactory = deflateFactory
 
     def getChildWithDefault(self, name, request):
         """
@@ -699,6 +1003,17 @@ class WebSocketsResource:
         # 4.2.2.5.5 Optional codec declaration
         if protocolName:
             request.setHeader(b"Sec-WebSocket-Protocol", protocolName)
+        # 4.2.2.5.6 Optional extensions, only permessage-deflate is supported.
+        deflate = None
+        offers = request.requestHeaders.getRawHeaders(
+            b"Sec-WebSocket-Extensions"
+        )
+        if self._deflateFactory is not None and offers:
+            deflate = self._deflateFactory.accept(offers)
+            if deflate is not None:
+                request.setHeader(
+                    b"Sec-WebSocket-Extensions", deflate.responseHeader()
+                )
 
         # Provoke request into flushing headers and finishing the handshake.
         request.write(b"")
@@ -729,7 +1044,9 @@ class WebSocketsResource:
         transport.host = request.requestHeaders.getRawHeaders("host")[0]
 
         if not isinstance(protocol, WebSocketsProtocol):
-            protocol = WebSocketsProtocolWrapper(protocol)
+            protocol = WebSocketsProtocolWrapper(protocol, deflate=deflate)
+        elif deflate is not None:
+            protocol._deflate = deflate
 
         # Connect the transport to our factory, and make things go. We need to
         # do some stupid stuff here; see #3204, which could fix it.
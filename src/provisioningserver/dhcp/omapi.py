@@ -0,0 +1,554 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Native client for the OMAPI protocol spoken by the ISC DHCP server.
+
+This replaces running `omshell` once per change: a single authenticated
+connection is kept open to each DHCP server, and batches of messages are
+written to it together before the responses are read back.
+"""
+
+__all__ = ["OmapiClient", "OmapiError", "OmapiMessage"]
+
+import base64
+import hashlib
+import hmac
+from itertools import count, islice
+import random
+import socket
+import struct
+
+from netaddr import EUI, IPAddress
+
+from provisioningserver.logger import LegacyLogger
+
+log = LegacyLogger()
+
+
+OMAPI_PROTOCOL_VERSION = 100
+OMAPI_HEADER_SIZE = 24
+
+OMAPI_OP_OPEN = 1
+OMAPI_OP_REFRESH = 2
+OMAPI_OP_UPDATE = 3
+OMAPI_OP_NOTIFY = 4
+OMAPI_OP_STATUS = 5
+OMAPI_OP_DELETE = 6
+
+# ISC result codes that are of interest here.
+ISC_R_SUCCESS = 0
+ISC_R_EXISTS = 18
+ISC_R_NOTFOUND = 23
+ISC_R_FAILURE = 25
+ISC_R_IOERROR = 26
+
+HMAC_MD5_ALGORITHM = b"hmac-md5.SIG-ALG.REG.INT."
+HMAC_MD5_LENGTH = 16
+
+_net16 = struct.Struct("!H")
+_net32 = struct.Struct("!I")
+_header = struct.Struct("!6I")
+_signed_header = struct.Struct("!5I")
+
+
+class OmapiError(Exception):
+    """An OMAPI conversation with the DHCP server failed."""
+
+
+class OmapiMessage:
+    """A single OMAPI message.
+
+    `message` and `obj` are sequences of `(name, value)` pairs of byte
+    strings: the former describes the request, the latter the object it
+    applies to.
+    """
+
+    def __init__(
+        self,
+        opcode,
+        handle=0,
+        tid=0,
+        rid=0,
+        message=(),
+        obj=(),
+        authid=0,
+        signature=b"",
+    ):
+        self.opcode = opcode
+        self.handle = handle
+        self.tid = tid
+        self.rid = rid
+        self.message = list(message)
+        self.obj = list(obj)
+        self.authid = authid
+        self.signature = signature
+
+    def __repr__(self):
+        return "<%s opcode=%d handle=%d tid=%d rid=%d>" % (
+            self.__class__.__name__,
+            self.opcode,
+            self.handle,
+            self.tid,
+            self.rid,
+        )
+
+    @staticmethod
+    def _pack_values(values):
+        for name, value in values:
+            yield _net16.pack(len(name))
+            yield name
+            yield _net32.pack(len(value))
+            yield value
+        yield _net16.pack(0)
+
+    def as_bytes(self, for_signing=False):
+        """Return the wire format of this message.
+
+        :param for_signing: Return the bytes the signature is computed from,
+            which omit the signature and its length.
+        """
+        if for_signing:
+            header = _signed_header.pack(
+                self.authid, self.opcode, self.handle, self.tid, self.rid
+            )
+        else:
+            header = _header.pack(
+                self.authid,
+                len(self.signature),
+                self.opcode,
+                self.handle,
+                self.tid,
+                self.rid,
+            )
+        parts = [header]
+        parts.extend(self._pack_values(self.message))
+        parts.extend(self._pack_values(self.obj))
+        if not for_signing:
+            parts.append(self.signature)
+        return b"".join(parts)
+
+    def compute_signature(self, key):
+        """Return the HMAC-MD5 signature of this message using `key`."""
+        return hmac.new(
+            key, self.as_bytes(for_signing=True), hashlib.md5
+        ).digest()
+
+    def sign(self, authid, key):
+        """Sign this message as authenticator `authid` with `key`."""
+        self.authid = authid
+        self.signature = self.compute_signature(key)
+
+    def verify(self, key):
+        """Return whether this message is correctly signed with `key`."""
+        return hmac.compare_digest(self.signature, self.compute_signature(key))
+
+    def get_message(self, name, default=None):
+        """Return the value of `name` in the message part, or `default`."""
+        return dict(self.message).get(name, default)
+
+    def get_object(self, name, default=None):
+        """Return the value of `name` in the object part, or `default`."""
+        return dict(self.obj).get(name, default)
+
+    @classmethod
+    def read(cls, read_exactly):
+        """Read a message using `read_exactly(n)`, which returns `n` bytes."""
+
+        def read_values():
+            values = []
+            while True:
+                (name_length,) = _net16.unpack(read_exactly(_net16.size))
+                if name_length == 0:
+                    return values
+                name = read_exactly(name_length)
+                (value_length,) = _net32.unpack(read_exactly(_net32.size))
+                values.append((name, read_exactly(value_length)))
+
+        authid, authlen, opcode, handle, tid, rid = _header.unpack(
+            read_exactly(_header.size)
+        )
+        message = read_values()
+        obj = read_values()
+        signature = read_exactly(authlen)
+        return cls(
+            opcode,
+            handle=handle,
+            tid=tid,
+            rid=rid,
+            message=message,
+            obj=obj,
+            authid=authid,
+            signature=signature,
+        )
+
+
+def pack_startup():
+    """Return the startup message each end of a connection sends first."""
+    return _net32.pack(OMAPI_PROTOCOL_VERSION) + _net32.pack(
+        OMAPI_HEADER_SIZE
+    )
+
+
+def pack_int(value):
+    return _net32.pack(value)
+
+
+def unpack_int(value):
+    (value,) = _net32.unpack(value)
+    return value
+
+
+def pack_ip(ip_address):
+    return IPAddress(ip_address).packed
+
+
+def pack_mac(mac_address):
+    return EUI(mac_address).packed
+
+
+def get_host_name(mac_address):
+    """Return the name MAAS gives the host map for `mac_address`.
+
+    This is not a host name; it's an identifier used within the DHCP server.
+    """
+    return mac_address.replace(":", "-").encode("ascii")
+
+
+def describe_status(response):
+    """Return a description of the error in a STATUS `response`."""
+    description = response.get_message(b"message", b"").decode(
+        "utf-8", "replace"
+    )
+    result = unpack_int(response.get_message(b"result", pack_int(0)))
+    if description:
+        return "%s (result %d)" % (description, result)
+    else:
+        return "result %d" % result
+
+
+def get_result(response):
+    """Return the result code of `response`; success unless it's a STATUS."""
+    if response.opcode != OMAPI_OP_STATUS:
+        return ISC_R_SUCCESS
+    return unpack_int(response.get_message(b"result", pack_int(0)))
+
+
+class OmapiClient:
+    """A persistent, authenticated, connection to a DHCP server's OMAPI.
+
+    Changes are made in batches. Each message in a batch is written to the
+    connection before any response is read, so a batch costs one or two
+    round trips however many hosts it covers. The batch methods return a
+    dict of the items that could not be changed, mapped to a description of
+    the error; `OmapiError` is raised only when the server could not be
+    talked to at all.
+
+    :param server_address: The address for the DHCP server.
+    :param shared_key: The base64-encoded HMAC-MD5 key configured in the
+        DHCP server as `key_name`; see `generate_omapi_key`.
+    """
+
+    batch_size = 100
+
+    def __init__(
+        self,
+        server_address,
+        shared_key,
+        ipv6=False,
+        port=None,
+        key_name="omapi_key",
+        timeout=30,
+    ):
+        self.server_address = server_address
+        self.shared_key = shared_key
+        self.ipv6 = ipv6
+        if port is not None:
+            self.server_port = port
+        elif ipv6 is True:
+            self.server_port = 7912
+        else:
+            self.server_port = 7911
+        self.key_name = key_name
+        self.timeout = timeout
+        self._key = base64.b64decode(shared_key)
+        self._sock = None
+        self._authid = None
+        self._buffer = b""
+        self._tids = count(random.randrange(1, 2 ** 31))
+
+    def __repr__(self):
+        return "<%s %s:%d>" % (
+            self.__class__.__name__,
+            self.server_address,
+            self.server_port,
+        )
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def connect(self):
+        """Connect and authenticate to the DHCP server, if not already."""
+        if self._sock is not None:
+            return
+        try:
+            self._sock = socket.create_connection(
+                (self.server_address, self.server_port), self.timeout
+            )
+            self._sock.sendall(pack_startup())
+            if self._read_exactly(8) != pack_startup():
+                raise OmapiError("Unsupported OMAPI protocol version.")
+            response = self._exchange(
+                [
+                    OmapiMessage(
+                        OMAPI_OP_OPEN,
+                        message=[(b"type", b"authenticator")],
+                        obj=[
+                            (b"name", self.key_name.encode("ascii")),
+                            (b"algorithm", HMAC_MD5_ALGORITHM),
+                        ],
+                    )
+                ],
+                sign=False,
+            )[0]
+        except OSError as error:
+            self.close()
+            raise OmapiError(
+                "The DHCP server could not be reached: %s" % error
+            ) from error
+        except OmapiError:
+            self.close()
+            raise
+        if response.opcode != OMAPI_OP_UPDATE:
+            self.close()
+            raise OmapiError(
+                "The DHCP server rejected the OMAPI key: %s"
+                % describe_status(response)
+            )
+        self._authid = response.handle
+
+    def close(self):
+        """Close the connection; the next batch will reconnect."""
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._authid = None
+                self._buffer = b""
+
+    def _read_exactly(self, size):
+        while len(self._buffer) < size:
+            data = self._sock.recv(max(2 ** 16, size))
+            if not data:
+                raise OmapiError("The DHCP server closed the connection.")
+            self._buffer += data
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _exchange(self, messages, sign=True):
+        """Send all of `messages` then return their responses, in order."""
+        for message in messages:
+            message.tid = next(self._tids)
+            if sign:
+                message.sign(self._authid, self._key)
+        self._sock.sendall(
+            b"".join(message.as_bytes() for message in messages)
+        )
+        responses = {}
+        while len(responses) < len(messages):
+            response = OmapiMessage.read(self._read_exactly)
+            if sign and not response.verify(self._key):
+                raise OmapiError("The DHCP server sent an unsigned response.")
+            responses[response.rid] = response
+        try:
+            return [responses[message.tid] for message in messages]
+        except KeyError:
+            raise OmapiError("The DHCP server sent an unexpected response.")
+
+    def _run(self, items, operation):
+        """Apply `operation` to `items` one batch at a time.
+
+        A connection lost part way through a batch is re-established and the
+        batch is tried again, once; each operation can safely be repeated.
+        """
+        items = iter(items)
+        failures = {}
+        while True:
+            batch = list(islice(items, self.batch_size))
+            if len(batch) == 0:
+                return failures
+            for attempt in (1, 2):
+                self.connect()
+                try:
+                    failures.update(operation(batch))
+                except (OSError, OmapiError) as error:
+                    self.close()
+                    if attempt == 2:
+                        raise OmapiError(
+                            "Lost the connection to the DHCP server: %s"
+                            % error
+                        ) from error
+                    log.debug(
+                        "Reconnecting to the DHCP server at {client}: "
+                        "{error}",
+                        client=self,
+                        error=error,
+                    )
+                else:
+                    break
+
+    def _open_all(self, type_name, keys, lookups):
+        """Open existing objects of `type_name`.
+
+        :return: A list of `(key, response)` tuples.
+        """
+        messages = [
+            OmapiMessage(
+                OMAPI_OP_OPEN, message=[(b"type", type_name)], obj=lookup
+            )
+            for lookup in lookups
+        ]
+        return list(zip(keys, self._exchange(messages)))
+
+    def create_hosts(self, hosts):
+        """Create host maps.
+
+        :param hosts: An iterable of `(mac_address, ip_address)` tuples.
+        :return: A dict of failed MAC addresses to error descriptions. A
+            host map that already existed is not a failure.
+        """
+
+        def create(batch):
+            messages = [
+                OmapiMessage(
+                    OMAPI_OP_OPEN,
+                    message=[
+                        (b"create", pack_int(1)),
+                        (b"exclusive", pack_int(1)),
+                        (b"type", b"host"),
+                    ],
+                    obj=[
+                        (b"name", get_host_name(mac)),
+                        (b"hardware-address", pack_mac(mac)),
+                        (b"hardware-type", pack_int(1)),
+                        (b"ip-address", pack_ip(ip)),
+                    ],
+                )
+                for mac, ip in batch
+            ]
+            return {
+                mac: describe_status(response)
+                for (mac, _), response in zip(batch, self._exchange(messages))
+                if get_result(response)
+                not in (ISC_R_SUCCESS, ISC_R_EXISTS, ISC_R_IOERROR)
+            }
+
+        return self._run(hosts, create)
+
+    def modify_hosts(self, hosts):
+        """Change the IP addresses of existing host maps.
+
+        :param hosts: An iterable of `(mac_address, ip_address)` tuples.
+        :return: A dict of failed MAC addresses to error descriptions.
+        """
+
+        def modify(batch):
+            addresses = dict(batch)
+            opened = self._open_all(
+                b"host",
+                addresses,
+                ([(b"name", get_host_name(mac))] for mac in addresses),
+            )
+            failures = {
+                mac: describe_status(response)
+                for mac, response in opened
+                if get_result(response) != ISC_R_SUCCESS
+            }
+            opened = [
+                (mac, response)
+                for mac, response in opened
+                if mac not in failures
+            ]
+            messages = [
+                OmapiMessage(
+                    OMAPI_OP_UPDATE,
+                    handle=response.handle,
+                    obj=[
+                        (b"hardware-address", pack_mac(mac)),
+                        (b"hardware-type", pack_int(1)),
+                        (b"ip-address", pack_ip(addresses[mac])),
+                    ],
+                )
+                for mac, response in opened
+            ]
+            for (mac, _), response in zip(opened, self._exchange(messages)):
+                if get_result(response) != ISC_R_SUCCESS:
+                    failures[mac] = describe_status(response)
+            return failures
+
+        return self._run(hosts, modify)
+
+    def _open_and_apply(self, type_name, keys, lookups, action):
+        """Open existing objects then send `action(handle)` for each.
+
+        Objects that are not found are skipped without error.
+        """
+        opened = self._open_all(type_name, keys, lookups)
+        failures = {
+            key: describe_status(response)
+            for key, response in opened
+            if get_result(response) not in (ISC_R_SUCCESS, ISC_R_NOTFOUND)
+        }
+        opened = [
+            (key, response)
+            for key, response in opened
+            if get_result(response) == ISC_R_SUCCESS
+        ]
+        messages = [action(response.handle) for _, response in opened]
+        for (key, _), response in zip(opened, self._exchange(messages)):
+            if get_result(response) != ISC_R_SUCCESS:
+                failures[key] = describe_status(response)
+        return failures
+
+    def remove_hosts(self, mac_addresses):
+        """Remove host maps.
+
+        :param mac_addresses: An iterable of MAC addresses.
+        :return: A dict of failed MAC addresses to error descriptions. A
+            host map that did not exist is not a failure.
+        """
+
+        def remove(batch):
+            return self._open_and_apply(
+                b"host",
+                batch,
+                ([(b"name", get_host_name(mac))] for mac in batch),
+                lambda handle: OmapiMessage(OMAPI_OP_DELETE, handle=handle),
+            )
+
+        return self._run(mac_addresses, remove)
+
+    def nullify_leases(self, ip_addresses):
+        """Reset existing leases so they are no longer valid.
+
+        Leases can't be deleted, so their expiry is set to the epoch.
+
+        :param ip_addresses: An iterable of IP addresses.
+        :return: A dict of failed IP addresses to error descriptions. A lease
+            that did not exist is not a failure.
+        """
+
+        def nullify(batch):
+            return self._open_and_apply(
+                b"lease",
+                batch,
+                ([(b"ip-address", pack_ip(ip))] for ip in batch),
+                lambda handle: OmapiMessage(
+                    OMAPI_OP_UPDATE,
+                    handle=handle,
+                    obj=[(b"ends", pack_int(0))],
+                ),
+            )
+
+        return self._run(ip_addresses, nullify)
@@ -0,0 +1,202 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""A fake OMAPI server, for testing `OmapiClient` without dhcpd."""
+
+__all__ = ["FakeOmapiServer"]
+
+import base64
+from itertools import count
+import socket
+import socketserver
+import threading
+
+from fixtures import Fixture
+
+from provisioningserver.dhcp.omapi import (
+    HMAC_MD5_ALGORITHM,
+    ISC_R_EXISTS,
+    ISC_R_NOTFOUND,
+    ISC_R_SUCCESS,
+    OMAPI_OP_DELETE,
+    OMAPI_OP_OPEN,
+    OMAPI_OP_STATUS,
+    OMAPI_OP_UPDATE,
+    OmapiMessage,
+    pack_int,
+    pack_startup,
+)
+
+
+class FakeOmapiServer(Fixture):
+    """Serve host and lease objects over OMAPI on a port on localhost.
+
+    Host maps are kept in `hosts`, a dict of host names to dicts of their
+    attributes, and leases in `leases`, a dict of packed IP addresses to
+    dicts of their attributes; names and values are byte strings, as they
+    are on the wire.
+
+    :ivar port: The port to connect to.
+    :ivar connections: The number of connections that have been accepted.
+    :ivar messages: The number of messages that have been received.
+    :ivar errors: A dict of host names to result codes. Any request about
+        those hosts gets a STATUS response with that result.
+    """
+
+    def __init__(self, shared_key, key_name="omapi_key"):
+        super().__init__()
+        self.key = base64.b64decode(shared_key)
+        self.key_name = key_name.encode("ascii")
+        self.hosts = {}
+        self.leases = {}
+        self.errors = {}
+        self.connections = 0
+        self.messages = 0
+        self._handles = {}
+        self._next_handle = count(1)
+        self._sockets = set()
+        self._lock = threading.RLock()
+
+    def _setUp(self):
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                fake._serve(self.request)
+
+        self.server = socketserver.ThreadingTCPServer(
+            ("127.0.0.1", 0), Handler
+        )
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}
+        )
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.drop_connections)
+
+    def drop_connections(self):
+        """Close every open connection, as restarting dhcpd would."""
+        with self._lock:
+            for sock in self._sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _serve(self, sock):
+        with self._lock:
+            self.connections += 1
+            self._sockets.add(sock)
+        reader = sock.makefile("rb")
+        try:
+            if reader.read(8) != pack_startup():
+                return
+            sock.sendall(pack_startup())
+            authid = None
+            while True:
+                try:
+                    request = OmapiMessage.read(
+                        lambda size: self._read_exactly(reader, size)
+                    )
+                except EOFError:
+                    return
+                with self._lock:
+                    self.messages += 1
+                    if authid is None:
+                        response = self._authenticate(request)
+                        if response.opcode == OMAPI_OP_UPDATE:
+                            authid = response.handle
+                    elif request.authid != authid or not request.verify(
+                        self.key
+                    ):
+                        return
+                    else:
+                        response = self._process(request)
+                response.rid = request.tid
+                if authid is not None and request.authid == authid:
+                    response.sign(authid, self.key)
+                sock.sendall(response.as_bytes())
+        except OSError:
+            pass
+        finally:
+            reader.close()
+            with self._lock:
+                self._sockets.discard(sock)
+
+    @staticmethod
+    def _read_exactly(reader, size):
+        data = reader.read(size)
+        if len(data) < size:
+            raise EOFError()
+        return data
+
+    @staticmethod
+    def _status(result, message=b""):
+        return OmapiMessage(
+            OMAPI_OP_STATUS,
+            message=[(b"result", pack_int(result)), (b"message", message)],
+        )
+
+    def _authenticate(self, request):
+        if (
+            request.opcode == OMAPI_OP_OPEN
+            and request.get_message(b"type") == b"authenticator"
+            and request.get_object(b"name") == self.key_name
+            and request.get_object(b"algorithm") == HMAC_MD5_ALGORITHM
+        ):
+            handle = next(self._next_handle)
+            return OmapiMessage(OMAPI_OP_UPDATE, handle=handle)
+        else:
+            return self._status(ISC_R_NOTFOUND, b"no key")
+
+    def _process(self, request):
+        if request.opcode == OMAPI_OP_OPEN:
+            return self._open(request)
+        elif request.handle not in self._handles:
+            return self._status(ISC_R_NOTFOUND, b"invalid handle")
+        objects, key = self._handles[request.handle]
+        if key in self.errors:
+            return self._status(self.errors[key], b"failed")
+        elif key not in objects:
+            return self._status(ISC_R_NOTFOUND, b"not found")
+        elif request.opcode == OMAPI_OP_UPDATE:
+            objects[key].update(request.obj)
+            return OmapiMessage(
+                OMAPI_OP_UPDATE,
+                handle=request.handle,
+                obj=sorted(objects[key].items()),
+            )
+        elif request.opcode == OMAPI_OP_DELETE:
+            del objects[key]
+            return self._status(ISC_R_SUCCESS)
+        else:
+            return self._status(ISC_R_NOTFOUND, b"not implemented")
+
+    def _open(self, request):
+        type_name = request.get_message(b"type")
+        if type_name == b"host":
+            objects, key = self.hosts, request.get_object(b"name")
+        elif type_name == b"lease":
+            objects, key = self.leases, request.get_object(b"ip-address")
+        else:
+            return self._status(ISC_R_NOTFOUND, b"unknown type")
+        if key in self.errors:
+            return self._status(self.errors[key], b"failed")
+        if request.get_message(b"create") == pack_int(1):
+            if key in objects:
+                if request.get_message(b"exclusive") == pack_int(1):
+                    return self._status(ISC_R_EXISTS, b"already exists")
+            else:
+                objects[key] = dict(request.obj)
+        elif key not in objects:
+            return self._status(ISC_R_NOTFOUND, b"not found")
+        handle = next(self._next_handle)
+        self._handles[handle] = objects, key
+        return OmapiMessage(
+            OMAPI_OP_UPDATE, handle=handle, obj=sorted(objects[key].items())
+        )
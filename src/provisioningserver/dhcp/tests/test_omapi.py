@@ -0,0 +1,262 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the native OMAPI client."""
+
+__all__ = []
+
+import base64
+import socket
+
+from netaddr import EUI, IPAddress
+from testtools.matchers import Equals, HasLength, MatchesStructure
+
+from maastesting.factory import factory
+from maastesting.testcase import MAASTestCase
+from provisioningserver.dhcp import omapi
+from provisioningserver.dhcp.omapi import (
+    ISC_R_FAILURE,
+    OMAPI_OP_OPEN,
+    OmapiClient,
+    OmapiError,
+    OmapiMessage,
+)
+from provisioningserver.dhcp.omshell import generate_omapi_key
+from provisioningserver.dhcp.testing.omapi import FakeOmapiServer
+
+
+class TestOmapiMessage(MAASTestCase):
+    def make_message(self):
+        return OmapiMessage(
+            OMAPI_OP_OPEN,
+            handle=factory.pick_port(),
+            tid=factory.pick_port(),
+            rid=factory.pick_port(),
+            message=[(b"type", b"host")],
+            obj=[(factory.make_bytes(5), factory.make_bytes(10))],
+        )
+
+    def read_back(self, data):
+        data = iter([data])
+        buffer = bytearray()
+
+        def read_exactly(size):
+            while len(buffer) < size:
+                buffer.extend(next(data))
+            chunk = bytes(buffer[:size])
+            del buffer[:size]
+            return chunk
+
+        return OmapiMessage.read(read_exactly)
+
+    def test_round_trips(self):
+        message = self.make_message()
+        message.sign(factory.pick_port(), factory.make_bytes())
+        self.assertThat(
+            self.read_back(message.as_bytes()),
+            MatchesStructure.byEquality(
+                opcode=message.opcode,
+                handle=message.handle,
+                tid=message.tid,
+                rid=message.rid,
+                message=message.message,
+                obj=message.obj,
+                authid=message.authid,
+                signature=message.signature,
+            ),
+        )
+
+    def test_sign_uses_hmac_md5(self):
+        message = self.make_message()
+        message.sign(1, factory.make_bytes())
+        self.assertThat(message.signature, HasLength(16))
+
+    def test_verify(self):
+        key = factory.make_bytes()
+        message = self.make_message()
+        message.sign(1, key)
+        self.assertTrue(message.verify(key))
+        self.assertFalse(message.verify(factory.make_bytes()))
+        message.tid += 1
+        self.assertFalse(message.verify(key))
+
+    def test_signature_does_not_cover_itself(self):
+        key = factory.make_bytes()
+        message = self.make_message()
+        message.sign(1, key)
+        self.assertTrue(self.read_back(message.as_bytes()).verify(key))
+
+
+class TestOmapiClient(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.omapi_key = generate_omapi_key()
+        self.server = self.useFixture(FakeOmapiServer(self.omapi_key))
+
+    def make_client(self, **kwargs):
+        kwargs.setdefault("port", self.server.port)
+        client = OmapiClient("127.0.0.1", self.omapi_key, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def make_hosts(self, count):
+        return [
+            (factory.make_mac_address(), factory.make_ipv4_address())
+            for _ in range(count)
+        ]
+
+    def get_name(self, mac):
+        return mac.replace(":", "-").encode("ascii")
+
+    def add_hosts(self, hosts):
+        for mac, ip in hosts:
+            self.server.hosts[self.get_name(mac)] = {
+                b"hardware-address": EUI(mac).packed,
+                b"ip-address": IPAddress(ip).packed,
+            }
+
+    def test_default_ports(self):
+        self.assertEqual(7911, OmapiClient("", self.omapi_key).server_port)
+        self.assertEqual(
+            7912, OmapiClient("", self.omapi_key, ipv6=True).server_port
+        )
+
+    def test_create_hosts(self):
+        hosts = self.make_hosts(3)
+        self.assertEqual({}, self.make_client().create_hosts(hosts))
+        self.assertItemsEqual(
+            [self.get_name(mac) for mac, _ in hosts], list(self.server.hosts)
+        )
+        for mac, ip in hosts:
+            self.assertThat(
+                self.server.hosts[self.get_name(mac)],
+                Equals(
+                    {
+                        b"name": self.get_name(mac),
+                        b"hardware-address": EUI(mac).packed,
+                        b"hardware-type": b"\x00\x00\x00\x01",
+                        b"ip-address": IPAddress(ip).packed,
+                    }
+                ),
+            )
+
+    def test_create_hosts_ignores_existing_hosts(self):
+        hosts = self.make_hosts(2)
+        self.add_hosts(hosts[:1])
+        self.assertEqual({}, self.make_client().create_hosts(hosts))
+        self.assertThat(self.server.hosts, HasLength(2))
+
+    def test_modify_hosts(self):
+        hosts = self.make_hosts(3)
+        self.add_hosts(hosts)
+        new_ip = factory.make_ipv4_address()
+        client = self.make_client()
+        self.assertEqual(
+            {}, client.modify_hosts((mac, new_ip) for mac, _ in hosts)
+        )
+        for mac, _ in hosts:
+            self.assertEqual(
+                IPAddress(new_ip).packed,
+                self.server.hosts[self.get_name(mac)][b"ip-address"],
+            )
+
+    def test_modify_hosts_reports_missing_hosts(self):
+        [(mac, ip)] = self.make_hosts(1)
+        failures = self.make_client().modify_hosts([(mac, ip)])
+        self.assertEqual([mac], list(failures))
+        self.assertDocTestMatches("not found...", failures[mac])
+
+    def test_remove_hosts(self):
+        hosts = self.make_hosts(3)
+        self.add_hosts(hosts)
+        macs = [mac for mac, _ in hosts]
+        self.assertEqual({}, self.make_client().remove_hosts(macs[:2]))
+        self.assertEqual([self.get_name(macs[2])], list(self.server.hosts))
+
+    def test_remove_hosts_ignores_missing_hosts(self):
+        macs = [mac for mac, _ in self.make_hosts(2)]
+        self.assertEqual({}, self.make_client().remove_hosts(macs))
+
+    def test_nullify_leases(self):
+        ip = factory.make_ipv4_address()
+        self.server.leases[IPAddress(ip).packed] = {b"ends": b"\xff" * 4}
+        missing_ip = factory.make_ipv4_address()
+        self.assertEqual(
+            {}, self.make_client().nullify_leases([ip, missing_ip])
+        )
+        self.assertEqual(
+            {IPAddress(ip).packed: {b"ends": b"\x00" * 4}}, self.server.leases
+        )
+
+    def test_reports_errors_per_host(self):
+        hosts = self.make_hosts(3)
+        self.add_hosts(hosts)
+        failed_mac = hosts[1][0]
+        self.server.errors[self.get_name(failed_mac)] = ISC_R_FAILURE
+        failures = self.make_client().remove_hosts(mac for mac, _ in hosts)
+        self.assertEqual([failed_mac], list(failures))
+        self.assertEqual([self.get_name(failed_mac)], list(self.server.hosts))
+
+    def test_keeps_one_connection(self):
+        client = self.make_client()
+        hosts = self.make_hosts(5)
+        client.create_hosts(hosts)
+        client.modify_hosts(hosts)
+        client.remove_hosts(mac for mac, _ in hosts)
+        self.assertEqual(1, self.server.connections)
+
+    def test_sends_batches(self):
+        self.patch(OmapiClient, "batch_size", 2)
+        client = self.make_client()
+        exchange = self.patch(client, "_exchange")
+        exchange.side_effect = lambda messages, sign=True: [
+            OmapiMessage(omapi.OMAPI_OP_UPDATE) for _ in messages
+        ]
+        client._sock = socket.socket()
+        self.addCleanup(client._sock.close)
+        client.create_hosts(self.make_hosts(5))
+        self.assertEqual(
+            [2, 2, 1], [len(call[0][0]) for call in exchange.call_args_list]
+        )
+
+    def test_reconnects_when_connection_is_lost(self):
+        client = self.make_client()
+        client.create_hosts(self.make_hosts(1))
+        self.server.drop_connections()
+        hosts = self.make_hosts(3)
+        self.assertEqual({}, client.create_hosts(hosts))
+        self.assertEqual(2, self.server.connections)
+        self.assertThat(self.server.hosts, HasLength(4))
+
+    def test_raises_when_server_cannot_be_reached(self):
+        # Nothing is listening on a port that was just released.
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        client = self.make_client(port=port)
+        error = self.assertRaises(
+            OmapiError, client.create_hosts, self.make_hosts(1)
+        )
+        self.assertDocTestMatches(
+            "The DHCP server could not be reached: ...", str(error)
+        )
+
+    def test_raises_when_key_is_rejected(self):
+        client = self.make_client(key_name=factory.make_name("key"))
+        error = self.assertRaises(
+            OmapiError, client.create_hosts, self.make_hosts(1)
+        )
+        self.assertDocTestMatches(
+            "The DHCP server rejected the OMAPI key: ...", str(error)
+        )
+        self.assertFalse(client.connected)
+
+    def test_raises_when_key_is_wrong(self):
+        client = OmapiClient(
+            "127.0.0.1",
+            base64.b64encode(factory.make_bytes()).decode("ascii"),
+            port=self.server.port,
+        )
+        self.addCleanup(client.close)
+        self.assertRaises(OmapiError, client.create_hosts, self.make_hosts(1))
+        self.assertEqual({}, self.server.hosts)
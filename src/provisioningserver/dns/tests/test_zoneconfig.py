@@ -8,6 +8,7 @@ __all__ = []
 from itertools import chain
 import os.path
 import random
+import tracemalloc
 
 from netaddr import IPAddress, IPNetwork, IPRange
 from testtools.matchers import (
@@ -28,7 +29,9 @@ from provisioningserver.dns.testing import patch_dns_config_path
 from provisioningserver.dns.zoneconfig import (
     DNSForwardZoneConfig,
     DNSReverseZoneConfig,
+    DomainConfigBase,
     DomainInfo,
+    render_zone_file,
 )
 
 
@@ -969,3 +972,98 @@ class TestDNSForwardZoneConfig_GetGenerateDirectives(MAASTestCase):
             directives[1],
             Equals(("0-255", expected_hostname % "1", expected_address % "1")),
         )
+
+
+class TestWriteZoneFile(MAASTestCase):
+    """Tests for `DomainConfigBase.write_zone_file`."""
+
+    def make_parameters(self, mappings=None, **kwargs):
+        parameters = {
+            "domain": factory.make_name("domain"),
+            "serial": random.randint(1, 100000),
+            "modified": factory.make_name("modified"),
+            "ttl": 30,
+            "ns_ttl": 30,
+            "ns_host_name": factory.make_name("ns"),
+            "generate_directives": {},
+            "mappings": {} if mappings is None else mappings,
+            "other_mapping": [],
+        }
+        parameters.update(kwargs)
+        return parameters
+
+    def make_mappings(self, count):
+        return {
+            "A": (
+                ("host%d" % index, None, "10.0.%d.%d" % divmod(index, 256))
+                for index in range(count)
+            )
+        }
+
+    def test_writes_zone_file(self):
+        output_file = os.path.join(self.make_dir(), "zone")
+        parameters = self.make_parameters(
+            mappings={"A": [("host", 60, "10.0.0.1")]}
+        )
+        DomainConfigBase.write_zone_file(output_file, parameters)
+        self.assertThat(
+            output_file,
+            FileContains(
+                matcher=ContainsAll(
+                    [
+                        "; Zone file modified: %s." % parameters["modified"],
+                        "%s ; serial" % parameters["serial"],
+                        "host 60 IN A 10.0.0.1",
+                    ]
+                )
+            ),
+        )
+
+    def test_renders_None_as_nothing(self):
+        lines = render_zone_file(
+            self.make_parameters(mappings={"A": [("host", None, "10.0.0.1")]})
+        )
+        self.assertIn("host  IN A 10.0.0.1\n", list(lines))
+
+    def test_does_not_rewrite_unchanged_zone_file(self):
+        output_file = os.path.join(self.make_dir(), "zone")
+        parameters = self.make_parameters()
+        DomainConfigBase.write_zone_file(output_file, parameters)
+        inode = os.stat(output_file).st_ino
+        DomainConfigBase.write_zone_file(
+            output_file, parameters, {"modified": factory.make_name("now")}
+        )
+        self.assertEqual(inode, os.stat(output_file).st_ino)
+        self.assertEqual(["zone"], os.listdir(os.path.dirname(output_file)))
+
+    def test_rewrites_changed_zone_file(self):
+        output_file = os.path.join(self.make_dir(), "zone")
+        parameters = self.make_parameters()
+        DomainConfigBase.write_zone_file(output_file, parameters)
+        DomainConfigBase.write_zone_file(
+            output_file, parameters, {"serial": parameters["serial"] + 1}
+        )
+        self.assertThat(
+            output_file,
+            FileContains(
+                matcher=Contains("%d ; serial" % (parameters["serial"] + 1))
+            ),
+        )
+
+    def test_memory_use_does_not_grow_with_zone_size(self):
+        output_dir = self.make_dir()
+
+        def peak_memory_writing(count):
+            tracemalloc.start()
+            try:
+                DomainConfigBase.write_zone_file(
+                    os.path.join(output_dir, "zone%d" % count),
+                    self.make_parameters(mappings=self.make_mappings(count)),
+                )
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        small = peak_memory_writing(10000)
+        large = peak_memory_writing(100000)
+        self.assertLess(large, small * 2)
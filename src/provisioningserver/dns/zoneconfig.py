@@ -6,17 +6,17 @@
 __all__ = ["DNSForwardZoneConfig", "DNSReverseZoneConfig", "DomainInfo"]
 
 from datetime import datetime
-from itertools import chain
+import hashlib
+from itertools import chain, islice
 
 from netaddr import IPAddress, IPNetwork, spanning_cidr
 from netaddr.core import AddrFormatError
 
 from provisioningserver.dns.config import (
     compose_config_path,
-    render_dns_template,
     report_missing_config_dir,
 )
-from provisioningserver.utils.fs import incremental_write
+from provisioningserver.utils.fs import atomic_write_chunks
 from provisioningserver.utils.network import (
     intersect_iprange,
     ip_range_within_network,
@@ -54,6 +54,81 @@ def enumerate_rrset_mapping(mapping):
             yield hostname, value[0], value[1], value[2]
 
 
+def format_zone_value(value):
+    """Format `value` for a zone file, rendering `None` as nothing."""
+    return "" if value is None else str(value)
+
+
+def render_zone_file(parameters):
+    """Generate the lines of a zone file.
+
+    The records are formatted as they are taken from the mappings in
+    `parameters`, which may be generators, so that large zones need not be
+    held in memory.
+
+    :param parameters: A dict of the common parameters from
+        `DomainConfigBase.make_parameters` plus "generate_directives",
+        "mappings" and "other_mapping".
+    """
+    f = format_zone_value
+    ttl = f(parameters["ttl"])
+    yield "; Zone file modified: %s.\n" % f(parameters["modified"])
+    yield "$TTL %s\n" % ttl
+    yield "@   IN    SOA %s. nobody.example.com. (\n" % f(
+        parameters["domain"]
+    )
+    yield "              %s ; serial\n" % f(parameters["serial"])
+    yield "              600 ; Refresh\n"
+    yield "              1800 ; Retry\n"
+    yield "              604800 ; Expire\n"
+    yield "              %s ; NXTTL\n" % ttl
+    yield "              )\n"
+    yield "\n"
+    yield "@   %s IN NS %s.\n" % (
+        f(parameters["ns_ttl"]),
+        f(parameters["ns_host_name"]),
+    )
+    for rrtype, directives in parameters["generate_directives"].items():
+        for iterator_values, rdns, hostname in directives:
+            yield "$GENERATE %s %s IN %s %s\n" % (
+                f(iterator_values),
+                f(rdns),
+                f(rrtype),
+                f(hostname),
+            )
+    for rrtype, mapping in parameters["mappings"].items():
+        for item_from, rrttl, item_to in mapping:
+            yield "%s %s IN %s %s\n" % (
+                f(item_from),
+                f(rrttl),
+                f(rrtype),
+                f(item_to),
+            )
+    for item_from, rrttl, rrtype, rrdata in parameters["other_mapping"]:
+        yield "%s %s IN %s %s\n" % (
+            f(item_from),
+            f(rrttl),
+            f(rrtype),
+            f(rrdata),
+        )
+
+
+def get_zone_file_digest(path):
+    """Return the digest of the zone file at `path`, or `None`.
+
+    The first line, recording when the file was written, is not included.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as zone_file:
+            zone_file.readline()
+            for block in iter(lambda: zone_file.read(2 ** 16), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.digest()
+
+
 def get_details_for_ip_range(ip_range):
     """For a given IPRange, return all subnets, a useable prefix and the
     reverse DNS suffix calculated from that IP range.
@@ -124,7 +199,8 @@ class DomainInfo:
 class DomainConfigBase:
     """Base class for zone writers."""
 
-    template_file_name = "zone.template"
+    # The number of lines to write out at a time.
+    write_batch_size = 1000
 
     def __init__(self, domain, zone_info, serial=None, **kwargs):
         """
@@ -158,20 +234,45 @@ class DomainConfigBase:
 
     @classmethod
     def write_zone_file(cls, output_file, *parameters):
-        """Write a zone file based on the zone file template.
+        """Write a zone file.
+
+        The records are written out as they are generated, so memory use
+        does not grow with the size of the zone.  The file is left alone if
+        only the modification time recorded in it would change.
 
-        There is a subtlety with zone files: their filesystem timestamp must
-        increase with every rewrite.  Some filesystems (ext3?) only seem to
-        support a resolution of one second, and so this method may set an
-        unexpected modification time in order to maintain that property.
+        :param parameters: One or more dicts of parameters for
+            `render_zone_file`.  Each adds to (and may overwrite) the
+            previous ones.
         """
         if not isinstance(output_file, list):
             output_file = [output_file]
+        combined_params = {}
+        for params_dict in parameters:
+            combined_params.update(params_dict)
         for outfile in output_file:
-            content = render_dns_template(cls.template_file_name, *parameters)
+            digest = hashlib.sha256()
+            lines = render_zone_file(combined_params)
+            header = next(lines).encode("utf-8")
+
+            def generate_body():
+                while True:
+                    batch = "".join(islice(lines, cls.write_batch_size))
+                    if batch == "":
+                        break
+                    chunk = batch.encode("utf-8")
+                    digest.update(chunk)
+                    yield chunk
+
+            def unchanged():
+                return get_zone_file_digest(outfile) == digest.digest()
+
             with report_missing_config_dir():
-                incremental_write(content.encode("utf-8"), outfile, mode=0o644)
-        pass
+                atomic_write_chunks(
+                    chain([header], generate_body()),
+                    outfile,
+                    mode=0o644,
+                    unchanged=unchanged,
+                )
 
 
 class DNSForwardZoneConfig(DomainConfigBase):
@@ -287,12 +388,10 @@ class DNSForwardZoneConfig(DomainConfigBase):
         """Write the zone file."""
         # Create GENERATE directives for IPv4 ranges.
         for zi in self.zone_info:
-            generate_directives = list(
-                chain.from_iterable(
-                    self.get_GENERATE_directives(dynamic_range)
-                    for dynamic_range in self._dynamic_ranges
-                    if dynamic_range.version == 4
-                )
+            generate_directives = chain.from_iterable(
+                self.get_GENERATE_directives(dynamic_range)
+                for dynamic_range in self._dynamic_ranges
+                if dynamic_range.version == 4
             )
             self.write_zone_file(
                 zi.target_path,
@@ -539,14 +638,10 @@ class DNSReverseZoneConfig(DomainConfigBase):
         """Write the zone file."""
         # Create GENERATE directives for IPv4 ranges.
         for zi in self.zone_info:
-            generate_directives = list(
-                chain.from_iterable(
-                    self.get_GENERATE_directives(
-                        dynamic_range, self.domain, zi
-                    )
-                    for dynamic_range in self._dynamic_ranges
-                    if dynamic_range.version == 4
-                )
+            generate_directives = chain.from_iterable(
+                self.get_GENERATE_directives(dynamic_range, self.domain, zi)
+                for dynamic_range in self._dynamic_ranges
+                if dynamic_range.version == 4
             )
             self.write_zone_file(
                 zi.target_path,
@@ -3,14 +3,16 @@
 
 """LXD Pod Driver."""
 
-__all__ = []
+__all__ = ["lxd_clients", "LXDClientCache"]
 
+from functools import partial
 import re
 from urllib.parse import urlparse
 
 from pylxd import Client
-from pylxd.exceptions import ClientConnectionFailed, NotFound
-from twisted.internet.defer import inlineCallbacks
+from pylxd.exceptions import ClientConnectionFailed, LXDAPIException, NotFound
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredLock, inlineCallbacks
 from twisted.internet.threads import deferToThread
 
 from provisioningserver.drivers import (
@@ -89,11 +91,143 @@ class LXDPodError(Exception):
     """Failure communicating to LXD. """
 
 
+def is_client_failure(error):
+    """Whether `error` means a pylxd client can no longer be used.
+
+    That is when the connection to LXD is lost, or LXD no longer trusts
+    the client's certificate.
+    """
+    if isinstance(error, (ClientConnectionFailed, OSError)):
+        return True
+    elif isinstance(error, LXDAPIException) and not isinstance(
+        error, NotFound
+    ):
+        return error.response.status_code in (401, 403)
+    else:
+        return False
+
+
+def get_vm_status_codes(client):
+    """Return the status code of each VM on the host, by name.
+
+    One request gets them all, where `client.virtual_machines.all` would
+    fetch each VM separately.
+    """
+    response = client.api.virtual_machines.get(params={"recursion": 1})
+    return {
+        machine["name"]: machine["status_code"]
+        for machine in response.json()["metadata"]
+    }
+
+
+class LXDClientCache:
+    """Connected pylxd clients, kept to be used again.
+
+    Clients are kept by endpoint and client certificate, so connecting,
+    checking trust and authenticating happen once per host, and requests
+    to a host share the client's HTTP connections. Clients unused for
+    `idle_timeout` seconds are dropped.
+    """
+
+    def __init__(self, clock=reactor, idle_timeout=300):
+        self.clock = clock
+        self.idle_timeout = idle_timeout
+        # (endpoint, cert) -> (client, last_used)
+        self._clients = {}
+        # (endpoint, cert) -> DeferredLock
+        self._locks = {}
+        self._evict_call = None
+
+    @inlineCallbacks
+    def get(self, pod_id, endpoint, password=None):
+        """Return a trusted client for `endpoint`, connecting if needed."""
+        self._evict()
+        cert = get_maas_cert_tuple()
+        key = endpoint, cert
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = DeferredLock()
+        # Only one caller connects; the others wait and use its client.
+        yield lock.acquire()
+        try:
+            if key in self._clients:
+                client, _ = self._clients[key]
+            else:
+                client = yield self._connect(pod_id, endpoint, cert, password)
+            self._clients[key] = client, self.clock.seconds()
+        finally:
+            lock.release()
+        self._evict()
+        return client
+
+    @inlineCallbacks
+    def _connect(self, pod_id, endpoint, cert, password):
+        try:
+            client = yield deferToThread(
+                Client, endpoint=endpoint, cert=cert, verify=False
+            )
+            if not client.trusted:
+                if password:
+                    yield deferToThread(client.authenticate, password)
+                else:
+                    raise LXDPodError(
+                        f"Pod {pod_id}: Certificate is not trusted and no password was given."
+                    )
+        except ClientConnectionFailed:
+            raise LXDPodError(
+                f"Pod {pod_id}: Failed to connect to the LXD REST API."
+            )
+        return client
+
+    def discard(self, client):
+        """Forget `client`; the next `get` for its host connects anew."""
+        for key, (cached, _) in list(self._clients.items()):
+            if cached is client:
+                del self._clients[key]
+
+    def _evict(self):
+        """Forget clients unused for `idle_timeout` seconds.
+
+        This runs again when the least recently used client times out.
+        """
+        cutoff = self.clock.seconds() - self.idle_timeout
+        for key, (_, last_used) in list(self._clients.items()):
+            if last_used <= cutoff:
+                del self._clients[key]
+        for key, lock in list(self._locks.items()):
+            if not lock.locked and key not in self._clients:
+                del self._locks[key]
+        oldest = min(
+            (last_used for _, last_used in self._clients.values()),
+            default=None,
+        )
+        if oldest is not None and (
+            self._evict_call is None or not self._evict_call.active()
+        ):
+            # Any call already due runs no later than this one would.
+            self._evict_call = self.clock.callLater(
+                max(0, oldest - cutoff), self._evict
+            )
+
+    def clear(self):
+        """Forget all clients."""
+        if self._evict_call is not None and self._evict_call.active():
+            self._evict_call.cancel()
+        self._evict_call = None
+        self._clients.clear()
+
+
+# LXD clients for the pod driver, shared by power actions, queries and pod
+# operations.
+lxd_clients = LXDClientCache()
+
+
 class LXDPodDriver(PodDriver):
 
     name = "lxd"
     chassis = True
     can_probe = False
+    can_query_many = True
     description = "LXD (virtual systems)"
     settings = [
         make_setting_field("power_address", "LXD address", required=True),
@@ -138,37 +272,47 @@ class LXDPodDriver(PodDriver):
         return url.geturl()
 
     @typed
-    @inlineCallbacks
     def get_client(self, pod_id: str, context: dict):
-        """Connect pylxd client."""
-        endpoint = self.get_url(context)
-        password = context.get("password")
+        """Connect pylxd client, or reuse a connected one."""
+        return lxd_clients.get(
+            pod_id, self.get_url(context), context.get("password")
+        )
+
+    @inlineCallbacks
+    def use_client(self, pod_id, context, func, *args, retry=False):
+        """Call `func` with a pylxd client for the pod, then `args`.
+
+        If `func` fails because the client can no longer be used, the
+        client is discarded. With `retry`, `func` is then called again with
+        a new client; only use it where `func` is safe to repeat.
+        """
+        client = yield self.get_client(pod_id, context)
         try:
-            client = yield deferToThread(
-                Client,
-                endpoint=endpoint,
-                cert=get_maas_cert_tuple(),
-                verify=False,
-            )
-            if not client.trusted:
-                if password:
-                    yield deferToThread(client.authenticate, password)
-                else:
-                    raise LXDPodError(
-                        f"Pod {pod_id}: Certificate is not trusted and no password was given."
-                    )
-        except ClientConnectionFailed:
-            raise LXDPodError(
-                f"Pod {pod_id}: Failed to connect to the LXD REST API."
-            )
-        return client
+            result = yield func(client, *args)
+        except Exception as error:
+            if not is_client_failure(error):
+                raise
+            lxd_clients.discard(client)
+            if not retry:
+                raise
+            client = yield self.get_client(pod_id, context)
+            result = yield func(client, *args)
+        return result
 
     @typed
-    @inlineCallbacks
     def get_machine(self, pod_id: str, context: dict):
         """Retrieve LXD VM."""
-        client = yield self.get_client(pod_id, context)
-        instance_name = context.get("instance_name")
+        return self.use_client(
+            pod_id,
+            context,
+            self._get_machine,
+            pod_id,
+            context.get("instance_name"),
+            retry=True,
+        )
+
+    @inlineCallbacks
+    def _get_machine(self, client, pod_id, instance_name):
         try:
             machine = yield deferToThread(
                 client.virtual_machines.get, instance_name
@@ -337,11 +481,36 @@ class LXDPodDriver(PodDriver):
                 f"Pod {pod_id}: Unknown power status code: {state}"
             )
 
+    @asynchronous
     @inlineCallbacks
+    def query_many(self, contexts):
+        """Power query many LXD VMs on the same host.
+
+        All their states are read from one listing of the host's VMs.
+        """
+        pod_id, context = next(iter(contexts.items()))
+        status_codes = yield self.use_client(
+            pod_id,
+            context,
+            partial(deferToThread, get_vm_status_codes),
+            retry=True,
+        )
+        power_states = {}
+        for system_id, context in contexts.items():
+            state = LXD_VM_POWER_STATE.get(
+                status_codes.get(context.get("instance_name"))
+            )
+            if state is not None:
+                power_states[system_id] = state
+        return power_states
+
     def discover(self, pod_id, context):
         """Discover all Pod host resources."""
-        # Connect to the Pod and make sure it is valid.
-        client = yield self.get_client(pod_id, context)
+        return self.use_client(pod_id, context, self._discover, retry=True)
+
+    @inlineCallbacks
+    def _discover(self, client):
+        # Make sure the Pod is valid.
         if not client.has_api_extension("virtual-machines"):
             raise LXDPodError(
                 "Please upgrade your LXD host to 3.19+ for virtual machine support."
@@ -417,9 +586,10 @@ class LXDPodDriver(PodDriver):
     @asynchronous
     def get_commissioning_data(self, pod_id, context):
         """Retreive commissioning data from LXD."""
-        d = self.get_client(pod_id, context)
         # Replicate the LXD API in tree form, like machine-resources does.
-        d.addCallback(
+        d = self.use_client(
+            pod_id,
+            context,
             lambda client: {
                 # /1.0
                 **client.host_info,
@@ -428,7 +598,8 @@ class LXDPodDriver(PodDriver):
                 # TODO - Add networking information.
                 # /1.0/networks
                 # 'networks': {'eth0': {...}, 'eth1': {...}, 'bond0': {...}},
-            }
+            },
+            retry=True,
         )
         d.addCallback(lambda resources: {LXD_OUTPUT_NAME: resources})
         return d
@@ -495,10 +666,14 @@ class LXDPodDriver(PodDriver):
             )
         )
 
-    @inlineCallbacks
     def compose(self, pod_id: str, context: dict, request: RequestedMachine):
         """Compose a virtual machine."""
-        client = yield self.get_client(pod_id, context)
+        return self.use_client(
+            pod_id, context, self._compose, pod_id, context, request
+        )
+
+    @inlineCallbacks
+    def _compose(self, client, pod_id, context, request):
         # Check to see if there is a maas profile.  If not, use the default.
         try:
             profile = yield deferToThread(client.profiles.get, "maas")
@@ -645,10 +820,12 @@ class LXDPodDriver(PodDriver):
         device_name = list(nic_devices.keys())[0]
         return device_name, nic_devices[device_name]
 
-    @inlineCallbacks
     def decompose(self, pod_id, context):
         """Decompose a virtual machine."""
-        client = yield self.get_client(pod_id, context)
+        return self.use_client(pod_id, context, self._decompose, context)
+
+    @inlineCallbacks
+    def _decompose(self, client, context):
         machine = yield deferToThread(
             client.virtual_machines.get, context["instance_name"]
         )
@@ -11,7 +11,11 @@ import json
 from os.path import join
 
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import (
+    DeferredList,
+    inlineCallbacks,
+    maybeDeferred,
+)
 from twisted.web.client import (
     Agent,
     FileBodyProducer,
@@ -36,10 +40,8 @@ from provisioningserver.drivers.pod import (
     PodDriverBase,
     PodFatalError,
 )
-from provisioningserver.drivers.power.redfish import (
-    RedfishPowerDriverBase,
-    WebClientContextFactory,
-)
+from provisioningserver.drivers.power.redfish import RedfishPowerDriverBase
+from provisioningserver.drivers.power.utils import bmc_connection_pool
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.rpc.exceptions import PodInvalidResources
 from provisioningserver.utils.twisted import asynchronous, pause
@@ -69,6 +71,7 @@ class RSDPodDriver(RedfishPowerDriverBase, PodDriverBase):
 
     chassis = True  # Pods are always a chassis
     can_probe = False
+    can_query_many = True
 
     # RSDPodDriver inherits from RedfishPowerDriver.
     # Power parameters will need to be changed to reflect this.
@@ -93,7 +96,16 @@ class RSDPodDriver(RedfishPowerDriverBase, PodDriverBase):
     @asynchronous
     def redfish_request(self, method, uri, headers=None, bodyProducer=None):
         """Send the redfish request and return the response."""
-        agent = Agent(reactor, contextFactory=WebClientContextFactory())
+        return bmc_connection_pool.limit(
+            uri, self._redfish_request, method, uri, headers, bodyProducer
+        )
+
+    def _redfish_request(self, method, uri, headers, bodyProducer):
+        agent = Agent(
+            reactor,
+            contextFactory=bmc_connection_pool.contextFactory,
+            pool=bmc_connection_pool,
+        )
         d = agent.request(
             method, uri, headers=headers, bodyProducer=bodyProducer
         )
@@ -1304,3 +1316,48 @@ class RSDPodDriver(RedfishPowerDriverBase, PodDriverBase):
             return RSD_SYSTEM_POWER_STATE.get(power_state)
         else:
             raise PodActionError("Unknown power state: %s" % node_state)
+
+    @asynchronous
+    @inlineCallbacks
+    def query_many(self, contexts):
+        """Power query many composed machines in the same pod.
+
+        The pod's nodes are listed once, and the state of each is read with
+        one request. Machines that are not assembled are left out, to be
+        assembled and queried by `power_query`.
+        """
+        context = next(iter(contexts.values()))
+        url = self.get_url(context)
+        headers = self.make_auth_headers(**context)
+        nodes = yield self.list_resources(
+            join(url, b"redfish/v1/Nodes"), headers
+        )
+        existing = {node.rsplit(b"/", 1)[-1] for node in nodes}
+        node_ids = {}
+        for system_id, context in contexts.items():
+            node_id = context.get("node_id").encode("utf-8")
+            if node_id in existing:
+                node_ids[system_id] = node_id
+        results = yield DeferredList(
+            [
+                maybeDeferred(
+                    self.redfish_request,
+                    b"GET",
+                    join(url, b"redfish/v1/Nodes/%s" % node_id),
+                    headers,
+                )
+                for node_id in node_ids.values()
+            ],
+            consumeErrors=True,
+        )
+        power_states = {}
+        for system_id, (success, result) in zip(node_ids, results):
+            if success:
+                node_data, _ = result
+                node_state = node_data.get("ComposedNodeState")
+                power_state = RSD_SYSTEM_POWER_STATE.get(
+                    node_data.get("PowerState")
+                )
+                if node_state in RSD_NODE_POWER_STATE and power_state:
+                    power_states[system_id] = power_state
+        return power_states
@@ -7,11 +7,12 @@ __all__ = []
 
 from os.path import join
 import random
-from unittest.mock import Mock, PropertyMock, sentinel
+from unittest.mock import ANY, Mock, PropertyMock, sentinel
 
 from testtools.matchers import Equals, IsInstance, MatchesAll, MatchesStructure
 from testtools.testcase import ExpectedException
 from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
 
 from maastesting.factory import factory
 from maastesting.matchers import MockCalledOnceWith
@@ -71,10 +72,152 @@ class TestLXDByteSuffixes(MAASTestCase):
         self.assertSequenceEqual(expected_results, actual_results)
 
 
+def make_api_error(status_code):
+    error = lxd_module.LXDAPIException()
+    error.response = Mock(status_code=status_code)
+    return error
+
+
+class TestIsClientFailure(MAASTestCase):
+    def test_connection_failures(self):
+        self.assertTrue(
+            lxd_module.is_client_failure(lxd_module.ClientConnectionFailed())
+        )
+        self.assertTrue(lxd_module.is_client_failure(ConnectionError()))
+
+    def test_lost_trust(self):
+        self.assertTrue(lxd_module.is_client_failure(make_api_error(403)))
+
+    def test_other_errors(self):
+        self.assertFalse(lxd_module.is_client_failure(make_api_error(400)))
+        self.assertFalse(lxd_module.is_client_failure(lxd_module.NotFound()))
+        self.assertFalse(
+            lxd_module.is_client_failure(factory.make_exception())
+        )
+
+
+class TestGetVMStatusCodes(MAASTestCase):
+    def test_lists_vms_in_one_request(self):
+        client = Mock()
+        get = client.api.virtual_machines.get
+        get.return_value.json.return_value = {
+            "metadata": [
+                {"name": "vm1", "status_code": 103},
+                {"name": "vm2", "status_code": 102},
+            ]
+        }
+        self.assertEqual(
+            {"vm1": 103, "vm2": 102}, lxd_module.get_vm_status_codes(client)
+        )
+        self.assertThat(get, MockCalledOnceWith(params={"recursion": 1}))
+
+
+class TestLXDClientCache(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def setUp(self):
+        super().setUp()
+        self.Client = self.patch(lxd_module, "Client")
+        self.Client.side_effect = lambda **kwargs: Mock(trusted=True)
+        # Generating a certificate is slow and not needed for these tests.
+        self.cert = (factory.make_name("cert"), factory.make_name("key"))
+        self.patch(lxd_module, "get_maas_cert_tuple").return_value = self.cert
+        self.clock = Clock()
+        self.cache = lxd_module.LXDClientCache(
+            clock=self.clock, idle_timeout=60
+        )
+        self.endpoint = "https://%s:8443" % factory.make_hostname()
+
+    @inlineCallbacks
+    def test_get_reuses_client(self):
+        client = yield self.cache.get(None, self.endpoint)
+        self.assertIs(client, (yield self.cache.get(None, self.endpoint)))
+        self.assertThat(
+            self.Client,
+            MockCalledOnceWith(
+                endpoint=self.endpoint, cert=self.cert, verify=False
+            ),
+        )
+
+    @inlineCallbacks
+    def test_get_connects_to_each_endpoint(self):
+        other_endpoint = "https://%s:8443" % factory.make_hostname()
+        client = yield self.cache.get(None, self.endpoint)
+        other_client = yield self.cache.get(None, other_endpoint)
+        self.assertIsNot(client, other_client)
+        self.assertEqual(2, self.Client.call_count)
+
+    @inlineCallbacks
+    def test_get_authenticates_once(self):
+        client = Mock(trusted=False)
+        self.Client.side_effect = None
+        self.Client.return_value = client
+        yield self.cache.get(None, self.endpoint, "password")
+        yield self.cache.get(None, self.endpoint, "password")
+        self.assertThat(client.authenticate, MockCalledOnceWith("password"))
+
+    @inlineCallbacks
+    def test_get_connects_again_after_discard(self):
+        client = yield self.cache.get(None, self.endpoint)
+        self.cache.discard(client)
+        self.assertIsNot(client, (yield self.cache.get(None, self.endpoint)))
+        self.assertEqual(2, self.Client.call_count)
+
+    @inlineCallbacks
+    def test_get_drops_idle_clients(self):
+        client = yield self.cache.get(None, self.endpoint)
+        self.clock.advance(30)
+        self.assertIs(client, (yield self.cache.get(None, self.endpoint)))
+        self.clock.advance(60)
+        self.assertIsNot(client, (yield self.cache.get(None, self.endpoint)))
+        self.assertEqual(2, self.Client.call_count)
+
+    @inlineCallbacks
+    def test_drops_idle_clients_without_further_use(self):
+        yield self.cache.get(None, self.endpoint)
+        self.clock.advance(30)
+        other_endpoint = "https://%s:8443" % factory.make_hostname()
+        yield self.cache.get(None, other_endpoint)
+        self.clock.advance(30)
+        self.assertEqual(
+            [(other_endpoint, self.cert)], list(self.cache._clients)
+        )
+        self.clock.advance(30)
+        self.assertEqual({}, self.cache._clients)
+        self.assertEqual({}, self.cache._locks)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    @inlineCallbacks
+    def test_clear_cancels_eviction(self):
+        yield self.cache.get(None, self.endpoint)
+        self.cache.clear()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    @inlineCallbacks
+    def test_get_does_not_keep_failed_connections(self):
+        self.Client.side_effect = lxd_module.ClientConnectionFailed()
+        with ExpectedException(lxd_module.LXDPodError):
+            yield self.cache.get(None, self.endpoint)
+        self.Client.side_effect = None
+        self.assertIs(
+            self.Client.return_value,
+            (yield self.cache.get(None, self.endpoint)),
+        )
+        self.assertEqual(2, self.Client.call_count)
+
+
 class TestLXDPodDriver(MAASTestCase):
 
     run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
 
+    def setUp(self):
+        super().setUp()
+        # A fake clock, so idle clients are not timed out on the reactor.
+        self.patch(
+            lxd_module, "lxd_clients", lxd_module.LXDClientCache(clock=Clock())
+        )
+
     def test_missing_packages(self):
         driver = lxd_module.LXDPodDriver()
         missing = driver.detect_missing_packages()
@@ -177,6 +320,61 @@ class TestLXDPodDriver(MAASTestCase):
         with ExpectedException(lxd_module.LXDPodError, error_msg):
             yield driver.get_client(pod_id, context)
 
+    @inlineCallbacks
+    def test_get_client_reuses_client(self):
+        context = self.make_parameters_context()
+        Client = self.patch(lxd_module, "Client")
+        self.patch(lxd_module, "get_maas_cert_tuple")
+        Client.return_value.trusted = False
+        driver = lxd_module.LXDPodDriver()
+        client = yield driver.get_client(None, context)
+        self.assertIs(client, (yield driver.get_client(None, context)))
+        self.assertThat(client.authenticate, MockCalledOnceWith(ANY))
+        self.assertEqual(1, Client.call_count)
+
+    @inlineCallbacks
+    def test_use_client_retries_with_new_client_on_lost_trust(self):
+        context = self.make_parameters_context()
+        Client = self.patch(lxd_module, "Client")
+        self.patch(lxd_module, "get_maas_cert_tuple")
+        Client.side_effect = lambda **kwargs: Mock(trusted=True)
+        func = Mock(side_effect=[make_api_error(403), sentinel.result])
+        driver = lxd_module.LXDPodDriver()
+        result = yield driver.use_client(
+            None, context, func, sentinel.arg, retry=True
+        )
+        self.assertIs(sentinel.result, result)
+        [first_call, second_call] = func.call_args_list
+        self.assertIsNot(first_call[0][0], second_call[0][0])
+        self.assertEqual(2, Client.call_count)
+
+    @inlineCallbacks
+    def test_use_client_discards_client_without_retry(self):
+        context = self.make_parameters_context()
+        Client = self.patch(lxd_module, "Client")
+        self.patch(lxd_module, "get_maas_cert_tuple")
+        Client.side_effect = lambda **kwargs: Mock(trusted=True)
+        func = Mock(side_effect=lxd_module.ClientConnectionFailed())
+        driver = lxd_module.LXDPodDriver()
+        with ExpectedException(lxd_module.ClientConnectionFailed):
+            yield driver.use_client(None, context, func)
+        self.assertThat(func, MockCalledOnceWith(ANY))
+        yield driver.get_client(None, context)
+        self.assertEqual(2, Client.call_count)
+
+    @inlineCallbacks
+    def test_use_client_keeps_client_on_other_errors(self):
+        context = self.make_parameters_context()
+        Client = self.patch(lxd_module, "Client")
+        self.patch(lxd_module, "get_maas_cert_tuple")
+        func = Mock(side_effect=lxd_module.NotFound())
+        driver = lxd_module.LXDPodDriver()
+        with ExpectedException(lxd_module.NotFound):
+            yield driver.use_client(None, context, func, retry=True)
+        self.assertThat(func, MockCalledOnceWith(ANY))
+        yield driver.get_client(None, context)
+        self.assertEqual(1, Client.call_count)
+
     @inlineCallbacks
     def test_get_machine(self):
         context = self.make_parameters_context()
@@ -240,6 +438,31 @@ class TestLXDPodDriver(MAASTestCase):
         with ExpectedException(lxd_module.LXDPodError, error_msg):
             yield driver.power_query(pod_id, context)
 
+    @inlineCallbacks
+    def test_query_many_lists_machines_once(self):
+        contexts = {}
+        status_codes = {}
+        for status_code in (103, 102, 106):
+            context = self.make_parameters_context()
+            contexts[factory.make_name("system_id")] = context
+            status_codes[context["instance_name"]] = status_code
+        contexts[factory.make_name("system_id")] = (
+            self.make_parameters_context()
+        )
+        driver = lxd_module.LXDPodDriver()
+        get_client = self.patch(driver, "get_client")
+        client = get_client.return_value
+        get_vm_status_codes = self.patch(lxd_module, "get_vm_status_codes")
+        get_vm_status_codes.return_value = status_codes
+        states = yield driver.query_many(contexts)
+        system_ids = list(contexts)
+        self.assertEqual({system_ids[0]: "on", system_ids[1]: "off"}, states)
+        self.assertThat(
+            get_client,
+            MockCalledOnceWith(system_ids[0], contexts[system_ids[0]]),
+        )
+        self.assertThat(get_vm_status_codes, MockCalledOnceWith(client))
+
     @inlineCallbacks
     def test_discover_requires_client_to_have_vm_support(self):
         context = self.make_parameters_context()
@@ -2364,3 +2364,66 @@ class TestRSDPodDriver(MAASTestCase):
             mock_get_composed_node_state,
             MockCalledOnceWith(url, node_id, headers),
         )
+
+    @inlineCallbacks
+    def test_query_many_reads_state_of_assembled_nodes(self):
+        driver = RSDPodDriver()
+        context = make_context()
+        url = driver.get_url(context)
+        headers = driver.make_auth_headers(**context)
+        contexts = {
+            system_id: dict(context, node_id=node_id)
+            for system_id, node_id in [
+                ("on", "1"),
+                ("off", "2"),
+                ("allocated", "3"),
+                ("gone", "4"),
+            ]
+        }
+        mock_list_resources = self.patch(driver, "list_resources")
+        mock_list_resources.return_value = [
+            b"redfish/v1/Nodes/%d" % node_id for node_id in range(1, 4)
+        ]
+        nodes = {
+            b"1": dict(
+                SAMPLE_JSON_NODE,
+                ComposedNodeState="PoweredOn",
+                PowerState="On",
+            ),
+            b"2": dict(
+                SAMPLE_JSON_NODE,
+                ComposedNodeState="PoweredOff",
+                PowerState="Off",
+            ),
+            b"3": dict(
+                SAMPLE_JSON_NODE,
+                ComposedNodeState="Allocated",
+                PowerState="Off",
+            ),
+        }
+        mock_redfish_request = self.patch(driver, "redfish_request")
+        mock_redfish_request.side_effect = lambda method, uri, headers: (
+            nodes[uri.rsplit(b"/", 1)[-1]],
+            None,
+        )
+
+        power_states = yield driver.query_many(contexts)
+        self.assertEqual({"on": "on", "off": "off"}, power_states)
+        self.assertThat(
+            mock_list_resources,
+            MockCalledOnceWith(join(url, b"redfish/v1/Nodes"), headers),
+        )
+        self.assertEqual(3, mock_redfish_request.call_count)
+
+    @inlineCallbacks
+    def test_query_many_leaves_out_nodes_it_fails_to_read(self):
+        driver = RSDPodDriver()
+        context = make_context()
+        self.patch(driver, "list_resources").return_value = [
+            b"redfish/v1/Nodes/" + context["node_id"].encode("utf-8")
+        ]
+        self.patch(driver, "redfish_request").side_effect = PodActionError(
+            "boom"
+        )
+        power_states = yield driver.query_many({"system_id": context})
+        self.assertEqual({}, power_states)
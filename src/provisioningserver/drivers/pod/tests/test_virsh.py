@@ -17,6 +17,7 @@ import pexpect
 from testtools.matchers import Contains, Equals
 from testtools.testcase import ExpectedException
 from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
 from twisted.internet.threads import deferToThread
 
 from maastesting.factory import factory
@@ -44,6 +45,7 @@ from provisioningserver.drivers.pod.virsh import (
 )
 from provisioningserver.enum import LIBVIRT_NETWORK, MACVLAN_MODE_CHOICES
 from provisioningserver.rpc.exceptions import PodInvalidResources
+from provisioningserver.testing.virsh import FakeVirsh
 from provisioningserver.utils import (
     debian_to_kernel_architecture,
     kernel_to_debian_architecture,
@@ -113,6 +115,16 @@ SAMPLE_POOLLIST = dedent(
     """
 )
 
+SAMPLE_LIST_ALL = dedent(
+    """
+     Id   Name   State
+    -----------------------
+     1    vm-1   running
+     -    vm-2   shut off
+     3    vm-3   paused
+    """
+)
+
 SAMPLE_POOLINFO = dedent(
     """
     <pool type='dir'>
@@ -742,6 +754,13 @@ class TestVirshSSH(MAASTestCase):
         expected = conn.get_machine_state("")
         self.assertEqual(None, expected)
 
+    def test_get_machine_states(self):
+        conn = self.configure_virshssh(SAMPLE_LIST_ALL)
+        self.assertEqual(
+            {"vm-1": "running", "vm-2": "shut off", "vm-3": "paused"},
+            conn.get_machine_states(),
+        )
+
     def test_machine_mac_addresses_returns_list(self):
         macs = [factory.make_mac_address() for _ in range(2)]
         output = SAMPLE_IFLIST % (macs[0], macs[1])
@@ -2631,6 +2650,13 @@ class TestVirshPodDriver(MAASTestCase):
 
     run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
 
+    def setUp(self):
+        super().setUp()
+        # A fake clock, so idle sessions are not timed out on the reactor.
+        self.patch(
+            virsh, "virsh_sessions", virsh.VirshSessionPool(clock=Clock())
+        )
+
     def test_missing_packages(self):
         mock = self.patch(has_command_available)
         mock.return_value = False
@@ -2688,6 +2714,46 @@ class TestVirshPodDriver(MAASTestCase):
         self.expectThat(power_state_virsh, MockCalledOnceWith(**context))
         self.expectThat(expected_result, Equals(power_state))
 
+    @inlineCallbacks
+    def test_query_many_lists_machines_once(self):
+        contexts = {}
+        for power_id in ("vm-1", "vm-2", "vm-3", "vm-4"):
+            context = self.make_context()
+            context["power_id"] = power_id
+            contexts[factory.make_name("system_id")] = context
+        driver = VirshPodDriver()
+        login = self.patch(virsh.VirshSSH, "login")
+        login.return_value = True
+        run = self.patch(virsh.VirshSSH, "run")
+        run.return_value = SAMPLE_LIST_ALL
+        states = yield driver.query_many(contexts)
+        system_ids = list(contexts)
+        self.assertEqual(
+            {
+                system_ids[0]: "on",
+                system_ids[1]: "off",
+                system_ids[2]: "off",
+            },
+            states,
+        )
+        self.assertThat(run, MockCalledOnceWith(["list", "--all"]))
+        context = contexts[system_ids[0]]
+        self.assertThat(
+            login,
+            MockCalledOnceWith(
+                context["power_address"], context["power_pass"]
+            ),
+        )
+
+    @inlineCallbacks
+    def test_query_many_login_failure(self):
+        driver = VirshPodDriver()
+        self.patch(virsh.VirshSSH, "login").return_value = False
+        with ExpectedException(virsh.VirshError):
+            yield driver.query_many(
+                {factory.make_name("system_id"): self.make_context()}
+            )
+
     @inlineCallbacks
     def test_power_control_login_failure(self):
         driver = VirshPodDriver()
@@ -2922,3 +2988,131 @@ class TestVirshPodDriver(MAASTestCase):
 
         hints = yield driver.decompose(pod_id, context)
         self.assertEquals(sentinel.hints, hints)
+
+
+class TestVirshSessionPool(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=10)
+
+    def setUp(self):
+        super().setUp()
+        self.virsh = self.useFixture(
+            FakeVirsh({"vm-1": "running", "vm-2": "shut off"})
+        )
+        self.clock = Clock()
+        self.pool = virsh.VirshSessionPool(clock=self.clock)
+        self.addCleanup(self.pool.close)
+        self.patch(virsh, "virsh_sessions", self.pool)
+        self.power_address = "qemu+ssh://%s/system" % factory.make_hostname()
+
+    def get_state(self, power_id):
+        return VirshPodDriver().power_state_virsh(
+            self.power_address, power_id
+        )
+
+    @inlineCallbacks
+    def test_reuses_session(self):
+        state = yield self.get_state("vm-1")
+        self.assertEqual("on", state)
+        state = yield self.get_state("vm-2")
+        self.assertEqual("off", state)
+        self.assertEqual(1, self.virsh.logins)
+
+    @inlineCallbacks
+    def test_power_control_uses_pooled_session(self):
+        driver = VirshPodDriver()
+        yield driver.power_control_virsh(self.power_address, "vm-2", "on")
+        self.assertEqual("running", self.virsh.get_domains()["vm-2"])
+        state = yield self.get_state("vm-2")
+        self.assertEqual("on", state)
+        self.assertEqual(1, self.virsh.logins)
+
+    @inlineCallbacks
+    def test_keeps_session_after_virsh_error(self):
+        with ExpectedException(virsh.VirshError):
+            yield self.get_state("vm-3")
+        yield self.get_state("vm-1")
+        self.assertEqual(1, self.virsh.logins)
+
+    @inlineCallbacks
+    def test_closes_session_after_other_errors(self):
+        def fail(conn):
+            raise pexpect.EOF("End of file")
+
+        with ExpectedException(pexpect.EOF):
+            yield self.pool.use(self.power_address, None, fail)
+        yield self.get_state("vm-1")
+        self.assertEqual(2, self.virsh.logins)
+
+    @inlineCallbacks
+    def test_limits_sessions_per_address(self):
+        self.pool.max_sessions = 1
+        conn = yield self.pool.acquire(self.power_address)
+        d = self.pool.acquire(self.power_address)
+        self.assertFalse(d.called)
+        self.pool.release(conn)
+        other = yield d
+        self.assertIs(conn, other)
+        self.pool.release(other)
+        self.assertEqual(1, self.virsh.logins)
+
+    @inlineCallbacks
+    def test_uses_sessions_to_other_addresses_at_once(self):
+        self.pool.max_sessions = 1
+        conn = yield self.pool.acquire(self.power_address)
+        other = yield self.pool.acquire(factory.make_name("power_address"))
+        self.assertIsNot(conn, other)
+        self.pool.release(conn)
+        self.pool.release(other)
+        self.assertEqual(2, self.virsh.logins)
+
+    @inlineCallbacks
+    def test_replaces_dead_session(self):
+        conn = yield self.pool.acquire(self.power_address)
+        self.pool.release(conn)
+        yield deferToThread(conn.close)
+        state = yield self.get_state("vm-1")
+        self.assertEqual("on", state)
+        self.assertEqual(2, self.virsh.logins)
+
+    @inlineCallbacks
+    def test_replaces_stale_session(self):
+        conn = yield self.pool.acquire(self.power_address)
+        conn.stale = True
+        self.pool.release(conn)
+        yield self.get_state("vm-1")
+        self.assertEqual(2, self.virsh.logins)
+
+    @inlineCallbacks
+    def test_closes_idle_sessions(self):
+        conn = yield self.pool.acquire(self.power_address)
+        self.pool.release(conn)
+        self.clock.advance(self.pool.idle_timeout)
+        other = yield self.pool.acquire(factory.make_name("power_address"))
+        self.pool.release(other)
+        key = self.power_address, None
+        self.assertNotIn(key, self.pool._idle)
+        self.assertNotIn(key, self.pool._limits)
+
+    @inlineCallbacks
+    def test_closes_idle_sessions_without_further_use(self):
+        conn = yield self.pool.acquire(self.power_address)
+        self.pool.release(conn)
+        self.clock.advance(self.pool.idle_timeout / 2)
+        other = yield self.pool.acquire(factory.make_name("power_address"))
+        self.pool.release(other)
+        close = self.patch(self.pool, "_close")
+        self.clock.advance(self.pool.idle_timeout / 2)
+        close.assert_called_once_with(conn)
+        self.clock.advance(self.pool.idle_timeout / 2)
+        close.assert_called_with(other)
+        self.assertEqual({}, self.pool._idle)
+        self.assertEqual({}, self.pool._limits)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    @inlineCallbacks
+    def test_forgets_cached_xml(self):
+        conn = yield self.pool.acquire(self.power_address)
+        conn.xml["vm-1"] = factory.make_string()
+        self.pool.release(conn)
+        self.assertEqual({}, conn.xml)
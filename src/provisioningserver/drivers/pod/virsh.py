@@ -3,9 +3,14 @@
 
 """Virsh pod driver."""
 
-__all__ = ["probe_virsh_and_enlist", "VirshPodDriver"]
+__all__ = [
+    "probe_virsh_and_enlist",
+    "virsh_sessions",
+    "VirshPodDriver",
+    "VirshSessionPool",
+]
 
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from math import floor
 import os
 import string
@@ -16,7 +21,8 @@ from uuid import uuid4
 
 from lxml import etree
 import pexpect
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredSemaphore, inlineCallbacks
 from twisted.internet.threads import deferToThread
 
 from provisioningserver.drivers import (
@@ -308,6 +314,9 @@ class VirshSSH(pexpect.spawn):
             self.dom_prefix = dom_prefix
         # Store a mapping of { machine_name: xml }.
         self.xml = {}
+        # Whether a command timed out; its output may turn up later, so
+        # the session must not be used again.
+        self.stale = False
 
     def _execute(self, poweraddr):
         """Spawns the pexpect command."""
@@ -390,10 +399,18 @@ class VirshSSH(pexpect.spawn):
             return False
         return True
 
+    def check(self):
+        """Check the session is still logged in and at the prompt."""
+        if self.child_fd == -1 or self.stale or not self.isalive():
+            return False
+        self.sendline("")
+        return self.prompt(timeout=5)
+
     def run(self, args):
         cmd = " ".join(args)
         self.sendline(cmd)
-        self.prompt()
+        if not self.prompt():
+            self.stale = True
         result = self.before.decode("utf-8").splitlines()
         return "\n".join(result[1:])
 
@@ -481,6 +498,18 @@ class VirshSSH(pexpect.spawn):
             return None
         return state
 
+    def get_machine_states(self):
+        """Gets the states of all VMs, by name."""
+        output = self.run(["list", "--all"]).strip().splitlines()
+        states = {}
+        # Skip the two header lines.
+        for line in output[2:]:
+            columns = line.split(None, 2)
+            if len(columns) == 3:
+                _, machine, state = columns
+                states[machine] = state.strip()
+        return states
+
     def get_machine_interface_info(self, machine):
         """Gets list of mac addressess assigned to the VM."""
         output = self.run(["domiflist", machine]).strip()
@@ -1288,11 +1317,163 @@ class VirshSSH(pexpect.spawn):
         )
 
 
+class VirshSessionPool:
+    """Logged-in virsh sessions, kept open to be used again.
+
+    Sessions are kept by power address and password. Each is used by one
+    caller at a time, and at most `max_sessions` are open to an address at
+    once; other callers wait their turn. Idle sessions are checked before
+    they are used again, and closed once idle for `idle_timeout` seconds.
+    """
+
+    def __init__(self, clock=reactor, max_sessions=4, idle_timeout=300):
+        self.clock = clock
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        # (power_address, power_pass) -> DeferredSemaphore
+        self._limits = {}
+        # (power_address, power_pass) -> [(session, idle_since), ...]
+        self._idle = defaultdict(list)
+        # session -> (power_address, power_pass)
+        self._in_use = {}
+        self._evict_call = None
+
+    @inlineCallbacks
+    def acquire(self, power_address, power_pass=None):
+        """Return a logged-in session to `power_address`.
+
+        It must be given back with `release`.
+        """
+        key = power_address, power_pass
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = DeferredSemaphore(self.max_sessions)
+        yield limit.acquire()
+        try:
+            conn = yield self._get_session(key)
+        except BaseException:
+            limit.release()
+            raise
+        self._in_use[conn] = key
+        return conn
+
+    @inlineCallbacks
+    def _get_session(self, key):
+        idle = self._idle[key]
+        while len(idle) != 0:
+            conn, _ = idle.pop()
+            usable = yield deferToThread(conn.check)
+            if usable:
+                return conn
+            self._close(conn)
+        conn = VirshSSH()
+        logged_in = yield deferToThread(conn.login, *key)
+        if not logged_in:
+            raise VirshError("Failed to login to virsh console.")
+        return conn
+
+    def release(self, conn, broken=False):
+        """Give back a session from `acquire`.
+
+        :param broken: Close the session instead of keeping it, because it
+            may not be in a usable state.
+        """
+        key = self._in_use.pop(conn)
+        if broken or conn.stale:
+            self._close(conn)
+        else:
+            # Machines may change before the session is used again.
+            conn.xml.clear()
+            self._idle[key].append((conn, self.clock.seconds()))
+        self._limits[key].release()
+        self._evict()
+
+    @inlineCallbacks
+    def use(self, power_address, power_pass, func, *args):
+        """Call `func` with a session to `power_address`, then `args`.
+
+        `func` may return a `Deferred`. The session is closed if `func`
+        fails with anything other than a `VirshError` or
+        `PodInvalidResources`.
+        """
+        conn = yield self.acquire(power_address, power_pass)
+        try:
+            result = yield func(conn, *args)
+        except (VirshError, PodInvalidResources):
+            self.release(conn)
+            raise
+        except BaseException:
+            self.release(conn, broken=True)
+            raise
+        else:
+            self.release(conn)
+            return result
+
+    def _evict(self):
+        """Close idle sessions past `idle_timeout`, and forget old hosts.
+
+        This runs again when the oldest remaining idle session times out.
+        """
+        cutoff = self.clock.seconds() - self.idle_timeout
+        for key, idle in list(self._idle.items()):
+            for conn, idle_since in idle:
+                if idle_since <= cutoff:
+                    self._close(conn)
+            idle[:] = [
+                (conn, idle_since)
+                for conn, idle_since in idle
+                if idle_since > cutoff
+            ]
+            if len(idle) == 0:
+                del self._idle[key]
+        for key, limit in list(self._limits.items()):
+            in_use = limit.tokens < limit.limit or len(limit.waiting) != 0
+            if not in_use and key not in self._idle:
+                del self._limits[key]
+        oldest = min(
+            (
+                idle_since
+                for idle in self._idle.values()
+                for _, idle_since in idle
+            ),
+            default=None,
+        )
+        if oldest is not None and (
+            self._evict_call is None or not self._evict_call.active()
+        ):
+            # Any call already due runs no later than this one would.
+            self._evict_call = self.clock.callLater(
+                max(0, oldest - cutoff), self._evict
+            )
+
+    def _close(self, conn):
+        d = deferToThread(conn.logout)
+        # The session is being thrown away; errors closing it don't matter.
+        d.addErrback(lambda failure: None)
+        return d
+
+    def close(self):
+        """Close all idle sessions."""
+        if self._evict_call is not None and self._evict_call.active():
+            self._evict_call.cancel()
+        self._evict_call = None
+        for idle in self._idle.values():
+            for conn, _ in idle:
+                self._close(conn)
+        self._idle.clear()
+
+
+# Virsh sessions for the pod driver, shared by power actions, queries and
+# pod operations.
+virsh_sessions = VirshSessionPool()
+
+
 class VirshPodDriver(PodDriver):
 
     name = "virsh"
     description = "Virsh (virtual systems)"
     can_probe = True
+    can_query_many = True
     settings = [
         make_setting_field("power_address", "Address", required=True),
         make_setting_field(
@@ -1316,22 +1497,33 @@ class VirshPodDriver(PodDriver):
                 missing_packages.add(package)
         return list(missing_packages)
 
-    @inlineCallbacks
-    def power_control_virsh(
-        self, power_address, power_id, power_change, power_pass=None, **kwargs
-    ):
-        """Powers controls a VM using virsh."""
+    def use_virsh_session(self, context, func, *args):
+        """Call `func` with a pooled virsh session, then `args`.
 
+        See `VirshSessionPool.use`.
+        """
+        power_pass = context.get("power_pass")
         # Force password to None if blank, as the power control
         # script will send a blank password if one is not set.
         if power_pass == "":
             power_pass = None
+        return virsh_sessions.use(
+            context.get("power_address"), power_pass, func, *args
+        )
 
-        conn = VirshSSH()
-        logged_in = yield deferToThread(conn.login, power_address, power_pass)
-        if not logged_in:
-            raise VirshError("Failed to login to virsh console.")
+    def power_control_virsh(
+        self, power_address, power_id, power_change, power_pass=None, **kwargs
+    ):
+        """Powers controls a VM using virsh."""
+        return self.use_virsh_session(
+            {"power_address": power_address, "power_pass": power_pass},
+            self._power_control_virsh,
+            power_id,
+            power_change,
+        )
 
+    @inlineCallbacks
+    def _power_control_virsh(self, conn, power_id, power_change):
         state = yield deferToThread(conn.get_machine_state, power_id)
         if state is None:
             raise VirshError("%s: Failed to get power state" % power_id)
@@ -1347,22 +1539,18 @@ class VirshPodDriver(PodDriver):
                 if powered_off is False:
                     raise VirshError("%s: Failed to power off VM" % power_id)
 
-    @inlineCallbacks
     def power_state_virsh(
         self, power_address, power_id, power_pass=None, **kwargs
     ):
         """Return the power state for the VM using virsh."""
+        return self.use_virsh_session(
+            {"power_address": power_address, "power_pass": power_pass},
+            self._power_state_virsh,
+            power_id,
+        )
 
-        # Force password to None if blank, as the power control
-        # script will send a blank password if one is not set.
-        if power_pass == "":
-            power_pass = None
-
-        conn = VirshSSH()
-        logged_in = yield deferToThread(conn.login, power_address, power_pass)
-        if not logged_in:
-            raise VirshError("Failed to login to virsh console.")
-
+    @inlineCallbacks
+    def _power_state_virsh(self, conn, power_id):
         state = yield deferToThread(conn.get_machine_state, power_id)
         if state is None:
             raise VirshError("Failed to get domain: %s" % power_id)
@@ -1387,26 +1575,33 @@ class VirshPodDriver(PodDriver):
         """Power query Virsh node."""
         return self.power_state_virsh(**context)
 
+    @asynchronous
     @inlineCallbacks
-    def get_virsh_connection(self, context):
-        """Connect and return the virsh connection."""
-        power_address = context.get("power_address")
-        power_pass = context.get("power_pass")
-        # Login to Virsh console.
-        conn = VirshSSH()
-        logged_in = yield deferToThread(conn.login, power_address, power_pass)
-        if not logged_in:
-            raise VirshError("Failed to login to virsh console.")
-        return conn
+    def query_many(self, contexts):
+        """Power query many Virsh nodes on the same host.
+
+        All their states are read from one listing of the host's VMs.
+        """
+        context = next(iter(contexts.values()))
+        states = yield self.use_virsh_session(
+            context, lambda conn: deferToThread(conn.get_machine_states)
+        )
+        power_states = {}
+        for system_id, context in contexts.items():
+            state = states.get(context.get("power_id"))
+            if state in VM_STATE_TO_POWER_STATE:
+                power_states[system_id] = VM_STATE_TO_POWER_STATE[state]
+        return power_states
 
-    @inlineCallbacks
     def discover(self, pod_id, context):
         """Discover all resources.
 
         Returns a defer to a DiscoveredPod object.
         """
-        conn = yield self.get_virsh_connection(context)
+        return self.use_virsh_session(context, self._discover)
 
+    @inlineCallbacks
+    def _discover(self, conn):
         # Check that we have at least one storage pool.  If not, create it.
         pools = yield deferToThread(conn.list_pools)
         if not len(pools):
@@ -1438,24 +1633,32 @@ class VirshPodDriver(PodDriver):
         # Return the DiscoveredPod
         return discovered_pod
 
-    @inlineCallbacks
     def compose(self, pod_id, context, request):
         """Compose machine."""
-        conn = yield self.get_virsh_connection(context)
         default_pool = context.get(
             "default_storage_pool_id", context.get("default_storage_pool")
         )
+        return self.use_virsh_session(
+            context, self._compose, request, default_pool
+        )
+
+    @inlineCallbacks
+    def _compose(self, conn, request, default_pool):
         created_machine = yield deferToThread(
             conn.create_domain, request, default_pool
         )
         hints = yield deferToThread(conn.get_pod_hints)
         return created_machine, hints
 
-    @inlineCallbacks
     def decompose(self, pod_id, context):
         """Decompose machine."""
-        conn = yield self.get_virsh_connection(context)
-        yield deferToThread(conn.delete_domain, context["power_id"])
+        return self.use_virsh_session(
+            context, self._decompose, context["power_id"]
+        )
+
+    @inlineCallbacks
+    def _decompose(self, conn, power_id):
+        yield deferToThread(conn.delete_domain, power_id)
         hints = yield deferToThread(conn.get_pod_hints)
         return hints
 
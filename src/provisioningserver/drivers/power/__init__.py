@@ -29,6 +29,7 @@ from twisted.internet.threads import deferToThread
 from provisioningserver.drivers import (
     IP_EXTRACTOR_SCHEMA,
     SETTING_PARAMETER_FIELD_SCHEMA,
+    SETTING_SCOPE,
 )
 from provisioningserver.utils.twisted import IAsynchronous, pause
 
@@ -129,6 +130,9 @@ class PowerActionError(PowerError):
 class PowerDriverBase(metaclass=ABCMeta):
     """Base driver for a power driver."""
 
+    # Whether `query_many` is implemented.
+    can_query_many = False
+
     def __init__(self):
         super().__init__()
         validate(
@@ -215,6 +219,30 @@ class PowerDriverBase(metaclass=ABCMeta):
             calling function should ignore this error, and continue on.
         """
 
+    def query_many(self, contexts):
+        """Perform the query action for many nodes behind the same BMC.
+
+        Drivers whose BMC can list the power states of all its nodes in
+        one go implement this, and set `can_query_many`.
+
+        :param contexts: A dict mapping each node's `Node.system_id` to its
+            power settings. The nodes all have the same `get_bmc_context`.
+        :return: A dict mapping system IDs to power states, `on` or `off`.
+            Nodes that are left out are queried one by one with `query`.
+        """
+        raise NotImplementedError()
+
+    def get_bmc_context(self, context):
+        """Return the power settings in `context` that identify the BMC.
+
+        These are the settings that are not specific to the node.
+        """
+        return {
+            setting["name"]: context.get(setting["name"])
+            for setting in self.settings
+            if setting.get("scope") != SETTING_SCOPE.NODE
+        }
+
     def get_schema(self, detect_missing_packages=True):
         """Returns the JSON schema for the driver.
 
@@ -8,6 +8,9 @@ __all__ = []
 import re
 from tempfile import NamedTemporaryFile
 
+from netaddr import valid_ipv4
+from twisted.internet.defer import inlineCallbacks, returnValue
+
 from provisioningserver.drivers import (
     make_ip_extractor,
     make_setting_field,
@@ -22,6 +25,12 @@ from provisioningserver.drivers.power import (
     PowerFatalError,
     PowerSettingError,
 )
+from provisioningserver.drivers.power.rmcp import (
+    IPMIAuthError,
+    IPMIError,
+    IPMITimeout,
+    RMCPPlusClient,
+)
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.utils import shell
 from provisioningserver.utils.network import find_ip_via_arp
@@ -167,6 +176,19 @@ IPMI_ERRORS = {
 maaslog = get_maas_logger("drivers.power.ipmi")
 
 
+# The RMCP+ client shared by all power queries in this process, so that
+# they share one socket, and one session with each BMC.
+_rmcp_client = None
+
+
+def get_rmcp_client():
+    """Return the RMCP+ client for power queries, creating it if needed."""
+    global _rmcp_client
+    if _rmcp_client is None:
+        _rmcp_client = RMCPPlusClient()
+    return _rmcp_client
+
+
 class IPMI_DRIVER:
     DEFAULT = ""
     LAN = "LAN"
@@ -375,3 +397,42 @@ class IPMIPowerDriver(PowerDriver):
 
     def power_query(self, system_id, context):
         return self._issue_ipmi_command("query", **context)
+
+    @inlineCallbacks
+    def query(self, system_id, context):
+        """Query the power state, over an RMCP+ session where possible.
+
+        The power state of IPMI 2.0 BMCs with an IPv4 address is queried
+        in-process, reusing a session with the BMC between queries.
+        FreeIPMI is used for other BMCs, and for those the RMCP+ client
+        cannot talk to, e.g. because they support neither cipher suite 3
+        nor 17.
+        """
+        power_address = context.get("power_address")
+        if context.get("power_driver") == IPMI_DRIVER.LAN_2_0 and (
+            is_power_parameter_set(power_address) and valid_ipv4(power_address)
+        ):
+            try:
+                state = yield get_rmcp_client().get_power_state(
+                    power_address,
+                    context.get("power_user") or "",
+                    context.get("power_pass") or "",
+                )
+            except (IPMIAuthError, IPMITimeout) as error:
+                # FreeIPMI would fail in the same way; report it as it
+                # would have been.
+                for key, error_info in IPMI_ERRORS.items():
+                    if key in str(error):
+                        raise error_info["exception"](error_info["message"])
+                raise PowerError(
+                    "Failed to query %s: %s" % (power_address, error)
+                )
+            except IPMIError as error:
+                maaslog.debug(
+                    "Querying %s over RMCP+ failed, using FreeIPMI: %s"
+                    % (power_address, error)
+                )
+            else:
+                returnValue(state)
+        state = yield super().query(system_id, context)
+        returnValue(state)
@@ -22,7 +22,7 @@ from provisioningserver.drivers.power import (
     PowerDriver,
     PowerFatalError,
 )
-from provisioningserver.drivers.power.utils import WebClientContextFactory
+from provisioningserver.drivers.power.utils import bmc_connection_pool
 from provisioningserver.utils.twisted import asynchronous
 
 # OpenBMC RESTful uri path
@@ -57,7 +57,12 @@ class OpenBMCPowerDriver(PowerDriver):
 
     cookie_jar = compat.cookielib.CookieJar()
     agent = CookieAgent(
-        Agent(reactor, contextFactory=WebClientContextFactory()), cookie_jar
+        Agent(
+            reactor,
+            contextFactory=bmc_connection_pool.contextFactory,
+            pool=bmc_connection_pool,
+        ),
+        cookie_jar,
     )
 
     def detect_missing_packages(self):
@@ -67,6 +72,11 @@ class OpenBMCPowerDriver(PowerDriver):
     @asynchronous
     def openbmc_request(self, method, uri, data=None):
         """Send the RESTful request and return the response."""
+        return bmc_connection_pool.limit(
+            uri, self._openbmc_request, method, uri, data
+        )
+
+    def _openbmc_request(self, method, uri, data):
         d = self.agent.request(
             method,
             uri,
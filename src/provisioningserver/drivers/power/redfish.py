@@ -28,7 +28,7 @@ from provisioningserver.drivers import (
     SETTING_SCOPE,
 )
 from provisioningserver.drivers.power import PowerActionError, PowerDriver
-from provisioningserver.drivers.power.utils import WebClientContextFactory
+from provisioningserver.drivers.power.utils import bmc_connection_pool
 from provisioningserver.utils.twisted import asynchronous
 
 # no trailing slashes
@@ -64,8 +64,17 @@ class RedfishPowerDriverBase(PowerDriver):
     @asynchronous
     def redfish_request(self, method, uri, headers=None, bodyProducer=None):
         """Send the redfish request and return the response."""
+        return bmc_connection_pool.limit(
+            uri, self._redfish_request, method, uri, headers, bodyProducer
+        )
+
+    def _redfish_request(self, method, uri, headers, bodyProducer):
         agent = RedirectAgent(
-            Agent(reactor, contextFactory=WebClientContextFactory())
+            Agent(
+                reactor,
+                contextFactory=bmc_connection_pool.contextFactory,
+                pool=bmc_connection_pool,
+            )
         )
         d = agent.request(
             method, uri, headers=headers, bodyProducer=bodyProducer
@@ -0,0 +1,852 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Asynchronous IPMI v2.0 (RMCP+) client.
+
+This talks to BMCs directly over UDP instead of running FreeIPMI's tools,
+which fork a process and negotiate a new session for every request.
+Sessions are kept open and reused, so querying the power state of a
+machine usually takes a single round trip, and sessions with all BMCs
+share one socket.
+
+Only what MAAS needs is implemented: RAKP authentication with cipher
+suites 3 and 17, Get Chassis Status, Chassis Control and Set System Boot
+Options.
+"""
+
+__all__ = [
+    "CHASSIS_CONTROL",
+    "IPMIAuthError",
+    "IPMIError",
+    "IPMITimeout",
+    "IPMIUnsupported",
+    "RMCPPlusClient",
+]
+
+from collections import namedtuple
+import hashlib
+import hmac
+import os
+import random
+import struct
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import algorithms, Cipher, modes
+from twisted.internet.defer import (
+    Deferred,
+    DeferredList,
+    DeferredLock,
+    inlineCallbacks,
+    returnValue,
+    TimeoutError,
+)
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet.task import LoopingCall
+
+from provisioningserver.logger import LegacyLogger
+
+log = LegacyLogger()
+
+
+# RMCP header for IPMI messages: version 6, no RMCP ACK, IPMI class.
+RMCP_HEADER = b"\x06\x00\xff\x07"
+
+# Authentication type field of all IPMI v2.0 session headers.
+AUTH_TYPE_RMCP_PLUS = 0x06
+
+# Flags in the payload type field of the session header.
+PAYLOAD_ENCRYPTED = 0x80
+PAYLOAD_AUTHENTICATED = 0x40
+
+
+class PAYLOAD:
+    """Payload types used by the client."""
+
+    IPMI = 0x00
+    OPEN_SESSION_REQUEST = 0x10
+    OPEN_SESSION_RESPONSE = 0x11
+    RAKP1 = 0x12
+    RAKP2 = 0x13
+    RAKP3 = 0x14
+    RAKP4 = 0x15
+
+
+class PRIVILEGE:
+    """Session privilege levels."""
+
+    USER = 0x02
+    OPERATOR = 0x03
+    ADMINISTRATOR = 0x04
+
+
+class NETFN:
+    """Network functions of the commands used by the client."""
+
+    CHASSIS = 0x00
+    APP = 0x06
+
+
+class CMD:
+    """Commands used by the client, by network function."""
+
+    # Chassis.
+    GET_CHASSIS_STATUS = 0x01
+    CHASSIS_CONTROL = 0x02
+    SET_SYSTEM_BOOT_OPTIONS = 0x08
+    # Application.
+    GET_DEVICE_ID = 0x01
+    SET_SESSION_PRIVILEGE_LEVEL = 0x3B
+    CLOSE_SESSION = 0x3C
+
+
+class CHASSIS_CONTROL:
+    """Actions for the Chassis Control command."""
+
+    POWER_DOWN = 0x00
+    POWER_UP = 0x01
+    POWER_CYCLE = 0x02
+    HARD_RESET = 0x03
+    SOFT_SHUTDOWN = 0x05
+
+
+CipherSuite = namedtuple(
+    "CipherSuite",
+    ("id", "auth", "integrity", "confidentiality", "digest", "icv_length"),
+)
+
+# The cipher suites the client supports: both use AES-CBC-128, with
+# HMAC-SHA1 or HMAC-SHA256 for authentication and integrity.
+CIPHER_SUITES = {
+    3: CipherSuite(3, 0x01, 0x01, 0x01, hashlib.sha1, 12),
+    17: CipherSuite(17, 0x03, 0x04, 0x01, hashlib.sha256, 16),
+}
+
+# RMCP+ status codes. Messages that match `IPMI_ERRORS` in the IPMI power
+# driver use the same wording as FreeIPMI.
+RMCP_STATUS = {
+    0x01: "insufficient resources to create a session",
+    0x02: "invalid session id",
+    0x03: "invalid payload type",
+    0x04: "cipher suite id unavailable",
+    0x05: "cipher suite id unavailable",
+    0x06: "cipher suite id unavailable",
+    0x07: "cipher suite id unavailable",
+    0x08: "inactive session id",
+    0x09: "invalid role",
+    0x0A: "privilege level cannot be obtained for this user",
+    0x0B: "insufficient resources for the requested role",
+    0x0C: "username invalid",
+    0x0D: "username invalid",
+    0x0E: "unauthorized GUID",
+    0x0F: "password invalid",
+    0x10: "cipher suite id unavailable",
+    0x11: "cipher suite id unavailable",
+    0x12: "illegal or unrecognized parameter",
+}
+
+# Status codes after which another cipher suite may be tried.
+RMCP_STATUS_UNSUPPORTED = frozenset((0x04, 0x05, 0x06, 0x07, 0x10, 0x11))
+
+# Status codes that mean the credentials were rejected.
+RMCP_STATUS_AUTH = frozenset((0x0A, 0x0C, 0x0D, 0x0F))
+
+# Completion code of the Set Session Privilege Level command when the
+# user may not have the requested privilege level.
+COMPLETION_PRIVILEGE_UNAVAILABLE = 0x81
+
+
+class IPMIError(Exception):
+    """An IPMI request failed."""
+
+
+class IPMIAuthError(IPMIError):
+    """The BMC rejected the credentials."""
+
+
+class IPMITimeout(IPMIError):
+    """The BMC did not respond."""
+
+
+class IPMIUnsupported(IPMIError):
+    """The BMC does not support any of the client's cipher suites."""
+
+
+class IPMICommandError(IPMIError):
+    """The BMC answered a command with a non-zero completion code."""
+
+    def __init__(self, message, completion_code):
+        super().__init__(message)
+        self.completion_code = completion_code
+
+
+def _hmac(suite, key, *parts):
+    return hmac.new(key, b"".join(parts), suite.digest).digest()
+
+
+def _checksum(data):
+    return -sum(data) & 0xFF
+
+
+def encode_ipmi_message(netfn, cmd, rq_seq, data=b"", response=False):
+    """Encode an IPMI LAN message from the remote console (software ID
+    0x81) to the BMC (slave address 0x20), or the response to one.
+
+    For responses, `netfn` is the response's own network function and
+    `data` starts with the completion code.
+    """
+    if response:
+        addresses = (0x81, 0x20)
+    else:
+        addresses = (0x20, 0x81)
+    header = bytes((addresses[0], netfn << 2))
+    body = bytes((addresses[1], rq_seq << 2, cmd)) + data
+    return (
+        header
+        + bytes((_checksum(header),))
+        + body
+        + bytes((_checksum(body),))
+    )
+
+
+def decode_ipmi_message(message):
+    """Decode an IPMI LAN message encoded by `encode_ipmi_message`.
+
+    :return: A tuple of (netfn, rq_seq, cmd, data).
+    :raise ValueError: If the message is malformed.
+    """
+    if len(message) < 7:
+        raise ValueError("IPMI message too short.")
+    if _checksum(message[:2]) != message[2]:
+        raise ValueError("Bad IPMI message header checksum.")
+    if _checksum(message[3:-1]) != message[-1]:
+        raise ValueError("Bad IPMI message checksum.")
+    return message[1] >> 2, message[4] >> 2, message[5], message[6:-1]
+
+
+def _pack_session_header(payload_type, session_id, seq, length):
+    return struct.pack(
+        "<BBIIH", AUTH_TYPE_RMCP_PLUS, payload_type, session_id, seq, length
+    )
+
+
+def encode_packet(payload_type, payload, session_id=0, seq=0):
+    """Encode an RMCP+ packet without authentication or encryption."""
+    return (
+        RMCP_HEADER
+        + _pack_session_header(payload_type, session_id, seq, len(payload))
+        + payload
+    )
+
+
+def decode_packet(packet):
+    """Decode the session header of an RMCP+ packet.
+
+    The integrity of the packet is not checked, and an encrypted payload
+    is returned as is.
+
+    :return: A tuple of (payload type, session ID, sequence number,
+        payload). The payload type includes the encryption and
+        authentication flags.
+    :raise ValueError: If this is not an RMCP+ packet.
+    """
+    if len(packet) < 16:
+        raise ValueError("Packet too short.")
+    if packet[0] != 0x06 or packet[3] != 0x07:
+        raise ValueError("Not an IPMI packet.")
+    auth_type, payload_type, session_id, seq, length = struct.unpack_from(
+        "<BBIIH", packet, 4
+    )
+    if auth_type != AUTH_TYPE_RMCP_PLUS:
+        raise ValueError("Not an IPMI v2.0 packet.")
+    payload = packet[16 : 16 + length]
+    if len(payload) != length:
+        raise ValueError("Packet truncated.")
+    return payload_type, session_id, seq, payload
+
+
+class SessionKeys:
+    """Authenticates and encrypts the packets of an established session.
+
+    :ivar suite: The `CipherSuite` negotiated for the session.
+    """
+
+    def __init__(self, suite, sik):
+        self.suite = suite
+        # The constants are 20 bytes long whatever the hash (IPMI v2.0,
+        # section 13.32), as in FreeIPMI and ipmitool.
+        self.k1 = _hmac(suite, sik, b"\x01" * 20)
+        self.k2 = _hmac(suite, sik, b"\x02" * 20)
+
+    def _cipher(self, iv):
+        return Cipher(
+            algorithms.AES(self.k2[:16]), modes.CBC(iv), default_backend()
+        )
+
+    def _auth_code(self, data):
+        return _hmac(self.suite, self.k1, data)[: self.suite.icv_length]
+
+    def encode(self, payload_type, payload, session_id, seq):
+        """Encode an encrypted and authenticated RMCP+ packet."""
+        iv = os.urandom(16)
+        pad_length = -(len(payload) + 1) % 16
+        plaintext = (
+            payload + bytes(range(1, pad_length + 1)) + bytes((pad_length,))
+        )
+        encryptor = self._cipher(iv).encryptor()
+        payload = iv + encryptor.update(plaintext) + encryptor.finalize()
+        payload_type |= PAYLOAD_ENCRYPTED | PAYLOAD_AUTHENTICATED
+        data = (
+            _pack_session_header(payload_type, session_id, seq, len(payload))
+            + payload
+        )
+        # Pad so that the authentication code starts on a 4-byte boundary;
+        # 0x07 is the reserved "next header" field.
+        pad_length = -(len(data) + 2) % 4
+        data += b"\xff" * pad_length + bytes((pad_length, 0x07))
+        return RMCP_HEADER + data + self._auth_code(data)
+
+    def decode(self, packet):
+        """Decode an RMCP+ packet encoded by `encode`.
+
+        :return: A tuple of (payload type, session ID, sequence number,
+            payload), with the payload decrypted.
+        :raise ValueError: If the packet is malformed or its integrity
+            check fails.
+        """
+        payload_type, session_id, seq, payload = decode_packet(packet)
+        if not payload_type & PAYLOAD_AUTHENTICATED:
+            raise ValueError("Packet is not authenticated.")
+        icv_length = self.suite.icv_length
+        data, auth_code = packet[4:-icv_length], packet[-icv_length:]
+        if len(data) < 12 + len(payload) + 2:
+            raise ValueError("Packet truncated.")
+        if not hmac.compare_digest(self._auth_code(data), auth_code):
+            raise ValueError("Packet integrity check failed.")
+        if payload_type & PAYLOAD_ENCRYPTED:
+            iv, ciphertext = payload[:16], payload[16:]
+            if len(iv) != 16 or len(ciphertext) == 0 or len(ciphertext) % 16:
+                raise ValueError("Encrypted payload has a bad length.")
+            decryptor = self._cipher(iv).decryptor()
+            plaintext = decryptor.update(ciphertext) + decryptor.finalize()
+            pad_length = plaintext[-1]
+            if pad_length >= len(plaintext):
+                raise ValueError("Encrypted payload has bad padding.")
+            payload = plaintext[: -1 - pad_length]
+        return payload_type & 0x3F, session_id, seq, payload
+
+
+def _algorithm(kind, algorithm):
+    return struct.pack("<BxxBBxxx", kind, 8, algorithm)
+
+
+class IPMISession:
+    """A session with a BMC.
+
+    Requests in a session are made one at a time. The session is opened
+    by the first request, and opened again after it has timed out.
+
+    :ivar console_id: The session ID chosen by the client. The BMC
+        addresses packets in this session to it.
+    :ivar last_used: When a request was last made in this session.
+    :ivar last_active: When the BMC last answered in this session.
+    """
+
+    def __init__(self, client, address, username, password, privilege):
+        self.client = client
+        self.address = address
+        self.username = username.encode("utf-8")
+        self.password = password.encode("utf-8")[:20].ljust(20, b"\x00")
+        self.privilege = privilege
+        self.console_id = client._register(self)
+        self.bmc_id = None
+        self.keys = None
+        self.last_used = self.last_active = client.reactor.seconds()
+        self._lock = DeferredLock()
+        self._waiting = None
+        self._seq = 0
+        self._rq_seq = 0
+        self._tag = 0
+
+    @property
+    def established(self):
+        """Whether the session is open."""
+        return self.keys is not None
+
+    def reset(self):
+        """Forget the open session, so the next request opens another."""
+        self.bmc_id = None
+        self.keys = None
+
+    def request(self, netfn, cmd, data=b""):
+        """Make a request in this session, opening it first if necessary.
+
+        :return: A `Deferred` firing with the response data, without the
+            completion code.
+        """
+        self.last_used = self.client.reactor.seconds()
+        return self._lock.run(self._open_and_request, netfn, cmd, data)
+
+    def keep_alive(self):
+        """Make a request in the session, if it is open, to keep it so."""
+        return self._lock.run(self._keep_alive)
+
+    def close(self):
+        """Close the session, if it is open. Errors are ignored."""
+        return self._lock.run(self._close)
+
+    def received(self, packet):
+        """Handle a packet from the BMC addressed to this session."""
+        try:
+            if self.established:
+                payload_type, _, _, payload = self.keys.decode(packet)
+            else:
+                payload_type, _, _, payload = decode_packet(packet)
+            if payload_type == PAYLOAD.IPMI:
+                _, rq_seq, cmd, data = decode_ipmi_message(payload)
+                key, value = (rq_seq, cmd), data
+            elif len(payload) >= 8:
+                key, value = payload[0], payload
+            else:
+                raise ValueError("Payload too short.")
+        except ValueError as error:
+            log.debug(
+                "Ignoring IPMI packet from {address}: {error}",
+                address=self.address[0],
+                error=error,
+            )
+            return
+        if self._waiting is not None:
+            expected_type, expected_key, d = self._waiting
+            if (payload_type, key) == (expected_type, expected_key):
+                self._waiting = None
+                self.last_active = self.client.reactor.seconds()
+                d.callback(value)
+
+    @inlineCallbacks
+    def _exchange(self, encode, payload_type, key):
+        """Send a packet, and retransmit it until a response arrives.
+
+        :param encode: Returns the packet to send. It is called again for
+            each retransmission.
+        :param payload_type: The payload type of the response.
+        :param key: The message tag or IPMI request sequence number and
+            command that identify the response.
+        """
+        for timeout in self.client.timeouts:
+            waiting = payload_type, key, self.client._make_deferred(timeout)
+            self._waiting = waiting
+            self.client._send(encode(), self.address)
+            try:
+                response = yield waiting[2]
+            except TimeoutError:
+                continue
+            finally:
+                self._waiting = None
+            returnValue(response)
+        raise IPMITimeout("%s: session timeout" % self.address[0])
+
+    def _next_tag(self):
+        self._tag = (self._tag + 1) % 256
+        return self._tag
+
+    def _check_status(self, status, step):
+        if status == 0:
+            return
+        message = "%s: %s failed: %s" % (
+            self.address[0],
+            step,
+            RMCP_STATUS.get(status, "status 0x%02x" % status),
+        )
+        if status in RMCP_STATUS_UNSUPPORTED:
+            raise IPMIUnsupported(message)
+        elif status in RMCP_STATUS_AUTH:
+            raise IPMIAuthError(message)
+        else:
+            raise IPMIError(message)
+
+    @inlineCallbacks
+    def _open(self):
+        for suite_id in self.client.cipher_suites:
+            try:
+                yield self._open_with(CIPHER_SUITES[suite_id])
+            except IPMIUnsupported:
+                continue
+            else:
+                return
+        raise IPMIUnsupported(
+            "%s: cipher suite id unavailable: none of %s are supported"
+            % (
+                self.address[0],
+                ", ".join(map(str, self.client.cipher_suites)),
+            )
+        )
+
+    @inlineCallbacks
+    def _open_with(self, suite):
+        host = self.address[0]
+        if len(self.username) > 16:
+            raise IPMIAuthError("%s: username invalid: too long" % host)
+        # Ask for the privilege level up front, as FreeIPMI's
+        # "opensesspriv" workaround does; many BMCs require it.
+        tag = self._next_tag()
+        request = (
+            struct.pack("<BBxxI", tag, self.privilege, self.console_id)
+            + _algorithm(0, suite.auth)
+            + _algorithm(1, suite.integrity)
+            + _algorithm(2, suite.confidentiality)
+        )
+        response = yield self._exchange(
+            lambda: encode_packet(PAYLOAD.OPEN_SESSION_REQUEST, request),
+            PAYLOAD.OPEN_SESSION_RESPONSE,
+            tag,
+        )
+        self._check_status(response[1], "open session")
+        if len(response) < 12:
+            raise IPMIError("%s: malformed open session response" % host)
+        [bmc_id] = struct.unpack_from("<I", response, 8)
+
+        # RAKP messages 1 and 2: the BMC proves it knows the password.
+        rm = os.urandom(16)
+        # Look the user up by name and privilege level.
+        role, name_length = self.privilege | 0x10, len(self.username)
+        tag = self._next_tag()
+        request = (
+            struct.pack("<BxxxI16sBxxB", tag, bmc_id, rm, role, name_length)
+            + self.username
+        )
+        # The role and name, as they appear in the key exchange codes.
+        role = bytes((role, name_length))
+        response = yield self._exchange(
+            lambda: encode_packet(PAYLOAD.RAKP1, request),
+            PAYLOAD.RAKP2,
+            tag,
+        )
+        self._check_status(response[1], "RAKP 2")
+        size = suite.digest().digest_size
+        if len(response) < 40 + size:
+            raise IPMIError("%s: malformed RAKP 2 message" % host)
+        rc, guid, key_exchange_code = (
+            response[8:24],
+            response[24:40],
+            response[40 : 40 + size],
+        )
+        session_ids = struct.pack("<II", self.console_id, bmc_id)
+        expected = _hmac(
+            suite,
+            self.password,
+            session_ids,
+            rm,
+            rc,
+            guid,
+            role,
+            self.username,
+        )
+        if not hmac.compare_digest(expected, key_exchange_code):
+            raise IPMIAuthError("%s: password invalid" % host)
+
+        # RAKP messages 3 and 4: the client proves it knows the password.
+        tag = self._next_tag()
+        request = struct.pack("<BBxxI", tag, 0, bmc_id) + _hmac(
+            suite,
+            self.password,
+            rc,
+            struct.pack("<I", self.console_id),
+            role,
+            self.username,
+        )
+        response = yield self._exchange(
+            lambda: encode_packet(PAYLOAD.RAKP3, request),
+            PAYLOAD.RAKP4,
+            tag,
+        )
+        self._check_status(response[1], "RAKP 4")
+        sik = _hmac(suite, self.password, rm, rc, role, self.username)
+        expected = _hmac(suite, sik, rm, struct.pack("<I", bmc_id), guid)
+        if not hmac.compare_digest(
+            expected[: suite.icv_length], response[8 : 8 + suite.icv_length]
+        ):
+            raise IPMIError("%s: session integrity check failed" % host)
+
+        self.bmc_id, self.keys, self._seq = bmc_id, SessionKeys(suite, sik), 0
+        try:
+            # Sessions start at the User privilege level.
+            if self.privilege > PRIVILEGE.USER:
+                yield self._request(
+                    NETFN.APP,
+                    CMD.SET_SESSION_PRIVILEGE_LEVEL,
+                    bytes((self.privilege,)),
+                )
+        except IPMICommandError as error:
+            self.reset()
+            if error.completion_code == COMPLETION_PRIVILEGE_UNAVAILABLE:
+                raise IPMIAuthError(
+                    "%s: privilege level insufficient" % host
+                ) from error
+            raise
+        except Exception:
+            self.reset()
+            raise
+
+    @inlineCallbacks
+    def _request(self, netfn, cmd, data=b""):
+        self._rq_seq = (self._rq_seq + 1) % 64
+        message = encode_ipmi_message(netfn, cmd, self._rq_seq, data)
+
+        def encode():
+            # Each retransmission has a new session sequence number, so that
+            # the BMC does not drop it as a replay.
+            self._seq = self._seq % 0xFFFFFFFF + 1
+            return self.keys.encode(
+                PAYLOAD.IPMI, message, self.bmc_id, self._seq
+            )
+
+        response = yield self._exchange(
+            encode, PAYLOAD.IPMI, (self._rq_seq, cmd)
+        )
+        if len(response) == 0:
+            raise IPMIError("%s: empty response" % self.address[0])
+        elif response[0] != 0:
+            raise IPMICommandError(
+                "%s: command 0x%02x/0x%02x failed with completion code 0x%02x"
+                % (self.address[0], netfn, cmd, response[0]),
+                response[0],
+            )
+        returnValue(response[1:])
+
+    @inlineCallbacks
+    def _open_and_request(self, netfn, cmd, data):
+        if not self.established:
+            yield self._open()
+        try:
+            response = yield self._request(netfn, cmd, data)
+        except IPMITimeout:
+            # The BMC may have dropped the session, e.g. because it was
+            # reset; the next request will open another.
+            self.reset()
+            raise
+        returnValue(response)
+
+    @inlineCallbacks
+    def _keep_alive(self):
+        if self.established:
+            yield self._open_and_request(NETFN.APP, CMD.GET_DEVICE_ID, b"")
+
+    @inlineCallbacks
+    def _close(self):
+        if not self.established:
+            return
+        try:
+            yield self._request(
+                NETFN.APP, CMD.CLOSE_SESSION, struct.pack("<I", self.bmc_id)
+            )
+        except IPMIError:
+            pass
+        finally:
+            self.reset()
+
+
+class _RMCPProtocol(DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagramReceived(self, datagram, address):
+        self.client._received(datagram, address)
+
+
+class RMCPPlusClient:
+    """Makes IPMI requests to many BMCs over one UDP socket.
+
+    A session is kept open with each BMC (and set of credentials), and
+    kept alive while it is used.
+
+    :ivar cipher_suites: The cipher suites to try, in order.
+    :ivar timeouts: How long to wait for each transmission of a request.
+    :ivar keepalive_interval: How long a session may be quiet before a
+        keep-alive request is sent in it.
+    :ivar idle_timeout: How long a session may go unused before it is
+        closed.
+    """
+
+    def __init__(
+        self,
+        reactor=None,
+        cipher_suites=(3, 17),
+        timeouts=(1, 2, 4),
+        keepalive_interval=30,
+        idle_timeout=600,
+    ):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.cipher_suites = cipher_suites
+        self.timeouts = timeouts
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self._port = None
+        self._keepalive = LoopingCall(self._keep_alive)
+        self._keepalive.clock = reactor
+        self._sessions = {}
+        self._sessions_by_id = {}
+
+    def _listen(self):
+        if self._port is None:
+            self._port = self.reactor.listenUDP(0, _RMCPProtocol(self))
+            self._keepalive.start(self.keepalive_interval / 2, now=False)
+
+    def stop(self):
+        """Close all sessions and the socket."""
+        if self._keepalive.running:
+            self._keepalive.stop()
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        d = DeferredList([session.close() for session in sessions])
+        d.addCallback(lambda _: self._stop_listening())
+        return d
+
+    def _stop_listening(self):
+        self._sessions_by_id.clear()
+        port, self._port = self._port, None
+        if port is not None:
+            return port.stopListening()
+
+    def _register(self, session):
+        while True:
+            console_id = random.randint(1, 0xFFFFFFFF)
+            if console_id not in self._sessions_by_id:
+                self._sessions_by_id[console_id] = session
+                return console_id
+
+    def _make_deferred(self, timeout):
+        return Deferred().addTimeout(timeout, self.reactor)
+
+    def _send(self, packet, address):
+        self._port.write(packet, address)
+
+    def _received(self, packet, address):
+        try:
+            payload_type, session_id, _, payload = decode_packet(packet)
+        except ValueError:
+            return
+        if payload_type & 0x3F in (
+            PAYLOAD.OPEN_SESSION_RESPONSE,
+            PAYLOAD.RAKP2,
+            PAYLOAD.RAKP4,
+        ):
+            # These are sent before the session is established, so they
+            # carry the session ID in the payload.
+            if len(payload) < 8:
+                return
+            [session_id] = struct.unpack_from("<I", payload, 4)
+        session = self._sessions_by_id.get(session_id)
+        if session is not None and session.address[0] == address[0]:
+            session.received(packet)
+
+    @inlineCallbacks
+    def request(
+        self,
+        host,
+        username,
+        password,
+        netfn,
+        cmd,
+        data=b"",
+        port=623,
+        privilege=PRIVILEGE.OPERATOR,
+    ):
+        """Make an IPMI request to the BMC at `host`, an IPv4 address.
+
+        :return: A `Deferred` firing with the response data, without the
+            completion code.
+        """
+        self._listen()
+        key = host, port, username, password, privilege
+        session = self._sessions.get(key)
+        if session is None:
+            session = IPMISession(
+                self, (host, port), username, password, privilege
+            )
+            self._sessions[key] = session
+        reused = session.established
+        try:
+            response = yield session.request(netfn, cmd, data)
+        except IPMITimeout:
+            if not reused:
+                raise
+            # The BMC may have forgotten the session; try once more in a
+            # new one.
+            response = yield session.request(netfn, cmd, data)
+        returnValue(response)
+
+    def get_power_state(self, host, username, password, port=623):
+        """Query the power state of the machine managed by a BMC.
+
+        :return: A `Deferred` firing with "on" or "off".
+        """
+        d = self.request(
+            host,
+            username,
+            password,
+            NETFN.CHASSIS,
+            CMD.GET_CHASSIS_STATUS,
+            port=port,
+        )
+        return d.addCallback(lambda data: "on" if data[0] & 0x01 else "off")
+
+    def chassis_control(self, host, username, password, action, port=623):
+        """Power the machine managed by a BMC on, off, or cycle it.
+
+        :param action: One of `CHASSIS_CONTROL`.
+        """
+        return self.request(
+            host,
+            username,
+            password,
+            NETFN.CHASSIS,
+            CMD.CHASSIS_CONTROL,
+            bytes((action,)),
+            port=port,
+        )
+
+    def set_pxe_boot(self, host, username, password, efi=False, port=623):
+        """Make the machine managed by a BMC boot from PXE, once."""
+        # Boot flags parameter: valid for the next boot only, then the
+        # boot type and device (0x04 is PXE).
+        flags = 0x80 | (0x20 if efi else 0x00)
+        return self.request(
+            host,
+            username,
+            password,
+            NETFN.CHASSIS,
+            CMD.SET_SYSTEM_BOOT_OPTIONS,
+            bytes((0x05, flags, 0x04, 0x00, 0x00, 0x00)),
+            port=port,
+        )
+
+    def _keep_alive(self):
+        """Keep quiet sessions alive, and close those no longer used."""
+        now = self.reactor.seconds()
+        calls = []
+        for key, session in list(self._sessions.items()):
+            if now - session.last_used >= self.idle_timeout:
+                del self._sessions[key]
+                d = session.close()
+                d.addBoth(self._forget, session)
+                calls.append(d)
+            elif (
+                session.established
+                and now - session.last_active >= self.keepalive_interval
+            ):
+                d = session.keep_alive()
+                d.addErrback(
+                    lambda failure, host: log.debug(
+                        "IPMI keep-alive for {host} failed: {error}",
+                        host=host,
+                        error=failure.getErrorMessage(),
+                    ),
+                    session.address[0],
+                )
+                calls.append(d)
+        return DeferredList(calls)
+
+    def _forget(self, _, session):
+        self._sessions_by_id.pop(session.console_id, None)
@@ -22,7 +22,11 @@ from maastesting.matchers import (
 )
 from maastesting.runtest import MAASTwistedRunTest
 from maastesting.testcase import MAASTestCase
-from provisioningserver.drivers import make_setting_field, power
+from provisioningserver.drivers import (
+    make_setting_field,
+    power,
+    SETTING_SCOPE,
+)
 from provisioningserver.drivers.power import (
     get_error_message,
     JSON_POWER_DRIVER_SCHEMA,
@@ -197,6 +201,33 @@ class TestPowerDriverBase(MAASTestCase):
         #: doesn't raise ValidationError
         validate(fake_driver.get_schema(), JSON_POWER_DRIVER_SCHEMA)
 
+    def test_get_bmc_context_leaves_out_node_settings(self):
+        fake_driver = make_power_driver_base(
+            settings=[
+                make_setting_field("power_address", "Address"),
+                make_setting_field("power_pass", "Password"),
+                make_setting_field(
+                    "power_id", "ID", scope=SETTING_SCOPE.NODE
+                ),
+            ]
+        )
+        context = {
+            "power_address": factory.make_ipv4_address(),
+            "power_id": factory.make_name("power_id"),
+            "system_id": factory.make_name("system_id"),
+        }
+        self.assertEqual(
+            {"power_address": context["power_address"], "power_pass": None},
+            fake_driver.get_bmc_context(context),
+        )
+
+    def test_query_many_raises_not_implemented(self):
+        fake_driver = make_power_driver_base()
+        self.assertFalse(fake_driver.can_query_many)
+        self.assertRaises(
+            NotImplementedError, fake_driver.query_many, sentinel.contexts
+        )
+
 
 class TestGetErrorMessage(MAASTestCase):
 
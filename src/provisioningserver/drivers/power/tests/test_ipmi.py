@@ -6,23 +6,36 @@
 __all__ = []
 
 import random
-from unittest.mock import ANY, call, sentinel
+from unittest.mock import ANY, call, Mock, sentinel
 
 from testtools.matchers import Contains, Equals
+from twisted.internet.defer import fail, succeed
 
 from maastesting.factory import factory
-from maastesting.matchers import MockCalledOnceWith
+from maastesting.matchers import MockCalledOnceWith, MockNotCalled
 from maastesting.testcase import MAASTestCase
+from maastesting.twisted import extract_result
 from provisioningserver.drivers.power import ipmi as ipmi_module
-from provisioningserver.drivers.power import PowerAuthError, PowerError
+from provisioningserver.drivers.power import (
+    PowerAuthError,
+    PowerConnError,
+    PowerDriver,
+    PowerError,
+)
 from provisioningserver.drivers.power.ipmi import (
     IPMI_BOOT_TYPE,
     IPMI_BOOT_TYPE_MAPPING,
     IPMI_CONFIG,
     IPMI_CONFIG_WITH_BOOT_TYPE,
+    IPMI_DRIVER,
     IPMI_ERRORS,
     IPMIPowerDriver,
 )
+from provisioningserver.drivers.power.rmcp import (
+    IPMIAuthError,
+    IPMIError,
+    IPMITimeout,
+)
 from provisioningserver.utils.shell import has_command_available, ProcessResult
 
 
@@ -385,3 +398,84 @@ class TestIPMIPowerDriver(MAASTestCase):
         )
         self.assertThat(tmpfile.flush, MockCalledOnceWith())
         self.assertThat(tmpfile.__exit__, MockCalledOnceWith(None, None, None))
+
+
+class TestIPMIPowerDriverQuery(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Mock()
+        self.patch(ipmi_module, "get_rmcp_client").return_value = self.client
+        self.freeipmi_query = self.patch(PowerDriver, "query")
+        self.freeipmi_query.return_value = succeed("off")
+
+    def make_context(self):
+        context = make_context()
+        context["power_driver"] = IPMI_DRIVER.LAN_2_0
+        context["power_address"] = factory.make_ipv4_address()
+        return context
+
+    def test_queries_over_rmcp_plus(self):
+        context = self.make_context()
+        self.client.get_power_state.return_value = succeed("on")
+        driver = IPMIPowerDriver()
+        self.assertEqual("on", extract_result(driver.query("id", context)))
+        self.assertThat(
+            self.client.get_power_state,
+            MockCalledOnceWith(
+                context["power_address"],
+                context["power_user"],
+                context["power_pass"],
+            ),
+        )
+        self.assertThat(self.freeipmi_query, MockNotCalled())
+
+    def test_uses_freeipmi_for_ipmi_1_5(self):
+        context = self.make_context()
+        context["power_driver"] = IPMI_DRIVER.LAN
+        driver = IPMIPowerDriver()
+        self.assertEqual("off", extract_result(driver.query("id", context)))
+        self.assertThat(self.client.get_power_state, MockNotCalled())
+        self.assertThat(self.freeipmi_query, MockCalledOnceWith("id", context))
+
+    def test_uses_freeipmi_for_bmcs_without_ipv4_address(self):
+        context = self.make_context()
+        context["power_address"] = random.choice(
+            ("", factory.make_ipv6_address(), factory.make_hostname())
+        )
+        driver = IPMIPowerDriver()
+        self.assertEqual("off", extract_result(driver.query("id", context)))
+        self.assertThat(self.client.get_power_state, MockNotCalled())
+
+    def test_falls_back_to_freeipmi_on_other_errors(self):
+        context = self.make_context()
+        self.client.get_power_state.return_value = fail(
+            IPMIError("cipher suite id unavailable")
+        )
+        driver = IPMIPowerDriver()
+        self.assertEqual("off", extract_result(driver.query("id", context)))
+        self.assertThat(self.freeipmi_query, MockCalledOnceWith("id", context))
+
+    def test_raises_auth_errors(self):
+        context = self.make_context()
+        self.client.get_power_state.return_value = fail(
+            IPMIAuthError("1.2.3.4: RAKP 2 failed: password invalid")
+        )
+        driver = IPMIPowerDriver()
+        error = self.assertRaises(
+            PowerAuthError, extract_result, driver.query("id", context)
+        )
+        self.assertEqual(
+            IPMI_ERRORS["password invalid"]["message"], str(error)
+        )
+        self.assertThat(self.freeipmi_query, MockNotCalled())
+
+    def test_raises_timeouts(self):
+        context = self.make_context()
+        self.client.get_power_state.return_value = fail(
+            IPMITimeout("1.2.3.4: session timeout")
+        )
+        driver = IPMIPowerDriver()
+        error = self.assertRaises(
+            PowerConnError, extract_result, driver.query("id", context)
+        )
+        self.assertEqual(IPMI_ERRORS["session timeout"]["message"], str(error))
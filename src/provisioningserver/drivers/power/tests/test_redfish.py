@@ -33,8 +33,8 @@ import provisioningserver.drivers.power.redfish as redfish_module
 from provisioningserver.drivers.power.redfish import (
     REDFISH_POWER_CONTROL_ENDPOINT,
     RedfishPowerDriver,
-    WebClientContextFactory,
 )
+from provisioningserver.drivers.power.utils import WebClientContextFactory
 
 SAMPLE_JSON_SYSTEMS = {
     "@odata.context": "/redfish/v1/$metadata#Systems",
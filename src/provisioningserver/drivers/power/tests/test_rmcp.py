@@ -0,0 +1,318 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `provisioningserver.drivers.power.rmcp`."""
+
+__all__ = []
+
+import os
+
+from testtools.testcase import ExpectedException
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults, inlineCallbacks
+
+from maastesting.factory import factory
+from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
+from provisioningserver.drivers.power.rmcp import (
+    CHASSIS_CONTROL,
+    CIPHER_SUITES,
+    CMD,
+    decode_ipmi_message,
+    encode_ipmi_message,
+    IPMIAuthError,
+    IPMITimeout,
+    IPMIUnsupported,
+    NETFN,
+    PAYLOAD,
+    RMCPPlusClient,
+    SessionKeys,
+)
+from provisioningserver.testing.ipmi import FakeBMC, FakeSessionKeys
+
+
+class TestIPMIMessages(MAASTestCase):
+    def test_encode_decode_request(self):
+        data = os.urandom(5)
+        message = encode_ipmi_message(
+            NETFN.CHASSIS, CMD.CHASSIS_CONTROL, 9, data
+        )
+        self.assertEqual(
+            (NETFN.CHASSIS, 9, CMD.CHASSIS_CONTROL, data),
+            decode_ipmi_message(message),
+        )
+
+    def test_encode_decode_response(self):
+        message = encode_ipmi_message(
+            NETFN.APP + 1, CMD.GET_DEVICE_ID, 63, b"\x00\x01", response=True
+        )
+        self.assertEqual(b"\x81", message[:1])
+        self.assertEqual(
+            (NETFN.APP + 1, 63, CMD.GET_DEVICE_ID, b"\x00\x01"),
+            decode_ipmi_message(message),
+        )
+
+    def test_decode_rejects_bad_checksum(self):
+        message = bytearray(encode_ipmi_message(NETFN.APP, 0x01, 1, b"\x00"))
+        message[-2] ^= 0x01
+        self.assertRaises(ValueError, decode_ipmi_message, bytes(message))
+
+
+class TestSessionKeys(MAASTestCase):
+
+    scenarios = [
+        ("suite-%d" % suite_id, {"suite": suite})
+        for suite_id, suite in sorted(CIPHER_SUITES.items())
+    ]
+
+    def test_encode_decode(self):
+        keys = SessionKeys(self.suite, os.urandom(20))
+        for length in range(0, 40):
+            payload = os.urandom(length)
+            packet = keys.encode(PAYLOAD.IPMI, payload, 1234, 5)
+            self.assertEqual(0, len(packet[4:]) % 4)
+            self.assertEqual(
+                (PAYLOAD.IPMI, 1234, 5, payload), keys.decode(packet)
+            )
+
+    def test_decode_rejects_tampered_packets(self):
+        keys = SessionKeys(self.suite, os.urandom(20))
+        packet = bytearray(keys.encode(PAYLOAD.IPMI, b"payload", 1234, 5))
+        packet[20] ^= 0x01
+        self.assertRaises(ValueError, keys.decode, bytes(packet))
+
+    def test_decode_rejects_packets_from_other_sessions(self):
+        keys = SessionKeys(self.suite, os.urandom(20))
+        other_keys = SessionKeys(self.suite, os.urandom(20))
+        packet = other_keys.encode(PAYLOAD.IPMI, b"payload", 1234, 5)
+        self.assertRaises(ValueError, keys.decode, packet)
+
+    def test_derives_keys_like_bmc(self):
+        sik = os.urandom(self.suite.digest().digest_size)
+        keys = SessionKeys(self.suite, sik)
+        bmc_keys = FakeSessionKeys(self.suite, sik)
+        self.assertEqual((bmc_keys.k1, bmc_keys.k2), (keys.k1, keys.k2))
+
+
+class TestSessionKeyDerivation(MAASTestCase):
+    # K1 = HMAC-SHA256(SIK, 0x01 * 20) and K2 = HMAC-SHA256(SIK, 0x02 * 20),
+    # as defined in IPMI v2.0, section 13.32, for SIK = 0x00, 0x01, ... 0x1f.
+    sik = bytes(range(32))
+    k1 = bytes.fromhex(
+        "8f34f198a044babe550f6217f57fc801e20bee40dd16b9712797aaf5bac3106b"
+    )
+    k2 = bytes.fromhex(
+        "4711da70e361cc4884e705f63bb297e3ba8e1c56e5de896cc0282feba64592f0"
+    )
+
+    def test_suite_17_keys(self):
+        keys = SessionKeys(CIPHER_SUITES[17], self.sik)
+        self.assertEqual(self.k1, keys.k1)
+        self.assertEqual(self.k2, keys.k2)
+
+    def test_fake_bmc_suite_17_keys(self):
+        keys = FakeSessionKeys(CIPHER_SUITES[17], self.sik)
+        self.assertEqual(self.k1, keys.k1)
+        self.assertEqual(self.k2, keys.k2)
+
+
+class TestRMCPPlusClient(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def setUp(self):
+        super().setUp()
+        self.username = factory.make_name("user")
+        self.password = factory.make_name("password")
+
+    def make_bmc(self, **kwargs):
+        bmc = FakeBMC({self.username: self.password}, **kwargs)
+        port = reactor.listenUDP(0, bmc, interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+        return bmc, port.getHost().port
+
+    def make_client(self, **kwargs):
+        kwargs.setdefault("timeouts", (0.2, 0.2))
+        client = RMCPPlusClient(**kwargs)
+        self.addCleanup(client.stop)
+        return client
+
+    def get_power_state(self, client, port, password=None):
+        if password is None:
+            password = self.password
+        return client.get_power_state(
+            "127.0.0.1", self.username, password, port=port
+        )
+
+    @inlineCallbacks
+    def test_get_power_state(self):
+        bmc, port = self.make_bmc()
+        client = self.make_client()
+        state = yield self.get_power_state(client, port)
+        self.assertEqual("off", state)
+        bmc.power_state = "on"
+        state = yield self.get_power_state(client, port)
+        self.assertEqual("on", state)
+
+    @inlineCallbacks
+    def test_reuses_session(self):
+        bmc, port = self.make_bmc()
+        client = self.make_client()
+        for _ in range(3):
+            yield self.get_power_state(client, port)
+        self.assertEqual(1, bmc.opened)
+        self.assertEqual(
+            [
+                (NETFN.APP, CMD.SET_SESSION_PRIVILEGE_LEVEL, b"\x03"),
+                (NETFN.CHASSIS, CMD.GET_CHASSIS_STATUS, b""),
+                (NETFN.CHASSIS, CMD.GET_CHASSIS_STATUS, b""),
+                (NETFN.CHASSIS, CMD.GET_CHASSIS_STATUS, b""),
+            ],
+            bmc.requests,
+        )
+
+    @inlineCallbacks
+    def test_concurrent_requests_share_session(self):
+        bmc, port = self.make_bmc()
+        client = self.make_client()
+        states = yield gatherResults(
+            [self.get_power_state(client, port) for _ in range(5)]
+        )
+        self.assertEqual(["off"] * 5, states)
+        self.assertEqual(1, bmc.opened)
+
+    @inlineCallbacks
+    def test_queries_many_bmcs_over_one_socket(self):
+        bmcs = [self.make_bmc() for _ in range(20)]
+        for index, (bmc, _) in enumerate(bmcs):
+            bmc.power_state = "on" if index % 2 else "off"
+        client = self.make_client()
+        states = yield gatherResults(
+            [self.get_power_state(client, port) for _, port in bmcs]
+        )
+        self.assertEqual([bmc.power_state for bmc, _ in bmcs], states)
+
+    @inlineCallbacks
+    def test_uses_cipher_suite_17_if_3_is_unsupported(self):
+        bmc, port = self.make_bmc(cipher_suites=(17,))
+        client = self.make_client()
+        yield self.get_power_state(client, port)
+        [session] = bmc.sessions.values()
+        self.assertEqual(17, session["suite"].id)
+
+    @inlineCallbacks
+    def test_raises_unsupported_if_no_cipher_suite_matches(self):
+        _, port = self.make_bmc(cipher_suites=())
+        client = self.make_client()
+        with ExpectedException(IPMIUnsupported, ".*cipher suite id.*"):
+            yield self.get_power_state(client, port)
+
+    @inlineCallbacks
+    def test_raises_auth_error_for_wrong_password(self):
+        _, port = self.make_bmc()
+        client = self.make_client()
+        with ExpectedException(IPMIAuthError, ".*password invalid.*"):
+            yield self.get_power_state(client, port, password="wrong")
+
+    @inlineCallbacks
+    def test_raises_auth_error_for_unknown_user(self):
+        _, port = self.make_bmc()
+        client = self.make_client()
+        with ExpectedException(IPMIAuthError, ".*username invalid.*"):
+            yield client.get_power_state(
+                "127.0.0.1", "nobody", self.password, port=port
+            )
+
+    @inlineCallbacks
+    def test_retransmits_lost_requests(self):
+        bmc, port = self.make_bmc()
+        client = self.make_client()
+        yield self.get_power_state(client, port)
+        bmc.drop = 1
+        state = yield self.get_power_state(client, port)
+        self.assertEqual("off", state)
+        self.assertEqual(1, bmc.opened)
+
+    @inlineCallbacks
+    def test_raises_timeout_if_bmc_does_not_answer(self):
+        bmc, port = self.make_bmc()
+        bmc.drop = 100
+        client = self.make_client()
+        with ExpectedException(IPMITimeout, ".*session timeout.*"):
+            yield self.get_power_state(client, port)
+
+    @inlineCallbacks
+    def test_opens_new_session_if_bmc_forgets_session(self):
+        bmc, port = self.make_bmc()
+        client = self.make_client()
+        yield self.get_power_state(client, port)
+        bmc.sessions.clear()
+        bmc.power_state = "on"
+        state = yield self.get_power_state(client, port)
+        self.assertEqual("on", state)
+        self.assertEqual(2, bmc.opened)
+
+    @inlineCallbacks
+    def test_chassis_control(self):
+        bmc, port = self.make_bmc()
+        client = self.make_client()
+        yield client.chassis_control(
+            "127.0.0.1",
+            self.username,
+            self.password,
+            CHASSIS_CONTROL.POWER_UP,
+            port=port,
+        )
+        self.assertEqual("on", bmc.power_state)
+
+    @inlineCallbacks
+    def test_set_pxe_boot(self):
+        bmc, port = self.make_bmc()
+        client = self.make_client()
+        yield client.set_pxe_boot(
+            "127.0.0.1", self.username, self.password, efi=True, port=port
+        )
+        self.assertEqual(
+            (
+                NETFN.CHASSIS,
+                CMD.SET_SYSTEM_BOOT_OPTIONS,
+                b"\x05\xa0\x04\x00\x00\x00",
+            ),
+            bmc.requests[-1],
+        )
+
+    @inlineCallbacks
+    def test_keep_alive_pings_quiet_sessions(self):
+        bmc, port = self.make_bmc()
+        client = self.make_client(keepalive_interval=10)
+        yield self.get_power_state(client, port)
+        yield client._keep_alive()
+        self.assertEqual(
+            (NETFN.CHASSIS, CMD.GET_CHASSIS_STATUS, b""), bmc.requests[-1]
+        )
+        [session] = client._sessions.values()
+        session.last_active -= 10
+        yield client._keep_alive()
+        self.assertEqual((NETFN.APP, CMD.GET_DEVICE_ID, b""), bmc.requests[-1])
+        self.assertEqual(1, bmc.opened)
+
+    @inlineCallbacks
+    def test_keep_alive_closes_unused_sessions(self):
+        bmc, port = self.make_bmc()
+        client = self.make_client(idle_timeout=60)
+        yield self.get_power_state(client, port)
+        [session] = client._sessions.values()
+        session.last_used -= 60
+        yield client._keep_alive()
+        self.assertEqual({}, client._sessions)
+        self.assertEqual({}, client._sessions_by_id)
+        self.assertEqual({}, bmc.sessions)
+        self.assertEqual((NETFN.APP, CMD.CLOSE_SESSION), bmc.requests[-1][:2])
+
+    @inlineCallbacks
+    def test_stop_closes_sessions(self):
+        bmc, port = self.make_bmc()
+        client = RMCPPlusClient(timeouts=(0.2, 0.2))
+        yield self.get_power_state(client, port)
+        yield client.stop()
+        self.assertEqual({}, bmc.sessions)
+        self.assertIsNone(client._port)
@@ -0,0 +1,165 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `provisioningserver.drivers.power.utils`."""
+
+__all__ = []
+
+from unittest.mock import call, Mock, sentinel
+
+from OpenSSL import SSL
+from twisted.internet import reactor
+from twisted.internet._sslverify import ClientTLSOptions
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed
+from twisted.protocols.policies import WrappingFactory
+from twisted.web.client import Agent, readBody
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from maastesting.factory import factory
+from maastesting.matchers import (
+    MockCalledOnceWith,
+    MockCallsMatch,
+    MockNotCalled,
+)
+from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
+from provisioningserver.drivers.power.utils import (
+    BMCConnectionPool,
+    SessionResumingTLSOptions,
+    WebClientContextFactory,
+)
+
+
+class TestWebClientContextFactory(MAASTestCase):
+    def test_creatorForNetloc_keeps_options_for_each_server(self):
+        hostname = factory.make_name("hostname").encode("utf-8")
+        contextFactory = WebClientContextFactory()
+        opts = contextFactory.creatorForNetloc(hostname, 443)
+        self.assertIsInstance(opts, SessionResumingTLSOptions)
+        self.assertIs(opts, contextFactory.creatorForNetloc(hostname, 443))
+        self.assertIsNot(opts, contextFactory.creatorForNetloc(hostname, 8443))
+
+
+class TestSessionResumingTLSOptions(MAASTestCase):
+    def make_options(self):
+        contextFactory = WebClientContextFactory()
+        return contextFactory.creatorForNetloc(b"bmc.example.com", 443)
+
+    def test_resumes_last_session(self):
+        clientConnectionForTLS = self.patch(
+            ClientTLSOptions, "clientConnectionForTLS"
+        )
+        opts = self.make_options()
+        connection = opts.clientConnectionForTLS(sentinel.protocol)
+        self.assertThat(connection.set_session, MockNotCalled())
+        opts._save_session(
+            Mock(get_session=lambda: sentinel.session),
+            SSL.SSL_CB_HANDSHAKE_DONE,
+            1,
+        )
+        connection = opts.clientConnectionForTLS(sentinel.protocol)
+        self.assertThat(
+            connection.set_session, MockCalledOnceWith(sentinel.session)
+        )
+        self.assertThat(
+            clientConnectionForTLS,
+            MockCalledOnceWith(sentinel.protocol),
+        )
+
+    def test_saves_session_only_when_handshake_is_done(self):
+        opts = self.make_options()
+        opts._save_session(
+            Mock(get_session=lambda: sentinel.session),
+            SSL.SSL_CB_HANDSHAKE_START,
+            1,
+        )
+        self.assertIsNone(opts._session)
+
+
+class Hello(Resource):
+
+    isLeaf = True
+
+    def render_GET(self, request):
+        return b"hello"
+
+
+class ServerFactory(WrappingFactory):
+    """Keep track of the server's connections, to wait for them to close."""
+
+    def __init__(self, wrappedFactory):
+        super().__init__(wrappedFactory)
+        self._waiting = []
+
+    def unregisterProtocol(self, p):
+        super().unregisterProtocol(p)
+        if len(self.protocols) == 0:
+            waiting, self._waiting = self._waiting, []
+            for d in waiting:
+                d.callback(None)
+
+    def wait_closed(self):
+        if len(self.protocols) == 0:
+            return succeed(None)
+        d = Deferred()
+        self._waiting.append(d)
+        return d
+
+
+class TestBMCConnectionPool(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def make_pool(self):
+        return BMCConnectionPool(reactor, prometheus_metrics=Mock())
+
+    def make_server(self):
+        # No timeout, to leave no delayed calls behind.
+        server = ServerFactory(Site(Hello(), timeout=None))
+        port = reactor.listenTCP(0, server, interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+        return server, b"http://127.0.0.1:%d/" % port.getHost().port
+
+    @inlineCallbacks
+    def test_reuses_connections(self):
+        pool = self.make_pool()
+        server, uri = self.make_server()
+        agent = Agent(reactor, pool=pool)
+        for _ in range(3):
+            response = yield agent.request(b"GET", uri)
+            self.assertEqual(b"hello", (yield readBody(response)))
+        yield pool.closeCachedConnections()
+        yield server.wait_closed()
+        self.assertEqual((1, 2), (pool.opened, pool.reused))
+        self.assertThat(
+            pool.prometheus_metrics.update,
+            MockCallsMatch(
+                *(
+                    call(
+                        "maas_bmc_http_connections",
+                        "inc",
+                        labels={"result": result},
+                    )
+                    for result in ("new", "reused", "reused")
+                )
+            ),
+        )
+
+    def test_limit_runs_requests_to_each_host_in_turn(self):
+        pool = self.make_pool()
+        pool.maxPersistentPerHost = 2
+        requests = [Deferred() for _ in range(3)]
+        other_request = Deferred()
+        func = Mock(side_effect=requests + [other_request])
+        results = [
+            pool.limit(b"https://bmc1.example.com/redfish/v1", func, index)
+            for index in range(3)
+        ]
+        pool.limit("https://bmc2.example.com/redfish/v1", func, "other")
+        self.assertEqual([call(0), call(1), call("other")], func.mock_calls)
+        requests[0].callback(sentinel.response)
+        self.assertEqual(sentinel.response, results[0].result)
+        self.assertEqual(call(2), func.mock_calls[-1])
+        for request in requests[1:] + [other_request]:
+            request.callback(None)
+        self.assertEqual({}, pool._limits)
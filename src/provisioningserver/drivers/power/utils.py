@@ -3,21 +3,134 @@
 
 """Helpers for MAAS power drivers."""
 
-__all__ = ["WebClientContextFactory"]
+__all__ = [
+    "bmc_connection_pool",
+    "BMCConnectionPool",
+    "WebClientContextFactory",
+]
 
+from urllib.parse import urlparse
+
+from OpenSSL import SSL
+from twisted.internet import reactor
 from twisted.internet._sslverify import (
     ClientTLSOptions,
     OpenSSLCertificateOptions,
 )
-from twisted.web.client import BrowserLikePolicyForHTTPS
+from twisted.internet.defer import DeferredSemaphore
+from twisted.web.client import BrowserLikePolicyForHTTPS, HTTPConnectionPool
+
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
+
+
+class SessionResumingTLSOptions(ClientTLSOptions):
+    """TLS options that resume the last TLS session with the server.
+
+    The server's certificate and hostname are not checked.
+    """
+
+    def __init__(self, hostname, ctx):
+        super().__init__(hostname, ctx)
+        self._session = None
+        # This forces Twisted to not validate the hostname of the certificate.
+        ctx.set_info_callback(self._save_session)
+
+    def _save_session(self, connection, where, ret):
+        if where & SSL.SSL_CB_HANDSHAKE_DONE:
+            self._session = connection.get_session()
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        connection = super().clientConnectionForTLS(tlsProtocol)
+        if self._session is not None:
+            connection.set_session(self._session)
+        return connection
 
 
 class WebClientContextFactory(BrowserLikePolicyForHTTPS):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (hostname, port) -> SessionResumingTLSOptions
+        self._options = {}
+
     def creatorForNetloc(self, hostname, port):
-        opts = ClientTLSOptions(
-            hostname.decode("ascii"),
-            OpenSSLCertificateOptions(verify=False).getContext(),
-        )
-        # This forces Twisted to not validate the hostname of the certificate.
-        opts._ctx.set_info_callback(lambda *args: None)
+        # The options hold the TLS session, so they're kept for each server.
+        opts = self._options.get((hostname, port))
+        if opts is None:
+            opts = SessionResumingTLSOptions(
+                hostname.decode("ascii"),
+                OpenSSLCertificateOptions(verify=False).getContext(),
+            )
+            self._options[(hostname, port)] = opts
         return opts
+
+
+class BMCConnectionPool(HTTPConnectionPool):
+    """Persistent HTTP(S) connections to BMCs, shared by their drivers.
+
+    Connections are used again for the next request to the same host, and
+    closed once idle for `cachedConnectionTimeout` seconds. Use `limit` to
+    keep at most `maxPersistentPerHost` requests to a host going at once.
+
+    :ivar contextFactory: TLS options for `Agent`; using the same one
+        lets new connections resume earlier TLS sessions.
+    :ivar opened: The number of connections opened.
+    :ivar reused: The number of requests sent on an open connection.
+    """
+
+    maxPersistentPerHost = 4
+    cachedConnectionTimeout = 60
+
+    def __init__(self, reactor, prometheus_metrics=PROMETHEUS_METRICS):
+        super().__init__(reactor, persistent=True)
+        self.prometheus_metrics = prometheus_metrics
+        self.contextFactory = WebClientContextFactory()
+        self.opened = 0
+        self.reused = 0
+        # host -> DeferredSemaphore
+        self._limits = {}
+
+    def getConnection(self, key, endpoint):
+        opened = self.opened
+        d = super().getConnection(key, endpoint)
+        if self.opened == opened:
+            self.reused += 1
+            self._count("reused")
+        return d
+
+    def _newConnection(self, key, endpoint):
+        self.opened += 1
+        self._count("new")
+        return super()._newConnection(key, endpoint)
+
+    def _count(self, result):
+        self.prometheus_metrics.update(
+            "maas_bmc_http_connections", "inc", labels={"result": result}
+        )
+
+    def limit(self, uri, func, *args, **kwargs):
+        """Call `func` with `args` once fewer than `maxPersistentPerHost`
+        requests to the host in `uri` are going.
+
+        `func` should send the request and read the response, and may
+        return a `Deferred`.
+        """
+        if isinstance(uri, bytes):
+            uri = uri.decode("utf-8")
+        host = urlparse(uri).netloc
+        limit = self._limits.get(host)
+        if limit is None:
+            limit = self._limits[host] = DeferredSemaphore(
+                self.maxPersistentPerHost
+            )
+        d = limit.run(func, *args, **kwargs)
+        d.addBoth(self._forget_limit, host, limit)
+        return d
+
+    def _forget_limit(self, result, host, limit):
+        if limit.tokens == limit.limit and self._limits.get(host) is limit:
+            del self._limits[host]
+        return result
+
+
+# Connections for the Redfish, RSD and OpenBMC drivers.
+bmc_connection_pool = BMCConnectionPool(reactor)
@@ -31,6 +31,43 @@ METRICS_DEFINITIONS = [
         "Latency of TFTP file downloads",
         ["filename"],
     ),
+    MetricDefinition(
+        "Counter",
+        "maas_power_queries",
+        "Power queries by the rack, by result (success, failure or skipped)",
+        ["power_type", "result"],
+    ),
+    MetricDefinition(
+        "Histogram",
+        "maas_power_query_latency",
+        "Latency of successful power queries",
+        ["power_type"],
+        buckets=[0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120],
+    ),
+    MetricDefinition(
+        "Histogram",
+        "maas_power_state_age",
+        "Time since the power state of a node was last queried",
+        ["power_type"],
+        buckets=[60, 120, 300, 600, 900, 1800, 3600, 7200, 14400],
+    ),
+    MetricDefinition(
+        "Gauge",
+        "maas_power_query_concurrency",
+        "Number of power queries allowed to run at once",
+        ["power_type"],
+    ),
+    MetricDefinition(
+        "Gauge",
+        "maas_power_query_rate",
+        "Power queries completed per second in the last monitoring pass",
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_bmc_http_connections",
+        "HTTP requests to BMCs, by whether the connection was new or reused",
+        ["result"],
+    ),
     # regiond metrics
     MetricDefinition(
         "Histogram",
@@ -70,6 +107,12 @@ METRICS_DEFINITIONS = [
         "Latency of a Websocket handler call",
         ["call"],
     ),
+    MetricDefinition(
+        "Histogram",
+        "maas_websocket_call_queue_wait",
+        "Time a Websocket handler call waited before running",
+        ["call"],
+    ),
     MetricDefinition(
         "Histogram",
         "maas_websocket_call_query_count",
@@ -83,6 +126,40 @@ METRICS_DEFINITIONS = [
         "HTTP request query latency",
         _WEBSOCKET_CALL_LABELS,
     ),
+    MetricDefinition(
+        "Counter",
+        "maas_websocket_notify_dehydrate_cache",
+        "Websocket notifications dehydration cache lookups",
+        ["handler", "result"],
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_websocket_sent_bytes",
+        "Size of the messages sent over compressed websockets",
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_websocket_sent_wire_bytes",
+        "Size of the messages sent over compressed websockets, after "
+        "compression",
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_subnet_index_lookups",
+        "Lookups of the subnet for an IP address in the subnet index",
+        ["result"],
+    ),
+    MetricDefinition(
+        "Gauge",
+        "maas_db_notify_queue_depth",
+        "Number of database notifications waiting to be handled",
+    ),
+    MetricDefinition(
+        "Histogram",
+        "maas_db_notify_latency",
+        "Latency between receiving and handling a database notification",
+        ["channel"],
+    ),
     # Common metrics
     *node_metrics_definitions(),
 ]
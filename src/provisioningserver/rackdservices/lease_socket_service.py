@@ -13,11 +13,12 @@ from twisted.application.service import Service
 from twisted.internet import reactor, task
 from twisted.internet.defer import inlineCallbacks
 from twisted.internet.protocol import DatagramProtocol
+from twisted.protocols import amp
 
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.path import get_maas_data_path
 from provisioningserver.rpc.exceptions import NoConnectionsAvailable
-from provisioningserver.rpc.region import UpdateLease
+from provisioningserver.rpc.region import UpdateLease, UpdateLeases
 from provisioningserver.utils.twisted import pause, retries
 
 maaslog = get_maas_logger("lease_socket_service")
@@ -34,6 +35,9 @@ class LeaseSocketService(Service, DatagramProtocol):
     # None, or a Deferred that will fire when the processor exits.
     done = None
 
+    # The most notifications sent to the region in one `UpdateLeases` call.
+    batch_size = 100
+
     def __init__(self, client_service, reactor):
         self.client_service = client_service
         self.reactor = reactor
@@ -85,36 +89,65 @@ class LeaseSocketService(Service, DatagramProtocol):
         self.notifications.append(notification)
 
     def processNotifications(self, clock=reactor):
-        """Process all notifications."""
+        """Process all notifications, in batches of up to `batch_size`."""
 
-        def gen_notifications(notifications):
+        def gen_batches(notifications):
             while len(notifications) != 0:
-                yield notifications.popleft()
+                size = min(len(notifications), self.batch_size)
+                yield [notifications.popleft() for _ in range(size)]
 
         return task.coiterate(
-            self.processNotification(notification, clock=clock)
-            for notification in gen_notifications(self.notifications)
+            self.processNotificationBatch(batch, clock=clock)
+            for batch in gen_batches(self.notifications)
         )
 
     @inlineCallbacks
-    def processNotification(self, notification, clock=reactor):
-        """Send a notification to the region."""
-        client = None
+    def getClient(self, clock=reactor):
+        """Return a client for the region, or `None` if there is none."""
         for elapsed, remaining, wait in retries(30, 10, clock):
             try:
                 client = yield self.client_service.getClientNow()
-                break
+                return client
             except NoConnectionsAvailable:
-                yield pause(wait, self.clock)
+                yield pause(wait, clock)
         else:
             maaslog.error(
                 "Can't send DHCP lease information, no RPC "
                 "connection to region."
             )
+            return None
+
+    @inlineCallbacks
+    def processNotificationBatch(self, notifications, clock=reactor):
+        """Send a batch of notifications to the region.
+
+        Regions that do not know about `UpdateLeases` are sent each of the
+        notifications in turn instead.
+        """
+        client = yield self.getClient(clock=clock)
+        if client is None:
             return
+        try:
+            yield client(
+                UpdateLeases,
+                cluster_uuid=client.localIdent,
+                updates=notifications,
+            )
+        except amp.UnhandledCommand:
+            for notification in notifications:
+                yield self.sendNotification(client, notification)
+
+    @inlineCallbacks
+    def processNotification(self, notification, clock=reactor):
+        """Send a notification to the region."""
+        client = yield self.getClient(clock=clock)
+        if client is not None:
+            yield self.sendNotification(client, notification)
 
+    def sendNotification(self, client, notification):
+        """Send a notification to the region with `UpdateLease`."""
         # Notification contains all the required data except for the cluster
         # UUID. Add that into the notification and send the information to
         # the region for processing.
         notification["cluster_uuid"] = client.localIdent
-        yield client(UpdateLease, **notification)
+        return client(UpdateLease, **notification)
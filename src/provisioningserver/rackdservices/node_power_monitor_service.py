@@ -9,7 +9,8 @@ __all__ = ["NodePowerMonitorService"]
 from datetime import timedelta
 
 from twisted.application.internet import TimerService
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredList, inlineCallbacks
 from twisted.internet.error import ConnectionDone
 
 from provisioningserver.logger import get_maas_logger, LegacyLogger
@@ -18,7 +19,7 @@ from provisioningserver.rpc.exceptions import (
     NoConnectionsAvailable,
     NoSuchCluster,
 )
-from provisioningserver.rpc.power import query_all_nodes
+from provisioningserver.rpc.power import PowerQueryScheduler, query_all_nodes
 from provisioningserver.rpc.region import ListNodePowerParameters
 
 maaslog = get_maas_logger("power_monitor_service")
@@ -35,6 +36,10 @@ class NodePowerMonitorService(TimerService, object):
         # Call self.query_nodes() every self.check_interval.
         super().__init__(self.check_interval, self.try_query_nodes)
         self.clock = clock
+        self.scheduler = PowerQueryScheduler(
+            clock=reactor if clock is None else clock,
+            initial_concurrency=self.max_nodes_at_once,
+        )
 
     def try_query_nodes(self):
         """Attempt to query nodes' power states.
@@ -55,21 +60,38 @@ class NodePowerMonitorService(TimerService, object):
 
     @inlineCallbacks
     def query_nodes(self, client):
+        scheduler = self.scheduler
+        started, completed = scheduler.clock.seconds(), scheduler.completed
         # Get the nodes' power parameters from the region. Keep getting more
-        # power parameters until the region returns an empty list.
+        # power parameters until the region returns an empty list. Ask for
+        # more once the queries for the last lot have all started, rather
+        # than waiting for the slowest of them to finish.
+        queries = []
         while True:
             response = yield client(
                 ListNodePowerParameters, uuid=client.localIdent
             )
             power_parameters = response["nodes"]
             if len(power_parameters) > 0:
-                yield query_all_nodes(
-                    power_parameters,
-                    max_concurrency=self.max_nodes_at_once,
-                    clock=self.clock,
+                queries.append(
+                    query_all_nodes(
+                        power_parameters,
+                        clock=self.clock,
+                        scheduler=scheduler,
+                    )
                 )
+                yield scheduler.wait_for_room()
             else:
                 break
+        yield DeferredList(queries)
+        elapsed = scheduler.clock.seconds() - started
+        if elapsed > 0:
+            scheduler.prometheus_metrics.update(
+                "maas_power_query_rate",
+                "set",
+                value=(scheduler.completed - completed) / elapsed,
+            )
+        scheduler.forget(older_than=2 * scheduler.max_backoff)
 
     def query_nodes_failed(self, failure, localIdent):
         if failure.check(NoSuchCluster):
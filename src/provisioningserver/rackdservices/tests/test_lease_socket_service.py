@@ -9,7 +9,7 @@ import json
 import os
 import socket
 import time
-from unittest.mock import MagicMock, sentinel
+from unittest.mock import call, MagicMock, sentinel
 
 from testtools.matchers import Not, PathExists
 from twisted.application.service import Service
@@ -18,14 +18,14 @@ from twisted.internet.protocol import DatagramProtocol
 from twisted.internet.threads import deferToThread
 
 from maastesting.factory import factory
-from maastesting.matchers import MockCalledOnceWith
+from maastesting.matchers import MockCalledOnceWith, MockCallsMatch
 from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
 from provisioningserver.rackdservices import lease_socket_service
 from provisioningserver.rackdservices.lease_socket_service import (
     LeaseSocketService,
 )
 from provisioningserver.rpc import getRegionClient
-from provisioningserver.rpc.region import UpdateLease
+from provisioningserver.rpc.region import UpdateLease, UpdateLeases
 from provisioningserver.rpc.testing import MockLiveClusterToRegionRPCFixture
 from provisioningserver.utils.twisted import DeferredValue, pause, retries
 
@@ -42,11 +42,24 @@ class TestLeaseSocketService(MAASTestCase):
         ).return_value = socket_path
         return socket_path
 
-    def patch_rpc_UpdateLease(self):
+    def patch_rpc_UpdateLease(self, *commands):
+        if len(commands) == 0:
+            commands = (UpdateLease,)
         fixture = self.useFixture(MockLiveClusterToRegionRPCFixture())
-        protocol, connecting = fixture.makeEventLoop(UpdateLease)
+        protocol, connecting = fixture.makeEventLoop(*commands)
         return protocol, connecting
 
+    def make_notification(self):
+        return {
+            "action": "commit",
+            "mac": factory.make_mac_address(),
+            "ip_family": "ipv4",
+            "ip": factory.make_ipv4_address(),
+            "timestamp": int(time.time()),
+            "lease_time": 30,
+            "hostname": factory.make_name("host"),
+        }
+
     def send_notification(self, socket_path, payload):
         conn = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
         conn.connect(socket_path)
@@ -108,16 +121,18 @@ class TestLeaseSocketService(MAASTestCase):
         self.assertEquals([packet], list(service.notifications))
 
     @defer.inlineCallbacks
-    def test_processNotification_gets_called_with_notification(self):
+    def test_processNotificationBatch_gets_called_with_notification(self):
         socket_path = self.patch_socket_path()
         service = LeaseSocketService(sentinel.service, reactor)
         dv = DeferredValue()
 
-        # Mock processNotifcation to catch the call.
-        def mock_processNotification(*args, **kwargs):
+        # Mock processNotificationBatch to catch the call.
+        def mock_processNotificationBatch(*args, **kwargs):
             dv.set(args)
 
-        self.patch(service, "processNotification", mock_processNotification)
+        self.patch(
+            service, "processNotificationBatch", mock_processNotificationBatch
+        )
 
         # Start the service and stop it at the end of the test.
         service.startService()
@@ -130,23 +145,25 @@ class TestLeaseSocketService(MAASTestCase):
         yield deferToThread(self.send_notification, socket_path, packet)
         yield dv.get(timeout=10)
 
-        # Packet should be the argument passed to processNotifcation
-        self.assertEquals((packet,), dv.value)
+        # Packet should be in the batch passed to processNotificationBatch.
+        self.assertEquals(([packet],), dv.value)
 
     @defer.inlineCallbacks
-    def test_processNotification_gets_called_multiple_times(self):
+    def test_processNotificationBatch_gets_notifications_in_order(self):
         socket_path = self.patch_socket_path()
         service = LeaseSocketService(sentinel.service, reactor)
-        dvs = [DeferredValue(), DeferredValue()]
+        dv = DeferredValue()
+        received = []
 
-        # Mock processNotifcation to catch the call.
-        def mock_processNotification(*args, **kwargs):
-            for dv in dvs:
-                if not dv.isSet:
-                    dv.set(args)
-                    break
+        # Mock processNotificationBatch to catch the calls.
+        def mock_processNotificationBatch(notifications, **kwargs):
+            received.extend(notifications)
+            if len(received) == 2:
+                dv.set(received)
 
-        self.patch(service, "processNotification", mock_processNotification)
+        self.patch(
+            service, "processNotificationBatch", mock_processNotificationBatch
+        )
 
         # Start the service and stop it at the end of the test.
         service.startService()
@@ -159,13 +176,69 @@ class TestLeaseSocketService(MAASTestCase):
         # Send notifications to the socket and wait for notifications.
         yield deferToThread(self.send_notification, socket_path, packet1)
         yield deferToThread(self.send_notification, socket_path, packet2)
-        yield dvs[0].get(timeout=10)
-        yield dvs[1].get(timeout=10)
+        yield dv.get(timeout=10)
+
+        # Packets should be passed to processNotificationBatch in order,
+        # whether in one batch or two.
+        self.assertEquals([packet1, packet2], dv.value)
+
+    @defer.inlineCallbacks
+    def test_processNotifications_sends_batches(self):
+        service = LeaseSocketService(sentinel.service, reactor)
+        service.batch_size = 2
+        batches = []
+
+        def mock_processNotificationBatch(notifications, **kwargs):
+            batches.append(notifications)
+
+        self.patch(
+            service, "processNotificationBatch", mock_processNotificationBatch
+        )
+        notifications = [{"test": index} for index in range(5)]
+        service.notifications.extend(notifications)
+        yield service.processNotifications()
+        self.assertEquals(
+            [notifications[0:2], notifications[2:4], notifications[4:]],
+            batches,
+        )
+        self.assertEquals(0, len(service.notifications))
+
+    @defer.inlineCallbacks
+    def test_processNotificationBatch_send_to_region(self):
+        protocol, connecting = self.patch_rpc_UpdateLease(UpdateLeases)
+        self.addCleanup((yield connecting))
 
-        # Packet should be the argument passed to processNotification in
-        # order.
-        self.assertEquals((packet1,), dvs[0].value)
-        self.assertEquals((packet2,), dvs[1].value)
+        client = getRegionClient()
+        rpc_service = MagicMock()
+        rpc_service.getClientNow.return_value = defer.succeed(client)
+        service = LeaseSocketService(rpc_service, reactor)
+
+        packets = [self.make_notification() for _ in range(3)]
+        yield service.processNotificationBatch(packets, clock=reactor)
+        self.assertThat(
+            protocol.UpdateLeases,
+            MockCalledOnceWith(
+                protocol, cluster_uuid=client.localIdent, updates=packets
+            ),
+        )
+
+    @defer.inlineCallbacks
+    def test_processNotificationBatch_falls_back_to_UpdateLease(self):
+        protocol, connecting = self.patch_rpc_UpdateLease()
+        self.addCleanup((yield connecting))
+
+        client = getRegionClient()
+        rpc_service = MagicMock()
+        rpc_service.getClientNow.return_value = defer.succeed(client)
+        service = LeaseSocketService(rpc_service, reactor)
+
+        packets = [self.make_notification() for _ in range(2)]
+        expected_calls = [
+            call(protocol, cluster_uuid=client.localIdent, **packet)
+            for packet in packets
+        ]
+        yield service.processNotificationBatch(packets, clock=reactor)
+        self.assertThat(protocol.UpdateLease, MockCallsMatch(*expected_calls))
 
     @defer.inlineCallbacks
     def test_processNotification_send_to_region(self):
@@ -178,15 +251,7 @@ class TestLeaseSocketService(MAASTestCase):
         service = LeaseSocketService(rpc_service, reactor)
 
         # Notification to region.
-        packet = {
-            "action": "commit",
-            "mac": factory.make_mac_address(),
-            "ip_family": "ipv4",
-            "ip": factory.make_ipv4_address(),
-            "timestamp": int(time.time()),
-            "lease_time": 30,
-            "hostname": factory.make_name("host"),
-        }
+        packet = self.make_notification()
         yield service.processNotification(packet, clock=reactor)
         self.assertThat(
             protocol.UpdateLease,
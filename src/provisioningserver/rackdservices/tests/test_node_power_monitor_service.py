@@ -6,16 +6,16 @@
 
 __all__ = []
 
-from unittest.mock import ANY, Mock, sentinel
+from unittest.mock import ANY, call, Mock, sentinel
 
 from fixtures import FakeLogger
 from testtools.matchers import MatchesStructure
-from twisted.internet.defer import fail, succeed
+from twisted.internet.defer import Deferred, fail, succeed
 from twisted.internet.error import ConnectionDone
 from twisted.internet.task import Clock
 
 from maastesting.factory import factory
-from maastesting.matchers import MockCalledOnceWith
+from maastesting.matchers import MockCalledOnceWith, MockCallsMatch
 from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
 from maastesting.twisted import extract_result, TwistedLoggerFixture
 from provisioningserver.rackdservices import node_power_monitor_service as npms
@@ -65,7 +65,6 @@ class TestNodePowerMonitorService(MAASTestCase):
 
     def test_query_nodes_calls_query_all_nodes(self):
         service = self.make_monitor_service()
-        service.max_nodes_at_once = sentinel.max_nodes_at_once
 
         example_power_parameters = {
             "system_id": factory.make_UUID(),
@@ -85,6 +84,7 @@ class TestNodePowerMonitorService(MAASTestCase):
         ]
 
         query_all_nodes = self.patch(npms, "query_all_nodes")
+        query_all_nodes.return_value = succeed(None)
 
         d = service.query_nodes(getRegionClient())
         io.flush()
@@ -94,11 +94,58 @@ class TestNodePowerMonitorService(MAASTestCase):
             query_all_nodes,
             MockCalledOnceWith(
                 [example_power_parameters],
-                max_concurrency=sentinel.max_nodes_at_once,
                 clock=service.clock,
+                scheduler=service.scheduler,
             ),
         )
 
+    def test_query_nodes_fetches_more_before_queries_finish(self):
+        service = self.make_monitor_service()
+        service.scheduler = Mock(
+            completed=0, clock=service.clock, max_backoff=3600
+        )
+        service.scheduler.wait_for_room.return_value = succeed(None)
+        client = Mock()
+        client.side_effect = [
+            succeed({"nodes": [sentinel.node1]}),
+            succeed({"nodes": [sentinel.node2]}),
+            succeed({"nodes": []}),
+        ]
+        queries = [Deferred(), Deferred()]
+        query_all_nodes = self.patch(npms, "query_all_nodes")
+        query_all_nodes.side_effect = queries
+
+        d = service.query_nodes(client)
+
+        # Both lots are being queried, and the region was asked for more.
+        self.assertEqual(3, client.call_count)
+        self.assertThat(
+            query_all_nodes,
+            MockCallsMatch(
+                call(
+                    [sentinel.node1],
+                    clock=service.clock,
+                    scheduler=service.scheduler,
+                ),
+                call(
+                    [sentinel.node2],
+                    clock=service.clock,
+                    scheduler=service.scheduler,
+                ),
+            ),
+        )
+        self.assertFalse(d.called)
+        for query in queries:
+            query.callback(None)
+        self.assertEqual(None, extract_result(d))
+
+    def test_query_nodes_schedules_queries_with_initial_concurrency(self):
+        service = self.make_monitor_service()
+        self.assertEqual(
+            service.max_nodes_at_once,
+            service.scheduler.get_concurrency(factory.make_name("type")),
+        )
+
     def test_query_nodes_copes_with_NoSuchCluster(self):
         service = self.make_monitor_service()
 
@@ -27,6 +27,8 @@ __all__ = [
     "PowerOn",
     "PowerQuery",
     "ScanNetworks",
+    "UpdateDHCPv4Hosts",
+    "UpdateDHCPv6Hosts",
     "ValidateDHCPv4Config",
     "ValidateDHCPv4Config_V2",
     "ValidateDHCPv6Config",
@@ -597,6 +599,11 @@ class ConfigureDHCPv4_V2(_ConfigureDHCP_V2):
     :since: 2.1
     """
 
+    arguments = _ConfigureDHCP_V2.arguments + [
+        # Since 2.9; see `UpdateDHCPv4Hosts`.
+        (b"version", amp.Unicode(optional=True))
+    ]
+
 
 class ValidateDHCPv4Config(_ValidateDHCPConfig):
     """Validate the configure the DHCPv4 server.
@@ -625,6 +632,11 @@ class ConfigureDHCPv6_V2(_ConfigureDHCP_V2):
     :since: 2.1
     """
 
+    arguments = _ConfigureDHCP_V2.arguments + [
+        # Since 2.9; see `UpdateDHCPv6Hosts`.
+        (b"version", amp.Unicode(optional=True))
+    ]
+
 
 class ValidateDHCPv6Config(_ValidateDHCPConfig):
     """Configure the DHCPv6 server.
@@ -640,6 +652,65 @@ class ValidateDHCPv6Config_V2(_ValidateDHCPConfig_V2):
     """
 
 
+class _UpdateDHCPHosts(amp.Command):
+    """Change the host maps of a configured DHCP server.
+
+    The change is computed against the configuration last sent with
+    `previous_version`; if that is not what the DHCP server has then
+    `DHCPStateMismatch` is raised, and the server must be configured in
+    full instead.
+
+    :since: 2.9
+    """
+
+    arguments = [
+        (b"omapi_key", amp.Unicode()),
+        (b"previous_version", amp.Unicode()),
+        (b"version", amp.Unicode()),
+        (b"removed_macs", amp.ListOf(amp.Unicode())),
+        (
+            b"hosts",
+            CompressedAmpList(
+                [
+                    (b"host", amp.Unicode()),
+                    (b"mac", amp.Unicode()),
+                    (b"ip", amp.Unicode()),
+                    (
+                        b"dhcp_snippets",
+                        AmpList(
+                            [
+                                (b"name", amp.Unicode()),
+                                (b"description", amp.Unicode(optional=True)),
+                                (b"value", amp.Unicode()),
+                            ],
+                            optional=True,
+                        ),
+                    ),
+                ]
+            ),
+        ),
+    ]
+    response = []
+    errors = {
+        exceptions.CannotConfigureDHCP: b"CannotConfigureDHCP",
+        exceptions.DHCPStateMismatch: b"DHCPStateMismatch",
+    }
+
+
+class UpdateDHCPv4Hosts(_UpdateDHCPHosts):
+    """Add, change, and remove host maps in the DHCPv4 server.
+
+    :since: 2.9
+    """
+
+
+class UpdateDHCPv6Hosts(_UpdateDHCPHosts):
+    """Add, change, and remove host maps in the DHCPv6 server.
+
+    :since: 2.9
+    """
+
+
 class ImportBootImages(amp.Command):
     """Import boot images and report the final
     boot images that exist on the cluster.
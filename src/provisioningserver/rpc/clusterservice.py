@@ -507,6 +507,7 @@ class Cluster(RPCProtocol):
         hosts,
         interfaces,
         global_dhcp_snippets=[],
+        version=None,
     ):
         server = dhcp.DHCPv4Server(omapi_key)
         if concurrency.dhcpv4.locked:
@@ -530,6 +531,7 @@ class Cluster(RPCProtocol):
             hosts,
             interfaces,
             global_dhcp_snippets,
+            version,
         )
         d.addCallback(lambda _: {})
 
@@ -543,6 +545,33 @@ class Cluster(RPCProtocol):
 
         return d
 
+    @cluster.UpdateDHCPv4Hosts.responder
+    def update_dhcpv4_hosts(
+        self, omapi_key, previous_version, version, removed_macs, hosts
+    ):
+        server = dhcp.DHCPv4Server(omapi_key)
+        d = concurrency.dhcpv4.run(
+            deferWithTimeout,
+            DHCP_TIMEOUT,
+            dhcp.update_hosts,
+            server,
+            previous_version,
+            version,
+            removed_macs,
+            hosts,
+        )
+        d.addCallback(lambda _: {})
+
+        # Catch the cancelled error, which means the work timed out.
+        def _timeoutEb(failure):
+            failure.trap(CancelledError)
+            log.err(failure, "DHCPv4 host update timed out")
+            raise CannotConfigureDHCP("timed out") from failure.value
+
+        d.addErrback(_timeoutEb)
+
+        return d
+
     @cluster.ValidateDHCPv4Config.responder
     def validate_dhcpv4_config(
         self,
@@ -615,6 +644,7 @@ class Cluster(RPCProtocol):
         hosts,
         interfaces,
         global_dhcp_snippets=[],
+        version=None,
     ):
         server = dhcp.DHCPv6Server(omapi_key)
         if concurrency.dhcpv6.locked:
@@ -638,6 +668,7 @@ class Cluster(RPCProtocol):
             hosts,
             interfaces,
             global_dhcp_snippets,
+            version,
         )
         d.addCallback(lambda _: {})
 
@@ -651,6 +682,33 @@ class Cluster(RPCProtocol):
 
         return d
 
+    @cluster.UpdateDHCPv6Hosts.responder
+    def update_dhcpv6_hosts(
+        self, omapi_key, previous_version, version, removed_macs, hosts
+    ):
+        server = dhcp.DHCPv6Server(omapi_key)
+        d = concurrency.dhcpv6.run(
+            deferWithTimeout,
+            DHCP_TIMEOUT,
+            dhcp.update_hosts,
+            server,
+            previous_version,
+            version,
+            removed_macs,
+            hosts,
+        )
+        d.addCallback(lambda _: {})
+
+        # Catch the cancelled error, which means the work timed out.
+        def _timeoutEb(failure):
+            failure.trap(CancelledError)
+            log.err(failure, "DHCPv6 host update timed out")
+            raise CannotConfigureDHCP("timed out") from failure.value
+
+        d.addErrback(_timeoutEb)
+
+        return d
+
     @cluster.ValidateDHCPv6Config.responder
     def validate_dhcpv6_config(
         self,
@@ -8,14 +8,16 @@ __all__ = [
     "DHCPv4Server",
     "DHCPv6Server",
     "downgrade_shared_networks",
+    "update_hosts",
     "upgrade_shared_networks",
 ]
 
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from operator import itemgetter
 import os
 import re
 from tempfile import NamedTemporaryFile
+import threading
 
 from netaddr import IPAddress
 from twisted.internet.defer import inlineCallbacks, maybeDeferred
@@ -23,13 +25,11 @@ from twisted.internet.threads import deferToThread
 
 from provisioningserver.dhcp import DHCPv4Server, DHCPv6Server
 from provisioningserver.dhcp.config import get_config
-from provisioningserver.dhcp.omshell import Omshell
+from provisioningserver.dhcp.omapi import OmapiClient
 from provisioningserver.logger import get_maas_logger, LegacyLogger
 from provisioningserver.rpc.exceptions import (
     CannotConfigureDHCP,
-    CannotCreateHostMap,
-    CannotModifyHostMap,
-    CannotRemoveHostMap,
+    DHCPStateMismatch,
 )
 from provisioningserver.service_monitor import service_monitor
 from provisioningserver.utils.fs import sudo_delete_file, sudo_write_file
@@ -48,6 +48,9 @@ log = LegacyLogger()
 # Holds the current state of DHCPv4 and DHCPv6.
 _current_server_state = {}
 
+# Holds the region's version of the current state of DHCPv4 and DHCPv6.
+_current_server_version = {}
+
 
 DHCPStateBase = namedtuple(
     "DHCPStateBase",
@@ -187,70 +190,84 @@ def _delete_config(server):
         sudo_delete_file(server.config_filename)
 
 
-def _remove_host_map(omshell, mac):
-    """Remove host by `mac`."""
-    try:
-        omshell.remove(mac)
-    except ExternalProcessError as e:
-        if "not connected." in e.output_as_unicode:
-            msg = "The DHCP server could not be reached."
-        else:
-            msg = str(e)
-        err = "Could not remove host map for %s: %s" % (mac, msg)
-        maaslog.error(err)
-        raise CannotRemoveHostMap(err)
+# Holds the persistent OMAPI clients for DHCPv4 and DHCPv6, and the locks
+# guarding them. A client's connection must only be used by one thread at a
+# time, for the whole exchange, or the responses get mixed up.
+_omapi_clients = {}
+_omapi_locks = defaultdict(threading.Lock)
 
 
-def _create_host_map(omshell, mac, ip_address):
-    """Create host with `mac` -> `ip_address`."""
-    try:
-        omshell.create(ip_address, mac)
-    except ExternalProcessError as e:
-        if "not connected." in e.output_as_unicode:
-            msg = "The DHCP server could not be reached."
-        else:
-            msg = str(e)
-        err = "Could not create host map for %s -> %s: %s" % (
-            mac,
-            ip_address,
-            msg,
+def _get_omapi_client(server):
+    """Return the `OmapiClient` for `server`, reusing its connection.
+
+    The caller must hold the lock for `server` in `_omapi_locks`.
+    """
+    client = _omapi_clients.get(server.dhcp_service)
+    if client is None or client.shared_key != server.omapi_key:
+        if client is not None:
+            client.close()
+        client = OmapiClient(
+            server_address="127.0.0.1",
+            shared_key=server.omapi_key,
+            ipv6=server.ipv6,
         )
-        maaslog.error(err)
-        raise CannotCreateHostMap(err)
+        _omapi_clients[server.dhcp_service] = client
+    return client
 
 
-def _modify_host_map(omshell, mac, ip_address):
-    """Modify host with `mac` -> `ip_address`."""
-    try:
-        omshell.modify(ip_address, mac)
-    except ExternalProcessError as e:
-        if "not connected." in e.output_as_unicode:
-            msg = "The DHCP server could not be reached."
-        else:
-            msg = str(e)
-        err = "Could not modify host map for %s -> %s: %s" % (
-            mac,
-            ip_address,
-            msg,
-        )
-        maaslog.error(err)
-        raise CannotModifyHostMap(err)
+@synchronous
+def _close_omapi_client(server):
+    """Close the connection to the OMAPI of `server`, if any.
+
+    This waits for any exchange using the connection to finish.
+    """
+    with _omapi_locks[server.dhcp_service]:
+        client = _omapi_clients.pop(server.dhcp_service, None)
+        if client is not None:
+            client.close()
 
 
 @synchronous
 def _update_hosts(server, remove, add, modify):
-    """Update the hosts using the OMAPI."""
-    omshell = Omshell(
-        server_address="127.0.0.1",
-        shared_key=server.omapi_key,
-        ipv6=server.ipv6,
-    )
-    for host in remove:
-        _remove_host_map(omshell, host["mac"])
-    for host in add:
-        _create_host_map(omshell, host["mac"], host["ip"])
-    for host in modify:
-        _modify_host_map(omshell, host["mac"], host["ip"])
+    """Update the hosts using the OMAPI.
+
+    Each kind of change is sent as a batch over one connection.
+
+    :return: A list of errors, one for each host map that could not be
+        updated.
+    :raise OmapiError: If the DHCP server could not be talked to.
+    """
+    errors = []
+    with _omapi_locks[server.dhcp_service]:
+        client = _get_omapi_client(server)
+        failed = client.remove_hosts(host["mac"] for host in remove)
+        errors.extend(
+            "Could not remove host map for %s: %s"
+            % (host["mac"], failed[host["mac"]])
+            for host in remove
+            if host["mac"] in failed
+        )
+        failed = client.create_hosts(
+            (host["mac"], host["ip"]) for host in add
+        )
+        errors.extend(
+            "Could not create host map for %s -> %s: %s"
+            % (host["mac"], host["ip"], failed[host["mac"]])
+            for host in add
+            if host["mac"] in failed
+        )
+        failed = client.modify_hosts(
+            (host["mac"], host["ip"]) for host in modify
+        )
+        errors.extend(
+            "Could not modify host map for %s -> %s: %s"
+            % (host["mac"], host["ip"], failed[host["mac"]])
+            for host in modify
+            if host["mac"] in failed
+        )
+    for error in errors:
+        maaslog.error(error)
+    return errors
 
 
 @asynchronous
@@ -306,6 +323,127 @@ def _debug_hostmap_msg(hosts):
     return _inner
 
 
+@asynchronous
+@inlineCallbacks
+def _apply_state(server, new_state):
+    """Write the configuration for `new_state` and bring the DHCP server
+    into line with it, restarting it only if necessary."""
+    # Always write the config, that way its always up-to-date. Even if
+    # we are not going to restart the services. This makes sure that even
+    # the comments in the file are updated.
+    log.debug(
+        "Writing updated DHCP configuration for {name} service.",
+        name=server.descriptive_name,
+    )
+    yield deferToThread(_write_config, server, new_state)
+
+    # Service should always be on if shared_networks exists.
+    service = service_monitor.getServiceByName(server.dhcp_service)
+    service.on()
+
+    # Perform the required action based on the state change.
+    current_state = _current_server_state.get(server.dhcp_service, None)
+    if current_state is None:
+        log.debug(
+            "Unknown previous state; restarting {name} service.",
+            name=server.descriptive_name,
+        )
+        yield _catch_service_error(
+            server,
+            "restart",
+            service_monitor.restartService,
+            server.dhcp_service,
+        )
+    elif new_state.requires_restart(current_state):
+        log.debug(
+            "Restarting {name} service; configuration change requires "
+            "full restart.",
+            name=server.descriptive_name,
+        )
+        yield _catch_service_error(
+            server,
+            "restart",
+            service_monitor.restartService,
+            server.dhcp_service,
+        )
+    else:
+        # No restart required update the host mappings if needed.
+        remove, add, modify = new_state.host_diff(current_state)
+        if len(remove) + len(add) + len(modify) == 0:
+            # Nothing has changed, do nothing but make sure its running.
+            log.debug(
+                "Doing nothing; {name} service configuration has not "
+                "changed.",
+                name=server.descriptive_name,
+            )
+            yield _catch_service_error(
+                server,
+                "start",
+                service_monitor.ensureService,
+                server.dhcp_service,
+            )
+        else:
+            log.debug(
+                "Ensuring {name} service is running before updating "
+                "using the OMAPI.",
+                name=server.descriptive_name,
+            )
+            # Check the state of the service. Only if the services was on
+            # should the host maps be updated over the OMAPI.
+            before_state = yield service_monitor.getServiceState(
+                server.dhcp_service, now=True
+            )
+            yield _catch_service_error(
+                server,
+                "start",
+                service_monitor.ensureService,
+                server.dhcp_service,
+            )
+            if before_state.active_state == SERVICE_STATE.ON:
+                # Was already running, so update host maps over OMAPI
+                # instead of performing a full restart.
+                log.debug(
+                    "Writing to OMAPI for {name} service:\n"
+                    "\tremove: {remove()}\n"
+                    "\tadd: {add()}\n"
+                    "\tmodify: {modify()}\n",
+                    name=server.descriptive_name,
+                    remove=_debug_hostmap_msg_remove(remove),
+                    add=_debug_hostmap_msg(add),
+                    modify=_debug_hostmap_msg(modify),
+                )
+                try:
+                    errors = yield deferToThread(
+                        _update_hosts, server, remove, add, modify
+                    )
+                except Exception as error:
+                    errors = [str(error)]
+                if len(errors) != 0:
+                    # Error updating the host maps over the OMAPI.
+                    # Restart the DHCP service so that the host maps
+                    # are in-sync with what MAAS expects.
+                    maaslog.warning(
+                        "Failed to update all host maps. Restarting %s "
+                        "service to ensure host maps are in-sync."
+                        % (server.descriptive_name)
+                    )
+                    yield _catch_service_error(
+                        server,
+                        "restart",
+                        service_monitor.restartService,
+                        server.dhcp_service,
+                    )
+            else:
+                log.debug(
+                    "Usage of OMAPI skipped; {name} service was started "
+                    "with new configuration.",
+                    name=server.descriptive_name,
+                )
+
+    # Update the current state to the new state.
+    _current_server_state[server.dhcp_service] = new_state
+
+
 @asynchronous
 @inlineCallbacks
 def configure(
@@ -315,6 +453,7 @@ def configure(
     hosts,
     interfaces,
     global_dhcp_snippets=None,
+    version=None,
 ):
     """Configure the DHCPv6/DHCPv4 server, and restart it as appropriate.
 
@@ -331,12 +470,17 @@ def configure(
         contain a list of hosts the DHCP should statically.
     :param interfaces: List of interfaces that DHCP should use.
     :param global_dhcp_snippets: List of all global DHCP snippets
+    :param version: The version the region gave this configuration, which
+        `update_hosts` can later be asked to change.
     """
     stopping = len(shared_networks) == 0
 
     if global_dhcp_snippets is None:
         global_dhcp_snippets = []
 
+    # Until this is done the server cannot be updated incrementally.
+    _current_server_version[server.dhcp_service] = None
+
     if stopping:
         log.debug(
             "Deleting configuration and stopping the {name} service.",
@@ -346,6 +490,7 @@ def configure(
         # Remove the config so that the even an administrator cannot turn it on
         # accidently when it should be off.
         yield deferToThread(_delete_config, server)
+        yield deferToThread(_close_omapi_client, server)
 
         # Ensure that the service is off and is staying off.
         service = service_monitor.getServiceByName(server.dhcp_service)
@@ -365,118 +510,103 @@ def configure(
             global_dhcp_snippets,
         )
 
-        # Always write the config, that way its always up-to-date. Even if
-        # we are not going to restart the services. This makes sure that even
-        # the comments in the file are updated.
-        log.debug(
-            "Writing updated DHCP configuration for {name} service.",
-            name=server.descriptive_name,
+        yield _apply_state(server, new_state)
+
+    _current_server_version[server.dhcp_service] = version
+
+
+@asynchronous
+@inlineCallbacks
+def update_hosts(server, previous_version, version, removed_macs, hosts):
+    """Change the host maps of the DHCPv6/DHCPv4 server.
+
+    The rest of the configuration is as it was last given to `configure`.
+    This method is not safe to call concurrently, nor concurrently with
+    `configure`.
+
+    When the server is running, the changes are made over the OMAPI and
+    the configuration file is not rewritten: the DHCP server records the
+    host maps changed that way in its leases file, so they survive a
+    restart, and the file is brought up to date by the next `configure`.
+    Otherwise, or if the changes need a restart or fail, the configuration
+    is written and applied as `configure` does.
+
+    :param server: A `DHCPServer` instance.
+    :param previous_version: The version of the configuration this change
+        was computed from.
+    :param version: The version of the configuration once changed.
+    :param removed_macs: The MAC addresses of hosts to remove.
+    :param hosts: List of dicts with host parameters for hosts to add, or
+        to replace the existing host with the same MAC address.
+    :raise DHCPStateMismatch: If the server's current configuration is not
+        `previous_version`; the region must call `configure` instead.
+    """
+    current_state = _current_server_state.get(server.dhcp_service)
+    current_version = _current_server_version.get(server.dhcp_service)
+    if current_state is None or current_version != previous_version:
+        raise DHCPStateMismatch(
+            "%s server configuration is at version %s, not %s."
+            % (server.descriptive_name, current_version, previous_version)
+        )
+    new_hosts = dict(current_state.hosts)
+    for mac in removed_macs:
+        new_hosts.pop(mac, None)
+    new_hosts.update((host["mac"], host) for host in hosts)
+    new_state = current_state._replace(hosts=new_hosts)
+    # Forget the version until the change is complete; if it fails part way
+    # the region must configure the server in full.
+    _current_server_version[server.dhcp_service] = None
+    updated = False
+    if not new_state.requires_restart(current_state):
+        updated = yield _update_hosts_over_omapi(
+            server, current_state, new_state
         )
-        yield deferToThread(_write_config, server, new_state)
+    if not updated:
+        yield _apply_state(server, new_state)
+    _current_server_version[server.dhcp_service] = version
 
-        # Service should always be on if shared_networks exists.
-        service = service_monitor.getServiceByName(server.dhcp_service)
-        service.on()
 
-        # Perform the required action based on the state change.
-        current_state = _current_server_state.get(server.dhcp_service, None)
-        if current_state is None:
-            log.debug(
-                "Unknown previous state; restarting {name} service.",
-                name=server.descriptive_name,
-            )
-            yield _catch_service_error(
-                server,
-                "restart",
-                service_monitor.restartService,
-                server.dhcp_service,
-            )
-        elif new_state.requires_restart(current_state):
-            log.debug(
-                "Restarting {name} service; configuration change requires "
-                "full restart.",
-                name=server.descriptive_name,
+@inlineCallbacks
+def _update_hosts_over_omapi(server, current_state, new_state):
+    """Change the host maps of the running server to those of `new_state`,
+    over the OMAPI alone.
+
+    :return: Whether the server is now in `new_state`. If the host maps
+        could only be changed in part, the current state is forgotten, so
+        that `_apply_state` restarts the server.
+    """
+    before_state = yield service_monitor.getServiceState(
+        server.dhcp_service, now=True
+    )
+    if before_state.active_state != SERVICE_STATE.ON:
+        return False
+    remove, add, modify = new_state.host_diff(current_state)
+    if len(remove) + len(add) + len(modify) != 0:
+        log.debug(
+            "Writing to OMAPI for {name} service:\n"
+            "\tremove: {remove()}\n"
+            "\tadd: {add()}\n"
+            "\tmodify: {modify()}\n",
+            name=server.descriptive_name,
+            remove=_debug_hostmap_msg_remove(remove),
+            add=_debug_hostmap_msg(add),
+            modify=_debug_hostmap_msg(modify),
+        )
+        try:
+            errors = yield deferToThread(
+                _update_hosts, server, remove, add, modify
             )
-            yield _catch_service_error(
-                server,
-                "restart",
-                service_monitor.restartService,
-                server.dhcp_service,
+        except Exception as error:
+            errors = [str(error)]
+        if len(errors) != 0:
+            maaslog.warning(
+                "Failed to update all host maps. Restarting %s service to "
+                "ensure host maps are in-sync." % server.descriptive_name
             )
-        else:
-            # No restart required update the host mappings if needed.
-            remove, add, modify = new_state.host_diff(current_state)
-            if len(remove) + len(add) + len(modify) == 0:
-                # Nothing has changed, do nothing but make sure its running.
-                log.debug(
-                    "Doing nothing; {name} service configuration has not "
-                    "changed.",
-                    name=server.descriptive_name,
-                )
-                yield _catch_service_error(
-                    server,
-                    "start",
-                    service_monitor.ensureService,
-                    server.dhcp_service,
-                )
-            else:
-                log.debug(
-                    "Ensuring {name} service is running before updating "
-                    "using the OMAPI.",
-                    name=server.descriptive_name,
-                )
-                # Check the state of the service. Only if the services was on
-                # should the host maps be updated over the OMAPI.
-                before_state = yield service_monitor.getServiceState(
-                    server.dhcp_service, now=True
-                )
-                yield _catch_service_error(
-                    server,
-                    "start",
-                    service_monitor.ensureService,
-                    server.dhcp_service,
-                )
-                if before_state.active_state == SERVICE_STATE.ON:
-                    # Was already running, so update host maps over OMAPI
-                    # instead of performing a full restart.
-                    log.debug(
-                        "Writing to OMAPI for {name} service:\n"
-                        "\tremove: {remove()}\n"
-                        "\tadd: {add()}\n"
-                        "\tmodify: {modify()}\n",
-                        name=server.descriptive_name,
-                        remove=_debug_hostmap_msg_remove(remove),
-                        add=_debug_hostmap_msg(add),
-                        modify=_debug_hostmap_msg(modify),
-                    )
-                    try:
-                        yield deferToThread(
-                            _update_hosts, server, remove, add, modify
-                        )
-                    except Exception:
-                        # Error updating the host maps over the OMAPI.
-                        # Restart the DHCP service so that the host maps
-                        # are in-sync with what MAAS expects.
-                        maaslog.warning(
-                            "Failed to update all host maps. Restarting %s "
-                            "service to ensure host maps are in-sync."
-                            % (server.descriptive_name)
-                        )
-                        yield _catch_service_error(
-                            server,
-                            "restart",
-                            service_monitor.restartService,
-                            server.dhcp_service,
-                        )
-                else:
-                    log.debug(
-                        "Usage of OMAPI skipped; {name} service was started "
-                        "with new configuration.",
-                        name=server.descriptive_name,
-                    )
-
-        # Update the current state to the new state.
-        _current_server_state[server.dhcp_service] = new_state
+            _current_server_state[server.dhcp_service] = None
+            return False
+    _current_server_state[server.dhcp_service] = new_state
+    return True
 
 
 def _parse_dhcpd_errors(error_str):
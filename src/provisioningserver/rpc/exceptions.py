@@ -12,6 +12,7 @@ __all__ = [
     "CannotRegisterCluster",
     "CannotRemoveHostMap",
     "CommissionNodeFailed",
+    "DHCPStateMismatch",
     "NoConnectionsAvailable",
     "NodeAlreadyExists",
     "NodeStateViolation",
@@ -84,6 +85,10 @@ class CannotConfigureDHCP(Exception):
     """Failure while configuring a DHCP server."""
 
 
+class DHCPStateMismatch(Exception):
+    """The DHCP server's configuration is not the one a change was made to."""
+
+
 class CannotCreateHostMap(Exception):
     """The host map could not be created."""
 
@@ -6,35 +6,51 @@
 __all__ = [
     "power_action_registry",
     "power_state_update",
+    "power_state_reporter",
     "maybe_change_power_state",
+    "PowerQueryScheduler",
+    "PowerStateReporter",
 ]
 
+from collections import defaultdict
 from datetime import timedelta
 from functools import partial
+import heapq
+from itertools import count
+import json
 import sys
 
 from twisted.internet import reactor
 from twisted.internet.defer import (
     CancelledError,
+    Deferred,
     DeferredList,
     DeferredSemaphore,
     inlineCallbacks,
+    maybeDeferred,
     returnValue,
     succeed,
 )
 from twisted.internet.task import deferLater
+from twisted.protocols import amp
+from twisted.python.failure import Failure
 
 from provisioningserver.drivers.power import get_error_message, PowerError
 from provisioningserver.drivers.power.registry import PowerDriverRegistry
 from provisioningserver.events import EVENT_TYPES, send_node_event
 from provisioningserver.logger import get_maas_logger, LegacyLogger
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.rpc import getRegionClient
 from provisioningserver.rpc.exceptions import (
     NoSuchNode,
     PowerActionAlreadyInProgress,
     PowerActionFail,
 )
-from provisioningserver.rpc.region import MarkNodeFailed, UpdateNodePowerState
+from provisioningserver.rpc.region import (
+    MarkNodeFailed,
+    UpdateNodePowerState,
+    UpdateNodePowerStates,
+)
 from provisioningserver.utils.twisted import (
     asynchronous,
     callOut,
@@ -65,6 +81,110 @@ def power_state_update(system_id, state):
     return client(UpdateNodePowerState, system_id=system_id, power_state=state)
 
 
+class PowerStateReporter:
+    """Report nodes' power states to the region in batches.
+
+    States reported within `delay` seconds of the first are sent together
+    with `UpdateNodePowerStates`, or as soon as `batch_size` nodes are
+    waiting. Only the last state reported for a node is sent. Regions that
+    do not know about `UpdateNodePowerStates` are sent each state in turn
+    with `UpdateNodePowerState` instead.
+    """
+
+    def __init__(self, clock=reactor, delay=1.0, batch_size=500):
+        self.clock = clock
+        self.delay = delay
+        self.batch_size = batch_size
+        # system_id -> (state, [Deferred, ...]), in the order reported.
+        self._pending = {}
+        self._call = None
+
+    @asynchronous
+    def report(self, system_id, state):
+        """Report `state` as the power state of the node `system_id`.
+
+        :return: A `Deferred` that fires with `None` once the region has
+            been told, or fails with `NoSuchNode` if the region does not
+            know the node.
+        """
+        d = Deferred()
+        _, waiting = self._pending.pop(system_id, (None, []))
+        waiting.append(d)
+        self._pending[system_id] = (state, waiting)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif self._call is None:
+            self._call = self.clock.callLater(self.delay, self.flush)
+        return d
+
+    def flush(self):
+        """Send the waiting states to the region now.
+
+        :return: A `Deferred` that fires once they have been sent.
+        """
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        batch, self._pending = self._pending, {}
+        if len(batch) == 0:
+            return succeed(None)
+        else:
+            return self._send(batch)
+
+    @inlineCallbacks
+    def _send(self, batch):
+        try:
+            client = getRegionClient()
+            failures = yield self._update(client, batch)
+        except Exception:
+            failure = Failure()
+            failures = dict.fromkeys(batch, failure)
+        for system_id, (_, waiting) in batch.items():
+            failure = failures.get(system_id)
+            for d in waiting:
+                if failure is None:
+                    d.callback(None)
+                else:
+                    d.errback(failure)
+
+    @inlineCallbacks
+    def _update(self, client, batch):
+        """Send `batch` to the region.
+
+        :return: A dict of the `Failure` for each node that was not updated.
+        """
+        try:
+            response = yield client(
+                UpdateNodePowerStates,
+                power_states=[
+                    {"system_id": system_id, "power_state": state}
+                    for system_id, (state, _) in batch.items()
+                ],
+            )
+        except amp.UnhandledCommand:
+            failures = {}
+            for system_id, (state, _) in batch.items():
+                try:
+                    yield client(
+                        UpdateNodePowerState,
+                        system_id=system_id,
+                        power_state=state,
+                    )
+                except Exception:
+                    failures[system_id] = Failure()
+            return failures
+        else:
+            return {
+                system_id: Failure(NoSuchNode.from_system_id(system_id))
+                for system_id in response["unknown"]
+            }
+
+
+# Power states found by querying nodes are reported through this, so that
+# polling many nodes costs the region a few calls rather than one per node.
+power_state_reporter = PowerStateReporter()
+
+
 @asynchronous(timeout=15)
 @inlineCallbacks
 def power_change_failure(system_id, hostname, power_change, message):
@@ -373,11 +493,35 @@ def get_power_state(system_id, hostname, power_type, context, clock=reactor):
     raise exc_type(exc_value).with_traceback(exc_trace)
 
 
-@inlineCallbacks
+def queue_power_state(system_id, hostname, state):
+    """Queue `state` to be reported to the region as the node's power state.
+
+    This does not wait for the report to be sent, which happens with the
+    next batch; a failure to send it is logged.
+    """
+
+    def eb_report(failure):
+        if failure.check(NoSuchNode):
+            log.debug(
+                "{hostname}: Could not update power state: no such node.",
+                hostname=hostname,
+            )
+        else:
+            maaslog.error(
+                "%s: Failed to report power state: %s",
+                hostname,
+                failure.getErrorMessage(),
+            )
+
+    d = power_state_reporter.report(system_id, state)
+    d.addErrback(eb_report)
+
+
 def power_query_success(system_id, hostname, state):
     """Report a node that for which power querying has succeeded."""
     log.debug(f"Power state queried for node {system_id}: {state}")
-    yield power_state_update(system_id, state)
+    queue_power_state(system_id, hostname, state)
+    return succeed(None)
 
 
 @inlineCallbacks
@@ -387,7 +531,7 @@ def power_query_failure(system_id, hostname, failure):
         "%s: Power state could not be queried: %s"
         % (hostname, failure.getErrorMessage())
     )
-    yield power_state_update(system_id, "error")
+    queue_power_state(system_id, hostname, "error")
     yield send_node_event(
         EVENT_TYPES.NODE_POWER_QUERY_FAILED,
         system_id,
@@ -456,10 +600,14 @@ def maaslog_report_failure(node, failure):
         # log.err(failure, "Failed to refresh power state.")
 
 
-def query_node(node, clock):
+def query_node(node, clock, track=None):
     """Calls `get_power_state` on the given node.
 
     Logs to maaslog as errors and power states change.
+
+    :param track: If given, this is called with the outcome of the query,
+        a power state or a `Failure`, before it is reported. It must
+        return it unaltered.
     """
     if node["system_id"] in power_action_registry:
         log.debug(
@@ -476,6 +624,8 @@ def query_node(node, clock):
             node["context"],
             clock=clock,
         )
+        if track is not None:
+            d.addBoth(track)
         d = report_power_state(d, node["system_id"], node["hostname"])
         d.addCallbacks(
             partial(maaslog_report_success, node),
@@ -484,18 +634,427 @@ def query_node(node, clock):
         return d
 
 
-def query_all_nodes(nodes, max_concurrency=5, clock=reactor):
+def group_nodes_by_bmc(nodes):
+    """Find the nodes that can be queried together with `query_many`.
+
+    :return: A tuple of a list of groups of nodes that have the same BMC
+        and whose driver can query them together, and a list of the other
+        nodes.
+    """
+    groups = defaultdict(list)
+    singles = []
+    for node in nodes:
+        driver = PowerDriverRegistry[node["power_type"]]
+        if driver.can_query_many:
+            bmc_context = driver.get_bmc_context(node["context"])
+        else:
+            bmc_context = {}
+        if any(bmc_context.values()):
+            bmc = node["power_type"], json.dumps(bmc_context, sort_keys=True)
+            groups[bmc].append(node)
+        else:
+            singles.append(node)
+    together = []
+    for group in groups.values():
+        if len(group) == 1:
+            singles.extend(group)
+        else:
+            together.append(group)
+    return together, singles
+
+
+def query_many(nodes):
+    """Query `nodes`, which have the same BMC, with one call to their
+    driver's `query_many`.
+
+    :return: A `Deferred` that fires with a dict mapping system IDs to
+        power states.
+    """
+    driver = PowerDriverRegistry[nodes[0]["power_type"]]
+    contexts = {node["system_id"]: node["context"] for node in nodes}
+    return maybeDeferred(driver.query_many, contexts)
+
+
+@inlineCallbacks
+def query_nodes_together(nodes, query, query_group):
+    """Query `nodes`, which have the same BMC, together.
+
+    Nodes whose state is not found with `query_group`, or all of them if it
+    fails, are queried one by one with `query`.
+    """
+    driver = PowerDriverRegistry[nodes[0]["power_type"]]
+    states = {}
+    if len(driver.detect_missing_packages()) == 0:
+        try:
+            states = yield query_group(nodes)
+        except Exception as error:
+            log.debug(
+                "Failed to query {count} {power_type} nodes together; "
+                "querying them one by one: {error}",
+                count=len(nodes),
+                power_type=driver.name,
+                error=error,
+            )
+    queries = []
+    for node in nodes:
+        state = states.get(node["system_id"])
+        if state not in ("on", "off") or (
+            node["system_id"] in power_action_registry
+        ):
+            queries.append(query(node))
+        else:
+            d = report_power_state(
+                succeed(state), node["system_id"], node["hostname"]
+            )
+            d.addCallbacks(
+                partial(maaslog_report_success, node),
+                partial(maaslog_report_failure, node),
+            )
+            queries.append(d)
+    yield DeferredList(queries, consumeErrors=True)
+
+
+def query_all_nodes(nodes, max_concurrency=5, clock=reactor, scheduler=None):
     """Queries the given nodes for their power state.
 
-    Nodes' states are reported back to the region.
+    Nodes' states are reported back to the region. Nodes with the same BMC
+    are queried together when their driver supports it.
 
+    :param scheduler: A `PowerQueryScheduler` to run the queries. If not
+        given, up to `max_concurrency` queries run at once.
     :return: A deferred, which fires once all nodes have been queried,
         successfully or not.
     """
-    semaphore = DeferredSemaphore(tokens=max_concurrency)
-    queries = (
-        semaphore.run(query_node, node, clock)
-        for node in nodes
-        if node["power_type"] in PowerDriverRegistry
+    if scheduler is None:
+        semaphore = DeferredSemaphore(tokens=max_concurrency)
+        query = partial(semaphore.run, query_node, clock=clock)
+        group_semaphore = DeferredSemaphore(tokens=max_concurrency)
+        query_group = partial(group_semaphore.run, query_many)
+    else:
+        query = scheduler.query
+        query_group = scheduler.query_many
+    groups, singles = group_nodes_by_bmc(
+        node for node in nodes if node["power_type"] in PowerDriverRegistry
+    )
+    queries = [query(node) for node in singles]
+    queries.extend(
+        query_nodes_together(group, query, query_group) for group in groups
     )
     return DeferredList(queries, consumeErrors=True)
+
+
+class _ConcurrencyLimit:
+    """The concurrency limit for the queries of one power type.
+
+    Waiting queries are started lowest priority value first.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = 0
+        self.waiting = []
+        self.last_decrease = None
+        self._order = count()
+
+    def acquire(self, priority):
+        d = Deferred()
+        heapq.heappush(self.waiting, (priority, next(self._order), d))
+        self._start()
+        return d
+
+    def release(self):
+        self.running -= 1
+        self._start()
+
+    def _start(self):
+        while len(self.waiting) > 0 and self.running < int(self.limit):
+            _, _, d = heapq.heappop(self.waiting)
+            self.running += 1
+            d.callback(None)
+
+
+class _BMCHistory:
+    """What is known about a BMC from querying it.
+
+    :ivar latency: Moving average of the time taken by successful queries.
+    :ivar failures: Number of consecutive failed queries.
+    :ivar retry_at: When the BMC may be queried again, after failures.
+    :ivar last_seen: When a node with this BMC was last scheduled.
+    """
+
+    __slots__ = ("latency", "failures", "retry_at", "last_seen")
+
+    def __init__(self):
+        self.latency = None
+        self.failures = 0
+        self.retry_at = 0
+        self.last_seen = 0
+
+
+class PowerQueryScheduler:
+    """Schedules power queries for the nodes of a rack controller.
+
+    Queries run concurrently, up to a limit for each power type. The limit
+    grows by one after a limit's worth of prompt answers, and is halved
+    when a query is slow both in absolute terms and for its BMC (additive
+    increase, multiplicative decrease), so it settles near what the rack
+    and the BMCs of that type can sustain. Waiting queries start in order
+    of how long ago this rack last learned each node's power state.
+
+    A BMC that fails is not queried again until a backoff period has
+    passed, which doubles with each consecutive failure. Failures do not
+    lower the limit: a dead BMC says nothing about the rest.
+
+    Nodes with the same BMC that can be queried together are, with
+    `query_many`, and take one place in the limit between them.
+    """
+
+    def __init__(
+        self,
+        clock=reactor,
+        initial_concurrency=5,
+        max_concurrency=64,
+        slow_query=10.0,
+        min_backoff=60.0,
+        max_backoff=3600.0,
+        prometheus_metrics=PROMETHEUS_METRICS,
+    ):
+        self.clock = clock
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.slow_query = slow_query
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.prometheus_metrics = prometheus_metrics
+        self.completed = 0
+        self._limits = {}
+        self._bmcs = {}
+        self._last_queried = {}
+        self._room = []
+
+    def get_concurrency(self, power_type):
+        """Return the concurrency limit for `power_type`."""
+        return int(self._get_limit(power_type).limit)
+
+    def _get_limit(self, power_type):
+        limit = self._limits.get(power_type)
+        if limit is None:
+            limit = _ConcurrencyLimit(self.initial_concurrency)
+            self._limits[power_type] = limit
+        return limit
+
+    def _get_bmc(self, node):
+        # Nodes whose power parameters differ only in those that identify
+        # the node, like a VM's power ID, share a BMC, and its history.
+        context = node["context"]
+        driver = PowerDriverRegistry.get_item(node["power_type"])
+        if driver is not None:
+            bmc_context = driver.get_bmc_context(context)
+            if any(bmc_context.values()):
+                context = bmc_context
+        key = (
+            node["power_type"],
+            json.dumps(context, sort_keys=True, default=str),
+        )
+        bmc = self._bmcs.get(key)
+        if bmc is None:
+            bmc = self._bmcs[key] = _BMCHistory()
+        return bmc
+
+    def _count(self, node, result):
+        self.prometheus_metrics.update(
+            "maas_power_queries",
+            "inc",
+            labels={"power_type": node["power_type"], "result": result},
+        )
+
+    def _observe_age(self, node, now):
+        """Record how old the node's power state is, and return when it was
+        last queried, or `None`."""
+        last_queried = self._last_queried.get(node["system_id"])
+        if last_queried is not None:
+            self.prometheus_metrics.update(
+                "maas_power_state_age",
+                "observe",
+                value=now - last_queried,
+                labels={"power_type": node["power_type"]},
+            )
+        return last_queried
+
+    def query(self, node):
+        """Query the power state of `node` when its turn comes.
+
+        :return: A `Deferred` that fires with the node's power state, or
+            `None` if it was not queried, or could not be.
+        """
+        power_type = node["power_type"]
+        now = self.clock.seconds()
+        bmc = self._get_bmc(node)
+        bmc.last_seen = now
+        if bmc.retry_at > now:
+            self._count(node, "skipped")
+            return succeed(None)
+        last_queried = self._observe_age(node, now)
+        if last_queried is None:
+            priority = float("-inf")
+        else:
+            priority = last_queried
+        limit = self._get_limit(power_type)
+        d = limit.acquire(priority)
+        d.addCallback(lambda _: self._query(node, bmc, limit))
+        self._notify_room()
+        return d
+
+    def query_many(self, nodes):
+        """Query the power states of `nodes`, which have the same BMC,
+        together when their turn comes.
+
+        The BMC is backed off like it is for `query`. A failure to query
+        the nodes together does not back it off; the nodes are queried one
+        by one next, and those queries tell whether the BMC is down.
+
+        :return: A `Deferred` that fires with a dict mapping system IDs to
+            power states, which is empty if the BMC is backed off.
+        """
+        power_type = nodes[0]["power_type"]
+        now = self.clock.seconds()
+        bmc = self._get_bmc(nodes[0])
+        bmc.last_seen = now
+        if bmc.retry_at > now:
+            return succeed({})
+        priority = min(
+            float("-inf") if queried is None else queried
+            for queried in (self._observe_age(node, now) for node in nodes)
+        )
+        limit = self._get_limit(power_type)
+        d = limit.acquire(priority)
+        d.addCallback(lambda _: self._query_many(nodes, bmc, limit))
+        self._notify_room()
+        return d
+
+    def _query_many(self, nodes, bmc, limit):
+        started = self.clock.seconds()
+
+        def track(states):
+            for node in nodes:
+                if states.get(node["system_id"]) in ("on", "off"):
+                    self._queried(node)
+            self._adjust(nodes[0]["power_type"], bmc, limit, started)
+            return states
+
+        def eb_track(failure):
+            self.completed += 1
+            self._count(nodes[0], "failure")
+            return failure
+
+        d = query_many(nodes)
+        d.addCallbacks(track, eb_track)
+        d.addBoth(self._release, limit)
+        return d
+
+    def _query(self, node, bmc, limit):
+        started = self.clock.seconds()
+
+        def track(result):
+            if isinstance(result, Failure):
+                self._failed(node, bmc)
+            else:
+                self._succeeded(node, bmc, limit, started)
+            return result
+
+        d = query_node(node, self.clock, track=track)
+        d.addBoth(self._release, limit)
+        return d
+
+    def _release(self, result, limit):
+        limit.release()
+        self._notify_room()
+        return result
+
+    def _succeeded(self, node, bmc, limit, started):
+        self._queried(node)
+        self._adjust(node["power_type"], bmc, limit, started)
+
+    def _queried(self, node):
+        self.completed += 1
+        self._count(node, "success")
+        self._last_queried[node["system_id"]] = self.clock.seconds()
+
+    def _adjust(self, power_type, bmc, limit, started):
+        """Update the BMC's latency and the limit after a query."""
+        now = self.clock.seconds()
+        latency = now - started
+        self.prometheus_metrics.update(
+            "maas_power_query_latency",
+            "observe",
+            value=latency,
+            labels={"power_type": power_type},
+        )
+        typical = bmc.latency
+        bmc.failures, bmc.retry_at = 0, 0
+        if typical is None:
+            bmc.latency = latency
+        else:
+            bmc.latency = 0.8 * typical + 0.2 * latency
+        slow = latency > self.slow_query and (
+            typical is None or latency > 2 * typical
+        )
+        if not slow:
+            limit.limit = min(
+                limit.limit + 1 / int(limit.limit), self.max_concurrency
+            )
+        elif limit.last_decrease is None or started > limit.last_decrease:
+            # Queries that were already running when the limit was last
+            # decreased do not decrease it again.
+            limit.limit = max(limit.limit / 2, 1)
+            limit.last_decrease = now
+        self.prometheus_metrics.update(
+            "maas_power_query_concurrency",
+            "set",
+            value=int(limit.limit),
+            labels={"power_type": power_type},
+        )
+
+    def _failed(self, node, bmc):
+        now = self.clock.seconds()
+        self.completed += 1
+        self._count(node, "failure")
+        bmc.failures += 1
+        backoff = self.min_backoff * 2 ** (bmc.failures - 1)
+        bmc.retry_at = now + min(backoff, self.max_backoff)
+
+    def _waiting(self):
+        return sum(len(limit.waiting) for limit in self._limits.values())
+
+    def _notify_room(self):
+        if self._waiting() == 0:
+            room, self._room = self._room, []
+            for d in room:
+                d.callback(None)
+
+    def wait_for_room(self):
+        """Return a `Deferred` that fires once no queries are waiting.
+
+        Fetch more nodes to query then, rather than when the slowest of
+        the running queries finishes.
+        """
+        if self._waiting() == 0:
+            return succeed(None)
+        d = Deferred()
+        self._room.append(d)
+        return d
+
+    def forget(self, older_than):
+        """Forget BMCs that have not been scheduled for `older_than`
+        seconds, and the nodes last queried longer ago than that."""
+        cutoff = self.clock.seconds() - older_than
+        self._bmcs = {
+            key: bmc
+            for key, bmc in self._bmcs.items()
+            if bmc.last_seen >= cutoff
+        }
+        self._last_queried = {
+            system_id: queried
+            for system_id, queried in self._last_queried.items()
+            if queried >= cutoff
+        }
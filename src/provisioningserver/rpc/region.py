@@ -33,7 +33,9 @@ __all__ = [
     "SendEventMACAddress",
     "UpdateInterfaces",
     "UpdateLastImageSync",
+    "UpdateLeases",
     "UpdateNodePowerState",
+    "UpdateNodePowerStates",
 ]
 
 from twisted.protocols import amp
@@ -41,6 +43,7 @@ from twisted.protocols import amp
 from provisioningserver.rpc.arguments import (
     AmpList,
     Bytes,
+    CompressedAmpList,
     ParsedURL,
     StructureAsJSON,
 )
@@ -344,6 +347,32 @@ class UpdateNodePowerState(amp.Command):
     errors = {NoSuchNode: b"NoSuchNode"}
 
 
+class UpdateNodePowerStates(amp.Command):
+    """Update the power states of many nodes at once.
+
+    Nodes the region does not know about are not an error; their system
+    IDs are returned instead.
+
+    :since: 2.9
+    """
+
+    arguments = [
+        (
+            b"power_states",
+            CompressedAmpList(
+                [
+                    # The node's system_id.
+                    (b"system_id", amp.Unicode()),
+                    # The node's power_state.
+                    (b"power_state", amp.Unicode()),
+                ]
+            ),
+        )
+    ]
+    response = [(b"unknown", amp.ListOf(amp.Unicode()))]
+    errors = {}
+
+
 class RegisterEventType(amp.Command):
     """Register an event type.
 
@@ -552,6 +581,36 @@ class UpdateLease(amp.Command):
     errors = {NoSuchCluster: b"NoSuchCluster"}
 
 
+class UpdateLeases(amp.Command):
+    """Report a batch of DHCP lease updates from a rack controller.
+
+    Each update has the same fields as `UpdateLease`. They are given in the
+    order in which they happened.
+
+    :since: 2.9
+    """
+
+    arguments = [
+        (b"cluster_uuid", amp.Unicode()),
+        (
+            b"updates",
+            CompressedAmpList(
+                [
+                    (b"action", amp.Unicode()),
+                    (b"mac", amp.Unicode()),
+                    (b"ip_family", amp.Unicode()),
+                    (b"ip", amp.Unicode()),
+                    (b"timestamp", amp.Integer()),
+                    (b"lease_time", amp.Integer(optional=True)),
+                    (b"hostname", amp.Unicode(optional=True)),
+                ]
+            ),
+        ),
+    ]
+    response = []
+    errors = {NoSuchCluster: b"NoSuchCluster"}
+
+
 class UpdateServices(amp.Command):
     """Report service statuses that are monitored on the rackd.
 
@@ -2651,6 +2651,7 @@ class TestClusterProtocol_ConfigureDHCP(MAASTestCase):
                 hosts,
                 interfaces,
                 None,
+                None,
             ),
         )
 
@@ -2665,6 +2666,7 @@ class TestClusterProtocol_ConfigureDHCP(MAASTestCase):
             hosts,
             interfaces,
             global_dhcp_snippets,
+            version,
         ):
             self.assertTrue(self.concurrency_lock.locked)
             # While we're here, check this is the IO thread.
@@ -2726,6 +2728,7 @@ class TestClusterProtocol_ConfigureDHCP(MAASTestCase):
             hosts,
             interfaces,
             global_dhcp_snippets,
+            version,
         ):
             # Pause longer than the timeout.
             return pause(5)
@@ -2746,6 +2749,91 @@ class TestClusterProtocol_ConfigureDHCP(MAASTestCase):
             )
 
 
+class TestClusterProtocol_UpdateDHCPHosts(MAASTestCase):
+
+    scenarios = (
+        (
+            "DHCPv4",
+            {
+                "dhcp_server": (dhcp, "DHCPv4Server"),
+                "command": cluster.UpdateDHCPv4Hosts,
+                "concurrency_lock": concurrency.dhcpv4,
+            },
+        ),
+        (
+            "DHCPv6",
+            {
+                "dhcp_server": (dhcp, "DHCPv6Server"),
+                "command": cluster.UpdateDHCPv6Hosts,
+                "concurrency_lock": concurrency.dhcpv6,
+            },
+        ),
+    )
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def make_arguments(self):
+        return {
+            "omapi_key": factory.make_name("key"),
+            "previous_version": factory.make_name("version"),
+            "version": factory.make_name("version"),
+            "removed_macs": [factory.make_mac_address()],
+            "hosts": [make_host()],
+        }
+
+    def test_is_registered(self):
+        self.assertIsNotNone(
+            Cluster().locateResponder(self.command.commandName)
+        )
+
+    @inlineCallbacks
+    def test_executes_update_hosts(self):
+        DHCPServer = self.patch_autospec(*self.dhcp_server)
+        update_hosts = self.patch_autospec(dhcp, "update_hosts")
+        arguments = self.make_arguments()
+
+        yield call_responder(Cluster(), self.command, arguments)
+
+        self.assertThat(
+            DHCPServer, MockCalledOnceWith(arguments["omapi_key"])
+        )
+        self.assertThat(
+            update_hosts,
+            MockCalledOnceWith(
+                DHCPServer.return_value,
+                arguments["previous_version"],
+                arguments["version"],
+                arguments["removed_macs"],
+                arguments["hosts"],
+            ),
+        )
+
+    @inlineCallbacks
+    def test_limits_concurrency(self):
+        self.patch_autospec(*self.dhcp_server)
+
+        def check_dhcp_locked(
+            server, previous_version, version, removed_macs, hosts
+        ):
+            self.assertTrue(self.concurrency_lock.locked)
+
+        self.patch(dhcp, "update_hosts", check_dhcp_locked)
+
+        self.assertFalse(self.concurrency_lock.locked)
+        yield call_responder(Cluster(), self.command, self.make_arguments())
+        self.assertFalse(self.concurrency_lock.locked)
+
+    @inlineCallbacks
+    def test_propagates_DHCPStateMismatch(self):
+        update_hosts = self.patch_autospec(dhcp, "update_hosts")
+        update_hosts.side_effect = exceptions.DHCPStateMismatch()
+
+        with ExpectedException(exceptions.DHCPStateMismatch):
+            yield call_responder(
+                Cluster(), self.command, self.make_arguments()
+            )
+
+
 class TestClusterProtocol_ValidateDHCP(MAASTestCase):
 
     scenarios = (
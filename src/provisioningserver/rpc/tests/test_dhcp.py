@@ -7,12 +7,15 @@ __all__ = []
 
 import copy
 from operator import itemgetter
+import random
+import socket
 from unittest.mock import ANY, call, Mock, sentinel
 
 from fixtures import FakeLogger
+from netaddr import IPAddress
 from testtools import ExpectedException
-from testtools.matchers import MatchesStructure
-from twisted.internet.defer import inlineCallbacks
+from testtools.matchers import HasLength, MatchesStructure
+from twisted.internet.defer import fail, inlineCallbacks, succeed
 
 from maastesting.factory import factory
 from maastesting.matchers import (
@@ -21,6 +24,12 @@ from maastesting.matchers import (
     MockNotCalled,
 )
 from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
+from provisioningserver.dhcp.omapi import (
+    ISC_R_FAILURE,
+    OmapiClient,
+    OmapiError,
+)
+from provisioningserver.dhcp.omshell import generate_omapi_key
 from provisioningserver.dhcp.testing.config import (
     DHCPConfigNameResolutionDisabled,
     fix_shared_networks_failover,
@@ -32,6 +41,7 @@ from provisioningserver.dhcp.testing.config import (
     make_shared_network,
     make_subnet_dhcp_snippets,
 )
+from provisioningserver.dhcp.testing.omapi import FakeOmapiServer
 from provisioningserver.rpc import dhcp, exceptions
 from provisioningserver.utils.service_monitor import (
     SERVICE_STATE,
@@ -434,171 +444,346 @@ class TestDHCPState(MAASTestCase):
         )
 
 
-class TestRemoveHostMap(MAASTestCase):
-    def test_calls_omshell_remove(self):
-        omshell = Mock()
-        mac = factory.make_mac_address()
-        dhcp._remove_host_map(omshell, mac)
-        self.assertThat(omshell.remove, MockCalledOnceWith(mac))
+class TestGetOmapiClient(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(dhcp._omapi_clients.clear)
 
-    def test_raises_error_when_omshell_crashes(self):
-        error_message = factory.make_name("error").encode("ascii")
-        omshell = Mock()
-        omshell.remove.side_effect = ExternalProcessError(
-            returncode=2, cmd=("omshell",), output=error_message
+    def make_server(self, omapi_key=None):
+        if omapi_key is None:
+            omapi_key = generate_omapi_key()
+        return random.choice([dhcp.DHCPv4Server, dhcp.DHCPv6Server])(
+            omapi_key
         )
-        mac = factory.make_mac_address()
-        with FakeLogger("maas.dhcp") as logger:
-            error = self.assertRaises(
-                exceptions.CannotRemoveHostMap,
-                dhcp._remove_host_map,
-                omshell,
-                mac,
-            )
-        # The CannotRemoveHostMap exception includes a message describing the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not remove host map for %s: ..." % mac, str(error)
+
+    def test_creates_client_for_server(self):
+        server = self.make_server()
+        client = dhcp._get_omapi_client(server)
+        self.assertThat(
+            client,
+            MatchesStructure.byEquality(
+                server_address="127.0.0.1",
+                shared_key=server.omapi_key,
+                ipv6=server.ipv6,
+            ),
         )
-        # A message is also written to the maas.dhcp logger that describes the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not remove host map for %s: ..." % mac, logger.output
+
+    def test_reuses_client(self):
+        server = self.make_server()
+        self.assertIs(
+            dhcp._get_omapi_client(server), dhcp._get_omapi_client(server)
         )
 
-    def test_raises_error_when_omshell_not_connected(self):
-        error = ExternalProcessError(returncode=2, cmd=("omshell",), output="")
-        self.patch(ExternalProcessError, "output_as_unicode", "not connected.")
-        omshell = Mock()
-        omshell.remove.side_effect = error
-        mac = factory.make_mac_address()
-        with FakeLogger("maas.dhcp") as logger:
-            error = self.assertRaises(
-                exceptions.CannotRemoveHostMap,
-                dhcp._remove_host_map,
-                omshell,
-                mac,
-            )
-        # The CannotCreateHostMap exception includes a message describing the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not remove host map for %s: "
-            "The DHCP server could not be reached." % mac,
-            str(error),
+    def test_replaces_client_when_key_changes(self):
+        server = self.make_server()
+        client = dhcp._get_omapi_client(server)
+        close = self.patch(client, "close")
+        new_client = dhcp._get_omapi_client(
+            server.__class__(generate_omapi_key())
         )
-        # A message is also written to the maas.dhcp logger that describes the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not remove host map for %s: "
-            "The DHCP server could not be reached." % mac,
-            logger.output,
+        self.assertIsNot(client, new_client)
+        self.assertThat(close, MockCalledOnceWith())
+
+    def test_close_omapi_client_closes_and_forgets_client(self):
+        server = self.make_server()
+        client = dhcp._get_omapi_client(server)
+        close = self.patch(client, "close")
+        dhcp._close_omapi_client(server)
+        self.assertThat(close, MockCalledOnceWith())
+        self.assertIsNot(client, dhcp._get_omapi_client(server))
+
+
+class TestUpdateHosts(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.omapi_key = generate_omapi_key()
+        self.omapi_server = self.useFixture(FakeOmapiServer(self.omapi_key))
+        self.server = dhcp.DHCPv4Server(self.omapi_key)
+        client = OmapiClient(
+            "127.0.0.1", self.omapi_key, port=self.omapi_server.port
         )
+        self.addCleanup(client.close)
+        self.patch(dhcp, "_get_omapi_client").return_value = client
 
+    def get_host_name(self, host):
+        return host["mac"].replace(":", "-").encode("ascii")
 
-class TestCreateHostMap(MAASTestCase):
-    def test_calls_omshell_create(self):
-        omshell = Mock()
-        mac = factory.make_mac_address()
-        ip = factory.make_ip_address()
-        dhcp._create_host_map(omshell, mac, ip)
-        self.assertThat(omshell.create, MockCalledOnceWith(ip, mac))
+    def test_performs_operations(self):
+        remove_host = make_host()
+        modify_host = make_host()
+        self.omapi_server.hosts[self.get_host_name(remove_host)] = {}
+        self.omapi_server.hosts[self.get_host_name(modify_host)] = {}
+        add_host = make_host()
+        errors = dhcp._update_hosts(
+            self.server, [remove_host], [add_host], [modify_host]
+        )
+        self.assertEqual([], errors)
+        self.assertItemsEqual(
+            [self.get_host_name(add_host), self.get_host_name(modify_host)],
+            list(self.omapi_server.hosts),
+        )
+        self.assertEqual(
+            IPAddress(modify_host["ip"]).packed,
+            self.omapi_server.hosts[self.get_host_name(modify_host)][
+                b"ip-address"
+            ],
+        )
+
+    def test_holds_lock_for_whole_exchange(self):
+        lock = dhcp._omapi_locks[self.server.dhcp_service]
+        locked = []
+
+        def batch(items):
+            list(items)
+            locked.append(lock.locked())
+            return {}
+
+        client = dhcp._get_omapi_client.return_value
+        for method in ("remove_hosts", "create_hosts", "modify_hosts"):
+            self.patch(client, method).side_effect = batch
+        dhcp._update_hosts(self.server, [], [], [])
+        self.assertEqual([True, True, True], locked)
+        self.assertFalse(lock.locked())
 
-    def test_raises_error_when_omshell_crashes(self):
-        error_message = factory.make_name("error").encode("ascii")
-        omshell = Mock()
-        omshell.create.side_effect = ExternalProcessError(
-            returncode=2, cmd=("omshell",), output=error_message
+    def test_uses_one_connection(self):
+        hosts = [make_host() for _ in range(5)]
+        dhcp._update_hosts(self.server, [], hosts, [])
+        dhcp._update_hosts(self.server, hosts, [], [])
+        self.assertEqual(1, self.omapi_server.connections)
+
+    def test_returns_and_logs_errors_for_each_failed_host(self):
+        remove_host, add_host, modify_host = (
+            make_host() for _ in range(3)
         )
-        mac = factory.make_mac_address()
-        ip = factory.make_ip_address()
+        self.omapi_server.hosts[self.get_host_name(remove_host)] = {}
+        for host in (remove_host, add_host, modify_host):
+            self.omapi_server.errors[self.get_host_name(host)] = ISC_R_FAILURE
         with FakeLogger("maas.dhcp") as logger:
-            error = self.assertRaises(
-                exceptions.CannotCreateHostMap,
-                dhcp._create_host_map,
-                omshell,
-                mac,
-                ip,
+            errors = dhcp._update_hosts(
+                self.server, [remove_host], [add_host], [modify_host]
             )
-        # The CannotCreateHostMap exception includes a message describing the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: ..." % (mac, ip),
-            str(error),
+        expected = [
+            "Could not remove host map for %s: ..." % remove_host["mac"],
+            "Could not create host map for %s -> %s: ..."
+            % (add_host["mac"], add_host["ip"]),
+            "Could not modify host map for %s -> %s: ..."
+            % (modify_host["mac"], modify_host["ip"]),
+        ]
+        self.assertThat(errors, HasLength(3))
+        for message, error in zip(expected, errors):
+            self.assertDocTestMatches(message, error)
+        self.assertDocTestMatches("\n".join(expected), logger.output)
+
+    def test_raises_when_server_cannot_be_reached(self):
+        # Nothing is listening on a port that was just released.
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        client = OmapiClient("127.0.0.1", self.omapi_key, port=port)
+        dhcp._get_omapi_client.return_value = client
+        self.assertRaises(
+            OmapiError, dhcp._update_hosts, self.server, [], [make_host()], []
+        )
+
+
+class TestUpdateHostsFromVersion(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(dhcp._current_server_state.clear)
+        self.addCleanup(dhcp._current_server_version.clear)
+        self.server = random.choice([dhcp.DHCPv4Server, dhcp.DHCPv6Server])(
+            factory.make_name("omapi_key")
+        )
+        self.apply_state = self.patch(dhcp, "_apply_state")
+        self.apply_state.return_value = succeed(None)
+        self.get_service_state = self.patch(
+            dhcp.service_monitor, "getServiceState"
+        )
+        self.get_service_state.return_value = succeed(
+            ServiceState(SERVICE_STATE.OFF, "dead")
+        )
+        self.update_hosts = self.patch(dhcp, "_update_hosts")
+        self.update_hosts.return_value = []
+        self.write_config = self.patch(dhcp, "_write_config")
+
+    def make_state(self, hosts):
+        return dhcp.DHCPState(
+            self.server.omapi_key,
+            [make_failover_peer_config()],
+            [make_shared_network()],
+            hosts,
+            [make_interface()],
+            make_global_dhcp_snippets(),
         )
-        # A message is also written to the maas.dhcp logger that describes the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: ..." % (mac, ip),
-            logger.output,
+
+    def set_state(self, state, version):
+        dhcp._current_server_state[self.server.dhcp_service] = state
+        dhcp._current_server_version[self.server.dhcp_service] = version
+
+    @inlineCallbacks
+    def test_applies_changed_hosts_to_current_state(self):
+        unchanged_host, removed_host, modified_host = (
+            make_host() for _ in range(3)
+        )
+        state = self.make_state([unchanged_host, removed_host, modified_host])
+        version = factory.make_name("version")
+        self.set_state(state, version)
+        modified_host = dict(modified_host, ip=factory.make_ip_address())
+        added_host = make_host()
+        new_version = factory.make_name("version")
+
+        yield dhcp.update_hosts(
+            self.server,
+            version,
+            new_version,
+            [removed_host["mac"]],
+            [modified_host, added_host],
+        )
+
+        expected_state = self.make_state([])._replace(
+            failover_peers=state.failover_peers,
+            shared_networks=state.shared_networks,
+            interfaces=state.interfaces,
+            global_dhcp_snippets=state.global_dhcp_snippets,
+            hosts={
+                host["mac"]: host
+                for host in (unchanged_host, modified_host, added_host)
+            },
+        )
+        self.assertThat(
+            self.apply_state,
+            MockCalledOnceWith(self.server, expected_state),
+        )
+        self.assertEqual(
+            new_version,
+            dhcp._current_server_version[self.server.dhcp_service],
         )
 
-    def test_raises_error_when_omshell_not_connected(self):
-        error = ExternalProcessError(returncode=2, cmd=("omshell",), output="")
-        self.patch(ExternalProcessError, "output_as_unicode", "not connected.")
-        omshell = Mock()
-        omshell.create.side_effect = error
-        mac = factory.make_mac_address()
-        ip = factory.make_ip_address()
-        with FakeLogger("maas.dhcp") as logger:
-            error = self.assertRaises(
-                exceptions.CannotCreateHostMap,
-                dhcp._create_host_map,
-                omshell,
-                mac,
-                ip,
-            )
-        # The CannotCreateHostMap exception includes a message describing the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: "
-            "The DHCP server could not be reached." % (mac, ip),
-            str(error),
+    @inlineCallbacks
+    def test_updates_running_server_over_omapi_only(self):
+        self.get_service_state.return_value = succeed(
+            ServiceState(SERVICE_STATE.ON, "running")
         )
-        # A message is also written to the maas.dhcp logger that describes the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: "
-            "The DHCP server could not be reached." % (mac, ip),
-            logger.output,
+        unchanged_host, removed_host, modified_host = (
+            make_host(dhcp_snippets=[]) for _ in range(3)
         )
+        state = self.make_state([unchanged_host, removed_host, modified_host])
+        version = factory.make_name("version")
+        self.set_state(state, version)
+        modified_host = dict(modified_host, ip=factory.make_ip_address())
+        added_host = make_host(dhcp_snippets=[])
+        new_version = factory.make_name("version")
 
+        yield dhcp.update_hosts(
+            self.server,
+            version,
+            new_version,
+            [removed_host["mac"]],
+            [modified_host, added_host],
+        )
 
-class TestUpdateHost(MAASTestCase):
-    def test_creates_omshell_with_correct_arguments(self):
-        omshell = self.patch(dhcp, "Omshell")
-        server = Mock()
-        server.ipv6 = factory.pick_bool()
-        dhcp._update_hosts(server, [], [], [])
         self.assertThat(
-            omshell,
-            MockCallsMatch(
-                call(
-                    ipv6=server.ipv6,
-                    server_address="127.0.0.1",
-                    shared_key=server.omapi_key,
-                )
+            self.update_hosts,
+            MockCalledOnceWith(
+                self.server, [removed_host], [added_host], [modified_host]
             ),
         )
+        self.assertThat(self.apply_state, MockNotCalled())
+        self.assertThat(self.write_config, MockNotCalled())
+        self.assertEqual(
+            {
+                host["mac"]: host
+                for host in (unchanged_host, modified_host, added_host)
+            },
+            dhcp._current_server_state[self.server.dhcp_service].hosts,
+        )
+        self.assertEqual(
+            new_version,
+            dhcp._current_server_version[self.server.dhcp_service],
+        )
 
-    def test_performs_operations(self):
-        omshell = Mock()
-        self.patch(dhcp, "Omshell").return_value = omshell
-        remove_host = make_host()
-        add_host = make_host()
-        modify_host = make_host()
-        server = Mock()
-        server.ipv6 = factory.pick_bool()
-        dhcp._update_hosts(server, [remove_host], [add_host], [modify_host])
-        self.assertThat(
-            omshell.remove, MockCallsMatch(call(remove_host["mac"]))
+    @inlineCallbacks
+    def test_applies_state_when_host_snippets_change(self):
+        self.get_service_state.return_value = succeed(
+            ServiceState(SERVICE_STATE.ON, "running")
+        )
+        state = self.make_state([])
+        version = factory.make_name("version")
+        self.set_state(state, version)
+        host = make_host(
+            dhcp_snippets=make_host_dhcp_snippets(allow_empty=False)
+        )
+        yield dhcp.update_hosts(
+            self.server, version, factory.make_name("version"), [], [host]
         )
         self.assertThat(
-            omshell.create,
-            MockCallsMatch(call(add_host["ip"], add_host["mac"])),
+            self.apply_state,
+            MockCalledOnceWith(
+                self.server, state._replace(hosts={host["mac"]: host})
+            ),
+        )
+        self.assertThat(self.update_hosts, MockNotCalled())
+
+    @inlineCallbacks
+    def test_restarts_when_omapi_update_fails(self):
+        self.get_service_state.return_value = succeed(
+            ServiceState(SERVICE_STATE.ON, "running")
+        )
+        self.update_hosts.return_value = [factory.make_name("error")]
+        current_states = []
+        self.apply_state.side_effect = lambda server, state: succeed(
+            current_states.append(
+                dhcp._current_server_state[server.dhcp_service]
+            )
+        )
+        state = self.make_state([])
+        version = factory.make_name("version")
+        self.set_state(state, version)
+        host = make_host(dhcp_snippets=[])
+        yield dhcp.update_hosts(
+            self.server, version, factory.make_name("version"), [], [host]
         )
         self.assertThat(
-            omshell.modify,
-            MockCallsMatch(call(modify_host["ip"], modify_host["mac"])),
+            self.apply_state,
+            MockCalledOnceWith(
+                self.server, state._replace(hosts={host["mac"]: host})
+            ),
+        )
+        # Without a current state, the server is restarted.
+        self.assertEqual([None], current_states)
+
+    @inlineCallbacks
+    def test_raises_mismatch_without_current_state(self):
+        with ExpectedException(exceptions.DHCPStateMismatch):
+            yield dhcp.update_hosts(
+                self.server, factory.make_name("version"), "", [], []
+            )
+        self.assertThat(self.apply_state, MockNotCalled())
+
+    @inlineCallbacks
+    def test_raises_mismatch_for_other_version(self):
+        self.set_state(self.make_state([]), factory.make_name("version"))
+        with ExpectedException(exceptions.DHCPStateMismatch):
+            yield dhcp.update_hosts(
+                self.server, factory.make_name("version"), "", [], []
+            )
+        self.assertThat(self.apply_state, MockNotCalled())
+
+    @inlineCallbacks
+    def test_forgets_version_when_update_fails(self):
+        version = factory.make_name("version")
+        self.set_state(self.make_state([]), version)
+        exception = factory.make_exception()
+        self.apply_state.return_value = fail(exception)
+        with ExpectedException(type(exception)):
+            yield dhcp.update_hosts(
+                self.server, version, factory.make_name("version"), [], []
+            )
+        self.assertIsNone(
+            dhcp._current_server_version[self.server.dhcp_service]
         )
 
 
@@ -619,6 +804,7 @@ class TestConfigureDHCP(MAASTestCase):
         self.addCleanup(dhcp.service_monitor.getServiceByName("dhcpd6").off)
         # The dhcp server states are global so we clean them after each test.
         self.addCleanup(dhcp._current_server_state.clear)
+        self.addCleanup(dhcp._current_server_version.clear)
         # Temporarily prevent hostname resolution when generating DHCP
         # configuration. This is tested elsewhere.
         self.useFixture(DHCPConfigNameResolutionDisabled())
@@ -664,7 +850,45 @@ class TestConfigureDHCP(MAASTestCase):
         return self.patch_autospec(dhcp, "get_config")
 
     def patch_update_hosts(self):
-        return self.patch(dhcp, "_update_hosts")
+        update_hosts = self.patch(dhcp, "_update_hosts")
+        update_hosts.return_value = []
+        return update_hosts
+
+    @inlineCallbacks
+    def test_records_version(self):
+        self.patch(dhcp, "_apply_state").return_value = succeed(None)
+        server = self.server(factory.make_name("omapi_key"))
+        version = factory.make_name("version")
+        yield dhcp.configure(
+            server,
+            [],
+            [make_shared_network()],
+            [],
+            [make_interface()],
+            version=version,
+        )
+        self.assertEqual(
+            version, dhcp._current_server_version[server.dhcp_service]
+        )
+
+    @inlineCallbacks
+    def test_forgets_version_when_configure_fails(self):
+        exception = factory.make_exception()
+        self.patch(dhcp, "_apply_state").return_value = fail(exception)
+        server = self.server(factory.make_name("omapi_key"))
+        dhcp._current_server_version[server.dhcp_service] = factory.make_name(
+            "version"
+        )
+        with ExpectedException(type(exception)):
+            yield dhcp.configure(
+                server,
+                [],
+                [make_shared_network()],
+                [],
+                [make_interface()],
+                version=factory.make_name("version"),
+            )
+        self.assertIsNone(dhcp._current_server_version[server.dhcp_service])
 
     @inlineCallbacks
     def test_deletes_dhcp_config_if_no_subnets_defined(self):
@@ -1207,6 +1431,55 @@ class TestConfigureDHCP(MAASTestCase):
             logger.output,
         )
 
+    @inlineCallbacks
+    def test_restarts_when_omapi_fails_to_update_some_hosts(self):
+        self.patch_sudo_write_file()
+        get_service_state = self.patch_getServiceState()
+        get_service_state.return_value = ServiceState(
+            SERVICE_STATE.ON, "running"
+        )
+        restart_service = self.patch_restartService()
+        self.patch_ensureService()
+        update_hosts = self.patch_update_hosts()
+        update_hosts.return_value = [factory.make_name("error")]
+        self.patch_get_config().return_value = factory.make_name("config")
+        self.patch_autospec(
+            dhcp.service_monitor.getServiceByName(self.server.dhcp_service),
+            "on",
+        )
+
+        failover_peers = make_failover_peer_config()
+        shared_network = make_shared_network()
+        [shared_network] = fix_shared_networks_failover(
+            [shared_network], [failover_peers]
+        )
+        old_hosts = [make_host(dhcp_snippets=[]) for _ in range(3)]
+        interface = make_interface()
+        global_dhcp_snippets = make_global_dhcp_snippets()
+        omapi_key = factory.make_name("omapi_key")
+        dhcp._current_server_state[self.server.dhcp_service] = dhcp.DHCPState(
+            omapi_key,
+            [failover_peers],
+            [shared_network],
+            old_hosts,
+            [interface],
+            global_dhcp_snippets,
+        )
+
+        yield self.configure(
+            omapi_key,
+            [failover_peers],
+            [shared_network],
+            old_hosts + [make_host(dhcp_snippets=[])],
+            [interface],
+            global_dhcp_snippets,
+        )
+
+        self.assertThat(update_hosts, MockCalledOnceWith(ANY, [], ANY, []))
+        self.assertThat(
+            restart_service, MockCalledOnceWith(self.server.dhcp_service)
+        )
+
     @inlineCallbacks
     def test_converts_failure_writing_file_to_CannotConfigureDHCP(self):
         self.patch_sudo_delete_file()
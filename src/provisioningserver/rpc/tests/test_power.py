@@ -23,6 +23,7 @@ from twisted.internet.defer import (
     succeed,
 )
 from twisted.internet.task import Clock
+from twisted.protocols.amp import UnhandledCommand
 from twisted.python.failure import Failure
 
 from maastesting.factory import factory
@@ -773,6 +774,9 @@ class TestPowerQuery(MAASTestCase):
         hostname = factory.make_name("hostname")
         message = factory.make_name("message")
         SendEvent, _, io = self.patch_rpc_methods()
+        self.patch(
+            power.power_state_reporter, "report"
+        ).return_value = succeed(None)
         d = power.power_query_failure(
             system_id, hostname, Failure(Exception(message))
         )
@@ -853,7 +857,7 @@ class TestPowerQuery(MAASTestCase):
         err_msg = factory.make_name("error")
 
         _, _, io = self.patch_rpc_methods()
-        self.patch_autospec(power, "power_state_update")
+        report_state = self.patch(power.power_state_reporter, "report")
 
         # Simulate a failure when querying state.
         query = fail(exceptions.PowerActionFail(err_msg))
@@ -865,9 +869,7 @@ class TestPowerQuery(MAASTestCase):
             exceptions.PowerActionFail, extract_result, report
         )
         self.assertEqual(err_msg, str(error))
-        self.assertThat(
-            power.power_state_update, MockCalledOnceWith(system_id, "error")
-        )
+        self.assertThat(report_state, MockCalledOnceWith(system_id, "error"))
 
     def test_report_power_state_changes_power_state_if_success(self):
         system_id = factory.make_name("system_id")
@@ -875,7 +877,7 @@ class TestPowerQuery(MAASTestCase):
         power_state = random.choice(["on", "off"])
 
         _, _, io = self.patch_rpc_methods()
-        self.patch_autospec(power, "power_state_update")
+        report_state = self.patch(power.power_state_reporter, "report")
 
         # Simulate a success when querying state.
         query = succeed(power_state)
@@ -885,8 +887,7 @@ class TestPowerQuery(MAASTestCase):
 
         self.assertEqual(power_state, extract_result(report))
         self.assertThat(
-            power.power_state_update,
-            MockCalledOnceWith(system_id, power_state),
+            report_state, MockCalledOnceWith(system_id, power_state)
         )
 
     def test_report_power_state_changes_power_state_if_unknown(self):
@@ -895,7 +896,7 @@ class TestPowerQuery(MAASTestCase):
         power_state = "unknown"
 
         _, _, io = self.patch_rpc_methods()
-        self.patch_autospec(power, "power_state_update")
+        report_state = self.patch(power.power_state_reporter, "report")
 
         # Simulate a success when querying state.
         query = succeed(power_state)
@@ -905,10 +906,55 @@ class TestPowerQuery(MAASTestCase):
 
         self.assertEqual(power_state, extract_result(report))
         self.assertThat(
-            power.power_state_update,
-            MockCalledOnceWith(system_id, power_state),
+            report_state, MockCalledOnceWith(system_id, power_state)
+        )
+
+    def test_report_power_state_does_not_wait_for_report(self):
+        system_id = factory.make_name("system_id")
+        hostname = factory.make_name("hostname")
+        power_state = random.choice(["on", "off"])
+        logger = self.useFixture(FakeLogger("maas"))
+        sent = Deferred()
+        self.patch(power.power_state_reporter, "report").return_value = sent
+
+        report = power.report_power_state(
+            succeed(power_state), system_id, hostname
+        )
+        self.assertEqual(power_state, extract_result(report))
+        # A failure to send the report is logged.
+        sent.errback(factory.make_exception("boom"))
+        self.assertEqual(
+            "%s: Failed to report power state: boom\n" % hostname,
+            logger.output,
         )
 
+    def test_query_node_does_not_wait_for_report(self):
+        node = {
+            "system_id": factory.make_name("system_id"),
+            "hostname": factory.make_name("hostname"),
+            "power_state": "on",
+            "power_type": "ipmi",
+            "context": {},
+        }
+        self.patch(power, "get_power_state").return_value = succeed("off")
+        report = self.patch(power.power_state_reporter, "report")
+        report.return_value = Deferred()
+        d = power.query_node(node, Clock())
+        self.assertEqual("off", extract_result(d))
+        report.assert_called_once_with(node["system_id"], "off")
+
+    def test_report_power_state_ignores_unknown_node(self):
+        system_id = factory.make_name("system_id")
+        hostname = factory.make_name("hostname")
+        logger = self.useFixture(FakeLogger("maas"))
+        sent = Deferred()
+        self.patch(power.power_state_reporter, "report").return_value = sent
+
+        report = power.report_power_state(succeed("on"), system_id, hostname)
+        self.assertEqual("on", extract_result(report))
+        sent.errback(exceptions.NoSuchNode.from_system_id(system_id))
+        self.assertEqual("", logger.output)
+
 
 class TestPowerQueryExceptions(MAASTestCase):
 
@@ -952,9 +998,9 @@ class TestPowerQueryExceptions(MAASTestCase):
         query = self.patch_autospec(power, self.func)
         query.side_effect = always_fail_with(exception)
 
-        # Intercept calls to power_state_update() and send_node_event().
-        power_state_update = self.patch_autospec(power, "power_state_update")
-        power_state_update.return_value = succeed(None)
+        # Intercept reports of the power state and calls to send_node_event().
+        report_state = self.patch(power.power_state_reporter, "report")
+        report_state.return_value = succeed(None)
         send_node_event = self.patch_autospec(power, "send_node_event")
         send_node_event.return_value = succeed(None)
 
@@ -993,9 +1039,7 @@ class TestPowerQueryExceptions(MAASTestCase):
         )
 
         # An attempt was made to report the failure to the region.
-        self.assertThat(
-            power_state_update, MockCalledOnceWith(system_id, "error")
-        )
+        self.assertThat(report_state, MockCalledOnceWith(system_id, "error"))
         # An attempt was made to log a node event with details.
         self.assertThat(
             send_node_event,
@@ -1289,3 +1333,532 @@ class TestPowerQueryAsync(MAASTestCase):
             [(True, node1["power_state"]), (True, node2["power_state"])],
             results,
         )
+
+    def make_virsh_nodes(self, count=3):
+        power_address = factory.make_name("power_address")
+        nodes = [self.make_node(power_type="virsh") for _ in range(count)]
+        for node in nodes:
+            node["context"] = {
+                "power_address": power_address,
+                "power_id": factory.make_name("power_id"),
+                "power_pass": "",
+            }
+        return nodes
+
+    def patch_query_many(self):
+        driver = PowerDriverRegistry["virsh"]
+        self.patch(driver, "detect_missing_packages").return_value = []
+        return self.patch(driver, "query_many")
+
+    @inlineCallbacks
+    def test_query_all_nodes_queries_nodes_with_same_bmc_together(self):
+        nodes = self.make_virsh_nodes()
+        query_many = self.patch_query_many()
+        query_many.return_value = succeed(
+            {node["system_id"]: "on" for node in nodes}
+        )
+        get_power_state = self.patch(power, "get_power_state")
+        suppress_reporting(self)
+
+        results = yield power.query_all_nodes(nodes)
+        self.assertThat(
+            query_many,
+            MockCalledOnceWith(
+                {node["system_id"]: node["context"] for node in nodes}
+            ),
+        )
+        self.assertThat(get_power_state, MockNotCalled())
+        self.assertThat(
+            power.report_power_state,
+            MockCallsMatch(
+                *(
+                    call(ANY, node["system_id"], node["hostname"])
+                    for node in nodes
+                )
+            ),
+        )
+        self.assertEqual([(True, None)], results)
+
+    @inlineCallbacks
+    def test_query_all_nodes_queries_nodes_left_out_one_by_one(self):
+        nodes = self.make_virsh_nodes()
+        query_many = self.patch_query_many()
+        query_many.return_value = succeed({nodes[0]["system_id"]: "on"})
+        get_power_state = self.patch(power, "get_power_state")
+        get_power_state.return_value = succeed("off")
+        suppress_reporting(self)
+
+        yield power.query_all_nodes(nodes)
+        self.assertThat(
+            get_power_state,
+            MockCallsMatch(
+                *(
+                    call(
+                        node["system_id"],
+                        node["hostname"],
+                        node["power_type"],
+                        node["context"],
+                        clock=reactor,
+                    )
+                    for node in nodes[1:]
+                )
+            ),
+        )
+
+    @inlineCallbacks
+    def test_query_all_nodes_schedules_nodes_with_same_bmc_together(self):
+        nodes = self.make_virsh_nodes()
+        query_many = self.patch_query_many()
+        query_many.return_value = succeed(
+            {node["system_id"]: "on" for node in nodes}
+        )
+        suppress_reporting(self)
+        scheduler = power.PowerQueryScheduler(
+            clock=Clock(), prometheus_metrics=MagicMock()
+        )
+
+        yield power.query_all_nodes(nodes, scheduler=scheduler)
+        self.assertThat(query_many, MockCalledOnceWith(ANY))
+        self.assertItemsEqual(
+            [node["system_id"] for node in nodes],
+            list(scheduler._last_queried),
+        )
+
+    @inlineCallbacks
+    def test_query_all_nodes_queries_one_by_one_if_query_many_fails(self):
+        nodes = self.make_virsh_nodes()
+        query_many = self.patch_query_many()
+        query_many.return_value = fail(PowerError("boom"))
+        get_power_state = self.patch(power, "get_power_state")
+        get_power_state.return_value = succeed("off")
+        suppress_reporting(self)
+
+        yield power.query_all_nodes(nodes)
+        self.assertEqual(3, get_power_state.call_count)
+
+    @inlineCallbacks
+    def test_query_all_nodes_queries_nodes_of_other_bmcs_one_by_one(self):
+        nodes = self.make_virsh_nodes(1) + self.make_virsh_nodes(1)
+        query_many = self.patch_query_many()
+        get_power_state = self.patch(power, "get_power_state")
+        get_power_state.return_value = succeed("off")
+        suppress_reporting(self)
+
+        yield power.query_all_nodes(nodes)
+        self.assertThat(query_many, MockNotCalled())
+        self.assertEqual(2, get_power_state.call_count)
+
+
+class TestPowerQueryScheduler(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.get_power_state = self.patch(power, "get_power_state")
+        self.get_power_state.side_effect = lambda *args, **kwargs: succeed(
+            "on"
+        )
+        suppress_reporting(self)
+        self.clock = Clock()
+
+    def make_scheduler(self, **kwargs):
+        kwargs.setdefault("prometheus_metrics", MagicMock())
+        return power.PowerQueryScheduler(clock=self.clock, **kwargs)
+
+    def make_node(self, power_type="ipmi"):
+        return {
+            "system_id": factory.make_name("system_id"),
+            "hostname": factory.make_name("hostname"),
+            "power_state": "unknown",
+            "power_type": power_type,
+            "context": {"power_address": factory.make_ipv4_address()},
+        }
+
+    def block_queries(self):
+        queries = {}
+
+        def get_power_state(system_id, *args, **kwargs):
+            queries[system_id] = Deferred()
+            return queries[system_id]
+
+        self.get_power_state.side_effect = get_power_state
+        return queries
+
+    def queried(self):
+        return [args[0] for args, _ in self.get_power_state.call_args_list]
+
+    def test_runs_up_to_initial_concurrency(self):
+        queries = self.block_queries()
+        scheduler = self.make_scheduler(initial_concurrency=2)
+        nodes = [self.make_node() for _ in range(3)]
+        ds = [scheduler.query(node) for node in nodes]
+        self.assertEqual(
+            [node["system_id"] for node in nodes[:2]], list(queries)
+        )
+        queries[nodes[0]["system_id"]].callback("off")
+        self.assertEqual("off", extract_result(ds[0]))
+        self.assertIn(nodes[2]["system_id"], queries)
+
+    def test_limits_concurrency_by_power_type(self):
+        queries = self.block_queries()
+        scheduler = self.make_scheduler(initial_concurrency=1)
+        nodes = [self.make_node("ipmi"), self.make_node("virsh")]
+        for node in nodes:
+            scheduler.query(node)
+        self.assertEqual([node["system_id"] for node in nodes], list(queries))
+
+    def test_starts_stalest_first(self):
+        scheduler = self.make_scheduler(
+            initial_concurrency=1, max_concurrency=1
+        )
+        older, newer, blocker, never = [self.make_node() for _ in range(4)]
+        extract_result(scheduler.query(older))
+        self.clock.advance(10)
+        extract_result(scheduler.query(newer))
+        queries = self.block_queries()
+        scheduler.query(blocker)
+        for node in (newer, never, older):
+            scheduler.query(node)
+        queries[blocker["system_id"]].callback("on")
+        for _ in range(3):
+            list(queries.values())[-1].callback("on")
+        self.assertEqual(
+            [
+                node["system_id"]
+                for node in (older, newer, blocker, never, older, newer)
+            ],
+            self.queried(),
+        )
+
+    def test_increases_concurrency_after_prompt_answers(self):
+        scheduler = self.make_scheduler(initial_concurrency=2)
+        for _ in range(2):
+            extract_result(scheduler.query(self.make_node()))
+        self.assertEqual(3, scheduler.get_concurrency("ipmi"))
+
+    def test_concurrency_does_not_exceed_maximum(self):
+        scheduler = self.make_scheduler(
+            initial_concurrency=2, max_concurrency=2
+        )
+        for _ in range(5):
+            extract_result(scheduler.query(self.make_node()))
+        self.assertEqual(2, scheduler.get_concurrency("ipmi"))
+
+    def test_halves_concurrency_once_after_slow_queries(self):
+        queries = self.block_queries()
+        scheduler = self.make_scheduler(initial_concurrency=8, slow_query=10)
+        nodes = [self.make_node() for _ in range(2)]
+        for node in nodes:
+            scheduler.query(node)
+        self.clock.advance(11)
+        for node in nodes:
+            queries[node["system_id"]].callback("on")
+        self.assertEqual(4, scheduler.get_concurrency("ipmi"))
+
+    def test_does_not_halve_concurrency_for_usually_slow_bmc(self):
+        queries = self.block_queries()
+        scheduler = self.make_scheduler(initial_concurrency=8, slow_query=10)
+        node = self.make_node()
+        for _ in range(2):
+            scheduler.query(node)
+            self.clock.advance(12)
+            queries[node["system_id"]].callback("on")
+        self.assertEqual(4, scheduler.get_concurrency("ipmi"))
+
+    def test_failures_do_not_lower_concurrency(self):
+        self.get_power_state.side_effect = lambda *args, **kwargs: fail(
+            PowerError("boom")
+        )
+        scheduler = self.make_scheduler(initial_concurrency=2)
+        for _ in range(3):
+            scheduler.query(self.make_node())
+        self.assertEqual(2, scheduler.get_concurrency("ipmi"))
+
+    def test_backs_off_failing_bmc_exponentially(self):
+        self.get_power_state.side_effect = lambda *args, **kwargs: fail(
+            PowerError("boom")
+        )
+        scheduler = self.make_scheduler(min_backoff=60, max_backoff=100)
+        node = self.make_node()
+
+        def query_after(seconds):
+            self.clock.advance(seconds)
+            extract_result(scheduler.query(node))
+            return self.get_power_state.call_count
+
+        self.assertEqual(1, query_after(0))
+        self.assertEqual(1, query_after(59))
+        self.assertEqual(2, query_after(1))
+        self.assertEqual(2, query_after(99))
+        self.assertEqual(3, query_after(1))
+        # The backoff does not exceed the maximum.
+        self.assertEqual(4, query_after(100))
+
+    def make_group(self, count=3):
+        power_address = factory.make_name("power_address")
+        nodes = [self.make_node(power_type="virsh") for _ in range(count)]
+        for node in nodes:
+            node["context"] = {
+                "power_address": power_address,
+                "power_id": factory.make_name("power_id"),
+                "power_pass": "",
+            }
+        return nodes
+
+    def test_query_many_records_nodes_queried(self):
+        nodes = self.make_group()
+        query_many = self.patch(PowerDriverRegistry["virsh"], "query_many")
+        query_many.return_value = succeed(
+            {nodes[0]["system_id"]: "on", nodes[1]["system_id"]: "off"}
+        )
+        scheduler = self.make_scheduler()
+        self.assertEqual(
+            {nodes[0]["system_id"]: "on", nodes[1]["system_id"]: "off"},
+            extract_result(scheduler.query_many(nodes)),
+        )
+        self.assertEqual(
+            {nodes[0]["system_id"], nodes[1]["system_id"]},
+            set(scheduler._last_queried),
+        )
+        self.assertEqual(2, scheduler.completed)
+        self.assertEqual(1, len(scheduler._bmcs))
+        self.assertEqual(0, scheduler._get_limit("virsh").running)
+
+    def test_query_many_skips_backed_off_bmc(self):
+        self.get_power_state.side_effect = lambda *args, **kwargs: fail(
+            PowerError("boom")
+        )
+        nodes = self.make_group()
+        query_many = self.patch(PowerDriverRegistry["virsh"], "query_many")
+        scheduler = self.make_scheduler(min_backoff=60)
+        extract_result(scheduler.query(nodes[0]))
+        self.assertEqual({}, extract_result(scheduler.query_many(nodes)))
+        query_many.assert_not_called()
+        self.clock.advance(60)
+        query_many.return_value = succeed({})
+        self.assertEqual({}, extract_result(scheduler.query_many(nodes)))
+        query_many.assert_called_once_with(
+            {node["system_id"]: node["context"] for node in nodes}
+        )
+
+    def test_query_many_failure_does_not_back_off_bmc(self):
+        nodes = self.make_group()
+        query_many = self.patch(PowerDriverRegistry["virsh"], "query_many")
+        query_many.return_value = fail(PowerError("boom"))
+        scheduler = self.make_scheduler()
+        d = scheduler.query_many(nodes)
+        self.assertRaises(PowerError, extract_result, d)
+        self.assertEqual("on", extract_result(scheduler.query(nodes[0])))
+        self.assertEqual(0, scheduler._get_limit("virsh").running)
+
+    def test_backs_off_nodes_sharing_failing_bmc(self):
+        self.get_power_state.side_effect = lambda *args, **kwargs: fail(
+            PowerError("boom")
+        )
+        scheduler = self.make_scheduler(min_backoff=60)
+        power_address = factory.make_name("power_address")
+        nodes = [self.make_node(power_type="virsh") for _ in range(2)]
+        for node in nodes:
+            node["context"] = {
+                "power_address": power_address,
+                "power_id": factory.make_name("power_id"),
+                "power_pass": "",
+            }
+        other = self.make_node(power_type="virsh")
+        other["context"] = dict(
+            nodes[0]["context"], power_address=factory.make_name("address")
+        )
+        for node in nodes + [other]:
+            extract_result(scheduler.query(node))
+        self.assertEqual(
+            [nodes[0]["system_id"], other["system_id"]], self.queried()
+        )
+        self.assertEqual(2, len(scheduler._bmcs))
+
+    def test_success_ends_backoff(self):
+        self.get_power_state.side_effect = [
+            fail(PowerError("boom")),
+            succeed("on"),
+            succeed("on"),
+        ]
+        scheduler = self.make_scheduler(min_backoff=60)
+        node = self.make_node()
+        extract_result(scheduler.query(node))
+        self.clock.advance(60)
+        self.assertEqual("on", extract_result(scheduler.query(node)))
+        self.assertEqual("on", extract_result(scheduler.query(node)))
+
+    def test_wait_for_room_fires_once_no_queries_wait(self):
+        queries = self.block_queries()
+        scheduler = self.make_scheduler(initial_concurrency=1)
+        self.assertIsNone(extract_result(scheduler.wait_for_room()))
+        first, second = self.make_node(), self.make_node()
+        scheduler.query(first)
+        scheduler.query(second)
+        d = scheduler.wait_for_room()
+        self.assertFalse(d.called)
+        queries[first["system_id"]].callback("on")
+        self.assertIsNone(extract_result(d))
+
+    def test_forget_drops_old_history(self):
+        scheduler = self.make_scheduler()
+        extract_result(scheduler.query(self.make_node()))
+        self.clock.advance(100)
+        node = self.make_node()
+        extract_result(scheduler.query(node))
+        scheduler.forget(older_than=50)
+        self.assertEqual([node["system_id"]], list(scheduler._last_queried))
+        self.assertEqual(1, len(scheduler._bmcs))
+
+    def test_updates_metrics(self):
+        scheduler = self.make_scheduler()
+        metrics = scheduler.prometheus_metrics
+        node = self.make_node()
+        extract_result(scheduler.query(node))
+        self.clock.advance(30)
+        extract_result(scheduler.query(node))
+        labels = {"power_type": "ipmi"}
+        self.assertThat(
+            metrics.update,
+            MockCallsMatch(
+                call(
+                    "maas_power_queries",
+                    "inc",
+                    labels={"power_type": "ipmi", "result": "success"},
+                ),
+                call(
+                    "maas_power_query_latency",
+                    "observe",
+                    value=0,
+                    labels=labels,
+                ),
+                call(
+                    "maas_power_query_concurrency",
+                    "set",
+                    value=5,
+                    labels=labels,
+                ),
+                call(
+                    "maas_power_state_age", "observe", value=30, labels=labels
+                ),
+                call(
+                    "maas_power_queries",
+                    "inc",
+                    labels={"power_type": "ipmi", "result": "success"},
+                ),
+                call(
+                    "maas_power_query_latency",
+                    "observe",
+                    value=0,
+                    labels=labels,
+                ),
+                call(
+                    "maas_power_query_concurrency",
+                    "set",
+                    value=5,
+                    labels=labels,
+                ),
+            ),
+        )
+
+
+class TestPowerStateReporter(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = Clock()
+        self.client = MagicMock()
+        self.client.return_value = succeed({"unknown": []})
+        self.patch(power, "getRegionClient").return_value = self.client
+
+    def make_reporter(self, **kwargs):
+        return power.PowerStateReporter(clock=self.clock, **kwargs)
+
+    def test_report_sends_states_together_after_delay(self):
+        reporter = self.make_reporter(delay=1.0)
+        system_ids = [factory.make_name("system_id") for _ in range(3)]
+        ds = [reporter.report(system_id, "on") for system_id in system_ids]
+        self.clock.advance(0.5)
+        self.assertThat(self.client, MockNotCalled())
+        self.clock.advance(0.5)
+        self.assertThat(
+            self.client,
+            MockCalledOnceWith(
+                region.UpdateNodePowerStates,
+                power_states=[
+                    {"system_id": system_id, "power_state": "on"}
+                    for system_id in system_ids
+                ],
+            ),
+        )
+        self.assertEqual([None] * 3, [extract_result(d) for d in ds])
+
+    def test_report_sends_last_state_of_node(self):
+        reporter = self.make_reporter()
+        system_id = factory.make_name("system_id")
+        d1 = reporter.report(system_id, "on")
+        d2 = reporter.report(system_id, "off")
+        reporter.flush()
+        self.assertThat(
+            self.client,
+            MockCalledOnceWith(
+                region.UpdateNodePowerStates,
+                power_states=[{"system_id": system_id, "power_state": "off"}],
+            ),
+        )
+        self.assertIsNone(extract_result(d1))
+        self.assertIsNone(extract_result(d2))
+
+    def test_report_sends_full_batch_at_once(self):
+        reporter = self.make_reporter(batch_size=2)
+        reporter.report(factory.make_name("system_id"), "on")
+        self.assertThat(self.client, MockNotCalled())
+        reporter.report(factory.make_name("system_id"), "on")
+        self.assertEqual(1, self.client.call_count)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_flush_without_reports_does_nothing(self):
+        reporter = self.make_reporter()
+        self.assertIsNone(extract_result(reporter.flush()))
+        self.assertThat(self.client, MockNotCalled())
+
+    def test_report_fails_for_unknown_nodes(self):
+        reporter = self.make_reporter()
+        system_id = factory.make_name("system_id")
+        self.client.return_value = succeed({"unknown": [system_id]})
+        d = reporter.report(system_id, "on")
+        reporter.flush()
+        self.assertRaises(exceptions.NoSuchNode, extract_result, d)
+
+    def test_report_fails_if_states_cannot_be_sent(self):
+        reporter = self.make_reporter()
+        self.client.return_value = fail(exceptions.NoConnectionsAvailable())
+        d = reporter.report(factory.make_name("system_id"), "on")
+        reporter.flush()
+        self.assertRaises(
+            exceptions.NoConnectionsAvailable, extract_result, d
+        )
+
+    def test_report_falls_back_to_UpdateNodePowerState(self):
+        reporter = self.make_reporter()
+        system_ids = [factory.make_name("system_id") for _ in range(2)]
+
+        def call_region(command, **kwargs):
+            if command is region.UpdateNodePowerStates:
+                return fail(UnhandledCommand())
+            elif kwargs["system_id"] == system_ids[1]:
+                return fail(exceptions.NoSuchNode())
+            else:
+                return succeed({})
+
+        self.client.side_effect = call_region
+        ds = [reporter.report(system_id, "off") for system_id in system_ids]
+        reporter.flush()
+        self.assertThat(
+            self.client,
+            MockCalledWith(
+                region.UpdateNodePowerState,
+                system_id=system_ids[1],
+                power_state="off",
+            ),
+        )
+        self.assertEqual(3, self.client.call_count)
+        self.assertIsNone(extract_result(ds[0]))
+        self.assertRaises(exceptions.NoSuchNode, extract_result, ds[1])
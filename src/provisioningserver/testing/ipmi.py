@@ -0,0 +1,229 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Test helpers for `provisioningserver.drivers.power.rmcp`."""
+
+__all__ = ["FakeBMC", "FakeSessionKeys"]
+
+import hmac
+import os
+import random
+import struct
+
+from twisted.internet.protocol import DatagramProtocol
+
+from provisioningserver.drivers.power.rmcp import (
+    _algorithm,
+    _hmac,
+    CHASSIS_CONTROL,
+    CIPHER_SUITES,
+    CMD,
+    decode_ipmi_message,
+    decode_packet,
+    encode_ipmi_message,
+    encode_packet,
+    NETFN,
+    PAYLOAD,
+    SessionKeys,
+)
+
+
+class FakeSessionKeys(SessionKeys):
+    """`SessionKeys` with the BMC's own derivation of K1 and K2.
+
+    This follows the IPMI v2.0 specification directly, so that a mistake
+    in the client's derivation is not mirrored by the fake BMC.
+    """
+
+    def __init__(self, suite, sik):
+        self.suite = suite
+        self.k1 = hmac.new(sik, bytes([0x01] * 20), suite.digest).digest()
+        self.k2 = hmac.new(sik, bytes([0x02] * 20), suite.digest).digest()
+
+
+class FakeBMC(DatagramProtocol):
+    """A BMC that answers RMCP+ requests from `RMCPPlusClient`.
+
+    Listen on a UDP port with it, e.g. ``reactor.listenUDP(0, bmc)``.
+
+    :ivar users: A dict mapping user names to passwords.
+    :ivar power_state: "on" or "off".
+    :ivar cipher_suites: The IDs of the cipher suites it supports.
+    :ivar sessions: The open sessions, by the BMC's session ID.
+    :ivar opened: The number of sessions opened so far.
+    :ivar requests: The (netfn, cmd, data) of each IPMI request received
+        in a session.
+    :ivar drop: The number of packets to ignore before answering again.
+    """
+
+    def __init__(self, users, power_state="off", cipher_suites=(3, 17)):
+        super().__init__()
+        self.users = users
+        self.power_state = power_state
+        self.cipher_suites = cipher_suites
+        self.guid = os.urandom(16)
+        self.sessions = {}
+        self.opened = 0
+        self.requests = []
+        self.drop = 0
+        self._seq = 0
+
+    def datagramReceived(self, datagram, address):
+        if self.drop > 0:
+            self.drop -= 1
+            return
+        payload_type, session_id, _, payload = decode_packet(datagram)
+        payload_type &= 0x3F
+        if payload_type == PAYLOAD.OPEN_SESSION_REQUEST:
+            response = self._open_session(payload)
+            self._reply(PAYLOAD.OPEN_SESSION_RESPONSE, response, address)
+        elif payload_type == PAYLOAD.RAKP1:
+            response = self._rakp1(payload)
+            self._reply(PAYLOAD.RAKP2, response, address)
+        elif payload_type == PAYLOAD.RAKP3:
+            response = self._rakp3(payload)
+            self._reply(PAYLOAD.RAKP4, response, address)
+        elif payload_type == PAYLOAD.IPMI:
+            self._ipmi(session_id, datagram, address)
+
+    def _reply(self, payload_type, payload, address):
+        self.transport.write(encode_packet(payload_type, payload), address)
+
+    def _error(self, tag, status, console_id):
+        return struct.pack("<BBxxI", tag, status, console_id)
+
+    def _open_session(self, payload):
+        tag, privilege, console_id = struct.unpack_from("<BBxxI", payload)
+        algorithms = payload[12], payload[20], payload[28]
+        for suite_id in self.cipher_suites:
+            suite = CIPHER_SUITES[suite_id]
+            if algorithms == suite[1:4]:
+                break
+        else:
+            # No cipher suite match with proposed security algorithms.
+            return self._error(tag, 0x11, console_id)
+        bmc_id = random.randint(1, 0xFFFFFFFF)
+        self.sessions[bmc_id] = {
+            "console_id": console_id,
+            "suite": suite,
+            "keys": None,
+        }
+        return (
+            struct.pack("<BBBxII", tag, 0, privilege, console_id, bmc_id)
+            + _algorithm(0, suite.auth)
+            + _algorithm(1, suite.integrity)
+            + _algorithm(2, suite.confidentiality)
+        )
+
+    def _rakp1(self, payload):
+        tag, bmc_id, rm, role, name_length = struct.unpack_from(
+            "<BxxxI16sBxxB", payload
+        )
+        username = payload[28 : 28 + name_length]
+        session = self.sessions[bmc_id]
+        password = self.users.get(username.decode("utf-8"))
+        if password is None:
+            # Unauthorized name.
+            return self._error(tag, 0x0D, session["console_id"])
+        password = password.encode("utf-8").ljust(20, b"\x00")
+        rc = os.urandom(16)
+        role = bytes((role, name_length))
+        session.update(rm=rm, rc=rc, role=role, username=username)
+        session["password"] = password
+        return (
+            self._error(tag, 0, session["console_id"])
+            + rc
+            + self.guid
+            + _hmac(
+                session["suite"],
+                password,
+                struct.pack("<II", session["console_id"], bmc_id),
+                rm,
+                rc,
+                self.guid,
+                role,
+                username,
+            )
+        )
+
+    def _rakp3(self, payload):
+        tag, bmc_id = struct.unpack_from("<BxxxI", payload)
+        session = self.sessions[bmc_id]
+        suite, console_id = session["suite"], session["console_id"]
+        expected = _hmac(
+            suite,
+            session["password"],
+            session["rc"],
+            struct.pack("<I", console_id),
+            session["role"],
+            session["username"],
+        )
+        if not hmac.compare_digest(expected, payload[8:]):
+            # Invalid integrity check value.
+            del self.sessions[bmc_id]
+            return self._error(tag, 0x0F, console_id)
+        sik = _hmac(
+            suite,
+            session["password"],
+            session["rm"],
+            session["rc"],
+            session["role"],
+            session["username"],
+        )
+        session["keys"] = FakeSessionKeys(suite, sik)
+        self.opened += 1
+        icv = _hmac(
+            suite, sik, session["rm"], struct.pack("<I", bmc_id), self.guid
+        )
+        return self._error(tag, 0, console_id) + icv[: suite.icv_length]
+
+    def _ipmi(self, bmc_id, datagram, address):
+        session = self.sessions.get(bmc_id)
+        if session is None or session["keys"] is None:
+            return
+        keys = session["keys"]
+        _, _, _, message = keys.decode(datagram)
+        netfn, rq_seq, cmd, data = decode_ipmi_message(message)
+        self.requests.append((netfn, cmd, data))
+        completion_code, response = self._command(bmc_id, netfn, cmd, data)
+        message = encode_ipmi_message(
+            netfn + 1,
+            cmd,
+            rq_seq,
+            bytes((completion_code,)) + response,
+            response=True,
+        )
+        self._seq += 1
+        self.transport.write(
+            keys.encode(
+                PAYLOAD.IPMI, message, session["console_id"], self._seq
+            ),
+            address,
+        )
+
+    def _command(self, bmc_id, netfn, cmd, data):
+        if netfn == NETFN.APP:
+            if cmd == CMD.SET_SESSION_PRIVILEGE_LEVEL:
+                return 0x00, data[:1]
+            elif cmd == CMD.GET_DEVICE_ID:
+                return 0x00, bytes(11)
+            elif cmd == CMD.CLOSE_SESSION:
+                del self.sessions[bmc_id]
+                return 0x00, b""
+        elif netfn == NETFN.CHASSIS:
+            if cmd == CMD.GET_CHASSIS_STATUS:
+                state = 0x01 if self.power_state == "on" else 0x00
+                return 0x00, bytes((state, 0, 0, 0))
+            elif cmd == CMD.CHASSIS_CONTROL:
+                if data[0] in (
+                    CHASSIS_CONTROL.POWER_DOWN,
+                    CHASSIS_CONTROL.SOFT_SHUTDOWN,
+                ):
+                    self.power_state = "off"
+                else:
+                    self.power_state = "on"
+                return 0x00, b""
+            elif cmd == CMD.SET_SYSTEM_BOOT_OPTIONS:
+                return 0x00, b""
+        # Invalid command.
+        return 0xC1, b""
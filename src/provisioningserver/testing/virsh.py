@@ -0,0 +1,135 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Test helpers for `provisioningserver.drivers.pod.virsh`."""
+
+__all__ = ["FakeVirsh"]
+
+import json
+import os
+import sys
+from textwrap import dedent
+
+from fixtures import Fixture, MonkeyPatch, TempDir
+
+EXECUTE = "provisioningserver.drivers.pod.virsh.VirshSSH._execute"
+
+FAKE_VIRSH_SCRIPT = dedent(
+    """\
+    import json
+    import sys
+
+    domains_path, log_path = sys.argv[1:]
+
+
+    def log(line):
+        with open(log_path, "a") as log_file:
+            log_file.write(line + "\\n")
+
+
+    def load():
+        with open(domains_path) as domains_file:
+            return json.load(domains_file)
+
+
+    def save(domains):
+        with open(domains_path, "w") as domains_file:
+            json.dump(domains, domains_file)
+
+
+    def set_state(name, state, message):
+        domains = load()
+        if name in domains:
+            domains[name] = state
+            save(domains)
+            print(message % name)
+        else:
+            print("error: failed to get domain '%s'" % name)
+
+
+    log("login")
+    while True:
+        sys.stdout.write("virsh # ")
+        sys.stdout.flush()
+        line = sys.stdin.readline()
+        if line == "":
+            break
+        args = line.split()
+        log(" ".join(args))
+        if len(args) == 0:
+            continue
+        elif args[0] == "quit":
+            break
+        elif args[0] == "list":
+            print(" Id   Name   State")
+            print("-" * 30)
+            for name, state in load().items():
+                print(" -    %s   %s" % (name, state))
+        elif args[0] == "domstate":
+            domains = load()
+            if args[1] in domains:
+                print(domains[args[1]])
+            else:
+                print("error: failed to get domain '%s'" % args[1])
+        elif args[0] == "start":
+            set_state(args[1], "running", "Domain %s started")
+        elif args[0] == "destroy":
+            set_state(args[1], "shut off", "Domain %s destroyed")
+        else:
+            print("error: unknown command: '%s'" % args[0])
+    """
+)
+
+
+class FakeVirsh(Fixture):
+    """Run a fake virsh shell instead of `virsh` for `VirshSSH` sessions.
+
+    It knows `list`, `domstate`, `start` and `destroy`.
+
+    :ivar domains: The initial domains, a dict mapping names to states like
+        "running" or "shut off".
+    """
+
+    def __init__(self, domains=None):
+        super().__init__()
+        self.domains = {} if domains is None else dict(domains)
+
+    def setUp(self):
+        super().setUp()
+        path = self.useFixture(TempDir()).path
+        self.script_path = os.path.join(path, "virsh.py")
+        self.domains_path = os.path.join(path, "domains.json")
+        self.log_path = os.path.join(path, "log")
+        with open(self.script_path, "w") as script_file:
+            script_file.write(FAKE_VIRSH_SCRIPT)
+        self.set_domains(self.domains)
+        open(self.log_path, "w").close()
+
+        def _execute(conn, poweraddr):
+            conn._spawn(
+                sys.executable,
+                [self.script_path, self.domains_path, self.log_path],
+            )
+
+        self.useFixture(MonkeyPatch(EXECUTE, _execute))
+
+    def set_domains(self, domains):
+        """Replace the domains and their states."""
+        with open(self.domains_path, "w") as domains_file:
+            json.dump(domains, domains_file)
+
+    def get_domains(self):
+        """Return the domains and their current states."""
+        with open(self.domains_path) as domains_file:
+            return json.load(domains_file)
+
+    @property
+    def commands(self):
+        """The commands run so far; each login is recorded as "login"."""
+        with open(self.log_path) as log_file:
+            return log_file.read().splitlines()
+
+    @property
+    def logins(self):
+        """The number of sessions started so far."""
+        return self.commands.count("login")
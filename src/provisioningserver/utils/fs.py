@@ -8,6 +8,7 @@ __all__ = [
     "atomic_delete",
     "atomic_symlink",
     "atomic_write",
+    "atomic_write_chunks",
     "FileLock",
     "get_library_script_path",
     "incremental_write",
@@ -92,6 +93,12 @@ def get_library_script_path(name):
 
 def _write_temp_file(content, filename):
     """Write the given `content` in a temporary file next to `filename`."""
+    return _write_temp_file_chunks([content], filename)
+
+
+def _write_temp_file_chunks(chunks, filename):
+    """Write each of `chunks` in turn to a temporary file next to `filename`.
+    """
     # Write the file to a temporary place (next to the target destination,
     # to ensure that it is on the same filesystem).
     directory = os.path.dirname(filename)
@@ -108,18 +115,23 @@ def _write_temp_file(content, filename):
             )
         raise
     else:
-        with os.fdopen(temp_fd, "wb") as f:
-            f.write(content)
-            # Finish writing this file to the filesystem, and then, tell the
-            # filesystem to push it down onto persistent storage.  This
-            # prevents a nasty hazard in aggressively optimized filesystems
-            # where you replace an old but consistent file with a new one that
-            # is still in cache, and lose power before the new file can be made
-            # fully persistent.
-            # This was a particular problem with ext4 at one point; it may
-            # still be.
-            f.flush()
-            os.fsync(f)
+        try:
+            with os.fdopen(temp_fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                # Finish writing this file to the filesystem, and then, tell
+                # the filesystem to push it down onto persistent storage.
+                # This prevents a nasty hazard in aggressively optimized
+                # filesystems where you replace an old but consistent file
+                # with a new one that is still in cache, and lose power
+                # before the new file can be made fully persistent.
+                # This was a particular problem with ext4 at one point; it may
+                # still be.
+                f.flush()
+                os.fsync(f)
+        except BaseException:
+            os.remove(temp_file)
+            raise
         return temp_file
 
 
@@ -139,6 +151,31 @@ def atomic_write(content, filename, overwrite=True, mode=0o600):
         raise TypeError("Content must be bytes, got: %r" % (content,))
 
     temp_file = _write_temp_file(content, filename)
+    _replace_with_temp_file(temp_file, filename, overwrite, mode)
+
+
+def atomic_write_chunks(chunks, filename, mode=0o600, unchanged=None):
+    """Write the byte strings from `chunks` into `filename` atomically.
+
+    This is the same as `atomic_write`, but `chunks` may be a generator so
+    that the content never needs to be held in memory all at once.
+
+    :param mode: Access permissions for the file, if written.
+    :param unchanged: Optional callable. It is called once all of `chunks`
+        have been written out; if it returns true then `filename` is left
+        as it was.
+    :return: True if `filename` was written, False otherwise.
+    """
+    temp_file = _write_temp_file_chunks(chunks, filename)
+    if unchanged is not None and unchanged():
+        os.remove(temp_file)
+        return False
+    _replace_with_temp_file(temp_file, filename, True, mode)
+    return True
+
+
+def _replace_with_temp_file(temp_file, filename, overwrite, mode):
+    """Move `temp_file` into place as `filename`; see `atomic_write`."""
     os.chmod(temp_file, mode)
 
     # Copy over ownership attributes if file exists
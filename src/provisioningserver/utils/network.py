@@ -19,6 +19,7 @@ __all__ = [
     "ip_range_within_network",
 ]
 
+from bisect import bisect_right
 import codecs
 from collections import namedtuple
 from operator import attrgetter
@@ -35,6 +36,7 @@ from socket import (
     IPPROTO_TCP,
 )
 import struct
+import threading
 from typing import Iterable, List, Optional, TypeVar
 from zlib import crc32
 
@@ -152,76 +154,86 @@ class MAASIPRange(IPRange):
         return json
 
 
-def _combine_overlapping_maasipranges(
-    ranges: Iterable[MAASIPRange],
-) -> List[MAASIPRange]:
-    """Returns the specified ranges after combining any overlapping ranges.
+# `MAASIPSet` keeps the purposes of each range as an integer bit mask. Each
+# purpose is given a bit the first time it is seen.
+_purpose_bits = {}
+_purpose_sets = {0: frozenset()}
+_purpose_lock = threading.Lock()
 
-    Given a sorted list of `MAASIPRange` objects, returns a new (sorted)
-    list where any adjacent overlapping ranges have been combined into a single
-    range.
-    """
-    new_ranges = []
-    previous_min = None
-    previous_max = None
-    for item in ranges:
-        if previous_min is not None and previous_max is not None:
-            # Check for an overlapping range.
-            min_overlaps = previous_min <= item.first <= previous_max
-            max_overlaps = previous_min <= item.last <= previous_max
-            if min_overlaps or max_overlaps:
-                previous = new_ranges.pop()
-                item = make_iprange(
-                    min(item.first, previous_min),
-                    max(item.last, previous_max),
-                    previous.purpose | item.purpose,
+
+def _get_purpose_mask(purposes) -> int:
+    """Returns the bit mask for the given set of purposes."""
+    mask = 0
+    for purpose in purposes:
+        bit = _purpose_bits.get(purpose)
+        if bit is None:
+            with _purpose_lock:
+                bit = _purpose_bits.setdefault(
+                    purpose, 1 << len(_purpose_bits)
                 )
-        previous_min = item.first
-        previous_max = item.last
-        new_ranges.append(item)
-    return new_ranges
+        mask |= bit
+    return mask
 
 
-def _coalesce_adjacent_purposes(
-    ranges: Iterable[MAASIPRange],
-) -> List[MAASIPRange]:
-    """Combines and returns adjacent ranges that have an identical purpose.
+def _get_purposes(mask: int) -> set:
+    """Returns a new set of the purposes in the given bit mask."""
+    purposes = _purpose_sets.get(mask)
+    if purposes is None:
+        purposes = _purpose_sets[mask] = frozenset(
+            purpose for purpose, bit in _purpose_bits.items() if mask & bit
+        )
+    return set(purposes)
 
-    Given a sorted list of `MAASIPRange` objects, returns a new (sorted)
-    list where any adjacent ranges with identical purposes have been combined
-    into a single range.
-    """
-    new_ranges = []
-    previous_first = None
-    previous_last = None
-    previous_purpose = None
-    for item in ranges:
-        if previous_purpose is not None and previous_last is not None:
-            adjacent_and_identical = (
-                item.first == (previous_last + 1)
-                and item.purpose == previous_purpose
-            )
-            if adjacent_and_identical:
-                new_ranges.pop()
-                item = make_iprange(previous_first, item.last, item.purpose)
-        previous_first = item.first
-        previous_last = item.last
-        previous_purpose = item.purpose
-        new_ranges.append(item)
-    return new_ranges
-
-
-def _normalize_ipranges(ranges: Iterable) -> List[MAASIPRange]:
-    """Converts each object in the list of ranges to an MAASIPRange, if
-    the object is not already a MAASIPRange. Then, returns a sorted list
-    of those MAASIPRange objects.
+
+def _get_rows(ranges: Iterable) -> list:
+    """Returns a `(version, first, last, purpose mask)` tuple for each object
+    in `ranges`.
+
+    Objects that are not already `MAASIPRange`s are converted to them first.
     """
-    new_ranges = []
+    rows = []
     for item in ranges:
         if not isinstance(item, MAASIPRange):
             item = MAASIPRange(item)
-        new_ranges.append(item)
-    return sorted(new_ranges)
+        rows.append(
+            (
+                item.version,
+                item.first,
+                item.last,
+                _get_purpose_mask(item.purpose),
+            )
+        )
+    return rows
+
+
+def _condense_rows(rows: list) -> list:
+    """Returns the given `(version, first, last, purpose mask)` tuples,
+    sorted, with overlapping ranges combined and then adjacent ranges with
+    an identical purpose combined.
+    """
+    rows = sorted(rows)
+    combined = []
+    for row in rows:
+        if combined:
+            version, first, last, mask = combined[-1]
+            if row[0] == version and row[1] <= last:
+                combined[-1] = (
+                    version,
+                    first,
+                    max(row[2], last),
+                    mask | row[3],
+                )
+                continue
+        combined.append(row)
+    coalesced = []
+    for row in combined:
+        if coalesced:
+            version, first, last, mask = coalesced[-1]
+            if row[0] == version and row[1] == last + 1 and row[3] == mask:
+                coalesced[-1] = (version, first, row[2], mask)
+                continue
+        coalesced.append(row)
+    return coalesced
 
 
 class IPRangeStatistics:
@@ -245,13 +257,15 @@ class IPRangeStatistics:
         self.largest_available = 0
         self.suggested_gateway = None
         self.suggested_dynamic_range = None
-        for range in full_maasipset.ranges:
-            if IPRANGE_TYPE.UNUSED in range.purpose:
-                self.num_available += range.num_addresses
-                if range.num_addresses > self.largest_available:
-                    self.largest_available = range.num_addresses
+        unused = _get_purpose_mask([IPRANGE_TYPE.UNUSED])
+        for _, first, last, mask in full_maasipset._rows:
+            num_addresses = last - first + 1
+            if mask & unused:
+                self.num_available += num_addresses
+                if num_addresses > self.largest_available:
+                    self.largest_available = num_addresses
             else:
-                self.num_unavailable += range.num_addresses
+                self.num_unavailable += num_addresses
         self.total_addresses = self.num_available + self.num_unavailable
         if not self.ranges.includes_purpose(IPRANGE_TYPE.GATEWAY_IP):
             self.suggested_gateway = self.get_recommended_gateway()
@@ -397,32 +411,65 @@ class IPRangeStatistics:
 
 
 class MAASIPSet(set):
-    def __init__(self, ranges, cidr=None):
-        self.cidr = cidr
-        self.ranges = ranges
-        self._condense()
-        super().__init__(set(self.ranges))
+    """A set of `MAASIPRange` objects, sorted and condensed.
 
-    def _condense(self):
-        """Condenses the `ranges` ivar in this `MAASIPSet` by:
+    The ranges are kept as parallel lists of their versions, first and last
+    addresses as integers, and purposes as bit masks, so that they can be
+    sorted, condensed and searched without comparing `MAASIPRange` objects.
+    Those are only created for the condensed ranges, in `ranges`.
+    """
 
-        (1) Ensuring range set is is sorted list of MAASIPRange objects.
-        (2) De-duplicate set by combining overlapping IP ranges.
-        (3) Combining adjacent ranges with an identical purpose.
-        """
-        self.ranges = _normalize_ipranges(self.ranges)
-        self.ranges = _combine_overlapping_maasipranges(self.ranges)
-        self.ranges = _coalesce_adjacent_purposes(self.ranges)
+    def __init__(self, ranges, cidr=None):
+        self.cidr = cidr
+        self._set_rows(_condense_rows(_get_rows(ranges)))
+
+    @classmethod
+    def _from_rows(cls, rows, cidr=None):
+        """Create a set from condensed `(version, first, last, mask)` rows."""
+        ipset = cls.__new__(cls)
+        ipset.cidr = cidr
+        ipset._set_rows(rows)
+        return ipset
+
+    def _set_rows(self, rows):
+        self._rows = rows
+        self._versions = [row[0] for row in rows]
+        self._firsts = [row[1] for row in rows]
+        self._lasts = [row[2] for row in rows]
+        self._masks = [row[3] for row in rows]
+        # The first addresses are only in order if all of the ranges are
+        # of the same version.
+        self._sorted = len(set(self._versions)) <= 1
+        self.ranges = [
+            MAASIPRange(
+                IPAddress(first, version),
+                IPAddress(last, version),
+                purpose=_get_purposes(mask),
+            )
+            for version, first, last, mask in rows
+        ]
+        super().clear()
+        super().update(self.ranges)
 
     def __ior__(self, other):
         """Return self |= other."""
-        self.ranges.extend(list(other.ranges))
-        self._condense()
-        # Replace the underlying set with the new ranges.
-        super().clear()
-        super().__ior__(set(self.ranges))
+        self._set_rows(_condense_rows(self._rows + other._rows))
         return self
 
+    def _find_index(self, value: int) -> Optional[int]:
+        """Returns the index of the first range containing `value`."""
+        if self._sorted:
+            index = bisect_right(self._firsts, value) - 1
+            if index >= 0 and value <= self._lasts[index]:
+                return index
+        else:
+            for index, (first, last) in enumerate(
+                zip(self._firsts, self._lasts)
+            ):
+                if first <= value <= last:
+                    return index
+        return None
+
     def find(self, search) -> Optional[MAASIPRange]:
         """Searches the list of IPRange objects until it finds the specified
         search parameter, and returns the range it belongs to if found.
@@ -431,33 +478,28 @@ class MAASIPSet(set):
         within that range.)
         """
         if isinstance(search, IPRange):
-            for item in self.ranges:
-                if (
-                    item.first <= search.first <= item.last
-                    and item.first <= search.last <= item.last
-                ):
-                    return item
+            index = self._find_index(search.first)
+            if index is not None and search.last <= self._lasts[index]:
+                return self.ranges[index]
         else:
-            addr = IPAddress(search)
-            addr = int(addr)
-            for item in self.ranges:
-                if item.first <= addr <= item.last:
-                    return item
+            index = self._find_index(int(IPAddress(search)))
+            if index is not None:
+                return self.ranges[index]
         return None
 
     @property
     def first(self) -> Optional[MAASIPRange]:
         """Returns the first IP address in this set."""
-        if len(self.ranges) > 0:
-            return self.ranges[0].first
+        if len(self._rows) > 0:
+            return self._firsts[0]
         else:
             return None
 
     @property
     def last(self) -> Optional[MAASIPRange]:
         """Returns the last IP address in this set."""
-        if len(self.ranges) > 0:
-            return self.ranges[-1].last
+        if len(self._rows) > 0:
+            return self._lasts[-1]
         else:
             return None
 
@@ -467,13 +509,13 @@ class MAASIPSet(set):
 
         :raises: ValueError if the IP address is not within this range.
         """
-        range = self.find(ip)
-        if range is None:
+        index = self._find_index(int(IPAddress(ip)))
+        if index is None:
             raise ValueError(
                 "IP address %s does not exist in range (%s-%s)."
                 % (ip, self.first, self.last)
             )
-        return purpose in range.purpose
+        return bool(self._masks[index] & _get_purpose_mask([purpose]))
 
     def is_unused(self, ip) -> bool:
         """Returns True if the specified IP address (which must be within the
@@ -487,17 +529,16 @@ class MAASIPSet(set):
         """Returns True if the specified purpose is found inside any of the
         ranges in this set, otherwise returns False.
         """
-        for item in self.ranges:
-            if purpose in item.purpose:
-                return True
-        return False
+        bit = _get_purpose_mask([purpose])
+        return any(mask & bit for mask in self._masks)
 
     def get_first_unused_ip(self) -> int:
         """Returns the integer value of the first unused IP address in the set.
         """
-        for item in self.ranges:
-            if IPRANGE_TYPE.UNUSED in item.purpose:
-                return item.first
+        unused = _get_purpose_mask([IPRANGE_TYPE.UNUSED])
+        for first, mask in zip(self._firsts, self._masks):
+            if mask & unused:
+                return first
         return None
 
     def get_largest_unused_block(self) -> Optional[MAASIPRange]:
@@ -509,21 +550,14 @@ class MAASIPSet(set):
         :returns: a `MAASIPRange` if the largest unused block was found,
             or None if no IP addresses are unused.
         """
-
-        class NullIPRange:
-            """Throwaway class to represent an empty IP range."""
-
-            def __init__(self):
-                self.size = 0
-
-        largest = NullIPRange()
-        for item in self.ranges:
-            if IPRANGE_TYPE.UNUSED in item.purpose:
-                if item.size >= largest.size:
-                    largest = item
-        if largest.size == 0:
+        unused = _get_purpose_mask([IPRANGE_TYPE.UNUSED])
+        largest, largest_size = None, 0
+        for index, (_, first, last, mask) in enumerate(self._rows):
+            if mask & unused and last - first + 1 >= largest_size:
+                largest, largest_size = index, last - first + 1
+        if largest is None:
             return None
-        return largest
+        return self.ranges[largest]
 
     def render_json(self, *args, **kwargs):
         return [
@@ -548,10 +582,18 @@ class MAASIPSet(set):
             addresses considered "unused". If an IPRange is supplied,
             all addresses in the range will be considered unused.
         """
+        return MAASIPSet._from_rows(
+            self._get_unused_rows(outer_range, purpose)
+        )
+
+    def _get_unused_rows(self, outer_range, purpose):
+        """Returns the rows for `get_unused_ranges`."""
         if isinstance(outer_range, (bytes, str)):
             if "/" in outer_range:
                 outer_range = IPNetwork(outer_range)
         unused_ranges = []
+        version = outer_range.version
+        mask = _get_purpose_mask([purpose])
         if type(outer_range) == IPNetwork:
             # Skip the network address, if this is a network
             prefixlen = outer_range.prefixlen
@@ -565,18 +607,18 @@ class MAASIPSet(set):
             # Otherwise, assume the first address is the start of the range
             start = outer_range.first
         candidate_start = start
-        # Note: by now, self.ranges is sorted from lowest
-        # to highest IP address.
-        for used_range in self.ranges:
-            candidate_end = used_range.first - 1
+        # Note: by now, the ranges are sorted from lowest to highest IP
+        # address.
+        for used_first, used_last in zip(self._firsts, self._lasts):
+            candidate_end = used_first - 1
             # Check if there is a gap between the start of the current
             # candidate range, and the address just before the next used
             # range.
             if candidate_end - candidate_start >= 0:
                 unused_ranges.append(
-                    make_iprange(candidate_start, candidate_end, purpose)
+                    (version, candidate_start, candidate_end, mask)
                 )
-            candidate_start = used_range.last + 1
+            candidate_start = used_last + 1
         # Skip the broadcast address, if this is an IPv4 network
         if type(outer_range) == IPNetwork:
             prefixlen = outer_range.prefixlen
@@ -590,13 +632,15 @@ class MAASIPSet(set):
         # of the range we're checking against.
         if candidate_end - candidate_start >= 0:
             unused_ranges.append(
-                make_iprange(candidate_start, candidate_end, purpose)
+                (version, candidate_start, candidate_end, mask)
             )
-        return MAASIPSet(unused_ranges)
+        return unused_ranges
 
     def get_full_range(self, outer_range):
-        unused_ranges = self.get_unused_ranges(outer_range)
-        full_range = MAASIPSet(self | unused_ranges, cidr=outer_range)
+        unused_ranges = self._get_unused_rows(outer_range, IPRANGE_TYPE.UNUSED)
+        full_range = MAASIPSet._from_rows(
+            _condense_rows(self._rows + unused_ranges), cidr=outer_range
+        )
         # The full_range should always contain at least one IP address.
         # However, in bug #1570606 we observed a situation where there were
         # no resulting ranges. This assert is just in case the fix didn't cover
@@ -638,14 +682,12 @@ def make_iprange(first, second=None, purpose="unknown") -> MAASIPRange:
     :param purpose: If supplied, stores a comment in the range object to
         indicate the purpose of this range.
     """
-    if isinstance(first, int):
-        first = IPAddress(first)
+    first = IPAddress(first)
     if second is None:
         second = first
     else:
-        if isinstance(second, int):
-            second = IPAddress(second)
-    iprange = MAASIPRange(inet_ntop(first), inet_ntop(second), purpose=purpose)
+        second = IPAddress(second)
+    iprange = MAASIPRange(first, second, purpose=purpose)
     return iprange
 
 
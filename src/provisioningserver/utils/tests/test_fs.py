@@ -58,6 +58,7 @@ from provisioningserver.utils.fs import (
     atomic_delete,
     atomic_symlink,
     atomic_write,
+    atomic_write_chunks,
     FileLock,
     FilesystemLock,
     get_library_script_path,
@@ -217,6 +218,59 @@ class TestAtomicWrite(MAASTestCase):
         )
 
 
+class TestAtomicWriteChunks(MAASTestCase):
+    """Test `atomic_write_chunks`."""
+
+    def test_writes_all_chunks(self):
+        chunks = [factory.make_bytes() for _ in range(3)]
+        filename = self.make_file(contents=factory.make_string())
+        self.assertTrue(atomic_write_chunks(iter(chunks), filename))
+        self.assertThat(filename, FileContains(b"".join(chunks)))
+
+    def test_sets_permissions(self):
+        filename = self.make_file()
+        atomic_write_chunks([factory.make_bytes()], filename, mode=0o615)
+        self.assertEqual(0o615, stat.S_IMODE(os.stat(filename).st_mode))
+
+    def test_leaves_file_alone_if_unchanged(self):
+        contents = factory.make_bytes()
+        filename = self.make_file(contents=contents)
+        written = atomic_write_chunks(
+            [factory.make_bytes()], filename, unchanged=lambda: True
+        )
+        self.assertFalse(written)
+        self.assertThat(filename, FileContains(contents))
+        self.assertEqual(
+            [os.path.basename(filename)], os.listdir(os.path.dirname(filename))
+        )
+
+    def test_checks_unchanged_after_writing_chunks(self):
+        seen = []
+
+        def chunks():
+            yield b"a"
+            seen.append("chunks")
+
+        atomic_write_chunks(
+            chunks(), self.make_file(), unchanged=lambda: seen.append("check")
+        )
+        self.assertEqual(["chunks", "check"], seen)
+
+    def test_does_not_leak_temp_file_on_failure(self):
+        def chunks():
+            yield factory.make_bytes()
+            raise ValueError()
+
+        contents = factory.make_bytes()
+        filename = self.make_file(contents=contents)
+        with ExpectedException(ValueError):
+            atomic_write_chunks(chunks(), filename)
+        self.assertThat(filename, FileContains(contents))
+        self.assertEqual(
+            [os.path.basename(filename)], os.listdir(os.path.dirname(filename))
+        )
+
+
 class TestAtomicCopy(MAASTestCase):
     def test_integration(self):
         loader_contents = factory.make_bytes()
@@ -912,6 +912,39 @@ class TestMAASIPSet(MAASTestCase):
         self.assertThat(str(IPAddress(s1.first)), Equals("10.0.0.1"))
         self.assertThat(str(IPAddress(s1.last)), Equals("10.0.0.8"))
 
+    def test_combines_overlapping_ranges_before_adjacent_ranges(self):
+        s = MAASIPSet(
+            [
+                make_iprange("10.0.0.1", "10.0.0.5", purpose="foo"),
+                make_iprange("10.0.0.6", "10.0.0.10", purpose="foo"),
+                make_iprange("10.0.0.8", purpose="bar"),
+            ]
+        )
+        self.assertEqual(
+            [("10.0.0.1", {"foo"}), ("10.0.0.6", {"foo", "bar"})],
+            [(str(IPAddress(r.first)), r.purpose) for r in s.ranges],
+        )
+
+    def test_keeps_ipv4_and_ipv6_ranges_apart(self):
+        s = MAASIPSet(["::a00:2", "10.0.0.1", "10.0.0.2", "::a00:1"])
+        self.assertEqual(
+            [
+                IPRange("10.0.0.1", "10.0.0.2"),
+                IPRange("::a00:1", "::a00:2"),
+            ],
+            s.ranges,
+        )
+
+    def test_ranges_have_their_own_purposes(self):
+        s = MAASIPSet(
+            [
+                make_iprange("10.0.0.1", purpose="foo"),
+                make_iprange("10.0.0.3", purpose="foo"),
+            ]
+        )
+        s.ranges[0].purpose.add("bar")
+        self.assertEqual({"foo"}, s.ranges[1].purpose)
+
 
 class TestIPRangeStatistics(MAASTestCase):
     def test_statistics_are_accurate(self):